@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Benchmark points writes per second under concurrent callers.
+
+Compares the old multi-statement write path (SELECT, then UPDATE/INSERT on
+points and user_stats, then the ledger INSERT) with the single-statement
+PostgreSQLPointsDatabase.change_points / assign_points, committed one by one
+and coalesced into batches (coalesce_writes=True). Uses DATABASE_URL and only
+touches user ids starting with "bench-", which are removed afterwards.
+Coalescing pays off with many concurrent callers, so try a high --workers.
+
+    python benchmark_points_writes.py --workers 200 --writes 50
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import time
+from database_postgresql import PostgreSQLPointsDatabase
+
+USER_PREFIX = "bench-"
+
+async def legacy_update_points(pool, user_id: str, amount: int, admin_id: int = None, reason: str = None) -> bool:
+    """Multi round-trip write path used before the single-statement version"""
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            current_balance = await conn.fetchval('SELECT balance FROM points WHERE user_id = $1', user_id)
+            if current_balance is None:
+                current_balance = 0
+                await conn.execute('''
+                    INSERT INTO points (user_id, balance, created_at, updated_at)
+                    VALUES ($1, $2, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                ''', user_id, amount)
+                await conn.execute('''
+                    INSERT INTO user_stats (user_id, total_points_earned, transactions_count, first_activity, last_activity)
+                    VALUES ($1, $2, 1, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                ''', user_id, max(0, amount))
+            else:
+                await conn.execute('''
+                    UPDATE points SET balance = $1, updated_at = CURRENT_TIMESTAMP WHERE user_id = $2
+                ''', current_balance + amount, user_id)
+                await conn.execute('''
+                    UPDATE user_stats
+                    SET total_points_earned = total_points_earned + $1,
+                        transactions_count = transactions_count + 1,
+                        last_activity = CURRENT_TIMESTAMP,
+                        highest_balance = GREATEST(highest_balance, $2)
+                    WHERE user_id = $3
+                ''', max(0, amount), current_balance + amount, user_id)
+            await conn.execute('''
+                INSERT INTO transactions (user_id, amount, transaction_type, admin_id, reason, old_balance, new_balance)
+                VALUES ($1, $2, $3, $4, $5, $6, $7)
+            ''', user_id, amount, "add" if amount > 0 else "remove", admin_id, reason,
+                current_balance, current_balance + amount)
+    return True
+
+async def new_update_points(db, user_id: str, amount: int, admin_id: int = None, reason: str = None) -> bool:
+    """Single-statement write path"""
+    return await db.change_points(user_id, amount, admin_id, reason) is not None
+
+async def cleanup(db):
+    """Remove benchmark rows"""
+    async with db.pool.acquire() as conn:
+        for table in ("transactions", "user_stats", "points"):
+            await conn.execute(f"DELETE FROM {table} WHERE user_id LIKE $1", USER_PREFIX + "%")
+
+async def run_case(name, write, workers: int, writes: int, users: int):
+    """Run `workers` concurrent callers doing `writes` writes each, return writes/s"""
+    errors = 0
+
+    async def worker(worker_id: int):
+        nonlocal errors
+        rng = random.Random(worker_id)
+        for _ in range(writes):
+            user_id = f"{USER_PREFIX}{rng.randrange(users)}"
+            try:
+                if not await write(user_id, rng.randint(1, 100), 0, "benchmark"):
+                    errors += 1
+            except Exception:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(workers)))
+    elapsed = time.perf_counter() - started
+    total = workers * writes
+    rate = total / elapsed if elapsed else 0
+    print(f"{name:<18} {total:>7} writes  {elapsed:7.2f}s  {rate:9.1f} writes/s  errors={errors}")
+    return rate
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=16, help="concurrent callers")
+    parser.add_argument("--writes", type=int, default=200, help="writes per caller")
+    parser.add_argument("--users", type=int, default=50, help="distinct users (fewer = more contention)")
+    args = parser.parse_args()
+
+    if not os.getenv("DATABASE_URL"):
+        print("DATABASE_URL not found in environment variables")
+        return
+
+    db = PostgreSQLPointsDatabase(coalesce_writes=False)
+    coalesced_db = PostgreSQLPointsDatabase(coalesce_writes=True)
+    await db.initialize()
+    await coalesced_db.initialize()
+    try:
+        await cleanup(db)
+        before = await run_case(
+            "multi-statement",
+            lambda *a: legacy_update_points(db.pool, *a),
+            args.workers, args.writes, args.users
+        )
+        await cleanup(db)
+        after = await run_case(
+            "single-statement",
+            lambda *a: new_update_points(db, *a),
+            args.workers, args.writes, args.users
+        )
+        await cleanup(db)
+        coalesced = await run_case(
+            "coalesced",
+            lambda *a: new_update_points(coalesced_db, *a),
+            args.workers, args.writes, args.users
+        )
+        stats = coalesced_db.get_write_stats()
+        print(f"coalesced: {stats['batches']} batches ({stats['writes_per_batch']} writes per batch, "
+              f"{stats['fallbacks']} fell back to single writes)")
+        if before:
+            print(f"speedup: {after / before:.2f}x single-statement, {coalesced / before:.2f}x coalesced")
+    finally:
+        await cleanup(db)
+        await coalesced_db.close()
+        await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
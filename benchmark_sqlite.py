@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark the SQLite points store, tuned and coalesced against single-connection mode.
+
+Runs the same workload against PointsDatabase(tuned=False) and
+PointsDatabase(tuned=True), each with and without write coalescing, on a fresh
+database file in a temporary directory. tuned=False is one connection in
+rollback-journal mode with each write committed on its own. tuned=True is WAL
+with a read-only reader pool and group-committed writes. coalesce_writes=True
+batches change_points calls through a WriteCoalescer. Each mode runs concurrent
+change_points writers, concurrent get_points / get_leaderboard readers, and
+both at once; speedups are against single connection.
+
+    python benchmark_sqlite.py --workers 16 --writes 200 --reads 500
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from database import PointsDatabase
+
+async def run_case(db, workers: int, writes: int, reads: int, users: int):
+    """`workers` writers doing `writes` writes and `workers` readers doing `reads` reads, concurrently
+
+    Returns (writes/s, reads/s); either count may be 0 to skip that half.
+    """
+    errors = 0
+    elapsed = {}
+
+    async def writer(worker_id: int):
+        nonlocal errors
+        rng = random.Random(worker_id)
+        for _ in range(writes):
+            if await db.change_points(str(rng.randrange(users)), rng.randint(1, 100), 0, "benchmark") is None:
+                errors += 1
+
+    async def reader(worker_id: int):
+        rng = random.Random(-worker_id)
+        for i in range(reads):
+            if i % 10 == 0:
+                await db.get_leaderboard(10)
+            else:
+                await db.get_points(str(rng.randrange(users)))
+
+    async def timed(kind: str, coroutines):
+        started = time.perf_counter()
+        await asyncio.gather(*coroutines)
+        elapsed[kind] = time.perf_counter() - started
+
+    await asyncio.gather(
+        timed('writes', [writer(i) for i in range(workers if writes else 0)]),
+        timed('reads', [reader(i) for i in range(workers if reads else 0)])
+    )
+    write_rate = workers * writes / elapsed['writes'] if writes and elapsed['writes'] else 0
+    read_rate = workers * reads / elapsed['reads'] if reads and elapsed['reads'] else 0
+    return write_rate, read_rate, errors
+
+async def run_mode(directory: str, tuned: bool, coalesce: bool, args) -> dict:
+    name = ("tuned" if tuned else "single") + (" coalesced" if coalesce else "")
+    db = PointsDatabase(os.path.join(directory, f"{name.replace(' ', '-')}.db"), tuned=tuned,
+                        coalesce_writes=coalesce)
+    await db.initialize()
+    rates = {}
+    try:
+        # Seed every user so reads hit existing rows
+        for user_id in range(args.users):
+            await db.assign_points(str(user_id), 100, 0, "benchmark")
+        for case, writes, reads in (("writes", args.writes, 0), ("reads", 0, args.reads),
+                                    ("mixed", args.writes, args.reads)):
+            write_rate, read_rate, errors = await run_case(db, args.workers, writes, reads, args.users)
+            rates[case] = (write_rate, read_rate)
+            print(f"{name:<16} {case:<7} {write_rate:10.1f} writes/s  {read_rate:10.1f} reads/s  errors={errors}")
+        stats = db.get_stats()
+        print(f"{name:<16} {stats['commits']} commits for {stats['writes']} writes "
+              f"({stats['writes_per_commit']} per commit)")
+        if coalesce:
+            coalescer = stats['write_coalescer']
+            print(f"{name:<16} {coalescer['batches']} batches for {coalescer['writes']} points writes "
+                  f"({coalescer['writes_per_batch']} per batch)")
+    finally:
+        await db.close()
+    return rates
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=16, help="concurrent writers (and as many readers)")
+    parser.add_argument("--writes", type=int, default=200, help="writes per writer")
+    parser.add_argument("--reads", type=int, default=500, help="reads per reader")
+    parser.add_argument("--users", type=int, default=1000, help="distinct users")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        modes = {}
+        for tuned, coalesce in ((False, False), (False, True), (True, False), (True, True)):
+            name = ("tuned" if tuned else "single") + (" coalesced" if coalesce else "")
+            modes[name] = await run_mode(directory, tuned, coalesce, args)
+
+    before = modes["single"]
+    for name, after in modes.items():
+        if after is before:
+            continue
+        for case in before:
+            write_speedup = after[case][0] / before[case][0] if before[case][0] else 0
+            read_speedup = after[case][1] / before[case][1] if before[case][1] else 0
+            print(f"speedup {name:<16} {case:<7} writes {write_speedup:.2f}x  reads {read_speedup:.2f}x")
+
+if __name__ == "__main__":
+    asyncio.run(main())
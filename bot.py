@@ -8,9 +8,20 @@ import sys
 import threading
 import re
 import os
+from functools import wraps
 from flask import Flask, request, jsonify
 from config import Config
 from database_postgresql import PostgreSQLPointsDatabase
+from db_runtime import runtime as db_runtime, get_db, run_db, iterate_db
+from job_queue import JobWorker, job_progress
+from dm_outbox import DMOutbox
+from discord_directory import DiscordUserDirectory, DIRECTORY_EVENTS
+from dashboard_events import event_hub, format_event
+from exports import EXPORT_CHUNK_SIZE, FORMATS, build_export_query, parse_date, render_export
+from leaderboard_index import leaderboard
+from leaderboard_cache import page_cache
+from order_processor import OrderProcessor
+from idempotency import IDEMPOTENCY_HEADER, IdempotencyError, begin_idempotent, finish_idempotent
 from enhanced_achievements import check_and_award_achievements, get_user_achievements, get_recent_achievements, ACHIEVEMENT_TYPES
 from datetime import datetime
 
@@ -32,6 +43,36 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.secret_key = os.getenv("SESSION_SECRET", "default_session_secret_change_in_production")
 
+def idempotent(scope):
+    """Replay the first successful response when a request repeats its Idempotency-Key"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return view(*args, **kwargs)
+            db = get_db()
+            try:
+                stored = run_db(begin_idempotent(db, scope, key, request.get_json(silent=True)))
+            except IdempotencyError as e:
+                return jsonify({"success": False, "error": str(e)}), e.status
+            except Exception as e:
+                logger.error(f"Error checking {IDEMPOTENCY_HEADER} for {scope}: {e}")
+                return jsonify({"success": False, "error": "Internal server error"})
+            if stored is not None:
+                response = jsonify(stored)
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
+            response = None
+            try:
+                response = view(*args, **kwargs)
+            finally:
+                body = response.get_json(silent=True) if response is not None else None
+                run_db(finish_idempotent(db, scope, key, body))
+            return response
+        return wrapper
+    return decorator
+
 @app.route("/")
 def home():
     """Root health check endpoint that returns 200 status code for deployment health checks"""
@@ -187,12 +228,17 @@ def dashboard():
                     <div class="form-group">
                         <label for="user-search">🔍 Search Users (by Username, Email, or User ID):</label>
                         <input type="text" id="user-search" placeholder="Enter username, email, or user ID..." onkeyup="searchUsers()" style="margin-bottom: 10px;">
-                        <select id="sort-users" onchange="sortUsers()" style="margin-bottom: 10px; margin-left: 10px; padding: 5px;">
+                        <select id="sort-users" onchange="loadUsers()" style="margin-bottom: 10px; margin-left: 10px; padding: 5px;">
                             <option value="points_desc">Sort by Points (High to Low)</option>
                             <option value="points_asc">Sort by Points (Low to High)</option>
                             <option value="username_asc">Sort by Username (A-Z)</option>
                             <option value="username_desc">Sort by Username (Z-A)</option>
-                            <option value="email_status">Sort by Email Status</option>
+                        </select>
+                        <select id="filter-users" onchange="loadUsers()" style="margin-bottom: 10px; margin-left: 10px; padding: 5px;">
+                            <option value="">All Users</option>
+                            <option value="pending">Email Pending</option>
+                            <option value="processed">Email Processed</option>
+                            <option value="no_email">No Email</option>
                         </select>
                         <button onclick="loadUsers()" class="refresh-btn">🔄 Refresh Users</button>
                         <button onclick="addNewUser()" class="export-btn" style="background: #17a2b8;">➕ Add New User</button>
@@ -221,6 +267,10 @@ def dashboard():
                     <div id="users-container">
                         <div class="loading">Loading users...</div>
                     </div>
+                    <div style="text-align: center; margin-top: 15px;">
+                        <span id="users-showing" style="color: #666; margin-right: 10px;"></span>
+                        <button id="load-more-users" onclick="loadUsers(true)" class="refresh-btn" style="display: none;">⬇️ Load More</button>
+                    </div>
                 </div>
             </div>
 
@@ -499,31 +549,18 @@ def dashboard():
             loadOverviewData();
             
             function loadOverviewData() {
-                // Load overview stats
-                fetch('/api/quick_stats')
-                .then(response => response.json())
-                .then(data => {
-                    document.getElementById('overview-total-users').textContent = data.total_users || 0;
-                    document.getElementById('overview-total-points').textContent = (data.total_points || 0).toLocaleString();
-                    document.getElementById('overview-achievements').textContent = data.total_achievements || 0;
-                });
-                
-                // Load pending email count
-                fetch('/api/email_submissions')
-                .then(response => response.json())
-                .then(data => {
-                    if (data.success && data.stats) {
-                        document.getElementById('overview-pending-emails').textContent = data.stats.pending || 0;
-                    }
-                });
-                
-                // Load recent achievements
-                fetch('/api/recent_achievements')
+                // One request for every overview widget; unchanged snapshots come back as 304
+                fetch('/api/dashboard_snapshot', { cache: 'no-cache' })
                 .then(response => response.json())
                 .then(data => {
+                    document.getElementById('overview-total-users').textContent = data.quick_stats.total_users || 0;
+                    document.getElementById('overview-total-points').textContent = (data.quick_stats.total_points || 0).toLocaleString();
+                    document.getElementById('overview-achievements').textContent = data.quick_stats.total_achievements || 0;
+                    document.getElementById('overview-pending-emails').textContent = data.email_stats.pending || 0;
+                    
                     let html = '';
-                    if (data.achievements && data.achievements.length > 0) {
-                        data.achievements.slice(0, 5).forEach(ach => {
+                    if (data.recent_achievements.length > 0) {
+                        data.recent_achievements.slice(0, 5).forEach(ach => {
                             html += '<div style="padding: 8px; border-bottom: 1px solid #eee;">';
                             html += '<strong>User ' + ach.user_id.slice(-4) + '</strong> earned <strong>' + ach.achievement_name + '</strong>';
                             html += '<div style="font-size: 12px; color: #666;">+' + ach.points_earned + ' points • ' + new Date(ach.earned_at).toLocaleDateString() + '</div>';
@@ -533,15 +570,10 @@ def dashboard():
                         html = '<div style="padding: 20px; text-align: center; color: #666;">No recent achievements</div>';
                     }
                     document.getElementById('recent-achievements-list').innerHTML = html;
-                });
-                
-                // Load recent transactions
-                fetch('/api/recent_transactions')
-                .then(response => response.json())
-                .then(data => {
-                    let html = '';
-                    if (data.transactions && data.transactions.length > 0) {
-                        data.transactions.slice(0, 8).forEach(tx => {
+                    
+                    html = '';
+                    if (data.recent_transactions.length > 0) {
+                        data.recent_transactions.slice(0, 8).forEach(tx => {
                             const color = tx.amount > 0 ? '#28a745' : '#dc3545';
                             html += '<div style="padding: 8px; border-bottom: 1px solid #eee; display: flex; justify-content: space-between;">';
                             html += '<div>User ' + tx.user_id.slice(-4) + ' • ' + (tx.reason || tx.type) + '</div>';
@@ -552,9 +584,106 @@ def dashboard():
                         html = '<div style="padding: 20px; text-align: center; color: #666;">No recent transactions</div>';
                     }
                     document.getElementById('recent-transactions-list').innerHTML = html;
+                    
+                    // Fill the email section up front; while it's open it reloads itself
+                    if (!isVisible('emails')) {
+                        displayEmailSubmissions(data.email_submissions, data.email_stats);
+                    }
+                });
+            }
+            
+            // Live updates: one SSE stream patches the overview widgets in place
+            function isVisible(section) {
+                return !document.getElementById(section + '-section').classList.contains('hidden');
+            }
+            
+            function prependRows(listId, rowsHtml, keep) {
+                const list = document.getElementById(listId);
+                if (!list.querySelector('div[style*="border-bottom"]')) {
+                    list.innerHTML = '';
+                }
+                list.insertAdjacentHTML('afterbegin', rowsHtml);
+                const rows = list.querySelectorAll('div[style*="border-bottom"]');
+                for (let i = keep; i < rows.length; i++) {
+                    rows[i].remove();
+                }
+            }
+            
+            function subscribeToEvents() {
+                if (!window.EventSource) {
+                    return;
+                }
+                const events = new EventSource('/api/events');
+                
+                events.addEventListener('counters', e => {
+                    const c = JSON.parse(e.data);
+                    document.getElementById('overview-total-users').textContent = c.users || 0;
+                    document.getElementById('overview-total-points').textContent = (c.total_points || 0).toLocaleString();
+                    document.getElementById('overview-achievements').textContent = c.achievements || 0;
+                    document.getElementById('overview-pending-emails').textContent = c.emails_pending || 0;
+                    if (isVisible('database')) {
+                        loadDatabaseStats();
+                    }
+                });
+                
+                events.addEventListener('transaction', e => {
+                    const data = JSON.parse(e.data);
+                    if (!data.rows) {
+                        loadOverviewData();
+                        return;
+                    }
+                    let html = '';
+                    data.rows.slice().reverse().slice(0, 8).forEach(tx => {
+                        const color = tx.amount > 0 ? '#28a745' : '#dc3545';
+                        html += '<div style="padding: 8px; border-bottom: 1px solid #eee; display: flex; justify-content: space-between;">';
+                        html += '<div>User ' + tx.user_id.slice(-4) + ' • ' + (tx.reason || tx.transaction_type) + '</div>';
+                        html += '<div style="color: ' + color + '; font-weight: bold;">' + (tx.amount > 0 ? '+' : '') + tx.amount + '</div>';
+                        html += '</div>';
+                    });
+                    prependRows('recent-transactions-list', html, 8);
+                    if (isVisible('database')) {
+                        loadTransactions();
+                    }
+                });
+                
+                events.addEventListener('achievement', e => {
+                    const data = JSON.parse(e.data);
+                    if (!data.rows) {
+                        loadOverviewData();
+                        return;
+                    }
+                    let html = '';
+                    data.rows.slice().reverse().slice(0, 5).forEach(ach => {
+                        html += '<div style="padding: 8px; border-bottom: 1px solid #eee;">';
+                        html += '<strong>User ' + ach.user_id.slice(-4) + '</strong> earned <strong>' + ach.achievement_name + '</strong>';
+                        html += '<div style="font-size: 12px; color: #666;">+' + ach.points_earned + ' points • ' + new Date(ach.earned_at).toLocaleDateString() + '</div>';
+                        html += '</div>';
+                    });
+                    prependRows('recent-achievements-list', html, 5);
+                    if (isVisible('achievements')) {
+                        loadAchievements();
+                    }
+                });
+                
+                events.addEventListener('email_submission', () => {
+                    if (isVisible('emails')) {
+                        loadEmailSubmissions();
+                    }
+                });
+                
+                events.addEventListener('dm', () => {
+                    if (isVisible('messages')) {
+                        loadMessageHistory();
+                        loadMessageStats();
+                    }
                 });
+                
+                // Missed events (slow client or lost listener) - reload the overview once
+                events.addEventListener('resync', () => loadOverviewData());
             }
             
+            subscribeToEvents();
+            
             function loadTransactions() {
                 fetch('/api/recent_transactions')
                 .then(response => response.json())
@@ -684,11 +813,26 @@ def dashboard():
             // User Management Functions
             let allUsers = [];
             
-            async function loadUsers() {
+            let usersCursor = null;
+            let usersSearchTimer = null;
+            
+            // Pages come from the server already searched, filtered and sorted; append=true fetches the next page
+            async function loadUsers(append = false) {
                 try {
-                    const response = await fetch('/api/users');
+                    const params = new URLSearchParams({
+                        sort: document.getElementById('sort-users').value,
+                        limit: 50
+                    });
+                    const search = document.getElementById('user-search').value.trim();
+                    const status = document.getElementById('filter-users').value;
+                    if (search) params.set('q', search);
+                    if (status) params.set('status', status);
+                    if (append && usersCursor) params.set('cursor', usersCursor);
+                    
+                    const response = await fetch('/api/users?' + params);
                     const data = await response.json();
-                    allUsers = data.users || [];
+                    allUsers = append ? allUsers.concat(data.users || []) : (data.users || []);
+                    usersCursor = data.next_cursor || null;
                     
                     // Update stats
                     document.getElementById('total-users-count').textContent = data.stats.total_users || 0;
@@ -697,6 +841,9 @@ def dashboard():
                     document.getElementById('total-points-distributed').textContent = data.stats.total_points || 0;
                     
                     displayUsers(allUsers);
+                    document.getElementById('users-showing').textContent = 'Showing ' + allUsers.length +
+                        (data.total !== null && data.total !== undefined ? ' of ' + data.total : '') + ' users';
+                    document.getElementById('load-more-users').style.display = usersCursor ? 'inline-block' : 'none';
                 } catch (error) {
                     console.error('Error loading users:', error);
                     document.getElementById('users-container').innerHTML = '<div style="color: red;">Error loading users</div>';
@@ -704,20 +851,9 @@ def dashboard():
             }
 
             function searchUsers() {
-                const searchTerm = document.getElementById('user-search').value.toLowerCase().trim();
-                
-                if (!searchTerm) {
-                    displayUsers(allUsers);
-                    return;
-                }
-                
-                const filteredUsers = allUsers.filter(user => {
-                    return (user.username && user.username.toLowerCase().includes(searchTerm)) ||
-                           (user.email && user.email.toLowerCase().includes(searchTerm)) ||
-                           (user.user_id && user.user_id.includes(searchTerm));
-                });
-                
-                displayUsers(filteredUsers);
+                // Wait for typing to pause before asking the server
+                clearTimeout(usersSearchTimer);
+                usersSearchTimer = setTimeout(() => loadUsers(), 300);
             }
 
             function displayUsers(users) {
@@ -853,34 +989,6 @@ def dashboard():
                 }
             }
 
-            function sortUsers() {
-                const sortBy = document.getElementById('sort-users').value;
-                let sortedUsers = [...allUsers];
-                
-                switch(sortBy) {
-                    case 'points_desc':
-                        sortedUsers.sort((a, b) => (b.points || 0) - (a.points || 0));
-                        break;
-                    case 'points_asc':
-                        sortedUsers.sort((a, b) => (a.points || 0) - (b.points || 0));
-                        break;
-                    case 'username_asc':
-                        sortedUsers.sort((a, b) => (a.username || '').localeCompare(b.username || ''));
-                        break;
-                    case 'username_desc':
-                        sortedUsers.sort((a, b) => (b.username || '').localeCompare(a.username || ''));
-                        break;
-                    case 'email_status':
-                        sortedUsers.sort((a, b) => {
-                            const statusOrder = {'processed': 3, 'pending': 2, null: 1};
-                            return (statusOrder[b.email_status] || 0) - (statusOrder[a.email_status] || 0);
-                        });
-                        break;
-                }
-                
-                displayUsers(sortedUsers);
-            }
-
             async function editUserProfile(userId) {
                 const user = allUsers.find(u => u.user_id === userId);
                 if (!user) {
@@ -1005,21 +1113,10 @@ def dashboard():
                 }
             }
 
-            async function exportUsers() {
-                try {
-                    const response = await fetch('/api/export_users');
-                    const blob = await response.blob();
-                    const url = window.URL.createObjectURL(blob);
-                    const a = document.createElement('a');
-                    a.href = url;
-                    a.download = 'users_export_' + new Date().toISOString().split('T')[0] + '.csv';
-                    document.body.appendChild(a);
-                    a.click();
-                    document.body.removeChild(a);
-                    window.URL.revokeObjectURL(url);
-                } catch (error) {
-                    alert('Error exporting users: ' + error.message);
-                }
+            function exportUsers() {
+                // Plain navigation lets the browser stream the file to disk instead of buffering it
+                const status = document.getElementById('filter-users').value;
+                window.location.href = '/api/export_users' + (status ? '?status=' + encodeURIComponent(status) : '');
             }
 
             // Email submissions functions
@@ -1158,8 +1255,9 @@ def dashboard():
                     
                     const result = await response.json();
                     if (result.success) {
+                        const job = await waitForJob(result.job_id);
                         loadEmailSubmissions();
-                        alert(result.message);
+                        alert(`${result.message}: ${job.succeeded} done, ${job.failed} failed`);
                     } else {
                         alert('Error: ' + result.error);
                     }
@@ -1212,21 +1310,18 @@ def dashboard():
                 }
             }
 
-            async function exportEmailSubmissions() {
-                try {
-                    const response = await fetch('/api/export_email_submissions');
-                    const blob = await response.blob();
-                    const url = window.URL.createObjectURL(blob);
-                    const a = document.createElement('a');
-                    a.href = url;
-                    a.download = 'email_submissions_' + new Date().toISOString().split('T')[0] + '.csv';
-                    document.body.appendChild(a);
-                    a.click();
-                    window.URL.revokeObjectURL(url);
-                    document.body.removeChild(a);
-                    alert('Email submissions exported successfully!');
-                } catch (error) {
-                    alert('Error exporting: ' + error.message);
+            function exportEmailSubmissions() {
+                window.location.href = '/api/export_email_submissions';
+            }
+
+            async function waitForJob(jobId) {
+                // Poll a background job until it finishes
+                while (true) {
+                    const response = await fetch(`/api/jobs/${jobId}`);
+                    const data = await response.json();
+                    if (!data.success) throw new Error(data.error);
+                    if (data.job.status === 'completed' || data.job.status === 'failed') return data.job;
+                    await new Promise(resolve => setTimeout(resolve, 1000));
                 }
             }
 
@@ -1240,8 +1335,9 @@ def dashboard():
                     
                     const result = await response.json();
                     if (result.success) {
+                        const job = await waitForJob(result.job_id);
                         loadEmailSubmissions();
-                        alert('Processed emails cleared!');
+                        alert(`Processed emails cleared! (${job.succeeded} deleted)`);
                     } else {
                         alert('Error: ' + result.error);
                     }
@@ -1312,49 +1408,8 @@ def dashboard():
                 }
             }
             
-            async function exportMessageHistory() {
-                try {
-                    const response = await fetch('/api/export_messages');
-                    const data = await response.json();
-                    
-                    if (!data.messages || data.messages.length === 0) {
-                        alert('No messages to export');
-                        return;
-                    }
-                    
-                    // Create CSV content
-                    const headers = ['Date', 'Admin', 'Admin ID', 'Recipient', 'Recipient ID', 'Type', 'Message', 'Status', 'Error'];
-                    let csvContent = headers.join(',') + '\\n';
-                    
-                    data.messages.forEach(msg => {
-                        const row = [
-                            '"' + new Date(msg.sent_at).toISOString() + '"',
-                            '"' + msg.sender_admin_name + '"',
-                            '"' + msg.sender_admin_id + '"',
-                            '"' + msg.recipient_username + '"',
-                            '"' + msg.recipient_user_id + '"',
-                            '"' + msg.message_type + '"',
-                            '"' + msg.message_content.replace(/"/g, '""') + '"',
-                            '"' + msg.delivery_status + '"',
-                            '"' + (msg.delivery_error || '') + '"'
-                        ];
-                        csvContent += row.join(',') + '\\n';
-                    });
-                    
-                    // Download CSV
-                    const blob = new Blob([csvContent], { type: 'text/csv' });
-                    const url = window.URL.createObjectURL(blob);
-                    const a = document.createElement('a');
-                    a.href = url;
-                    a.download = 'admin_messages_' + new Date().toISOString().split('T')[0] + '.csv';
-                    document.body.appendChild(a);
-                    a.click();
-                    window.URL.revokeObjectURL(url);
-                    document.body.removeChild(a);
-                    alert('Message history exported successfully!');
-                } catch (error) {
-                    alert('Error exporting: ' + error.message);
-                }
+            function exportMessageHistory() {
+                window.location.href = '/api/export_messages';
             }
             
             // User Lookup Function
@@ -1402,8 +1457,6 @@ def dashboard():
 
             // Send Message Form Handler
             document.addEventListener('DOMContentLoaded', function() {
-                loadEmailSubmissions();
-                
                 // Add event listener for send message form
                 const sendForm = document.getElementById('sendMessageForm');
                 if (sendForm) {
@@ -1454,6 +1507,7 @@ def dashboard():
     """
 
 @app.route("/api/manage_points", methods=["POST"])
+@idempotent("manage_points")
 def manage_points():
     try:
         data = request.json
@@ -1480,58 +1534,41 @@ def manage_points():
         if amount <= 0 or amount > 1000000:
             return jsonify({"success": False, "error": "Amount must be between 1 and 1,000,000"})
         
-        # Simple approach: create a new database instance for Flask operations
+        # Use the shared dashboard pool for Flask operations
         try:
-            from database_postgresql import PostgreSQLPointsDatabase
-            db = PostgreSQLPointsDatabase()
+            db = get_db()
             
-            # Run the async database operation
-            import asyncio
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
+            reason = data.get('reason', 'Dashboard operation')
+            admin_id = 0  # Dashboard admin ID
             
-            try:
-                # Initialize database connection
-                loop.run_until_complete(db.initialize())
-                
-                reason = data.get('reason', 'Dashboard operation')
-                admin_id = 0  # Dashboard admin ID
-                
-                if action == 'add':
-                    success = loop.run_until_complete(db.update_points(user_id, amount, admin_id, reason))
-                    if success:
-                        new_balance = loop.run_until_complete(db.get_points(user_id))
-                        # Check for new achievements
-                        new_achievements = loop.run_until_complete(check_and_award_achievements(db, user_id, new_balance))
-                        achievement_msg = f" (+{len(new_achievements)} achievements)" if new_achievements else ""
-                        message = f"Successfully added {amount:,} points. New balance: {new_balance:,}{achievement_msg}"
-                    else:
-                        return jsonify({"success": False, "error": "Failed to add points to database"})
-                elif action == 'remove':
-                    current_balance = loop.run_until_complete(db.get_points(user_id))
-                    if current_balance < amount:
-                        return jsonify({"success": False, "error": f"User only has {current_balance:,} points"})
-                    success = loop.run_until_complete(db.update_points(user_id, -amount, admin_id, reason))
-                    if success:
-                        new_balance = loop.run_until_complete(db.get_points(user_id))
-                        message = f"Successfully removed {amount:,} points. New balance: {new_balance:,}"
-                    else:
-                        return jsonify({"success": False, "error": "Failed to remove points from database"})
-                else:  # set
-                    success = loop.run_until_complete(db.set_points(user_id, amount, admin_id, reason))
-                    if success:
-                        # Check for new achievements after setting points
-                        new_achievements = loop.run_until_complete(check_and_award_achievements(db, user_id, amount))
-                        achievement_msg = f" (+{len(new_achievements)} achievements)" if new_achievements else ""
-                        message = f"Successfully set points to {amount:,}{achievement_msg}"
-                    else:
-                        return jsonify({"success": False, "error": "Failed to set points in database"})
-                        
-                # Close database connection
-                loop.run_until_complete(db.close())
-                        
-            finally:
-                loop.close()
+            if action == 'add':
+                balances = run_db(db.change_points(user_id, amount, admin_id, reason))
+                if balances:
+                    new_balance = balances[1]
+                    # Check for new achievements
+                    new_achievements = run_db(check_and_award_achievements(db, user_id, new_balance))
+                    achievement_msg = f" (+{len(new_achievements)} achievements)" if new_achievements else ""
+                    message = f"Successfully added {amount:,} points. New balance: {new_balance:,}{achievement_msg}"
+                else:
+                    return jsonify({"success": False, "error": "Failed to add points to database"})
+            elif action == 'remove':
+                # One conditional write: a balance that can't cover the removal is left untouched
+                balances = run_db(db.change_points(user_id, -amount, admin_id, reason, require_balance=True))
+                if not balances:
+                    return jsonify({"success": False, "error": "Failed to remove points from database"})
+                old_balance, new_balance = balances
+                if new_balance == old_balance:
+                    return jsonify({"success": False, "error": f"User only has {old_balance:,} points"})
+                message = f"Successfully removed {amount:,} points. New balance: {new_balance:,}"
+            else:  # set
+                balances = run_db(db.assign_points(user_id, amount, admin_id, reason))
+                if balances:
+                    # Check for new achievements after setting points
+                    new_achievements = run_db(check_and_award_achievements(db, user_id, balances[1]))
+                    achievement_msg = f" (+{len(new_achievements)} achievements)" if new_achievements else ""
+                    message = f"Successfully set points to {amount:,}{achievement_msg}"
+                else:
+                    return jsonify({"success": False, "error": "Failed to set points in database"})
                 
         except Exception as e:
             logger.error(f"Database operation error: {e}")
@@ -1550,32 +1587,17 @@ def manage_points():
 def quick_stats():
     """API endpoint for quick dashboard stats"""
     try:
-        from database_postgresql import PostgreSQLPointsDatabase
-        db = PostgreSQLPointsDatabase()
+        db = get_db()
         
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # Get real database stats
+        stats = run_db(db.get_database_stats())
         
-        try:
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            # Get real database stats
-            stats = loop.run_until_complete(db.get_database_stats())
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            return jsonify({
-                "total_users": stats['tables']['points']['rows'],
-                "total_points": stats['total_points'],
-                "total_transactions": stats['tables']['transactions']['rows'],
-                "total_achievements": stats['tables']['achievements']['rows']
-            })
-            
-        finally:
-            loop.close()
+        return jsonify({
+            "total_users": stats['tables']['points']['rows'],
+            "total_points": stats['total_points'],
+            "total_transactions": stats['tables']['transactions']['rows'],
+            "total_achievements": stats['tables']['achievements']['rows']
+        })
                 
     except Exception as e:
         logger.error(f"Error getting quick stats: {e}")
@@ -1586,43 +1608,97 @@ def quick_stats():
             "total_achievements": 0
         })
 
+def email_submission_json(row):
+    """Format a get_email_submissions row for the API"""
+    return {
+        'id': row[0],
+        'discord_user_id': row[1],
+        # Current name from discord_users, falling back to the name stored at submission
+        'discord_username': row[2] or f"User {row[1]}",
+        'email_address': row[3],
+        'submitted_at': row[4].isoformat() if row[4] else None,
+        'status': row[5],
+        'processed_at': row[6].isoformat() if row[6] else None,
+        'admin_notes': row[7],
+        'server_roles': row[8] if len(row) > 8 else ""
+    }
+
+def transaction_json(tx):
+    """Format a get_transactions row for the API"""
+    return {
+        "id": tx[0],
+        "user_id": str(tx[1]),
+        "amount": tx[2],
+        "type": tx[3],
+        "admin_id": tx[4],
+        "reason": tx[5] or "No reason provided",
+        "old_balance": tx[6],
+        "new_balance": tx[7],
+        "timestamp": tx[8]
+    }
+
+def achievement_json(ach):
+    """Format a get_achievements row for the API"""
+    return {
+        "id": ach[0],
+        "user_id": str(ach[1]),
+        "achievement_type": ach[2],
+        "achievement_name": ach[3],
+        "points_earned": ach[4],
+        "earned_at": ach[5]
+    }
+
+@app.route("/api/dashboard_snapshot")
+def dashboard_snapshot():
+    """Everything the overview section needs in one response, with an ETag so unchanged snapshots get a 304"""
+    try:
+        snapshot = run_db(get_db().get_dashboard_snapshot())
+        counters = snapshot['counters']
+        
+        response = jsonify({
+            "quick_stats": {
+                "total_users": counters.get('users', 0),
+                "total_points": counters.get('total_points', 0),
+                "total_transactions": counters.get('transactions', 0),
+                "total_achievements": counters.get('achievements', 0)
+            },
+            "email_stats": {
+                "total": counters.get('emails', 0),
+                "pending": counters.get('emails_pending', 0),
+                "processed": counters.get('emails_processed', 0)
+            },
+            "database_stats": {
+                "tables": {
+                    "points": {"rows": counters.get('users', 0)},
+                    "transactions": {"rows": counters.get('transactions', 0)},
+                    "achievements": {"rows": counters.get('achievements', 0)},
+                    "user_stats": {"rows": counters.get('users', 0)}
+                },
+                "total_points": counters.get('total_points', 0)
+            },
+            "recent_transactions": [transaction_json(tx) for tx in snapshot['transactions']],
+            "recent_achievements": [achievement_json(ach) for ach in snapshot['achievements']],
+            "email_submissions": [email_submission_json(row) for row in snapshot['email_submissions']]
+        })
+        # Browsers revalidate with If-None-Match; identical snapshots are answered with an empty 304
+        response.add_etag()
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+            
+    except Exception as e:
+        logger.error(f"Error building dashboard snapshot: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
 @app.route("/api/recent_achievements")
 def recent_achievements():
     """API endpoint for recent achievements"""
     try:
-        from database_postgresql import PostgreSQLPointsDatabase
-        db = PostgreSQLPointsDatabase()
+        db = get_db()
         
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # Get recent achievements from database
+        achievements_data = run_db(db.get_achievements(limit=10))
         
-        try:
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            # Get recent achievements from database
-            achievements_data = loop.run_until_complete(db.get_achievements(limit=10))
-            
-            # Format achievements for API response
-            achievements = []
-            for ach in achievements_data:
-                achievements.append({
-                    "id": ach[0],
-                    "user_id": str(ach[1]),
-                    "achievement_type": ach[2],
-                    "achievement_name": ach[3],
-                    "points_earned": ach[4],
-                    "earned_at": ach[5]
-                })
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            return jsonify({"achievements": achievements})
-            
-        finally:
-            loop.close()
+        return jsonify({"achievements": [achievement_json(ach) for ach in achievements_data]})
             
     except Exception as e:
         logger.error(f"Error getting recent achievements: {e}")
@@ -1632,37 +1708,22 @@ def recent_achievements():
 def database_stats():
     """API endpoint for detailed database statistics"""
     try:
-        from database_postgresql import PostgreSQLPointsDatabase
-        db = PostgreSQLPointsDatabase()
+        db = get_db()
         
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # Get database statistics
+        stats = run_db(db.get_database_stats())
         
-        try:
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            # Get database statistics
-            stats = loop.run_until_complete(db.get_database_stats())
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            # Format response with actual database data
-            return jsonify({
-                "tables": {
-                    "points": {"rows": stats['tables']['points']['rows']},
-                    "transactions": {"rows": stats['tables']['transactions']['rows']},
-                    "achievements": {"rows": stats['tables']['achievements']['rows']},
-                    "user_stats": {"rows": stats['tables']['points']['rows']}  # Same as points table
-                },
-                "total_points": stats['total_points'],
-                "most_active_user": None  # Can add this later if needed
-            })
-            
-        finally:
-            loop.close()
+        # Format response with actual database data
+        return jsonify({
+            "tables": {
+                "points": {"rows": stats['tables']['points']['rows']},
+                "transactions": {"rows": stats['tables']['transactions']['rows']},
+                "achievements": {"rows": stats['tables']['achievements']['rows']},
+                "user_stats": {"rows": stats['tables']['points']['rows']}  # Same as points table
+            },
+            "total_points": stats['total_points'],
+            "most_active_user": None  # Can add this later if needed
+        })
             
     except Exception as e:
         logger.error(f"Error getting database stats: {e}")
@@ -1676,42 +1737,12 @@ def database_stats():
 def recent_transactions():
     """API endpoint for recent transactions"""
     try:
-        from database_postgresql import PostgreSQLPointsDatabase
-        db = PostgreSQLPointsDatabase()
+        db = get_db()
         
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # Get recent transactions from database
+        transactions_data = run_db(db.get_transactions(limit=10))
         
-        try:
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            # Get recent transactions from database
-            transactions_data = loop.run_until_complete(db.get_transactions(limit=10))
-            
-            # Format transactions for API response
-            transactions = []
-            for tx in transactions_data:
-                transactions.append({
-                    "id": tx[0],
-                    "user_id": str(tx[1]),
-                    "amount": tx[2],
-                    "type": tx[3],
-                    "admin_id": tx[4],
-                    "reason": tx[5] or "No reason provided",
-                    "old_balance": tx[6],
-                    "new_balance": tx[7],
-                    "timestamp": tx[8]
-                })
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            return jsonify({"transactions": transactions})
-            
-        finally:
-            loop.close()
+        return jsonify({"transactions": [transaction_json(tx) for tx in transactions_data]})
             
     except Exception as e:
         logger.error(f"Error getting recent transactions: {e}")
@@ -1740,38 +1771,25 @@ def add_achievement():
             return jsonify({"success": False, "error": "Invalid user ID or points format"})
         
         # Connect to database and add achievement
-        from database_postgresql import PostgreSQLPointsDatabase
-        db = PostgreSQLPointsDatabase()
+        db = get_db()
         
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # Add achievement to database
+        success = run_db(db.add_achievement(user_id, ach_type, ach_name, points))
         
-        try:
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            # Add achievement to database
-            success = loop.run_until_complete(db.add_achievement(user_id, ach_type, ach_name, points))
-            
-            if success:
-                # If achievement has bonus points, add them to user's balance
-                if points > 0:
-                    loop.run_until_complete(db.update_points(user_id, points, 0, f"Achievement bonus: {ach_name}"))
-                
-                message = f"Added achievement '{ach_name}' to user {user_id}"
-                if points > 0:
-                    message += f" with {points} bonus points"
-            else:
-                return jsonify({"success": False, "error": "Failed to add achievement to database"})
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            return jsonify({"success": True, "message": message})
+        if success is False:
+            return jsonify({"success": False, "error": f"User {user_id} already has the achievement '{ach_name}'"})
+        if success:
+            # Bonus points only when the achievement was actually inserted
+            if points > 0:
+                run_db(db.update_points(user_id, points, 0, f"Achievement bonus: {ach_name}"))
             
-        finally:
-            loop.close()
+            message = f"Added achievement '{ach_name}' to user {user_id}"
+            if points > 0:
+                message += f" with {points} bonus points"
+        else:
+            return jsonify({"success": False, "error": "Failed to add achievement to database"})
+        
+        return jsonify({"success": True, "message": message})
             
     except Exception as e:
         logger.error(f"Error adding achievement: {e}")
@@ -1794,49 +1812,39 @@ def user_analytics():
         except ValueError:
             return jsonify({"success": False, "error": "Invalid user ID format"})
         
-        from database_postgresql import PostgreSQLPointsDatabase
-        db = PostgreSQLPointsDatabase()
+        db = get_db()
         
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # Get user analytics and current balance from database
+        analytics_data = run_db(db.get_user_analytics(user_id))
+        current_balance = run_db(db.get_points(user_id))
         
-        try:
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            # Get user analytics and current balance from database
-            analytics_data = loop.run_until_complete(db.get_user_analytics(user_id))
-            current_balance = loop.run_until_complete(db.get_points(user_id))
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            if analytics_data:
-                # analytics_data is a tuple: (total_points_earned, total_points_spent, highest_balance, transactions_count, achievements_count, first_activity, last_activity)
-                return jsonify({
-                    "success": True,
-                    "analytics": {
-                        "user_id": str(user_id),
-                        "current_balance": current_balance or 0,
-                        "total_earned": analytics_data[0] or 0,
-                        "total_spent": analytics_data[1] or 0,
-                        "highest_balance": analytics_data[2] or 0,
-                        "transaction_count": analytics_data[3] or 0,
-                        "achievements_count": analytics_data[4] or 0,
-                        "first_activity": str(analytics_data[5]) if analytics_data[5] else 'Never',
-                        "last_activity": str(analytics_data[6]) if analytics_data[6] else 'Never',
-                        "rank": 'N/A'  # Can calculate separately if needed
-                    }
-                })
-            else:
-                return jsonify({
-                    "success": False,
-                    "error": f"No data found for user {user_id}"
-                })
-            
-        finally:
-            loop.close()
+        if analytics_data:
+            # analytics_data is a tuple: (total_points_earned, total_points_spent, highest_balance, transactions_count, achievements_count, first_activity, last_activity)
+            return jsonify({
+                "success": True,
+                "analytics": {
+                    "user_id": str(user_id),
+                    "current_balance": current_balance or 0,
+                    "total_earned": analytics_data[0] or 0,
+                    "total_spent": analytics_data[1] or 0,
+                    "highest_balance": analytics_data[2] or 0,
+                    "transaction_count": analytics_data[3] or 0,
+                    "achievements_count": analytics_data[4] or 0,
+                    "first_activity": str(analytics_data[5]) if analytics_data[5] else 'Never',
+                    "last_activity": str(analytics_data[6]) if analytics_data[6] else 'Never',
+                    "rank": leaderboard.rank(user_id) or 'N/A',
+                    "percentile": leaderboard.percentile(user_id),
+                    "neighbors": [
+                        {"rank": position, "user_id": neighbor_id, "points": balance}
+                        for position, neighbor_id, balance in leaderboard.around(user_id)
+                    ]
+                }
+            })
+        else:
+            return jsonify({
+                "success": False,
+                "error": f"No data found for user {user_id}"
+            })
             
     except Exception as e:
         logger.error(f"Error getting user analytics: {e}")
@@ -1846,75 +1854,26 @@ def user_analytics():
 def get_email_submissions():
     """API endpoint to get all email submissions"""
     try:
-        from database_postgresql import PostgreSQLPointsDatabase
-        db = PostgreSQLPointsDatabase()
+        db = get_db()
         
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # Get all email submissions from PostgreSQL
+        submissions_data = run_db(db.get_email_submissions())
         
-        try:
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            # Get all email submissions from PostgreSQL
-            submissions_data = loop.run_until_complete(db.get_email_submissions())
-            
-            submissions = []
-            for row in submissions_data:
-                # Get current Discord username for display
-                current_username = row[2]  # Default to stored username
-                try:
-                    user = bot.get_user(row[1])
-                    if not user:
-                        user = loop.run_until_complete(bot.fetch_user(row[1]))
-                    if user:
-                        current_username = user.display_name
-                except Exception as e:
-                    logger.debug(f"Could not fetch user {row[1]}: {e}")
-                    if not current_username or current_username.startswith('User '):
-                        current_username = f"User {row[1]}"
-                
-                submissions.append({
-                    'id': row[0],
-                    'discord_user_id': row[1],
-                    'discord_username': current_username,
-                    'email_address': row[3],
-                    'submitted_at': row[4].isoformat() if row[4] else None,
-                    'status': row[5],
-                    'processed_at': row[6].isoformat() if row[6] else None,
-                    'admin_notes': row[7],
-                    'server_roles': row[8] if len(row) > 8 else ""
-                })
-            
-            # Get submission statistics
-            stats_query = '''
-                SELECT 
-                    COUNT(*) as total,
-                    SUM(CASE WHEN status = 'pending' THEN 1 ELSE 0 END) as pending,
-                    SUM(CASE WHEN status = 'processed' THEN 1 ELSE 0 END) as processed
-                FROM email_submissions
-            '''
-            stats_result = loop.run_until_complete(db.execute_query(stats_query))
-            stats_data = stats_result[0] if stats_result else (0, 0, 0)
-            
-            stats = {
-                'total': stats_data[0],
-                'pending': stats_data[1],
-                'processed': stats_data[2]
-            }
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            return jsonify({
-                "success": True,
-                "submissions": submissions,
-                "stats": stats
-            })
-            
-        finally:
-            loop.close()
+        submissions = [email_submission_json(row) for row in submissions_data]
+        
+        # Get submission statistics
+        counters = run_db(db.get_system_counters())
+        stats = {
+            'total': counters.get('emails', 0),
+            'pending': counters.get('emails_pending', 0),
+            'processed': counters.get('emails_processed', 0)
+        }
+        
+        return jsonify({
+            "success": True,
+            "submissions": submissions,
+            "stats": stats
+        })
             
     except Exception as e:
         logger.error(f"Error getting email submissions: {e}")
@@ -1932,50 +1891,34 @@ def process_email_submission():
         if not submission_id:
             return jsonify({"success": False, "error": "Submission ID is required"})
         
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # Use PostgreSQL database for processing
+        db = get_db()
         
-        try:
-            # Use PostgreSQL database for processing
-            from database_postgresql import PostgreSQLPointsDatabase
-            db = PostgreSQLPointsDatabase()
-            
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            # Get email details before processing for notification
-            get_query = '''
-                SELECT discord_user_id, email_address FROM email_submissions 
-                WHERE id = $1
-            '''
-            email_result = loop.run_until_complete(db.execute_query(get_query, submission_id))
-            
-            if not email_result:
-                loop.run_until_complete(db.close())
-                return jsonify({"success": False, "error": "Email submission not found"})
-            
-            user_id, user_email = email_result[0]
-            
-            # Mark submission as processed
-            update_query = '''
-                UPDATE email_submissions 
-                SET status = 'processed', processed_at = CURRENT_TIMESTAMP
-                WHERE id = $1
-            '''
-            result = loop.run_until_complete(db.execute_query(update_query, submission_id))
-            
-            # Send DM notification about email processing
-            notification_message = f"✅ **Email Processed**\n\nYour email submission **{user_email}** has been processed by an admin.\n\n📧 Status: **Completed**\n🕒 Processed at: **{datetime.now().strftime('%Y-%m-%d %H:%M')}**"
-            send_admin_notification_dm_sync(user_id, notification_message, "email_processed")
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            return jsonify({"success": True, "message": "Email submission marked as processed"})
-                
-        finally:
-            loop.close()
+        # Get email details before processing for notification
+        get_query = '''
+            SELECT discord_user_id, email_address FROM email_submissions 
+            WHERE id = $1
+        '''
+        email_result = run_db(db.execute_query(get_query, submission_id))
+        
+        if not email_result:
+            return jsonify({"success": False, "error": "Email submission not found"})
+        
+        user_id, user_email = email_result[0]
+        
+        # Mark submission as processed
+        update_query = '''
+            UPDATE email_submissions 
+            SET status = 'processed', processed_at = CURRENT_TIMESTAMP
+            WHERE id = $1
+        '''
+        result = run_db(db.execute_query(update_query, submission_id))
+        
+        # Send DM notification about email processing
+        notification_message = f"✅ **Email Processed**\n\nYour email submission **{user_email}** has been processed by an admin.\n\n📧 Status: **Completed**\n🕒 Processed at: **{datetime.now().strftime('%Y-%m-%d %H:%M')}**"
+        send_admin_notification_dm_sync(user_id, notification_message, "email_processed")
+        
+        return jsonify({"success": True, "message": "Email submission marked as processed"})
             
     except Exception as e:
         logger.error(f"Error processing email submission: {e}")
@@ -1993,108 +1936,87 @@ def delete_email_submission():
         if not submission_id:
             return jsonify({"success": False, "error": "Submission ID is required"})
         
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # Use PostgreSQL database for deletion
+        db = get_db()
         
-        try:
-            # Use PostgreSQL database for deletion
-            from database_postgresql import PostgreSQLPointsDatabase
-            db = PostgreSQLPointsDatabase()
-            
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            # Get email details before deletion for notification
-            get_query = '''
-                SELECT discord_user_id, email_address, status FROM email_submissions 
-                WHERE id = $1
-            '''
-            email_result = loop.run_until_complete(db.execute_query(get_query, submission_id))
-            
-            if not email_result:
-                loop.run_until_complete(db.close())
-                return jsonify({"success": False, "error": "Email submission not found"})
-            
-            user_id, user_email, status = email_result[0]
-            
-            # Delete submission
-            delete_query = 'DELETE FROM email_submissions WHERE id = $1'
-            result = loop.run_until_complete(db.execute_query(delete_query, submission_id))
-            
-            # Send DM notification about email deletion
-            from datetime import datetime
-            notification_message = f"🗑️ **Email Submission Removed**\n\nYour email submission **{user_email}** has been removed by an admin.\n\n📧 Previous Status: **{status.title()}**\n🕒 Removed at: **{datetime.now().strftime('%Y-%m-%d %H:%M')}**\n\n💡 You can submit a new email using `/submitemail` if needed."
-            send_admin_notification_dm_sync(user_id, notification_message, "email_deleted")
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            return jsonify({"success": True, "message": "Email submission deleted"})
-                
-        finally:
-            loop.close()
+        # Get email details before deletion for notification
+        get_query = '''
+            SELECT discord_user_id, email_address, status FROM email_submissions 
+            WHERE id = $1
+        '''
+        email_result = run_db(db.execute_query(get_query, submission_id))
+        
+        if not email_result:
+            return jsonify({"success": False, "error": "Email submission not found"})
+        
+        user_id, user_email, status = email_result[0]
+        
+        # Delete submission
+        delete_query = 'DELETE FROM email_submissions WHERE id = $1'
+        result = run_db(db.execute_query(delete_query, submission_id))
+        
+        # Send DM notification about email deletion
+        from datetime import datetime
+        notification_message = f"🗑️ **Email Submission Removed**\n\nYour email submission **{user_email}** has been removed by an admin.\n\n📧 Previous Status: **{status.title()}**\n🕒 Removed at: **{datetime.now().strftime('%Y-%m-%d %H:%M')}**\n\n💡 You can submit a new email using `/submitemail` if needed."
+        send_admin_notification_dm_sync(user_id, notification_message, "email_deleted")
+        
+        return jsonify({"success": True, "message": "Email submission deleted"})
             
     except Exception as e:
         logger.error(f"Error deleting email submission: {e}")
         return jsonify({"success": False, "error": str(e)})
 
-@app.route("/api/export_email_submissions", methods=["GET"])
-def export_email_submissions():
-    """API endpoint to export email submissions as CSV"""
+def export_response(name):
+    """Stream an export as CSV (default) or NDJSON (?format=ndjson), filtered by ?since, ?until and ?status
+
+    Rows come from a server-side cursor a chunk at a time, so memory use doesn't grow
+    with the table and the CSV header is sent before the query runs.
+    """
+    from flask import Response, stream_with_context
+    
+    export_format = request.args.get('format', 'csv')
+    if export_format not in FORMATS:
+        return jsonify({"success": False, "error": f"Unknown format: {export_format}"}), 400
     try:
-        import asyncio
-        import csv
-        from io import StringIO
-        
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
+        query, args = build_export_query(
+            name,
+            since=parse_date(request.args.get('since')),
+            until=parse_date(request.args.get('until')),
+            status=request.args.get('status') or None
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    def generate():
+        chunks = iterate_db(get_db().iterate_query(query, *args, chunk_size=EXPORT_CHUNK_SIZE))
         try:
-            # Use PostgreSQL database for export
-            from database_postgresql import PostgreSQLPointsDatabase
-            db = PostgreSQLPointsDatabase()
-            
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            # Get all submissions for export
-            submissions = loop.run_until_complete(db.get_email_submissions())
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            # Create CSV content
-            output = StringIO()
-            writer = csv.writer(output)
-            
-            # Write header
-            writer.writerow(['Discord_User_ID', 'Discord_Username', 'Email_Address', 'Submitted_At', 'Status', 'Processed_At', 'Admin_Notes'])
-            
-            # Write data with ' prefix for user IDs to preserve Excel formatting
-            for row in submissions:
-                # Add apostrophe prefix to user ID to prevent Excel from changing format
-                formatted_row = list(row)
-                formatted_row[1] = "'" + str(row[1])  # Add ' to user ID
-                writer.writerow(formatted_row)
-            
-            csv_content = output.getvalue()
-            output.close()
-            
-            # Return as downloadable file
-            from flask import Response
-            return Response(
-                csv_content,
-                mimetype='text/csv',
-                headers={"Content-disposition": f"attachment; filename=email_submissions_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"}
-            )
-            
+            yield from render_export(name, export_format, chunks)
+        except Exception as e:
+            # Headers are already sent, so the best we can do is log and cut the stream short
+            logger.error(f"Error streaming {name} export: {e}")
         finally:
-            loop.close()
-            
-    except Exception as e:
-        logger.error(f"Error exporting email submissions: {e}")
-        return jsonify({"success": False, "error": str(e)})
+            chunks.close()
+    
+    filename = f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    return Response(stream_with_context(generate()), mimetype=FORMATS[export_format], headers={
+        "Content-Disposition": f"attachment; filename={filename}",
+        "X-Accel-Buffering": "no"
+    })
+
+@app.route("/api/export_users", methods=["GET"])
+def export_users():
+    """API endpoint to export users with points and email status (status: pending/processed/no_email)"""
+    return export_response('users')
+
+@app.route("/api/export_transactions", methods=["GET"])
+def export_transactions():
+    """API endpoint to export the transaction log (status filters on transaction_type)"""
+    return export_response('transactions')
+
+@app.route("/api/export_email_submissions", methods=["GET"])
+def export_email_submissions():
+    """API endpoint to export email submissions"""
+    return export_response('email_submissions')
 
 @app.route("/api/bulk_email_action", methods=["POST"])
 def bulk_email_action():
@@ -2113,114 +2035,113 @@ def bulk_email_action():
         if action not in ['process', 'delete']:
             return jsonify({"success": False, "error": "Invalid action. Use 'process' or 'delete'"})
         
-        from database_postgresql import PostgreSQLPointsDatabase
-        db = PostgreSQLPointsDatabase()
+        try:
+            submission_ids = [int(submission_id) for submission_id in submission_ids]
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "error": "Invalid submission id"})
         
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        job_id = enqueue_job("bulk_email_action", {"action": action, "submission_ids": submission_ids},
+                             total=len(submission_ids))
+        if job_id is None:
+            return jsonify({"success": False, "error": "Failed to queue bulk email action"})
         
-        try:
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            if action == 'process':
-                # Mark submissions as processed
-                for submission_id in submission_ids:
-                    update_query = '''
-                        UPDATE email_submissions 
-                        SET status = 'processed', processed_at = CURRENT_TIMESTAMP
-                        WHERE id = $1
-                    '''
-                    loop.run_until_complete(db.execute_query(update_query, submission_id))
-                
-                message = f"Successfully marked {len(submission_ids)} submissions as processed"
-                
-            elif action == 'delete':
-                # Delete submissions
-                for submission_id in submission_ids:
-                    delete_query = 'DELETE FROM email_submissions WHERE id = $1'
-                    loop.run_until_complete(db.execute_query(delete_query, submission_id))
-                
-                message = f"Successfully deleted {len(submission_ids)} submissions"
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            return jsonify({"success": True, "message": message})
-            
-        finally:
-            loop.close()
+        verb = "marked as processed" if action == 'process' else "deleted"
+        return jsonify({
+            "success": True,
+            "job_id": job_id,
+            "status_url": f"/api/jobs/{job_id}",
+            "message": f"{len(submission_ids)} submissions will be {verb}"
+        })
             
     except Exception as e:
         logger.error(f"Error in bulk email action: {e}")
         return jsonify({"success": False, "error": str(e)})
 
+def encode_cursor(sort_value, user_id) -> str:
+    """Opaque keyset cursor for the user list"""
+    import base64
+    import json
+    return base64.urlsafe_b64encode(json.dumps([sort_value, user_id]).encode()).decode()
+
+def decode_cursor(cursor: str):
+    """(sort value, user_id) from a cursor made by encode_cursor"""
+    import base64
+    import json
+    sort_value, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return sort_value, user_id
+
 @app.route("/api/users")
 def api_users():
-    """API endpoint for unified user management"""
+    """Keyset-paginated user list with server-side search, status filter and sort
+
+    Query parameters: q (username, email or user id), status (pending, processed,
+    no_email), sort (points_desc, points_asc, username_asc, username_desc), limit
+    (max 200) and cursor (next_cursor from the previous page).
+    """
+    from database_postgresql import USER_SORTS, USER_STATUS_FILTERS
+    
     try:
-        from database_postgresql import PostgreSQLPointsDatabase
-        db = PostgreSQLPointsDatabase()
-        
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
+        sort = request.args.get('sort', 'points_desc')
+        status = request.args.get('status') or None
+        search = request.args.get('q', '').strip() or None
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+        if sort not in USER_SORTS:
+            return jsonify({"success": False, "error": f"Unknown sort: {sort}"}), 400
+        if status and status not in USER_STATUS_FILTERS:
+            return jsonify({"success": False, "error": f"Unknown status filter: {status}"}), 400
         try:
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            # Get combined user data with points and email info
-            query = '''
-                SELECT 
-                    COALESCE(p.user_id, es.discord_user_id) as user_id,
-                    p.balance as points,
-                    es.email_address,
-                    es.status as email_status,
-                    es.discord_username
-                FROM points p
-                FULL OUTER JOIN email_submissions es ON p.user_id = es.discord_user_id
-                ORDER BY COALESCE(p.balance, 0) DESC
-            '''
-            
-            users_data = loop.run_until_complete(db.execute_query(query))
-            
-            # Format users for API response
-            users = []
-            for user in users_data:
-                users.append({
-                    "user_id": user[0],
-                    "points": user[1] or 0,
-                    "email": user[2],
-                    "email_status": user[3],
-                    "username": user[4] or f"User {user[0]}"
-                })
-            
-            # Get statistics
-            stats_queries = {
-                'total_users': 'SELECT COUNT(DISTINCT COALESCE(p.user_id, es.discord_user_id)) FROM points p FULL OUTER JOIN email_submissions es ON p.user_id = es.discord_user_id',
-                'users_with_email': 'SELECT COUNT(*) FROM email_submissions',
-                'users_with_points': 'SELECT COUNT(*) FROM points',
-                'total_points': 'SELECT COALESCE(SUM(balance), 0) FROM points'
-            }
-            
-            stats = {}
-            for key, query in stats_queries.items():
-                result = loop.run_until_complete(db.execute_query(query))
-                stats[key] = result[0][0] if result and result[0] else 0
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            return jsonify({
-                "success": True,
-                "users": users,
-                "stats": stats
-            })
-            
-        finally:
-            loop.close()
+            after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        except (ValueError, TypeError):
+            return jsonify({"success": False, "error": "Invalid cursor"}), 400
+        
+        db = get_db()
+        
+        # One extra row tells us whether there is a next page
+        rows = run_db(db.list_users(sort, status, search, after, limit + 1))
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        
+        users = [{
+            "user_id": row['user_id'],
+            "points": row['balance'] or 0,
+            "email": row['email_address'],
+            "email_status": row['status'],
+            "username": row['username'] or f"User {row['user_id']}"
+        } for row in rows]
+        
+        key = USER_SORTS[sort][0]
+        next_cursor = encode_cursor(rows[-1][key], rows[-1]['user_id']) if has_more else None
+        
+        # Totals come from system_counters, not from counting the join; the email_users*
+        # counters count distinct users, like the list itself
+        counters = run_db(db.get_system_counters())
+        users_with_points = counters.get('users', 0)
+        users_with_email = counters.get('email_users', 0)
+        email_only_users = counters.get('email_users_without_points', 0)
+        stats = {
+            'total_users': users_with_points + email_only_users,
+            'users_with_email': users_with_email,
+            'users_with_points': users_with_points,
+            'total_points': counters.get('total_points', 0)
+        }
+        if search:
+            total = None  # search matches aren't counted
+        elif status == 'pending':
+            total = counters.get('email_users_pending', 0)
+        elif status == 'processed':
+            total = counters.get('email_users_processed', 0)
+        elif status == 'no_email':
+            total = max(users_with_points - (users_with_email - email_only_users), 0)
+        else:
+            total = stats['total_users']
+        
+        return jsonify({
+            "success": True,
+            "users": users,
+            "stats": stats,
+            "total": total,
+            "next_cursor": next_cursor
+        })
             
     except Exception as e:
         logger.error(f"Error getting users: {e}")
@@ -2232,6 +2153,7 @@ def api_users():
         })
 
 @app.route("/api/set_user_points", methods=["POST"])
+@idempotent("set_user_points")
 def set_user_points():
     """API endpoint for setting user points"""
     try:
@@ -2251,44 +2173,27 @@ def set_user_points():
         except ValueError:
             return jsonify({"success": False, "error": "Invalid points format"})
         
-        from database_postgresql import PostgreSQLPointsDatabase
-        db = PostgreSQLPointsDatabase()
+        db = get_db()
         
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # Set user points
+        success = run_db(db.assign_points(user_id, points, admin_id=None, reason=reason)) is not None
         
-        try:
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            # Get current points before updating
-            current_points = loop.run_until_complete(db.get_points(user_id))
-            
-            # Set user points
-            success = loop.run_until_complete(db.set_points(user_id, points, admin_id=None, reason=reason))
-            
-            # Send DM notification if successful
-            if success:
-                notification_message = f"🔄 **Points Updated**\n\nYour points have been set to **{points:,} points**.\n\n📝 **Reason:** {reason or 'Admin adjustment'}"
-                send_admin_notification_dm_sync(user_id, notification_message, "points_update")
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            if success:
-                return jsonify({"success": True, "message": f"Points set to {points} for user {user_id}"})
-            else:
-                return jsonify({"success": False, "error": "Failed to set points"})
-            
-        finally:
-            loop.close()
+        # Send DM notification if successful
+        if success:
+            notification_message = f"🔄 **Points Updated**\n\nYour points have been set to **{points:,} points**.\n\n📝 **Reason:** {reason or 'Admin adjustment'}"
+            send_admin_notification_dm_sync(user_id, notification_message, "points_update")
+        
+        if success:
+            return jsonify({"success": True, "message": f"Points set to {points} for user {user_id}"})
+        else:
+            return jsonify({"success": False, "error": "Failed to set points"})
             
     except Exception as e:
         logger.error(f"Error setting user points: {e}")
         return jsonify({"success": False, "error": str(e)})
 
 @app.route("/api/adjust_user_points", methods=["POST"])
+@idempotent("adjust_user_points")
 def adjust_user_points():
     """API endpoint for adding or reducing user points"""
     try:
@@ -2314,65 +2219,49 @@ def adjust_user_points():
         except ValueError:
             return jsonify({"success": False, "error": "Invalid amount format"})
         
-        from database_postgresql import PostgreSQLPointsDatabase
-        db = PostgreSQLPointsDatabase()
+        db = get_db()
         
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # Apply the change atomically - reductions stop at zero to prevent negative balances
+        if action == 'add':
+            balances = run_db(db.change_points(user_id, amount, admin_id=None, reason=reason))
+        else:  # reduce
+            balances = run_db(db.change_points(user_id, -amount, admin_id=None, reason=reason, clamp_at_zero=True))
+        success = balances is not None
         
-        try:
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            # Get current points
-            current_points = loop.run_until_complete(db.get_points(user_id))
-            
-            # Calculate new points
+        # Send DM notification if successful
+        if success:
+            current_points, new_points = balances
             if action == 'add':
-                new_points = current_points + amount
                 change_text = f"+{amount}"
                 action_text = "added"
-            else:  # reduce
-                new_points = max(0, current_points - amount)  # Don't allow negative points
+            else:
                 actual_reduction = current_points - new_points
                 change_text = f"-{actual_reduction}"
                 action_text = "reduced"
                 if actual_reduction != amount:
                     reason += f" (reduced by {actual_reduction} to prevent negative balance)"
             
-            # Update points
-            success = loop.run_until_complete(db.set_points(user_id, new_points, admin_id=None, reason=reason))
-            
-            # Send DM notification if successful
-            if success:
-                from datetime import datetime
-                dm_message = f"💰 **Points {action_text.title()}**\n\n"
-                dm_message += f"Your points have been {action_text} by an admin.\n\n"
-                dm_message += f"🔄 **Change:** {change_text} points\n"
-                dm_message += f"📊 **Previous Balance:** {current_points:,} points\n"
-                dm_message += f"📊 **New Balance:** {new_points:,} points\n"
-                dm_message += f"📝 **Reason:** {reason}\n"
-                dm_message += f"🕒 **Updated:** {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-                
-                send_admin_notification_dm_sync(user_id, dm_message, "points_adjustment")
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            if success:
-                return jsonify({
-                    "success": True, 
-                    "message": f"Points {action_text} successfully",
-                    "old_points": current_points,
-                    "new_points": new_points,
-                    "change": change_text
-                })
-            else:
-                return jsonify({"success": False, "error": "Failed to adjust points"})
+            from datetime import datetime
+            dm_message = f"💰 **Points {action_text.title()}**\n\n"
+            dm_message += f"Your points have been {action_text} by an admin.\n\n"
+            dm_message += f"🔄 **Change:** {change_text} points\n"
+            dm_message += f"📊 **Previous Balance:** {current_points:,} points\n"
+            dm_message += f"📊 **New Balance:** {new_points:,} points\n"
+            dm_message += f"📝 **Reason:** {reason}\n"
+            dm_message += f"🕒 **Updated:** {datetime.now().strftime('%Y-%m-%d %H:%M')}"
             
-        finally:
-            loop.close()
+            send_admin_notification_dm_sync(user_id, dm_message, "points_adjustment")
+        
+        if success:
+            return jsonify({
+                "success": True, 
+                "message": f"Points {action_text} successfully",
+                "old_points": current_points,
+                "new_points": new_points,
+                "change": change_text
+            })
+        else:
+            return jsonify({"success": False, "error": "Failed to adjust points"})
             
     except Exception as e:
         logger.error(f"Error adjusting user points: {e}")
@@ -2391,45 +2280,30 @@ def process_user_email():
         if not user_id:
             return jsonify({"success": False, "error": "Missing user_id"})
         
-        from database_postgresql import PostgreSQLPointsDatabase
-        db = PostgreSQLPointsDatabase()
+        db = get_db()
         
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # Get email details before processing
+        email_query = '''
+            SELECT email_address FROM email_submissions 
+            WHERE discord_user_id = $1 AND status = 'pending'
+        '''
+        email_result = run_db(db.execute_query(email_query, user_id))
+        user_email = email_result[0][0] if email_result else "your email"
         
-        try:
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            # Get email details before processing
-            email_query = '''
-                SELECT email_address FROM email_submissions 
-                WHERE discord_user_id = $1 AND status = 'pending'
-            '''
-            email_result = loop.run_until_complete(db.execute_query(email_query, user_id))
-            user_email = email_result[0][0] if email_result else "your email"
-            
-            # Update email status to processed
-            query = '''
-                UPDATE email_submissions 
-                SET status = 'processed', processed_at = CURRENT_TIMESTAMP 
-                WHERE discord_user_id = $1 AND status = 'pending'
-            '''
-            
-            result = loop.run_until_complete(db.execute_query(query, user_id))
-            
-            # Send DM notification about email processing
-            notification_message = f"✅ **Email Processed**\n\nYour email submission **{user_email}** has been processed by an admin.\n\n📧 Status: **Completed**\n🕒 Processed at: **{datetime.now().strftime('%Y-%m-%d %H:%M')}**"
-            send_admin_notification_dm_sync(user_id, notification_message, "email_processed")
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            return jsonify({"success": True, "message": f"Email processed for user {user_id}"})
-            
-        finally:
-            loop.close()
+        # Update email status to processed
+        query = '''
+            UPDATE email_submissions 
+            SET status = 'processed', processed_at = CURRENT_TIMESTAMP 
+            WHERE discord_user_id = $1 AND status = 'pending'
+        '''
+        
+        result = run_db(db.execute_query(query, user_id))
+        
+        # Send DM notification about email processing
+        notification_message = f"✅ **Email Processed**\n\nYour email submission **{user_email}** has been processed by an admin.\n\n📧 Status: **Completed**\n🕒 Processed at: **{datetime.now().strftime('%Y-%m-%d %H:%M')}**"
+        send_admin_notification_dm_sync(user_id, notification_message, "email_processed")
+        
+        return jsonify({"success": True, "message": f"Email processed for user {user_id}"})
             
     except Exception as e:
         logger.error(f"Error processing user email: {e}")
@@ -2455,72 +2329,46 @@ def add_new_user():
         if not user_id.isdigit() or len(user_id) < 17 or len(user_id) > 19:
             return jsonify({"success": False, "error": "Invalid Discord User ID format"})
         
-        from database_postgresql import PostgreSQLPointsDatabase
-        db = PostgreSQLPointsDatabase()
+        db = get_db()
         
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        message_parts = []
         
+        # Check if user already exists in points table
+        points_check = run_db(db.execute_query('SELECT balance FROM points WHERE user_id = $1', user_id))
+        if points_check:
+            return jsonify({"success": False, "error": f"User {user_id} already exists with {points_check[0][0]} points"})
+        
+        # Add user to points table with their ledger entry and statistics profile in one write
         try:
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            message_parts = []
-            
-            # Check if user already exists in points table
-            points_check = loop.run_until_complete(db.execute_query('SELECT balance FROM points WHERE user_id = $1', user_id))
-            if points_check:
-                return jsonify({"success": False, "error": f"User {user_id} already exists with {points_check[0][0]} points"})
-            
-            # Add user to points table
-            loop.run_until_complete(db.execute_query('''
-                INSERT INTO points (user_id, balance, created_at, updated_at)
-                VALUES ($1, $2, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-            ''', user_id, points))
-            message_parts.append(f"✓ Added user with {points:,} points")
-            
-            # Add initial transaction record if points > 0
-            if points > 0:
-                loop.run_until_complete(db.execute_query('''
-                    INSERT INTO transactions (user_id, amount, transaction_type, admin_id, reason, created_at)
-                    VALUES ($1, $2, 'add', 'dashboard_admin', 'Initial points from admin dashboard', CURRENT_TIMESTAMP)
-                ''', user_id, points))
-                message_parts.append(f"✓ Recorded initial points transaction")
-            
-            # Add email submission if email provided
-            if email:
-                # Check if email already exists
-                email_check = loop.run_until_complete(db.execute_query('SELECT discord_user_id FROM email_submissions WHERE email_address = $1', email))
-                if email_check:
-                    message_parts.append(f"⚠️ Email {email} already exists for user {email_check[0][0]}")
-                else:
-                    loop.run_until_complete(db.execute_query('''
-                        INSERT INTO email_submissions (discord_user_id, discord_username, email_address, server_roles, status, submitted_at)
-                        VALUES ($1, $2, $3, '', 'pending', CURRENT_TIMESTAMP)
-                    ''', user_id, username or f"User {user_id}", email))
-                    message_parts.append(f"✓ Added email submission: {email}")
-            
-            # Add to user_stats table
-            loop.run_until_complete(db.execute_query('''
-                INSERT INTO user_stats (user_id, total_earned, total_spent, highest_balance, transaction_count, last_activity, created_at)
-                VALUES ($1, $2, 0, $2, $3, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-            ''', user_id, points, 1 if points > 0 else 0))
-            message_parts.append(f"✓ Created user statistics profile")
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            return jsonify({
-                "success": True, 
-                "message": "\\n".join(message_parts),
-                "user_id": user_id,
-                "points": points,
-                "email": email or None
-            })
-            
-        finally:
-            loop.close()
+            points = int(points)
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "error": "Invalid points format"})
+        if run_db(db.assign_points(user_id, points, reason="Initial points from admin dashboard")) is None:
+            return jsonify({"success": False, "error": "Failed to add user to database"})
+        message_parts.append(f"✓ Added user with {points:,} points")
+        message_parts.append(f"✓ Recorded initial points transaction")
+        message_parts.append(f"✓ Created user statistics profile")
+        
+        # Add email submission if email provided
+        if email:
+            # Check if email already exists
+            email_check = run_db(db.execute_query('SELECT discord_user_id FROM email_submissions WHERE email_address = $1', email))
+            if email_check:
+                message_parts.append(f"⚠️ Email {email} already exists for user {email_check[0][0]}")
+            else:
+                run_db(db.execute_query('''
+                    INSERT INTO email_submissions (discord_user_id, discord_username, email_address, server_roles, status, submitted_at)
+                    VALUES ($1, $2, $3, '', 'pending', CURRENT_TIMESTAMP)
+                ''', user_id, username or f"User {user_id}", email))
+                message_parts.append(f"✓ Added email submission: {email}")
+        
+        return jsonify({
+            "success": True, 
+            "message": "\\n".join(message_parts),
+            "user_id": user_id,
+            "points": points,
+            "email": email or None
+        })
             
     except Exception as e:
         logger.error(f"Error adding new user: {e}")
@@ -2541,53 +2389,38 @@ def update_user_profile():
         if not user_id:
             return jsonify({"success": False, "error": "Missing user_id"})
         
-        from database_postgresql import PostgreSQLPointsDatabase
-        db = PostgreSQLPointsDatabase()
+        db = get_db()
         
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # Check if user already has an email submission
+        check_query = 'SELECT id FROM email_submissions WHERE discord_user_id = $1'
+        existing_submission = run_db(db.execute_query(check_query, user_id))
         
-        try:
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            # Check if user already has an email submission
-            check_query = 'SELECT id FROM email_submissions WHERE discord_user_id = $1'
-            existing_submission = loop.run_until_complete(db.execute_query(check_query, user_id))
-            
-            if existing_submission:
-                # Update existing email submission
-                update_query = '''
-                    UPDATE email_submissions 
-                    SET discord_username = $1, email_address = $2, 
-                        submitted_at = CASE WHEN email_address != $2 THEN CURRENT_TIMESTAMP ELSE submitted_at END,
-                        status = CASE WHEN email_address != $2 THEN 'pending' ELSE status END
-                    WHERE discord_user_id = $3
+        if existing_submission:
+            # Update existing email submission
+            update_query = '''
+                UPDATE email_submissions 
+                SET discord_username = $1, email_address = $2, 
+                    submitted_at = CASE WHEN email_address != $2 THEN CURRENT_TIMESTAMP ELSE submitted_at END,
+                    status = CASE WHEN email_address != $2 THEN 'pending' ELSE status END
+                WHERE discord_user_id = $3
+            '''
+            run_db(db.execute_query(update_query, username, email, user_id))
+            message = "User profile updated successfully"
+        else:
+            # Create new email submission if email is provided
+            if email:
+                insert_query = '''
+                    INSERT INTO email_submissions (discord_user_id, discord_username, email_address, server_roles, status, submitted_at)
+                    VALUES ($1, $2, $3, $4, 'pending', CURRENT_TIMESTAMP)
                 '''
-                loop.run_until_complete(db.execute_query(update_query, username, email, user_id))
-                message = "User profile updated successfully"
+                run_db(db.execute_query(insert_query, user_id, username, email, ""))
+                message = "User profile created with email submission"
             else:
-                # Create new email submission if email is provided
-                if email:
-                    insert_query = '''
-                        INSERT INTO email_submissions (discord_user_id, discord_username, email_address, server_roles, status, submitted_at)
-                        VALUES ($1, $2, $3, $4, 'pending', CURRENT_TIMESTAMP)
-                    '''
-                    loop.run_until_complete(db.execute_query(insert_query, user_id, username, email, ""))
-                    message = "User profile created with email submission"
-                else:
-                    # For username-only updates, we could store in a separate table or just return success
-                    # For now, we'll require email to create a submission
-                    message = "Username noted (email required for submission)"
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            return jsonify({"success": True, "message": message})
-            
-        finally:
-            loop.close()
+                # For username-only updates, we could store in a separate table or just return success
+                # For now, we'll require email to create a submission
+                message = "Username noted (email required for submission)"
+        
+        return jsonify({"success": True, "message": message})
             
     except Exception as e:
         logger.error(f"Error updating user profile: {e}")
@@ -2597,34 +2430,22 @@ def update_user_profile():
 def clear_processed_emails():
     """API endpoint to delete all processed email submissions"""
     try:
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # Use PostgreSQL database
+        db = get_db()
         
-        try:
-            # Use PostgreSQL database
-            from database_postgresql import PostgreSQLPointsDatabase
-            db = PostgreSQLPointsDatabase()
-            
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            # Delete processed emails
-            delete_query = "DELETE FROM email_submissions WHERE status = 'processed'"
-            result = loop.run_until_complete(db.execute_query(delete_query))
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            deleted_count = 0  # PostgreSQL doesn't easily return row count from delete
-            
-            return jsonify({
-                "success": True, 
-                "message": f"Deleted {deleted_count} processed email submissions"
-            })
-            
-        finally:
-            loop.close()
+        # Count now for progress reporting; the deletes run as a background job
+        pending_count = run_db(db.get_system_counters()).get('emails_processed', 0)
+        
+        job_id = enqueue_job("clear_processed_emails", {}, total=pending_count)
+        if job_id is None:
+            return jsonify({"success": False, "error": "Failed to queue processed email cleanup"})
+        
+        return jsonify({
+            "success": True, 
+            "job_id": job_id,
+            "status_url": f"/api/jobs/{job_id}",
+            "message": f"Deleting {pending_count} processed email submissions"
+        })
             
     except Exception as e:
         logger.error(f"Error clearing processed emails: {e}")
@@ -2650,42 +2471,22 @@ def send_dm():
         if message_type not in valid_types:
             return jsonify({"success": False, "error": "Invalid message type"})
         
-        from database_postgresql import PostgreSQLPointsDatabase
-        db = PostgreSQLPointsDatabase()
+        # Ensure user_id is a string for database operations
+        user_id_str = str(user_id)
         
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # Only the outbox row is written here; delivery status shows up in message history
+        success = send_admin_notification_dm_sync(user_id_str, message_content, message_type)
         
-        try:
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            # Ensure user_id is a string for database operations
-            user_id_str = str(user_id)
-            
-            # Check if user exists and get username
-            user_data = loop.run_until_complete(db.execute_query('SELECT user_id FROM points WHERE user_id = $1', user_id_str))
-            
-            # Use the synchronous DM wrapper instead of complex async logic
-            success = send_admin_notification_dm_sync(user_id_str, message_content, message_type)
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            if success:
-                return jsonify({
-                    "success": True,
-                    "message": f"DM sent successfully to user {user_id_str}"
-                })
-            else:
-                return jsonify({
-                    "success": False,
-                    "error": "Failed to send DM. Check logs for details."
-                })
-                
-        finally:
-            loop.close()
+        if success:
+            return jsonify({
+                "success": True,
+                "message": f"DM queued for delivery to user {user_id_str}"
+            })
+        else:
+            return jsonify({
+                "success": False,
+                "error": "Failed to queue DM. Check logs for details."
+            })
             
     except Exception as e:
         logger.error(f"Error sending DM via dashboard: {e}")
@@ -2695,50 +2496,35 @@ def send_dm():
 def message_history():
     """API endpoint for message history"""
     try:
-        from database_postgresql import PostgreSQLPointsDatabase
-        db = PostgreSQLPointsDatabase()
+        db = get_db()
         
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # Get message history from database
+        messages_data = run_db(db.execute_query('''
+            SELECT id, sender_admin_name, recipient_username, message_content, 
+                   message_type, sent_at, delivery_status, delivery_error,
+                   sender_admin_id, recipient_user_id
+            FROM admin_messages 
+            ORDER BY sent_at DESC 
+            LIMIT 50
+        '''))
+        
+        # Format messages for API response
+        messages = []
+        for msg in messages_data:
+            messages.append({
+                "id": msg[0],
+                "sender_admin_name": msg[1],
+                "recipient_username": msg[2],
+                "message_content": msg[3],
+                "message_type": msg[4],
+                "sent_at": msg[5].isoformat() if msg[5] else None,
+                "delivery_status": msg[6],
+                "delivery_error": msg[7],
+                "sender_admin_id": msg[8],
+                "recipient_user_id": msg[9]
+            })
         
-        try:
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            # Get message history from database
-            messages_data = loop.run_until_complete(db.execute_query('''
-                SELECT id, sender_admin_name, recipient_username, message_content, 
-                       message_type, sent_at, delivery_status, delivery_error,
-                       sender_admin_id, recipient_user_id
-                FROM admin_messages 
-                ORDER BY sent_at DESC 
-                LIMIT 50
-            '''))
-            
-            # Format messages for API response
-            messages = []
-            for msg in messages_data:
-                messages.append({
-                    "id": msg[0],
-                    "sender_admin_name": msg[1],
-                    "recipient_username": msg[2],
-                    "message_content": msg[3],
-                    "message_type": msg[4],
-                    "sent_at": msg[5].isoformat() if msg[5] else None,
-                    "delivery_status": msg[6],
-                    "delivery_error": msg[7],
-                    "sender_admin_id": msg[8],
-                    "recipient_user_id": msg[9]
-                })
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            return jsonify({"messages": messages})
-            
-        finally:
-            loop.close()
+        return jsonify({"messages": messages})
             
     except Exception as e:
         logger.error(f"Error getting message history: {e}")
@@ -2748,43 +2534,17 @@ def message_history():
 def message_stats():
     """API endpoint for message statistics"""
     try:
-        from database_postgresql import PostgreSQLPointsDatabase
-        db = PostgreSQLPointsDatabase()
-        
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        db = get_db()
         
-        try:
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            # Get message statistics
-            stats_data = loop.run_until_complete(db.execute_query('''
-                SELECT 
-                    COUNT(*) as total,
-                    COUNT(CASE WHEN delivery_status = 'delivered' THEN 1 END) as delivered,
-                    COUNT(CASE WHEN delivery_status = 'failed' THEN 1 END) as failed,
-                    COUNT(CASE WHEN delivery_status = 'pending' THEN 1 END) as pending
-                FROM admin_messages
-            '''))
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            if stats_data:
-                stats = stats_data[0]
-                return jsonify({
-                    "total": stats[0],
-                    "delivered": stats[1],
-                    "failed": stats[2],
-                    "pending": stats[3]
-                })
-            else:
-                return jsonify({"total": 0, "delivered": 0, "failed": 0, "pending": 0})
-            
-        finally:
-            loop.close()
+        # Get message statistics
+        counters = run_db(db.get_system_counters())
+        return jsonify({
+            "total": counters.get('messages', 0),
+            "delivered": counters.get('messages_delivered', 0),
+            "failed": counters.get('messages_failed', 0),
+            # Queued for delivery, including retries and sends in flight
+            "pending": sum(counters.get(f"messages_{status}", 0) for status in ('pending', 'retrying', 'sending'))
+        })
             
     except Exception as e:
         logger.error(f"Error getting message stats: {e}")
@@ -2792,55 +2552,8 @@ def message_stats():
 
 @app.route("/api/export_messages")
 def export_messages():
-    """API endpoint for exporting message history"""
-    try:
-        from database_postgresql import PostgreSQLPointsDatabase
-        db = PostgreSQLPointsDatabase()
-        
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        try:
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            # Get all messages from database
-            messages_data = loop.run_until_complete(db.execute_query('''
-                SELECT id, sender_admin_name, sender_admin_id, recipient_username, 
-                       recipient_user_id, message_content, message_type, sent_at, 
-                       delivery_status, delivery_error
-                FROM admin_messages 
-                ORDER BY sent_at DESC
-            '''))
-            
-            # Format messages for export
-            messages = []
-            for msg in messages_data:
-                messages.append({
-                    "id": msg[0],
-                    "sender_admin_name": msg[1],
-                    "sender_admin_id": msg[2],
-                    "recipient_username": msg[3],
-                    "recipient_user_id": msg[4],
-                    "message_content": msg[5],
-                    "message_type": msg[6],
-                    "sent_at": msg[7].isoformat() if msg[7] else None,
-                    "delivery_status": msg[8],
-                    "delivery_error": msg[9] or ""
-                })
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            return jsonify({"messages": messages})
-            
-        finally:
-            loop.close()
-            
-    except Exception as e:
-        logger.error(f"Error exporting messages: {e}")
-        return jsonify({"messages": []})
+    """API endpoint for exporting message history (status filters on delivery_status)"""
+    return export_response('messages')
 
 @app.route("/api/lookup_user", methods=["POST"])
 def lookup_user():
@@ -2854,100 +2567,92 @@ def lookup_user():
         if not lookup:
             return jsonify({"success": False, "error": "Lookup value is required"})
         
-        from database_postgresql import PostgreSQLPointsDatabase
-        db = PostgreSQLPointsDatabase()
+        db = get_db()
+        
+        # Try different lookup methods
+        user_data = None
+        
+        # Method 1: Try exact user ID match
+        if lookup.isdigit():
+            user_query = '''
+                SELECT DISTINCT 
+                    COALESCE(p.user_id, e.discord_user_id) as user_id,
+                    COALESCE(du.display_name, e.discord_username, 'User ' || COALESCE(p.user_id, e.discord_user_id)) as username,
+                    e.email_address as email,
+                    COALESCE(p.balance, 0) as points
+                FROM points p 
+                FULL OUTER JOIN email_submissions e ON p.user_id = e.discord_user_id
+                LEFT JOIN discord_users du ON du.user_id = COALESCE(p.user_id, e.discord_user_id)
+                WHERE COALESCE(p.user_id, e.discord_user_id) = $1
+            '''
+            result = run_db(db.execute_query(user_query, lookup))
+            if result:
+                user_data = result[0]
         
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # Method 2: Try email address match
+        if not user_data and '@' in lookup:
+            email_query = '''
+                SELECT DISTINCT 
+                    COALESCE(p.user_id, e.discord_user_id) as user_id,
+                    COALESCE(du.display_name, e.discord_username, 'User ' || COALESCE(p.user_id, e.discord_user_id)) as username,
+                    e.email_address as email,
+                    COALESCE(p.balance, 0) as points
+                FROM email_submissions e
+                LEFT JOIN points p ON e.discord_user_id = p.user_id
+                LEFT JOIN discord_users du ON du.user_id = e.discord_user_id
+                WHERE LOWER(e.email_address) = LOWER($1)
+            '''
+            result = run_db(db.execute_query(email_query, lookup))
+            if result:
+                user_data = result[0]
+        
+        # Method 3: Try username search (case-insensitive, partial match)
+        if not user_data:
+            username_query = '''
+                SELECT DISTINCT 
+                    COALESCE(p.user_id, e.discord_user_id) as user_id,
+                    COALESCE(du.display_name, e.discord_username, 'User ' || COALESCE(p.user_id, e.discord_user_id)) as username,
+                    e.email_address as email,
+                    COALESCE(p.balance, 0) as points
+                FROM email_submissions e
+                LEFT JOIN points p ON e.discord_user_id = p.user_id
+                LEFT JOIN discord_users du ON du.user_id = e.discord_user_id
+                WHERE LOWER(e.discord_username) LIKE LOWER($1)
+                   OR LOWER(du.display_name) LIKE LOWER($1)
+                   OR LOWER(du.username) LIKE LOWER($1)
+                UNION
+                SELECT DISTINCT 
+                    p.user_id,
+                    COALESCE(du.display_name, 'User ' || p.user_id) as username,
+                    NULL as email,
+                    p.balance as points
+                FROM points p
+                LEFT JOIN discord_users du ON du.user_id = p.user_id
+                WHERE p.user_id NOT IN (SELECT discord_user_id FROM email_submissions WHERE discord_user_id IS NOT NULL)
+                AND (LOWER(du.display_name) LIKE LOWER($1) OR LOWER(du.username) LIKE LOWER($1)
+                     OR ('User ' || p.user_id) LIKE $1)
+                LIMIT 1
+            '''
+            search_term = f"%{lookup}%"
+            result = run_db(db.execute_query(username_query, search_term))
+            if result:
+                user_data = result[0]
         
-        try:
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            # Try different lookup methods
-            user_data = None
-            
-            # Method 1: Try exact user ID match
-            if lookup.isdigit():
-                user_query = '''
-                    SELECT DISTINCT 
-                        COALESCE(p.user_id, e.discord_user_id) as user_id,
-                        COALESCE(e.discord_username, 'User ' || COALESCE(p.user_id, e.discord_user_id)) as username,
-                        e.email_address as email,
-                        COALESCE(p.balance, 0) as points
-                    FROM points p 
-                    FULL OUTER JOIN email_submissions e ON p.user_id = e.discord_user_id
-                    WHERE COALESCE(p.user_id, e.discord_user_id) = $1
-                '''
-                result = loop.run_until_complete(db.execute_query(user_query, lookup))
-                if result:
-                    user_data = result[0]
-            
-            # Method 2: Try email address match
-            if not user_data and '@' in lookup:
-                email_query = '''
-                    SELECT DISTINCT 
-                        COALESCE(p.user_id, e.discord_user_id) as user_id,
-                        COALESCE(e.discord_username, 'User ' || COALESCE(p.user_id, e.discord_user_id)) as username,
-                        e.email_address as email,
-                        COALESCE(p.balance, 0) as points
-                    FROM email_submissions e
-                    LEFT JOIN points p ON e.discord_user_id = p.user_id
-                    WHERE LOWER(e.email_address) = LOWER($1)
-                '''
-                result = loop.run_until_complete(db.execute_query(email_query, lookup))
-                if result:
-                    user_data = result[0]
-            
-            # Method 3: Try username search (case-insensitive, partial match)
-            if not user_data:
-                username_query = '''
-                    SELECT DISTINCT 
-                        COALESCE(p.user_id, e.discord_user_id) as user_id,
-                        COALESCE(e.discord_username, 'User ' || COALESCE(p.user_id, e.discord_user_id)) as username,
-                        e.email_address as email,
-                        COALESCE(p.balance, 0) as points
-                    FROM email_submissions e
-                    LEFT JOIN points p ON e.discord_user_id = p.user_id
-                    WHERE LOWER(e.discord_username) LIKE LOWER($1)
-                    UNION
-                    SELECT DISTINCT 
-                        p.user_id,
-                        'User ' || p.user_id as username,
-                        NULL as email,
-                        p.balance as points
-                    FROM points p
-                    WHERE p.user_id NOT IN (SELECT discord_user_id FROM email_submissions WHERE discord_user_id IS NOT NULL)
-                    AND ('User ' || p.user_id) LIKE $1
-                    LIMIT 1
-                '''
-                search_term = f"%{lookup}%"
-                result = loop.run_until_complete(db.execute_query(username_query, search_term))
-                if result:
-                    user_data = result[0]
-            
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            if user_data:
-                return jsonify({
-                    "success": True,
-                    "user": {
-                        "user_id": str(user_data[0]),
-                        "username": user_data[1],
-                        "email": user_data[2],
-                        "points": user_data[3]
-                    }
-                })
-            else:
-                return jsonify({
-                    "success": False,
-                    "error": f"No user found matching '{lookup}'. Try User ID, exact email address, or username."
-                })
-            
-        finally:
-            loop.close()
+        if user_data:
+            return jsonify({
+                "success": True,
+                "user": {
+                    "user_id": str(user_data[0]),
+                    "username": user_data[1],
+                    "email": user_data[2],
+                    "points": user_data[3]
+                }
+            })
+        else:
+            return jsonify({
+                "success": False,
+                "error": f"No user found matching '{lookup}'. Try User ID, exact email address, or username."
+            })
             
     except Exception as e:
         logger.error(f"Error in user lookup: {e}")
@@ -3003,7 +2708,111 @@ def healthz():
         "version": "1.0.0"
     }), 200
 
+@app.route("/api/metrics")
+def metrics():
+    """Connection pool and request metrics for the bot and dashboard"""
+    return jsonify({
+        "dashboard_db": db_runtime.get_stats(),
+        "bot_db": {"pool": bot.db.get_pool_stats(), "write_coalescer": bot.db.get_write_stats()},
+        "pool_config": Config.db_pool_settings(),
+        "leaderboard_index": leaderboard.get_stats(),
+        "leaderboard_cache": page_cache.get_stats(),
+        "achievement_cache": {"bot": bot.db.earned_cache.get_stats(), "dashboard": get_db().earned_cache.get_stats()},
+        "jobs": bot.job_worker.get_stats() if bot.job_worker else {"running": False},
+        "dm_outbox": {
+            **(bot.dm_outbox.get_stats() if bot.dm_outbox else {"workers": 0}),
+            "queued": run_db(get_db().get_outbox_counts())
+        },
+        "discord_directory": bot.directory.get_stats() if bot.directory else {},
+        "dashboard_events": event_hub.get_stats(),
+        "timestamp": datetime.now().isoformat()
+    })
+
+@app.route("/api/events")
+def dashboard_events():
+    """Server-Sent Events stream of dashboard changes (transactions, achievements, emails, DMs, counters)"""
+    from flask import Response
+    import queue
+    
+    try:
+        events = event_hub.subscribe()
+        counters = run_db(get_db().get_system_counters())
+    except Exception as e:
+        logger.error(f"Error opening dashboard event stream: {e}")
+        return jsonify({"success": False, "error": str(e)}), 503
+    
+    def generate():
+        try:
+            # Reconnect delay for EventSource, then the current counters to start from
+            yield "retry: 3000\n\n"
+            yield format_event('counters', counters)
+            while True:
+                try:
+                    yield events.get(timeout=15)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            event_hub.unsubscribe(events)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def enqueue_job(job_type, payload, total=0):
+    """Queue a background job and wake the worker on the bot loop"""
+    job_id = run_db(get_db().create_job(job_type, payload, total))
+    if job_id is not None and bot.job_worker:
+        bot.job_worker.wake()
+    return job_id
+
+@app.route("/api/jobs/<int:job_id>")
+def job_status(job_id):
+    """Job progress, throughput and per-row results; ?stream=1 streams NDJSON updates until the job ends"""
+    try:
+        db = get_db()
+        after = request.args.get('after', -1, type=int)
+        
+        if request.args.get('stream'):
+            from flask import Response
+            import json
+            import time
+            
+            def generate(after):
+                while True:
+                    job = run_db(db.get_job(job_id))
+                    if job is None:
+                        yield json.dumps({"success": False, "error": "Job not found"}) + "\n"
+                        return
+                    results = run_db(db.get_job_results(job_id, after))
+                    if results:
+                        after = results[-1]['row']
+                    yield json.dumps({"success": True, "job": job_progress(job), "results": results}) + "\n"
+                    if job['status'] in ('completed', 'failed') and not results:
+                        return
+                    if not results:
+                        time.sleep(1)
+            
+            return Response(generate(after), mimetype='application/x-ndjson')
+        
+        job = run_db(db.get_job(job_id))
+        if job is None:
+            return jsonify({"success": False, "error": "Job not found"}), 404
+        results = run_db(db.get_job_results(job_id, after))
+        
+        return jsonify({
+            "success": True,
+            "job": job_progress(job),
+            "results": results,
+            "next_after": results[-1]['row'] if results else after
+        })
+        
+    except Exception as e:
+        logger.error(f"Error getting job {job_id}: {e}")
+        return jsonify({"success": False, "error": str(e)})
+
 @app.route("/api/bulk_points", methods=["POST"])
+@idempotent("bulk_points")
 def bulk_points_management():
     """API endpoint for bulk points management with user ID template"""
     try:
@@ -3018,94 +2827,48 @@ def bulk_points_management():
         if not action or not users_data:
             return jsonify({"success": False, "error": "Missing action or users data"})
         
-        # Connect to database
-        from database_postgresql import PostgreSQLPointsDatabase
-        db = PostgreSQLPointsDatabase()
-        
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        if action not in ['set', 'add', 'remove']:
+            return jsonify({"success": False, "error": "Invalid action"})
         
-        try:
-            # Initialize database connection
-            loop.run_until_complete(db.initialize())
-            
-            # Process bulk operations
-            async def process_bulk_points():
-                results = []
-                for user_data in users_data:
-                    user_id = str(user_data.get('user_id', '')).strip().lstrip("'")  # Remove ' prefix if present
-                    points = user_data.get('points', 0)
-                    
-                    if not user_id or user_id == 'user_id':  # Skip header row if present
-                        continue
-                    
-                    try:
-                        points = int(points)
-                        
-                        # Get current points before operation for better notification messages
-                        current_points = await db.get_points(user_id)
-                        
-                        if action == 'set':
-                            success = await db.set_points(user_id, points, admin_id=None, reason=reason)
-                            if success:
-                                notification_message = f"🔄 **Points Set**\n\nYour points have been set to **{points:,} points**.\n\n📝 **Reason:** {reason or 'Admin adjustment'}"
-                                # Use sync wrapper for Flask route context
-                                send_admin_notification_dm_sync(user_id, notification_message, "points_set")
-                        elif action == 'add':
-                            success = await db.update_points(user_id, points, admin_id=None, reason=reason)
-                            if success:
-                                new_total = current_points + points
-                                notification_message = f"➕ **Points Added**\n\nYou received **+{points:,} points**!\n\n💰 **New Total:** {new_total:,} points\n📝 **Reason:** {reason or 'Admin bonus'}"
-                                # Use sync wrapper for Flask route context
-                                send_admin_notification_dm_sync(user_id, notification_message, "points_added")
-                        elif action == 'remove':
-                            success = await db.update_points(user_id, -abs(points), admin_id=None, reason=reason)
-                            if success:
-                                new_total = max(0, current_points - abs(points))
-                                notification_message = f"➖ **Points Removed**\n\n**{abs(points):,} points** have been deducted.\n\n💰 **New Total:** {new_total:,} points\n📝 **Reason:** {reason or 'Admin adjustment'}"
-                                # Use sync wrapper for Flask route context
-                                send_admin_notification_dm_sync(user_id, notification_message, "points_removed")
-                        else:
-                            success = False
-                        
-                        results.append({
-                            "user_id": user_id,
-                            "points": points,
-                            "success": success,
-                            "action": action
-                        })
-                    except Exception as e:
-                        results.append({
-                            "user_id": user_id, 
-                            "success": False, 
-                            "error": str(e)
-                        })
-                
-                return results
+        # Validate rows up front; invalid rows are reported now, valid ones are queued
+        results = []
+        rows = []
+        for user_data in users_data:
+            user_id = str(user_data.get('user_id', '')).strip().lstrip("'")  # Remove ' prefix if present
+            points = user_data.get('points', 0)
             
-            results = loop.run_until_complete(process_bulk_points())
+            if not user_id or user_id == 'user_id':  # Skip header row if present
+                continue
             
-            # Close database connection
-            loop.run_until_complete(db.close())
-            
-            # Count successes and failures
-            successes = sum(1 for r in results if r.get('success', False))
-            failures = len(results) - successes
-            
-            return jsonify({
-                "success": True,
-                "results": results,
-                "summary": {
-                    "total": len(results),
-                    "successes": successes,
-                    "failures": failures
-                },
-                "message": f"Bulk {action} operation completed: {successes} successes, {failures} failures"
-            })
-            
-        finally:
-            loop.close()
+            try:
+                rows.append((user_id, int(points)))
+            except (TypeError, ValueError):
+                results.append({
+                    "user_id": user_id, 
+                    "success": False, 
+                    "error": f"Invalid points value: {points}"
+                })
+        
+        if not rows:
+            return jsonify({"success": False, "error": "No valid rows to process", "results": results})
+        
+        # Apply the batch in the background - progress and per-row results are at /api/jobs/<id>
+        job_id = enqueue_job("bulk_points", {"action": action, "rows": rows, "reason": reason}, total=len(rows))
+        if job_id is None:
+            return jsonify({"success": False, "error": "Failed to queue bulk points operation"})
+        
+        return jsonify({
+            "success": True,
+            "job_id": job_id,
+            "status_url": f"/api/jobs/{job_id}",
+            "results": results,
+            "summary": {
+                "total": len(rows) + len(results),
+                "queued": len(rows),
+                "rejected": len(results)
+            },
+            "message": f"Bulk {action} queued for {len(rows)} users ({len(results)} rows rejected)"
+        })
             
     except Exception as e:
         logger.error(f"Error in bulk points management: {e}")
@@ -3145,7 +2908,6 @@ def get_bulk_template():
         logger.error(f"Error creating bulk template: {e}")
         return jsonify({"success": False, "error": str(e)})
 
-
 class PointsBot(commands.Bot):
     def __init__(self):
         # Use only non-privileged intents (slash commands work without message_content)
@@ -3161,14 +2923,32 @@ class PointsBot(commands.Bot):
         )
         
         self.db = PostgreSQLPointsDatabase()
+        self.order_processor = OrderProcessor(self.db)
+        self.job_worker = None
+        self.dm_outbox = None
+        self.directory = None
         
     async def setup_hook(self):
         """Called when the bot is starting up"""
         logger.info("Bot is starting up...")
         await self.db.initialize()
         
+        # DM deliveries and background jobs queued by the dashboard run on this loop
+        self.dm_outbox = DMOutbox(self, self.db)
+        self.dm_outbox.start()
+        self.job_worker = JobWorker(self.db, outbox=self.dm_outbox)
+        self.job_worker.start()
+        
+        # Record every user seen on the gateway so names are read from discord_users
+        self.directory = DiscordUserDirectory(self, self.db, on_change=page_cache.forget_name)
+        for event in DIRECTORY_EVENTS:
+            self.add_listener(getattr(self.directory, event), event)
+        self.directory.start()
+        
         # Start periodic presence refresh task
         self.presence_refresh_task = self.loop.create_task(self.periodic_presence_refresh())
+        self.leaderboard_resync_task = self.loop.create_task(self.periodic_leaderboard_resync())
+        self.idempotency_sweep_task = self.loop.create_task(self.periodic_idempotency_sweep())
         
     async def on_ready(self):
         """Called when the bot has successfully connected to Discord"""
@@ -3287,183 +3067,54 @@ class PointsBot(commands.Bot):
                 logger.error(f"Error in periodic presence refresh: {e}")
                 await asyncio.sleep(300)  # Retry after 5 minutes on error
 
+    async def periodic_leaderboard_resync(self):
+        """Periodically reload the leaderboard index to pick up writes made outside this process"""
+        while not self.is_closed():
+            await asyncio.sleep(Config.LEADERBOARD_RESYNC_SECONDS)
+            try:
+                await self.db.load_leaderboard_index()
+            except Exception as e:
+                logger.error(f"Error resyncing leaderboard index: {e}")
+
+    async def periodic_idempotency_sweep(self):
+        """Periodically delete expired Idempotency-Key rows (lookups already ignore them)"""
+        while not self.is_closed():
+            await asyncio.sleep(Config.IDEMPOTENCY_SWEEP_MINUTES * 60)
+            try:
+                deleted = await self.db.delete_expired_idempotency_keys()
+                if deleted:
+                    logger.info(f"Swept {deleted} expired idempotency keys")
+            except Exception as e:
+                logger.error(f"Error sweeping idempotency keys: {e}")
+
 # Initialize bot
 bot = PointsBot()
 
 # Function to store user email (for the privacy slash command)
 def send_admin_notification_dm_sync(user_id, message_content, message_type="general"):
-    """Synchronous wrapper for sending DM notifications from Flask routes"""
-    import asyncio
-    from datetime import datetime
-    
-    async def send_dm_async():
-        """Internal async function to handle DM sending"""
-        try:
-            # Check if bot is ready
-            if not bot.is_ready():
-                logger.error(f"Bot not ready for DM to user {user_id}")
-                return False
-                
-            # Convert user_id to int for Discord API
-            discord_user_id = int(user_id)
-            user = bot.get_user(discord_user_id)
-            
-            if not user:
-                try:
-                    # Set the bot's event loop context
-                    user = await bot.fetch_user(discord_user_id)
-                    logger.info(f"Successfully fetched user {user_id} for notification")
-                except Exception as e:
-                    logger.error(f"Error fetching user {user_id}: {e}")
-                    return False
-            
-            # Store message in database first
-            await bot.db.initialize()
-            async with bot.db.pool.acquire() as conn:
-                message_id = await conn.fetchval('''
-                    INSERT INTO admin_messages (sender_admin_id, sender_admin_name, recipient_user_id, message_content, message_type, sent_at)
-                    VALUES ($1, $2, $3, $4, $5, $6)
-                    RETURNING id
-                ''', "0", "Dashboard Admin", str(user_id), message_content, message_type, datetime.now())
-                
-                # Try to send DM
-                delivery_status = "pending"
-                delivery_error = None
-                
-                try:
-                    await user.send(message_content)
-                    delivery_status = "delivered"
-                    logger.info(f"✅ DM sent successfully to user {user_id}")
-                except Exception as dm_error:
-                    delivery_status = "failed"
-                    delivery_error = str(dm_error)
-                    logger.error(f"❌ Failed to send DM to user {user_id}: {dm_error}")
-                
-                # Update delivery status (table doesn't have delivered_at column)
-                await conn.execute('''
-                    UPDATE admin_messages 
-                    SET delivery_status = $1, delivery_error = $2
-                    WHERE id = $3
-                ''', delivery_status, delivery_error, message_id)
-                
-                return delivery_status == "delivered"
-                
-        except Exception as e:
-            logger.error(f"Error in DM notification: {e}")
-            return False
-    
-    # Use bot's existing event loop if available
-    try:
-        if bot.loop and not bot.loop.is_closed():
-            # Use bot's existing loop
-            future = asyncio.run_coroutine_threadsafe(send_dm_async(), bot.loop)
-            result = future.result(timeout=30)  # 30 second timeout
-            return result
-        else:
-            # Fallback to new event loop
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                result = loop.run_until_complete(send_dm_async())
-                return result
-            finally:
-                loop.close()
-    except Exception as e:
-        logger.error(f"Error in sync DM wrapper: {e}")
+    """Queue a DM notification from a Flask route; the bot's outbox delivers it"""
+    message_id = run_db(get_db().enqueue_admin_message(str(user_id), message_content, message_type))
+    if message_id is None:
         return False
+    if bot.dm_outbox:
+        bot.dm_outbox.wake()
+    logger.info(f"Queued DM {message_id} for user {user_id} ({message_type})")
+    return True
 
 async def send_admin_notification_dm(user_id, message_content, message_type="general"):
-    """Send DM notification to a user and store in admin_messages table"""
-    try:
-        # Convert user_id to int for Discord API
-        discord_user_id = int(user_id)
-        user = bot.get_user(discord_user_id)
-        
-        if not user:
-            try:
-                user = await bot.fetch_user(discord_user_id)
-                logger.info(f"Successfully fetched user {user_id} for notification")
-            except discord.NotFound:
-                logger.error(f"User {user_id} not found on Discord (account may be deleted)")
-                return False
-            except discord.Forbidden:
-                logger.error(f"No permission to fetch user {user_id}")
-                return False
-            except Exception as e:
-                logger.error(f"Error fetching user {user_id}: {e}")
-                return False
-        
-        # Store message in database first
-        await bot.db.initialize()
-        async with bot.db.pool.acquire() as conn:
-            message_id = await conn.fetchval('''
-                INSERT INTO admin_messages (
-                    sender_admin_id, sender_admin_name, recipient_user_id, 
-                    recipient_username, message_content, message_type, 
-                    delivery_status, sent_at
-                ) VALUES ($1, $2, $3, $4, $5, $6, $7, CURRENT_TIMESTAMP)
-                RETURNING id
-            ''', "0", "System Auto", str(user_id), user.display_name, 
-                message_content, message_type, "sending")
-        
-        # Create embed message
-        embed = discord.Embed(
-            title=f"📬 {message_type.replace('_', ' ').title()}",
-            description=message_content,
-            color=discord.Color.blue()
-        )
-        embed.add_field(
-            name="From",
-            value="Admin Dashboard (Automated)",
-            inline=True
-        )
-        
-        # Try to send the DM
-        try:
-            # Also try sending a simple test message first to debug
-            logger.info(f"Attempting to send DM to user {user_id} ({user.display_name})")
-            await user.send(embed=embed)
-            
-            # Update delivery status to delivered
-            async with bot.db.pool.acquire() as conn:
-                await conn.execute('''
-                    UPDATE admin_messages 
-                    SET delivery_status = 'delivered' 
-                    WHERE id = $1
-                ''', message_id)
-            
-            logger.info(f"Auto DM sent successfully to user {user_id} ({user.display_name}): {message_type}")
-            return True
-            
-        except discord.Forbidden:
-            # Update delivery status with error
-            async with bot.db.pool.acquire() as conn:
-                await conn.execute('''
-                    UPDATE admin_messages 
-                    SET delivery_status = 'failed', delivery_error = 'User has DMs disabled or blocked bot'
-                    WHERE id = $1
-                ''', message_id)
-            
-            logger.warning(f"Could not send auto DM to user {user_id} ({user.display_name}): DMs disabled or bot blocked")
-            return False
-            
-        except discord.HTTPException as e:
-            # Update delivery status with error  
-            async with bot.db.pool.acquire() as conn:
-                await conn.execute('''
-                    UPDATE admin_messages 
-                    SET delivery_status = 'failed', delivery_error = $2
-                    WHERE id = $1
-                ''', message_id, f"HTTP error: {e}")
-            
-            logger.error(f"HTTP error sending DM to user {user_id}: {e}")
-            return False
-            
-    except Exception as e:
-        logger.error(f"Error sending auto notification DM to user {user_id}: {e}")
+    """Queue an automated DM notification (sent as an embed) from the bot loop"""
+    message_id = await bot.db.enqueue_admin_message(
+        str(user_id), message_content, message_type,
+        sender_admin_name="System Auto", use_embed=True
+    )
+    if message_id is None:
         return False
+    if bot.dm_outbox:
+        bot.dm_outbox.wake()
+    logger.info(f"Queued auto DM {message_id} for user {user_id} ({message_type})")
+    return True
 
-async def store_user_email(user_id: int, email: str, roles: list = None):
+async def store_user_email(user_id: int, email: str, roles: list = None, username: str = None):
     """Store user email and server roles in database - only one pending submission per user"""
     # Convert user_id to string for database compatibility
     user_id_str = str(user_id)
@@ -3471,15 +3122,9 @@ async def store_user_email(user_id: int, email: str, roles: list = None):
     # Use the bot's PostgreSQL database connection
     await bot.db.initialize()
     
-    # Get user info to store proper username
-    user = bot.get_user(user_id)
-    if not user:
-        try:
-            user = await bot.fetch_user(user_id)
-        except:
-            pass
-    
-    username = user.display_name if user else f"User {user_id}"
+    # The submitting interaction already carries the name; otherwise read the directory
+    if not username:
+        username = (await bot.db.get_discord_names([user_id_str])).get(user_id_str) or f"User {user_id}"
     
     # Convert roles list to comma-separated string with fallback
     roles_str = ", ".join(roles) if roles else "Member only"
@@ -3527,11 +3172,19 @@ async def mypoints_slash(interaction: discord.Interaction):
         if not bot.db.pool:
             await bot.db.initialize()
         
-        balance = await bot.db.get_points(str(interaction.user.id))
+        user_id = str(interaction.user.id)
+        balance = leaderboard.get_balance(user_id) if leaderboard.loaded else None
+        if balance is None:
+            balance = await bot.db.get_points(user_id)
+        
+        description = f"You currently have **{balance:,} points**"
+        rank = leaderboard.rank(user_id)
+        if rank and balance > 0:
+            description += f"\n🏆 Rank **#{rank:,}** of {leaderboard.count_positive():,} (top {100 - leaderboard.percentile(user_id):.1f}%)"
         
         embed = discord.Embed(
             title="💰 Your Points Balance",
-            description=f"You currently have **{balance:,} points**",
+            description=description,
             color=discord.Color.blue()
         )
         embed.set_thumbnail(url=interaction.user.display_avatar.url)
@@ -3550,6 +3203,83 @@ async def mypoints_slash(interaction: discord.Interaction):
         except Exception as follow_error:
             logger.error(f"Could not send error message: {follow_error}")
 
+async def resolve_display_names(guild, user_ids):
+    """Display names for leaderboard entries - guild member cache first, then the discord_users directory"""
+    names = {}
+    for user_id in user_ids:
+        member = guild.get_member(int(user_id)) if guild and user_id.isdigit() else None
+        if member:
+            names[user_id] = member.display_name
+    
+    remaining = [user_id for user_id in user_ids if user_id not in names]
+    if remaining:
+        names.update(await bot.db.get_discord_names(remaining))
+    return names
+
+class LeaderboardView(discord.ui.View):
+    """Previous/next buttons for /pointsboard, served from the leaderboard page cache"""
+    
+    def __init__(self, owner_id: int, guild, page_size: int):
+        super().__init__(timeout=300)
+        self.owner_id = owner_id
+        self.guild = guild
+        self.page_size = page_size
+        self.page = 0
+        self.page_count = 1
+        self.message = None
+    
+    async def render(self):
+        """Build the embed for the current page and sync the buttons"""
+        description, self.page_count = await page_cache.get_page(
+            self.guild.id if self.guild else None, self.page_size, self.page,
+            lambda user_ids: resolve_display_names(self.guild, user_ids)
+        )
+        if description is None:
+            return None
+        self.page = min(self.page, self.page_count - 1)
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= self.page_count - 1
+        
+        embed = discord.Embed(
+            title="🏆 Points Leaderboard",
+            description=description,
+            color=discord.Color.gold()
+        )
+        if self.page_count > 1:
+            embed.set_footer(text=f"Page {self.page + 1}/{self.page_count}")
+        return embed
+    
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.owner_id:
+            await interaction.response.send_message("❌ Only the admin who opened this leaderboard can page through it.", ephemeral=True)
+            return False
+        return True
+    
+    async def _show(self, interaction: discord.Interaction, page: int):
+        self.page = page
+        embed = await self.render()
+        if embed is None:
+            await interaction.response.edit_message(content="📊 No users found in the leaderboard.", embed=None, view=None)
+        else:
+            await interaction.response.edit_message(embed=embed, view=self)
+    
+    @discord.ui.button(label="◀ Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.page - 1)
+    
+    @discord.ui.button(label="Next ▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.page + 1)
+    
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+        if self.message:
+            try:
+                await self.message.edit(view=self)
+            except discord.HTTPException:
+                pass
+
 @bot.tree.command(name="pointsboard", description="Show the points leaderboard (Admin only)")
 @app_commands.default_permissions(administrator=True)
 @app_commands.describe(limit="Number of users to show (max 25)")
@@ -3565,62 +3295,16 @@ async def pointsboard_slash(interaction: discord.Interaction, limit: int = 10):
         elif limit > 25:
             limit = 25
             
-        top_users = await bot.db.get_leaderboard(limit)
+        if not leaderboard.loaded:
+            await bot.db.load_leaderboard_index()
         
-        if not top_users:
+        view = LeaderboardView(interaction.user.id, interaction.guild, limit)
+        embed = await view.render()
+        if embed is None:
             await interaction.followup.send("📊 No users found in the leaderboard.")
             return
-            
-        embed = discord.Embed(
-            title="🏆 Points Leaderboard",
-            color=discord.Color.gold()
-        )
-        
-        # Get total stats for overview
-        total_users = await bot.db.get_total_users()
-        total_points = await bot.db.get_total_points()
         
-        description = f"📊 **Database Overview:**\n"
-        description += f"👥 Total Users: {total_users:,}\n"
-        description += f"💰 Total Points: {total_points:,}\n\n"
-        description += f"🏆 **Top {min(limit, len(top_users))} Rankings:**\n"
-        
-        for i, (user_id, balance) in enumerate(top_users, 1):
-            # Convert string user_id to int for Discord API
-            try:
-                discord_user_id = int(user_id)
-            except (ValueError, TypeError):
-                username = f"User {user_id}"
-            else:
-                # Try to get user from the current guild first, then global cache
-                user = interaction.guild.get_member(discord_user_id) if interaction.guild else None
-                if not user:
-                    user = bot.get_user(discord_user_id)
-                
-                if user:
-                    username = user.display_name
-                else:
-                    # Try to fetch user from Discord API as last resort
-                    try:
-                        user = await bot.fetch_user(discord_user_id)
-                        username = user.display_name
-                    except:
-                        username = f"User {user_id}"
-            
-            # Add medals for top 3
-            if i == 1:
-                medal = "🥇"
-            elif i == 2:
-                medal = "🥈"
-            elif i == 3:
-                medal = "🥉"
-            else:
-                medal = f"{i}."
-                
-            description += f"{medal} **{username}** - {balance:,} points\n"
-            
-        embed.description = description
-        await interaction.followup.send(embed=embed)
+        view.message = await interaction.followup.send(embed=embed, view=view if view.page_count > 1 else discord.utils.MISSING)
         
     except Exception as e:
         logger.error(f"Error in pointsboard slash command: {e}")
@@ -3702,7 +3386,7 @@ async def submitemail_slash(interaction: discord.Interaction, email: str):
             logger.info(f"→ Using fallback for user {interaction.user.id}: Member only")
         
         # Store the email with roles (will update if pending, or raise error if processed)
-        await store_user_email(str(interaction.user.id), email.strip(), user_roles)
+        await store_user_email(str(interaction.user.id), email.strip(), user_roles, interaction.user.display_name)
 
         if existing:
             old_email, status = existing
@@ -4105,7 +3789,7 @@ async def achievements_slash(interaction: discord.Interaction, user: discord.Use
             embed.description = "No achievements earned yet! Keep using the bot to unlock rewards."
             embed.add_field(
                 name="Available Achievements", 
-                value="• First Points Earned (50 pts)\n• 100 Points Milestone (25 pts)\n• 500 Points Milestone (75 pts)\n• 1000 Points Milestone (150 pts)\n• High Roller - 2000+ points (300 pts)\n• Email Verified (100 pts)", 
+                value="\n".join(f"• {data['name']} ({data['points_reward']} pts)" for data in ACHIEVEMENT_TYPES.values()), 
                 inline=False
             )
         else:
@@ -4130,6 +3814,38 @@ async def achievements_slash(interaction: discord.Interaction, user: discord.Use
         logger.error(f"Error in achievements slash command: {e}")
         await interaction.response.send_message("❌ An error occurred while fetching achievements.")
 
+@bot.tree.command(name="claim", description="Claim the points from an order email (private)")
+@app_commands.describe(code="Verification code from your order email")
+async def claim_slash(interaction: discord.Interaction, code: str):
+    """Redeem an order verification code"""
+    try:
+        await interaction.response.defer(ephemeral=True)
+        # Each /claim is a new interaction, so key on who claims what: re-running the same
+        # claim after a lost reply replays its result instead of "already used"
+        result = await bot.order_processor.process_claim(
+            code, interaction.user.id, idempotency_key=f"{interaction.user.id}:{code.strip()}"
+        )
+        if not result['success']:
+            await interaction.followup.send(f"❌ {result['error']}", ephemeral=True)
+            return
+        
+        embed = discord.Embed(
+            title="✅ Points Claimed",
+            description=result['message'],
+            color=discord.Color.green()
+        )
+        embed.add_field(name="New Balance", value=f"{result['new_balance']:,} points", inline=True)
+        
+        new_achievements = await check_and_award_achievements(bot.db, str(interaction.user.id), result['new_balance'])
+        if new_achievements:
+            embed.add_field(name="🏆 New Achievements", value="\n".join(ACHIEVEMENT_TYPES[t]['name'] for t in new_achievements)[:1024], inline=False)
+        
+        await interaction.followup.send(embed=embed, ephemeral=True)
+        
+    except Exception as e:
+        logger.error(f"Error in claim slash command: {e}")
+        await interaction.followup.send("❌ An error occurred while claiming your points.", ephemeral=True)
+
 @bot.tree.command(name="recentachievements", description="View recent achievements earned by all users")
 async def recent_achievements_slash(interaction: discord.Interaction):
     """View recent achievements across all users"""
@@ -4151,16 +3867,7 @@ async def recent_achievements_slash(interaction: discord.Interaction):
                 achievement_data = ACHIEVEMENT_TYPES.get(achievement_type, {})
                 emoji = achievement_data.get('emoji', '🏆')
                 
-                # Try to get Discord username
-                try:
-                    discord_user = bot.get_user(int(user_id))
-                    if discord_user:
-                        username = discord_user.display_name
-                    else:
-                        discord_user = await bot.fetch_user(int(user_id))
-                        username = discord_user.display_name
-                except:
-                    username = f"User {user_id}"
+                username = ach['username'] or f"User {user_id}"
                 
                 achievement_text += f"{emoji} **{username}** earned **{ach['achievement_name']}**\n"
                 achievement_text += f"   +{ach['points_earned']} points • {ach['earned_at'].strftime('%b %d')}\n\n"
@@ -4375,6 +4082,12 @@ def main():
                 logger.error(f'Unexpected error starting bot: {e}')
                 raise
             finally:
+                if bot.job_worker:
+                    await bot.job_worker.stop()
+                if bot.dm_outbox:
+                    await bot.dm_outbox.stop()
+                if bot.directory:
+                    await bot.directory.stop()
                 if bot.db:
                     try:
                         await bot.db.close()
@@ -4382,7 +4095,10 @@ def main():
                         logger.error(f'Error closing database: {e}')
         
         # Start the bot
-        asyncio.run(start_bot())
+        try:
+            asyncio.run(start_bot())
+        finally:
+            db_runtime.stop()
         
     except KeyboardInterrupt:
         logger.info('Bot shutdown requested by user')
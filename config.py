@@ -13,7 +13,66 @@ class Config:
     
     # Database configuration - Use persistent storage on Fly.io
     DATABASE_PATH: str = os.getenv("DATABASE_PATH", "/data/points.db" if os.path.exists("/data") else "points.db")
-    
+
+    # Points store behind create_points_store - "postgresql" (DATABASE_URL) or "sqlite" (DATABASE_PATH)
+    POINTS_BACKEND: str = os.getenv("POINTS_BACKEND", "postgresql")
+
+    # SQLite points store - WAL with read-only reader connections and group-committed writes
+    SQLITE_TUNED: bool = os.getenv("SQLITE_TUNED", "true").lower() == "true"
+    SQLITE_READERS: int = int(os.getenv("SQLITE_READERS", "4"))
+    SQLITE_MMAP_MB: int = int(os.getenv("SQLITE_MMAP_MB", "256"))
+    SQLITE_GROUP_COMMIT_MAX: int = int(os.getenv("SQLITE_GROUP_COMMIT_MAX", "256"))
+
+    # Points write coalescing - batch change/assign calls arriving within the window into one transaction
+    POINTS_WRITE_COALESCING: bool = os.getenv("POINTS_WRITE_COALESCING", "false").lower() == "true"
+    POINTS_COALESCE_WINDOW_MS: float = float(os.getenv("POINTS_COALESCE_WINDOW_MS", "5"))
+    POINTS_COALESCE_MAX_OPS: int = int(os.getenv("POINTS_COALESCE_MAX_OPS", "100"))
+    POINTS_COALESCE_MAX_WAIT_MS: float = float(os.getenv("POINTS_COALESCE_MAX_WAIT_MS", "250"))
+
+    # PostgreSQL connection pool - one pool per event loop (bot loop and dashboard loop)
+    DB_POOL_MIN_SIZE: int = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+    DB_POOL_MAX_SIZE: int = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+    DB_COMMAND_TIMEOUT: float = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
+    DB_REQUEST_TIMEOUT: float = float(os.getenv("DB_REQUEST_TIMEOUT", "30"))
+
+    # Background jobs - rows committed per progress step, idle poll interval and how long a claim lasts without a heartbeat
+    JOB_CHUNK_SIZE: int = int(os.getenv("JOB_CHUNK_SIZE", "500"))
+    JOB_POLL_INTERVAL: float = float(os.getenv("JOB_POLL_INTERVAL", "5"))
+    JOB_LEASE_SECONDS: float = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+
+    # DM outbox - delivery workers, send rate, retry backoff and how long a claimed row stays claimed
+    DM_WORKERS: int = int(os.getenv("DM_WORKERS", "4"))
+    DM_RATE_PER_SECOND: float = float(os.getenv("DM_RATE_PER_SECOND", "5"))
+    DM_PER_USER_INTERVAL: float = float(os.getenv("DM_PER_USER_INTERVAL", "1"))
+    DM_MAX_ATTEMPTS: int = int(os.getenv("DM_MAX_ATTEMPTS", "5"))
+    DM_RETRY_BASE_SECONDS: float = float(os.getenv("DM_RETRY_BASE_SECONDS", "30"))
+    DM_RETRY_MAX_SECONDS: float = float(os.getenv("DM_RETRY_MAX_SECONDS", "3600"))
+    DM_CLAIM_LEASE_SECONDS: float = float(os.getenv("DM_CLAIM_LEASE_SECONDS", "600"))
+
+    # Leaderboard index - full reload interval to pick up writes made outside this process
+    LEADERBOARD_RESYNC_SECONDS: int = int(os.getenv("LEADERBOARD_RESYNC_SECONDS", "600"))
+
+    # Discord user directory - gateway write batching and background refresh of stale names
+    DIRECTORY_FLUSH_SECONDS: float = float(os.getenv("DIRECTORY_FLUSH_SECONDS", "5"))
+    DIRECTORY_STALE_HOURS: float = float(os.getenv("DIRECTORY_STALE_HOURS", "24"))
+    DIRECTORY_BACKFILL_BATCH: int = int(os.getenv("DIRECTORY_BACKFILL_BATCH", "100"))
+    DIRECTORY_BACKFILL_CONCURRENCY: int = int(os.getenv("DIRECTORY_BACKFILL_CONCURRENCY", "4"))
+    DIRECTORY_BACKFILL_INTERVAL: float = float(os.getenv("DIRECTORY_BACKFILL_INTERVAL", "300"))
+
+    # Idempotency-Key support on point-mutating APIs - how long keys replay, and how often expired ones are swept
+    IDEMPOTENCY_TTL_HOURS: float = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+    IDEMPOTENCY_SWEEP_MINUTES: float = float(os.getenv("IDEMPOTENCY_SWEEP_MINUTES", "10"))
+
+    # Achievement cache - how long an entry is trusted before re-checking, and how many users it holds per store
+    ACHIEVEMENT_PROFILE_TTL: float = float(os.getenv("ACHIEVEMENT_PROFILE_TTL", "300"))
+    ACHIEVEMENT_CACHE_MAX_USERS: int = int(os.getenv("ACHIEVEMENT_CACHE_MAX_USERS", "50000"))
+
+    # SendGrid order notifications - API host (point at a fake for testing), sender and batching
+    SENDGRID_API_HOST: str = os.getenv("SENDGRID_API_HOST", "https://api.sendgrid.com")
+    SENDGRID_FROM_EMAIL: str = os.getenv("SENDGRID_FROM_EMAIL", "noreply@yourdomain.com")
+    SENDGRID_BATCH_SIZE: int = int(os.getenv("SENDGRID_BATCH_SIZE", "1000"))
+    SENDGRID_CONCURRENCY: int = int(os.getenv("SENDGRID_CONCURRENCY", "4"))
+
     # Bot settings
     MAX_POINTS_PER_TRANSACTION: int = int(os.getenv("MAX_POINTS_PER_TRANSACTION", "1000000"))
     MAX_TOTAL_POINTS: int = int(os.getenv("MAX_TOTAL_POINTS", "10000000"))
@@ -39,9 +98,54 @@ class Config:
             
         if cls.MAX_TOTAL_POINTS <= 0:
             return False
-            
+
+        if cls.POINTS_BACKEND.lower() not in ("postgresql", "sqlite"):
+            return False
+
+        if cls.SQLITE_READERS <= 0 or cls.SQLITE_MMAP_MB < 0 or cls.SQLITE_GROUP_COMMIT_MAX <= 0:
+            return False
+
+        if cls.POINTS_COALESCE_WINDOW_MS < 0 or cls.POINTS_COALESCE_MAX_OPS <= 0:
+            return False
+
+        if cls.POINTS_COALESCE_MAX_WAIT_MS <= cls.POINTS_COALESCE_WINDOW_MS:
+            return False
+
+        if cls.DB_POOL_MIN_SIZE < 0 or cls.DB_POOL_MAX_SIZE < max(1, cls.DB_POOL_MIN_SIZE):
+            return False
+
+        if cls.JOB_CHUNK_SIZE <= 0 or cls.JOB_LEASE_SECONDS <= 0:
+            return False
+
+        if cls.DM_WORKERS <= 0 or cls.DM_RATE_PER_SECOND <= 0 or cls.DM_MAX_ATTEMPTS <= 0:
+            return False
+
+        if cls.DM_CLAIM_LEASE_SECONDS <= 0:
+            return False
+
+        if cls.DIRECTORY_BACKFILL_BATCH <= 0 or cls.DIRECTORY_BACKFILL_CONCURRENCY <= 0:
+            return False
+
+        if not 0 < cls.SENDGRID_BATCH_SIZE <= 1000 or cls.SENDGRID_CONCURRENCY <= 0:
+            return False
+
+        if cls.IDEMPOTENCY_TTL_HOURS <= 0 or cls.IDEMPOTENCY_SWEEP_MINUTES <= 0:
+            return False
+
+        if cls.ACHIEVEMENT_CACHE_MAX_USERS <= 0:
+            return False
+
         return True
         
+    @classmethod
+    def db_pool_settings(cls) -> dict:
+        """Get keyword arguments for asyncpg.create_pool"""
+        return {
+            "min_size": cls.DB_POOL_MIN_SIZE,
+            "max_size": cls.DB_POOL_MAX_SIZE,
+            "command_timeout": cls.DB_COMMAND_TIMEOUT
+        }
+
     @classmethod
     def get_missing_vars(cls) -> list:
         """Get list of missing required environment variables"""
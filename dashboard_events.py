@@ -0,0 +1,126 @@
+"""
+Server-Sent Events fan-out for the admin dashboard.
+
+Triggers on transactions, achievements, email_submissions and admin_messages
+pg_notify a small JSON delta when a write commits (see DASHBOARD_EVENT_TABLES).
+DashboardEventHub holds one LISTEN connection on the dashboard's database loop
+and copies every notification into the queue of each connected /api/events
+stream. After a burst of changes it also pushes the new system counters, at
+most once per COUNTER_INTERVAL, so stat widgets update without polling.
+"""
+
+import asyncio
+import json
+import logging
+import queue
+import threading
+import asyncpg
+from database_postgresql import DASHBOARD_EVENTS_CHANNEL
+from db_runtime import runtime
+
+logger = logging.getLogger(__name__)
+
+# Seconds between counter pushes while changes keep arriving
+COUNTER_INTERVAL = 1.0
+
+# Events buffered per stream before a slow client is told to resync
+SUBSCRIBER_QUEUE_SIZE = 256
+
+def format_event(event_type: str, data) -> str:
+    """Encode one SSE message"""
+    return f"event: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+
+class DashboardEventHub:
+    """One LISTEN connection shared by every open /api/events stream"""
+
+    def __init__(self, runtime):
+        self.runtime = runtime
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._task = None
+        self._counters_dirty = False
+        self._received = 0
+        self._dropped = 0
+
+    def subscribe(self) -> queue.Queue:
+        """Register a stream; starts listening on the first call"""
+        self.runtime.run(self._ensure_listening())
+        events = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(events)
+        return events
+
+    def unsubscribe(self, events: queue.Queue):
+        with self._lock:
+            self._subscribers.discard(events)
+
+    async def _ensure_listening(self):
+        if self._conn is None or self._conn.is_closed():
+            self._conn = await asyncpg.connect(self.runtime.db.database_url)
+            await self._conn.add_listener(DASHBOARD_EVENTS_CHANNEL, self._on_notify)
+            logger.info("Listening for dashboard events")
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._push_counters())
+
+    def _on_notify(self, conn, pid, channel, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            logger.error(f"Invalid dashboard event payload: {payload[:200]}")
+            return
+        self._received += 1
+        self._counters_dirty = True
+        self.broadcast(event.pop('type', 'change'), event)
+
+    def broadcast(self, event_type: str, data):
+        """Queue an event for every open stream"""
+        message = format_event(event_type, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for events in subscribers:
+            try:
+                events.put_nowait(message)
+            except queue.Full:
+                # The client fell behind - drop its backlog and have it reload everything
+                self._dropped += 1
+                while not events.empty():
+                    try:
+                        events.get_nowait()
+                    except queue.Empty:
+                        break
+                events.put_nowait(format_event('resync', {}))
+
+    async def _push_counters(self):
+        while True:
+            await asyncio.sleep(COUNTER_INTERVAL)
+            if self._conn is None or self._conn.is_closed():
+                # Connection lost - reconnect while anyone is listening, otherwise stop
+                self._conn = None
+                if not self._subscribers:
+                    return
+                try:
+                    await self._ensure_listening()
+                    self.broadcast('resync', {})
+                except Exception as e:
+                    logger.error(f"Error reconnecting dashboard event listener: {e}")
+                continue
+            if not self._counters_dirty or not self._subscribers:
+                continue
+            self._counters_dirty = False
+            try:
+                self.broadcast('counters', await self.runtime.db.get_system_counters())
+            except Exception as e:
+                logger.error(f"Error reading counters for dashboard events: {e}")
+
+    def get_stats(self) -> dict:
+        """Get stream counters for the metrics endpoint"""
+        return {
+            "listening": self._conn is not None and not self._conn.is_closed(),
+            "subscribers": len(self._subscribers),
+            "received": self._received,
+            "dropped": self._dropped
+        }
+
+# Shared instance used by the /api/events route
+event_hub = DashboardEventHub(runtime)
@@ -1,251 +1,501 @@
+import asyncio
+import contextlib
+import itertools
+import json
+import os
 import sqlite3
 import aiosqlite
 import logging
-from typing import List, Tuple, Optional
+from datetime import datetime
+from typing import Awaitable, Callable, List, Tuple, Optional
+from urllib.request import pathname2url
+from config import Config
+from leaderboard_index import leaderboard
+from points_store import PointsStore
+from write_coalescer import PointsWrite, WriteCoalescer
 
 logger = logging.getLogger(__name__)
 
-class PointsDatabase:
-    def __init__(self, db_path: str = "points.db"):
+# TIMESTAMP columns come back as datetimes, as they do from PostgreSQL
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+
+# Everything the achievement rules look at; email submissions and server roles are
+# PostgreSQL-only, so those rules never match here.
+# Parameters: highest join position any rule checks, user_id.
+ACHIEVEMENT_STATE_SQL = '''
+    SELECT p.balance,
+           (SELECT COUNT(*) + 1 FROM (
+                SELECT 1 FROM points o WHERE o.created_at < p.created_at LIMIT ?
+            )) AS join_position
+    FROM points p WHERE p.user_id = ?
+'''
+
+# Ordered schema migrations as (version, description, statements). Append new
+# migrations at the end and never edit one that has already been released.
+MIGRATIONS = [
+    (1, "initial schema", [
+        '''
+        CREATE TABLE IF NOT EXISTS points (
+            user_id INTEGER PRIMARY KEY,
+            balance INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            transaction_type TEXT NOT NULL,
+            admin_id INTEGER,
+            reason TEXT,
+            old_balance INTEGER NOT NULL,
+            new_balance INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES points (user_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS achievements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            achievement_type TEXT NOT NULL,
+            achievement_name TEXT NOT NULL,
+            points_earned INTEGER DEFAULT 0,
+            earned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES points (user_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            total_points_earned INTEGER DEFAULT 0,
+            total_points_spent INTEGER DEFAULT 0,
+            highest_balance INTEGER DEFAULT 0,
+            transactions_count INTEGER DEFAULT 0,
+            achievements_count INTEGER DEFAULT 0,
+            first_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES points (user_id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_balance ON points(balance DESC)',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions(user_id, created_at DESC)',
+        'CREATE INDEX IF NOT EXISTS idx_achievements_user ON achievements(user_id, earned_at DESC)',
+        '''
+        CREATE TRIGGER IF NOT EXISTS update_points_timestamp 
+        AFTER UPDATE ON points
+        BEGIN
+            UPDATE points SET updated_at = CURRENT_TIMESTAMP 
+            WHERE user_id = NEW.user_id;
+        END;
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS update_user_stats_on_points
+        AFTER UPDATE ON points
+        BEGIN
+            INSERT OR REPLACE INTO user_stats (
+                user_id, total_points_earned, total_points_spent, 
+                highest_balance, transactions_count, last_activity,
+                first_activity
+            )
+            VALUES (
+                NEW.user_id,
+                COALESCE((SELECT total_points_earned FROM user_stats WHERE user_id = NEW.user_id), 0) +
+                CASE WHEN NEW.balance > OLD.balance THEN NEW.balance - OLD.balance ELSE 0 END,
+                COALESCE((SELECT total_points_spent FROM user_stats WHERE user_id = NEW.user_id), 0) +
+                CASE WHEN NEW.balance < OLD.balance THEN OLD.balance - NEW.balance ELSE 0 END,
+                MAX(NEW.balance, COALESCE((SELECT highest_balance FROM user_stats WHERE user_id = NEW.user_id), 0)),
+                COALESCE((SELECT transactions_count FROM user_stats WHERE user_id = NEW.user_id), 0) + 1,
+                CURRENT_TIMESTAMP,
+                COALESCE((SELECT first_activity FROM user_stats WHERE user_id = NEW.user_id), CURRENT_TIMESTAMP)
+            );
+        END;
+        ''',
+    ]),
+    (2, "point_requests table", [
+        '''
+        CREATE TABLE IF NOT EXISTS point_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT NOT NULL,
+            order_id TEXT NOT NULL,
+            points_amount INTEGER NOT NULL,
+            discord_user_id INTEGER,
+            status TEXT DEFAULT 'pending',
+            verification_code TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            processed_at TIMESTAMP,
+            UNIQUE(email, order_id)
+        )
+        ''',
+    ]),
+    (3, "point_requests.notified_at", [
+        'ALTER TABLE point_requests ADD COLUMN notified_at TIMESTAMP',
+        'CREATE INDEX IF NOT EXISTS idx_point_requests_unnotified ON point_requests(status, notified_at, id)',
+    ]),
+    (4, "point_requests.verification_code index", [
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_point_requests_code ON point_requests(verification_code)',
+    ]),
+    (5, "one achievement of each type per user", [
+        # Manual awards reuse a few generic types; fold the name in so they stay distinct
+        '''
+        UPDATE achievements SET achievement_type = achievement_type || ':' || achievement_name
+        WHERE achievement_type IN ('milestone', 'special', 'participation', 'achievement')
+        ''',
+        '''
+        DELETE FROM achievements
+        WHERE id NOT IN (SELECT MIN(id) FROM achievements GROUP BY user_id, achievement_type)
+        ''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_achievements_user_type ON achievements(user_id, achievement_type)',
+        'DROP INDEX IF EXISTS idx_achievements_user',
+    ]),
+    (6, "user_stats written by the points store instead of triggers", [
+        # Balance writes upsert user_stats and updated_at themselves (see PointsDatabase._apply_balance)
+        'DROP TRIGGER IF EXISTS update_user_stats_on_points',
+        'DROP TRIGGER IF EXISTS update_points_timestamp',
+    ]),
+    (7, "idempotency_keys", [
+        '''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            request_hash TEXT NOT NULL,
+            response TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys(expires_at)',
+    ]),
+]
+
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+class PointsDatabase(PointsStore):
+    """SQLite points store
+
+    Tuned mode (Config.SQLITE_TUNED, file databases only) runs the file in WAL with
+    synchronous=NORMAL and memory-mapped I/O. Reads go to a pool of read-only
+    connections, so they never wait on the writer. Writes queue up for a single writer
+    task that commits everything queued in one transaction, with each write in its own
+    savepoint. Untuned, one connection serves everything and each write commits on its own.
+    With Config.POINTS_WRITE_COALESCING, change_points/assign_points calls are also
+    batched by a WriteCoalescer and each batch is a single write.
+    """
+
+    def __init__(self, db_path: str = "points.db", tuned: bool = None, coalesce_writes: bool = None):
         self.db_path = db_path
+        self.tuned = (Config.SQLITE_TUNED if tuned is None else tuned) and db_path != ":memory:"
         self.conn = None
+        # Untuned, one connection is shared by every caller; writes hold this so another
+        # coroutine's statements can't land inside their transaction
+        self._write_lock = asyncio.Lock()
+        self._readers = None  # round-robin over the read-only connections (tuned mode)
+        self._reader_conns = []
+        self._write_queue = None  # (operation, future) pairs for the writer task (tuned mode)
+        self._writer_task = None
+        self._commits = 0
+        self._writes = 0
+        if coalesce_writes is None:
+            coalesce_writes = Config.POINTS_WRITE_COALESCING
+        self._coalescer = WriteCoalescer(self._apply_points_batch, self._apply_points_write) if coalesce_writes else None
         
     async def initialize(self):
-        """Initialize the database and create tables if they don't exist"""
+        """Open the database connection and apply pending schema migrations"""
+        if self.conn is not None:
+            return
         try:
-            self.conn = await aiosqlite.connect(self.db_path)
-            
-            # Create points table
-            await self.conn.execute('''
-                CREATE TABLE IF NOT EXISTS points (
-                    user_id INTEGER PRIMARY KEY,
-                    balance INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Create transactions table for audit trail
-            await self.conn.execute('''
-                CREATE TABLE IF NOT EXISTS transactions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    amount INTEGER NOT NULL,
-                    transaction_type TEXT NOT NULL,
-                    admin_id INTEGER,
-                    reason TEXT,
-                    old_balance INTEGER NOT NULL,
-                    new_balance INTEGER NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES points (user_id)
-                )
-            ''')
-            
-            # Create achievements table
-            await self.conn.execute('''
-                CREATE TABLE IF NOT EXISTS achievements (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    achievement_type TEXT NOT NULL,
-                    achievement_name TEXT NOT NULL,
-                    points_earned INTEGER DEFAULT 0,
-                    earned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES points (user_id)
-                )
-            ''')
-            
-            # Create user_stats table
-            await self.conn.execute('''
-                CREATE TABLE IF NOT EXISTS user_stats (
-                    user_id INTEGER PRIMARY KEY,
-                    total_points_earned INTEGER DEFAULT 0,
-                    total_points_spent INTEGER DEFAULT 0,
-                    highest_balance INTEGER DEFAULT 0,
-                    transactions_count INTEGER DEFAULT 0,
-                    achievements_count INTEGER DEFAULT 0,
-                    first_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES points (user_id)
-                )
-            ''')
-            
-            # Create indexes for faster queries
-            await self.conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_balance 
-                ON points(balance DESC)
-            ''')
-            
-            await self.conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_transactions_user 
-                ON transactions(user_id, created_at DESC)
-            ''')
-            
-            await self.conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_achievements_user 
-                ON achievements(user_id, earned_at DESC)
-            ''')
-            
-            # Create trigger to update the updated_at timestamp
-            await self.conn.execute('''
-                CREATE TRIGGER IF NOT EXISTS update_points_timestamp 
-                AFTER UPDATE ON points
-                BEGIN
-                    UPDATE points SET updated_at = CURRENT_TIMESTAMP 
-                    WHERE user_id = NEW.user_id;
-                END;
-            ''')
-            
-            # Create trigger to update user stats on points change
-            await self.conn.execute('''
-                CREATE TRIGGER IF NOT EXISTS update_user_stats_on_points
-                AFTER UPDATE ON points
-                BEGIN
-                    INSERT OR REPLACE INTO user_stats (
-                        user_id, total_points_earned, total_points_spent, 
-                        highest_balance, transactions_count, last_activity,
-                        first_activity
-                    )
-                    VALUES (
-                        NEW.user_id,
-                        COALESCE((SELECT total_points_earned FROM user_stats WHERE user_id = NEW.user_id), 0) +
-                        CASE WHEN NEW.balance > OLD.balance THEN NEW.balance - OLD.balance ELSE 0 END,
-                        COALESCE((SELECT total_points_spent FROM user_stats WHERE user_id = NEW.user_id), 0) +
-                        CASE WHEN NEW.balance < OLD.balance THEN OLD.balance - NEW.balance ELSE 0 END,
-                        MAX(NEW.balance, COALESCE((SELECT highest_balance FROM user_stats WHERE user_id = NEW.user_id), 0)),
-                        COALESCE((SELECT transactions_count FROM user_stats WHERE user_id = NEW.user_id), 0) + 1,
-                        CURRENT_TIMESTAMP,
-                        COALESCE((SELECT first_activity FROM user_stats WHERE user_id = NEW.user_id), CURRENT_TIMESTAMP)
-                    );
-                END;
-            ''')
-            
-            await self.conn.commit()
-            logger.info("Database initialized successfully")
+            self.conn = await aiosqlite.connect(self.db_path, detect_types=sqlite3.PARSE_DECLTYPES)
+            if self.tuned:
+                await self.conn.execute("PRAGMA journal_mode=WAL")
+                await self._apply_pragmas(self.conn)
+            await self._run_migrations()
+            if self.tuned:
+                await self._open_readers()
+                self._write_queue = asyncio.Queue()
+                self._writer_task = asyncio.get_running_loop().create_task(self._group_commit())
+            if not leaderboard.loaded:
+                await self.load_leaderboard_index()
+            logger.info(f"Database initialized successfully ({'tuned' if self.tuned else 'single connection'})")
             
         except Exception as e:
             logger.error(f"Error initializing database: {e}")
+            await self.close()
             raise
-            
+    
+    @staticmethod
+    async def _apply_pragmas(conn):
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute(f"PRAGMA mmap_size={Config.SQLITE_MMAP_MB * 1024 * 1024}")
+        await conn.execute("PRAGMA temp_store=MEMORY")
+        await conn.execute("PRAGMA busy_timeout=5000")
+    
+    async def _open_readers(self):
+        uri = f"file:{pathname2url(os.path.abspath(self.db_path))}?mode=ro"
+        for _ in range(Config.SQLITE_READERS):
+            conn = await aiosqlite.connect(uri, uri=True, detect_types=sqlite3.PARSE_DECLTYPES)
+            self._reader_conns.append(conn)
+            await self._apply_pragmas(conn)
+        self._readers = itertools.cycle(self._reader_conns)
+    
+    async def _run_migrations(self):
+        """Apply pending schema migrations - a single version check when the schema is current"""
+        try:
+            async with self.conn.execute("SELECT MAX(version) FROM schema_version") as cursor:
+                result = await cursor.fetchone()
+                current_version = result[0] or 0
+        except sqlite3.OperationalError:
+            current_version = 0
+        
+        if current_version >= LATEST_SCHEMA_VERSION:
+            return
+        
+        await self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        await self.conn.commit()
+        
+        for version, description, statements in MIGRATIONS:
+            if version <= current_version:
+                continue
+            # BEGIN IMMEDIATE takes the write lock so concurrent processes migrate one at a time
+            await self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                async with self.conn.execute(
+                    "SELECT 1 FROM schema_version WHERE version = ?", (version,)
+                ) as cursor:
+                    applied = await cursor.fetchone()
+                if not applied:
+                    for statement in statements:
+                        await self.conn.execute(statement)
+                    await self.conn.execute(
+                        "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                        (version, description)
+                    )
+                await self.conn.commit()
+            except Exception:
+                await self.conn.rollback()
+                raise
+            if not applied:
+                logger.info(f"Applied schema migration {version}: {description}")
+        # Migrations may rewrite achievements, so cached earned sets can't be trusted
+        self._forget_earned()
+    
+    @contextlib.asynccontextmanager
+    async def _reading(self):
+        """A connection for reads - the next read-only one in tuned mode
+
+        Readers are shared round-robin rather than checked out: reads are autocommit
+        statements, and each aiosqlite connection runs whatever is queued on it back to back.
+        """
+        if not self.conn:
+            await self.initialize()
+        if not self._reader_conns:
+            yield self.conn
+            return
+        yield next(self._readers)
+    
+    async def _write(self, operation: Callable[[aiosqlite.Connection], Awaitable]):
+        """Run operation(conn) in a write transaction and return its result once committed"""
+        if not self.conn:
+            await self.initialize()
+        if self._write_queue is None:
+            async with self._write_lock:
+                # BEGIN IMMEDIATE keeps other processes out between a write's read and its update
+                await self.conn.execute("BEGIN IMMEDIATE")
+                try:
+                    result = await operation(self.conn)
+                    await self.conn.commit()
+                except Exception:
+                    await self.conn.rollback()
+                    raise
+            self._commits += 1
+            self._writes += 1
+            return result
+        future = asyncio.get_running_loop().create_future()
+        self._write_queue.put_nowait((operation, future))
+        return await future
+    
+    async def _group_commit(self):
+        """Writer task: commit whatever queued up while the previous commit ran, up to SQLITE_GROUP_COMMIT_MAX"""
+        while True:
+            batch = [await self._write_queue.get()]
+            while len(batch) < Config.SQLITE_GROUP_COMMIT_MAX and not self._write_queue.empty():
+                batch.append(self._write_queue.get_nowait())
+            stopping = batch[-1] is None
+            batch = [item for item in batch if item is not None]
+            
+            results = []
+            try:
+                if batch:
+                    await self.conn.execute("BEGIN IMMEDIATE")
+                    for operation, future in batch:
+                        # A failing write rolls back to its savepoint; the rest of the batch still commits
+                        await self.conn.execute("SAVEPOINT write_op")
+                        try:
+                            results.append((future, await operation(self.conn), None))
+                            await self.conn.execute("RELEASE write_op")
+                        except Exception as e:
+                            await self.conn.execute("ROLLBACK TO write_op")
+                            await self.conn.execute("RELEASE write_op")
+                            results.append((future, None, e))
+                    await self.conn.commit()
+                    self._commits += 1
+                    self._writes += len(batch)
+            except Exception as e:
+                logger.error(f"Error committing {len(batch)} SQLite writes: {e}")
+                try:
+                    await self.conn.rollback()
+                except Exception:
+                    pass
+                results = [(future, None, e) for _, future in batch]
+            
+            for future, result, error in results:
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+            if stopping:
+                return
+    
     async def get_points(self, user_id: int) -> int:
         """Get points balance for a user"""
         try:
-            if not self.conn:
-                await self.initialize()
-                
-            async with self.conn.execute(
-                "SELECT balance FROM points WHERE user_id = ?", 
-                (user_id,)
-            ) as cursor:
-                result = await cursor.fetchone()
-                return result[0] if result else 0
+            async with self._reading() as conn:
+                async with conn.execute(
+                    "SELECT balance FROM points WHERE user_id = ?", 
+                    (user_id,)
+                ) as cursor:
+                    result = await cursor.fetchone()
+                    return result[0] if result else 0
                 
         except Exception as e:
             logger.error(f"Error getting points for user {user_id}: {e}")
             return 0
             
-    async def update_points(self, user_id: int, amount: int, admin_id: int = None, reason: str = None) -> bool:
-        """Update points for a user (add or subtract) with transaction logging"""
+    async def load_leaderboard_index(self):
+        """(Re)load the in-process leaderboard index from the points table"""
+        if not leaderboard.begin_reload():
+            return
         try:
-            if not self.conn:
-                await self.initialize()
-                
-            current_balance = await self.get_points(user_id)
-            new_balance = current_balance + amount
-            
-            # Prevent negative balances
-            if new_balance < 0:
-                new_balance = 0
-                
-            # Determine transaction type
-            if amount > 0:
-                transaction_type = "add"
-            elif amount < 0:
-                transaction_type = "remove"
-            else:
-                transaction_type = "no_change"
-                
-            if current_balance == 0 and amount > 0:
-                # Insert new user
-                await self.conn.execute(
-                    "INSERT INTO points (user_id, balance) VALUES (?, ?)",
-                    (user_id, new_balance)
-                )
-            else:
-                # Update existing user
-                await self.conn.execute(
-                    "INSERT OR REPLACE INTO points (user_id, balance) VALUES (?, ?)",
-                    (user_id, new_balance)
-                )
-            
-            # Log transaction
-            await self.conn.execute('''
-                INSERT INTO transactions (user_id, amount, transaction_type, admin_id, reason, old_balance, new_balance)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (user_id, amount, transaction_type, admin_id, reason, current_balance, new_balance))
-                
-            await self.conn.commit()
-            logger.info(f"Updated points for user {user_id}: {current_balance} -> {new_balance}")
-            return True
-            
+            async with self._reading() as conn:
+                async with conn.execute("SELECT CAST(user_id AS TEXT), balance FROM points") as cursor:
+                    rows = await cursor.fetchall()
+        except Exception:
+            leaderboard.cancel_reload()
+            raise
+        await asyncio.to_thread(leaderboard.finish_reload, rows)
+    
+    @staticmethod
+    async def _apply_balance(conn, user_id, new_balance: Callable[[int], Optional[int]], transaction_type: str,
+                             admin_id: int = None, reason: str = None) -> Tuple[int, int]:
+        """Write a balance, its user_stats and its ledger row inside the caller's transaction
+
+        new_balance returning None writes nothing and returns (balance, balance).
+        """
+        async with conn.execute("SELECT balance FROM points WHERE user_id = ?", (user_id,)) as cursor:
+            row = await cursor.fetchone()
+        old_balance = row[0] if row else 0
+        balance = new_balance(old_balance)
+        if balance is None:
+            return old_balance, old_balance
+        await conn.execute('''
+            INSERT INTO points (user_id, balance) VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET balance = excluded.balance, updated_at = CURRENT_TIMESTAMP
+        ''', (user_id, balance))
+        await conn.execute('''
+            INSERT INTO user_stats (user_id, total_points_earned, total_points_spent, highest_balance,
+                                    transactions_count, first_activity, last_activity)
+            VALUES (?, ?, ?, ?, 1, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+            ON CONFLICT(user_id) DO UPDATE
+            SET total_points_earned = total_points_earned + excluded.total_points_earned,
+                total_points_spent = total_points_spent + excluded.total_points_spent,
+                highest_balance = MAX(highest_balance, excluded.highest_balance),
+                transactions_count = transactions_count + 1,
+                last_activity = CURRENT_TIMESTAMP
+        ''', (user_id, max(balance - old_balance, 0), max(old_balance - balance, 0), max(balance, 0)))
+        await conn.execute('''
+            INSERT INTO transactions (user_id, amount, transaction_type, admin_id, reason, old_balance, new_balance)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, balance - old_balance, transaction_type, admin_id, reason, old_balance, balance))
+        return old_balance, balance
+    
+    async def change_points(self, user_id, amount: int, admin_id: int = None, reason: str = None,
+                            clamp_at_zero: bool = False, transaction_type: str = None,
+                            require_balance: bool = False) -> Optional[Tuple[int, int]]:
+        """Add (or subtract) points and return (old_balance, new_balance)
+
+        With require_balance, a debit larger than the balance writes nothing and returns
+        (balance, balance).
+        """
+        try:
+            return await self._write_points(PointsWrite('change', user_id, amount, admin_id, reason,
+                                                        clamp_at_zero, transaction_type, require_balance))
         except Exception as e:
             logger.error(f"Error updating points for user {user_id}: {e}")
-            return False
-            
-    async def set_points(self, user_id: int, amount: int, admin_id: int = None, reason: str = None) -> bool:
-        """Set points for a user to a specific amount with transaction logging"""
+            return None
+    
+    async def assign_points(self, user_id, amount: int, admin_id: int = None,
+                            reason: str = None) -> Optional[Tuple[int, int]]:
+        """Set points and return (old_balance, new_balance)"""
         try:
-            if not self.conn:
-                await self.initialize()
-                
-            current_balance = await self.get_points(user_id)
-            
-            await self.conn.execute(
-                "INSERT OR REPLACE INTO points (user_id, balance) VALUES (?, ?)",
-                (user_id, amount)
-            )
-            
-            # Log transaction
-            await self.conn.execute('''
-                INSERT INTO transactions (user_id, amount, transaction_type, admin_id, reason, old_balance, new_balance)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (user_id, amount - current_balance, "set", admin_id, reason, current_balance, amount))
-            
-            await self.conn.commit()
-            logger.info(f"Set points for user {user_id} to {amount}")
-            return True
-            
+            return await self._write_points(PointsWrite('set', user_id, amount, admin_id, reason))
         except Exception as e:
             logger.error(f"Error setting points for user {user_id}: {e}")
-            return False
-            
-    async def get_leaderboard(self, limit: int = 10) -> List[Tuple[int, int]]:
+            return None
+    
+    async def _write_points(self, write: PointsWrite) -> Tuple[int, int]:
+        """Apply one balance write, through the coalescer when it is enabled"""
+        if self._coalescer is not None:
+            return await self._coalescer.submit(write)
+        return await self._apply_points_write(write)
+    
+    async def _apply_points_write(self, write: PointsWrite) -> Tuple[int, int]:
+        """One write in its own transaction (or group commit savepoint)"""
+        balances = await self._write(
+            lambda conn: self._apply_balance(conn, write.user_id, write.new_balance, write.transaction_type,
+                                             write.admin_id, write.reason)
+        )
+        leaderboard.update(write.user_id, balances[1])
+        return balances
+    
+    async def _apply_points_batch(self, writes: List[PointsWrite]) -> List[Tuple[int, int]]:
+        """A coalesced batch of writes as a single write, in the order given"""
+        async def apply(conn):
+            return [await self._apply_balance(conn, write.user_id, write.new_balance, write.transaction_type,
+                                              write.admin_id, write.reason)
+                    for write in writes]
+        results = await self._write(apply)
+        leaderboard.apply((write.user_id, new_balance) for write, (_, new_balance) in zip(writes, results))
+        return results
+            
+    async def get_leaderboard(self, limit: int = 10) -> List[Tuple[str, int]]:
         """Get top users by points"""
         try:
-            if not self.conn:
-                await self.initialize()
-                
-            async with self.conn.execute(
-                "SELECT user_id, balance FROM points WHERE balance > 0 ORDER BY balance DESC LIMIT ?",
-                (limit,)
-            ) as cursor:
-                results = await cursor.fetchall()
-                return results
+            async with self._reading() as conn:
+                async with conn.execute(
+                    "SELECT CAST(user_id AS TEXT), balance FROM points WHERE balance > 0 ORDER BY balance DESC LIMIT ?",
+                    (limit,)
+                ) as cursor:
+                    return await cursor.fetchall()
                 
         except Exception as e:
             logger.error(f"Error getting leaderboard: {e}")
             return []
             
     async def get_total_users(self) -> int:
-        """Get total number of users with points"""
+        """Get total number of users"""
         try:
-            if not self.conn:
-                await self.initialize()
-                
-            async with self.conn.execute(
-                "SELECT COUNT(*) FROM points WHERE balance > 0"
-            ) as cursor:
-                result = await cursor.fetchone()
-                return result[0] if result else 0
+            async with self._reading() as conn:
+                async with conn.execute("SELECT COUNT(*) FROM points") as cursor:
+                    result = await cursor.fetchone()
+                    return result[0] if result else 0
                 
         except Exception as e:
             logger.error(f"Error getting total users: {e}")
@@ -254,14 +504,10 @@ class PointsDatabase:
     async def get_total_points(self) -> int:
         """Get sum of all points in the system"""
         try:
-            if not self.conn:
-                await self.initialize()
-                
-            async with self.conn.execute(
-                "SELECT SUM(balance) FROM points"
-            ) as cursor:
-                result = await cursor.fetchone()
-                return result[0] if result and result[0] else 0
+            async with self._reading() as conn:
+                async with conn.execute("SELECT SUM(balance) FROM points") as cursor:
+                    result = await cursor.fetchone()
+                    return result[0] if result and result[0] else 0
                 
         except Exception as e:
             logger.error(f"Error getting total points: {e}")
@@ -270,16 +516,14 @@ class PointsDatabase:
     async def get_user_rank(self, user_id: int) -> Optional[int]:
         """Get a user's rank in the leaderboard"""
         try:
-            if not self.conn:
-                await self.initialize()
-                
-            async with self.conn.execute('''
-                SELECT COUNT(*) + 1 as rank 
-                FROM points 
-                WHERE balance > (SELECT balance FROM points WHERE user_id = ?)
-            ''', (user_id,)) as cursor:
-                result = await cursor.fetchone()
-                return result[0] if result else None
+            async with self._reading() as conn:
+                async with conn.execute('''
+                    SELECT COUNT(*) + 1 as rank 
+                    FROM points 
+                    WHERE balance > (SELECT balance FROM points WHERE user_id = ?)
+                ''', (user_id,)) as cursor:
+                    result = await cursor.fetchone()
+                    return result[0] if result else None
                 
         except Exception as e:
             logger.error(f"Error getting user rank for {user_id}: {e}")
@@ -288,15 +532,8 @@ class PointsDatabase:
     async def delete_user(self, user_id: int) -> bool:
         """Delete a user's points record"""
         try:
-            if not self.conn:
-                await self.initialize()
-                
-            await self.conn.execute(
-                "DELETE FROM points WHERE user_id = ?",
-                (user_id,)
-            )
-            
-            await self.conn.commit()
+            await self._write(lambda conn: conn.execute("DELETE FROM points WHERE user_id = ?", (user_id,)))
+            self._forget_earned(str(user_id))
             logger.info(f"Deleted points record for user {user_id}")
             return True
             
@@ -324,15 +561,12 @@ class PointsDatabase:
             logger.error(f"Error creating database backup: {e}")
             return False
             
-    async def get_transactions(self, user_id: int = None, limit: int = 50) -> List[Tuple]:
+    async def get_transactions(self, user_id: int = None, limit: int = 10) -> List[Tuple]:
         """Get transaction history for a user or all users"""
         try:
-            if not self.conn:
-                await self.initialize()
-            
             if user_id:
                 query = '''
-                    SELECT id, user_id, amount, transaction_type, admin_id, reason, 
+                    SELECT id, CAST(user_id AS TEXT), amount, transaction_type, admin_id, reason, 
                            old_balance, new_balance, created_at
                     FROM transactions 
                     WHERE user_id = ? 
@@ -342,7 +576,7 @@ class PointsDatabase:
                 params = (user_id, limit)
             else:
                 query = '''
-                    SELECT id, user_id, amount, transaction_type, admin_id, reason, 
+                    SELECT id, CAST(user_id AS TEXT), amount, transaction_type, admin_id, reason, 
                            old_balance, new_balance, created_at
                     FROM transactions 
                     ORDER BY created_at DESC 
@@ -350,8 +584,9 @@ class PointsDatabase:
                 '''
                 params = (limit,)
             
-            async with self.conn.execute(query, params) as cursor:
-                return await cursor.fetchall()
+            async with self._reading() as conn:
+                async with conn.execute(query, params) as cursor:
+                    return await cursor.fetchall()
                 
         except Exception as e:
             logger.error(f"Error getting transactions: {e}")
@@ -360,132 +595,169 @@ class PointsDatabase:
     async def get_user_stats(self, user_id: int) -> Optional[Tuple]:
         """Get detailed stats for a user"""
         try:
-            if not self.conn:
-                await self.initialize()
-                
-            async with self.conn.execute('''
-                SELECT total_points_earned, total_points_spent, highest_balance, 
-                       transactions_count, achievements_count, first_activity, last_activity
-                FROM user_stats 
-                WHERE user_id = ?
-            ''', (user_id,)) as cursor:
-                return await cursor.fetchone()
+            async with self._reading() as conn:
+                async with conn.execute('''
+                    SELECT total_points_earned, total_points_spent, highest_balance, 
+                           transactions_count, achievements_count, first_activity, last_activity
+                    FROM user_stats 
+                    WHERE user_id = ?
+                ''', (user_id,)) as cursor:
+                    return await cursor.fetchone()
                 
         except Exception as e:
             logger.error(f"Error getting user stats for {user_id}: {e}")
             return None
 
-    async def add_achievement(self, user_id: int, achievement_type: str, achievement_name: str, points_earned: int = 0) -> bool:
-        """Add an achievement for a user"""
-        try:
-            if not self.conn:
-                await self.initialize()
-                
-            await self.conn.execute('''
+    async def add_achievement(self, user_id: int, achievement_type: str, achievement_name: str,
+                              points_earned: int = 0) -> Optional[bool]:
+        """Add a manual achievement for a user; False if they already have it, None on error
+
+        Manual awards are stored as "<type>:<name>" so one user can hold several of a type.
+        """
+        async def insert(conn):
+            cursor = await conn.execute('''
                 INSERT INTO achievements (user_id, achievement_type, achievement_name, points_earned)
                 VALUES (?, ?, ?, ?)
-            ''', (user_id, achievement_type, achievement_name, points_earned))
-            
-            # Update achievements count in user_stats
-            await self.conn.execute('''
-                INSERT OR REPLACE INTO user_stats (
-                    user_id, achievements_count, last_activity,
-                    total_points_earned, total_points_spent, highest_balance, 
-                    transactions_count, first_activity
-                )
-                VALUES (
-                    ?, 
-                    COALESCE((SELECT achievements_count FROM user_stats WHERE user_id = ?), 0) + 1,
-                    CURRENT_TIMESTAMP,
-                    COALESCE((SELECT total_points_earned FROM user_stats WHERE user_id = ?), 0),
-                    COALESCE((SELECT total_points_spent FROM user_stats WHERE user_id = ?), 0),
-                    COALESCE((SELECT highest_balance FROM user_stats WHERE user_id = ?), 0),
-                    COALESCE((SELECT transactions_count FROM user_stats WHERE user_id = ?), 0),
-                    COALESCE((SELECT first_activity FROM user_stats WHERE user_id = ?), CURRENT_TIMESTAMP)
-                )
-            ''', (user_id, user_id, user_id, user_id, user_id, user_id, user_id))
-            
-            await self.conn.commit()
-            logger.info(f"Added achievement '{achievement_name}' for user {user_id}")
+                ON CONFLICT(user_id, achievement_type) DO NOTHING
+            ''', (user_id, f"{achievement_type}:{achievement_name}", achievement_name, points_earned))
+            if cursor.rowcount == 0:
+                return False
+            
+            # Update user stats
+            await conn.execute('''
+                UPDATE user_stats
+                SET achievements_count = achievements_count + 1,
+                    last_activity = CURRENT_TIMESTAMP
+                WHERE user_id = ?
+            ''', (user_id,))
             return True
+        
+        try:
+            inserted = await self._write(insert)
+            if inserted:
+                logger.info(f"Added achievement '{achievement_name}' for user {user_id}")
+            return inserted
             
         except Exception as e:
             logger.error(f"Error adding achievement for user {user_id}: {e}")
-            return False
+            return None
 
-    async def get_achievements(self, user_id: int = None, limit: int = 50) -> List[Tuple]:
-        """Get achievements for a user or all users"""
+    async def get_achievements(self, limit: int = 10) -> List[Tuple]:
+        """Get recent achievements"""
         try:
-            if not self.conn:
-                await self.initialize()
-            
-            if user_id:
-                query = '''
-                    SELECT id, user_id, achievement_type, achievement_name, 
-                           points_earned, earned_at
-                    FROM achievements 
-                    WHERE user_id = ? 
-                    ORDER BY earned_at DESC 
+            async with self._reading() as conn:
+                async with conn.execute('''
+                    SELECT id, CAST(user_id AS TEXT), achievement_type, achievement_name, points_earned, earned_at
+                    FROM achievements
+                    ORDER BY earned_at DESC
                     LIMIT ?
-                '''
-                params = (user_id, limit)
-            else:
-                query = '''
-                    SELECT id, user_id, achievement_type, achievement_name, 
-                           points_earned, earned_at
-                    FROM achievements 
-                    ORDER BY earned_at DESC 
-                    LIMIT ?
-                '''
-                params = (limit,)
-            
-            async with self.conn.execute(query, params) as cursor:
-                return await cursor.fetchall()
+                ''', (limit,)) as cursor:
+                    return await cursor.fetchall()
                 
         except Exception as e:
             logger.error(f"Error getting achievements: {e}")
             return []
 
+    async def get_user_achievements(self, user_id) -> List[dict]:
+        """Get all achievements for a specific user"""
+        async with self._reading() as conn:
+            async with conn.execute('''
+                SELECT achievement_type, achievement_name, points_earned, earned_at
+                FROM achievements
+                WHERE user_id = ?
+                ORDER BY earned_at DESC
+            ''', (user_id,)) as cursor:
+                rows = await cursor.fetchall()
+        return [
+            {"achievement_type": row[0], "achievement_name": row[1], "points_earned": row[2], "earned_at": row[3]}
+            for row in rows
+        ]
+
+    async def get_recent_achievements(self, limit: int = 10) -> List[dict]:
+        """Get recent achievements across all users (there's no user directory here, so no username)"""
+        return [
+            {"user_id": row[1], "achievement_type": row[2], "achievement_name": row[3],
+             "points_earned": row[4], "earned_at": row[5], "username": None}
+            for row in await self.get_achievements(limit)
+        ]
+
+    async def get_achievement_state(self, user_id, max_join_position: int) -> dict:
+        """Balance, earned types and join position for the achievement rules"""
+        async with self._reading() as conn:
+            async with conn.execute(ACHIEVEMENT_STATE_SQL, (max_join_position, user_id)) as cursor:
+                row = await cursor.fetchone()
+            async with conn.execute("SELECT achievement_type FROM achievements WHERE user_id = ?", (user_id,)) as cursor:
+                earned = {earned_row[0] for earned_row in await cursor.fetchall()}
+        return {
+            'balance': row[0] if row else 0,
+            'earned': earned,
+            'email_statuses': set(),
+            'roles': [],
+            'join_position': row[1] if row else None
+        }
+
+    async def award_achievements(self, user_id, awards: list) -> Tuple[Optional[int], List[str]]:
+        """Insert (type, name, points_reward) awards, crediting bonuses only for rows actually inserted"""
+        async def award(conn):
+            awarded, new_balance = [], None
+            for achievement_type, achievement_name, points_reward in awards:
+                cursor = await conn.execute('''
+                    INSERT INTO achievements (user_id, achievement_type, achievement_name, points_earned)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(user_id, achievement_type) DO NOTHING
+                ''', (user_id, achievement_type, achievement_name, points_reward))
+                if cursor.rowcount == 0:
+                    continue
+                awarded.append(achievement_type)
+                if points_reward > 0:
+                    _, new_balance = await self._apply_balance(
+                        conn, user_id, lambda old: old + points_reward, "achievement", None,
+                        f"Achievement: {achievement_name}"
+                    )
+            return new_balance, awarded
+        
+        new_balance, awarded = await self._write(award)
+        if new_balance is not None:
+            leaderboard.update(str(user_id), new_balance)
+        return new_balance, awarded
+
     async def get_database_stats(self) -> dict:
         """Get overall database statistics"""
         try:
-            if not self.conn:
-                await self.initialize()
-            
             stats = {}
-            
-            # Total users
-            async with self.conn.execute("SELECT COUNT(*) FROM points") as cursor:
-                result = await cursor.fetchone()
-                stats['total_users'] = result[0] if result else 0
-            
-            # Total transactions
-            async with self.conn.execute("SELECT COUNT(*) FROM transactions") as cursor:
-                result = await cursor.fetchone()
-                stats['total_transactions'] = result[0] if result else 0
-            
-            # Total achievements
-            async with self.conn.execute("SELECT COUNT(*) FROM achievements") as cursor:
-                result = await cursor.fetchone()
-                stats['total_achievements'] = result[0] if result else 0
-            
-            # Total points in circulation
-            async with self.conn.execute("SELECT SUM(balance) FROM points") as cursor:
-                result = await cursor.fetchone()
-                stats['total_points'] = result[0] if result and result[0] else 0
-            
-            # Most active user
-            async with self.conn.execute('''
-                SELECT user_id, transactions_count 
-                FROM user_stats 
-                ORDER BY transactions_count DESC 
-                LIMIT 1
-            ''') as cursor:
-                result = await cursor.fetchone()
-                if result:
-                    stats['most_active_user'] = {'user_id': result[0], 'transactions': result[1]}
-                else:
-                    stats['most_active_user'] = None
+            async with self._reading() as conn:
+                # Total users
+                async with conn.execute("SELECT COUNT(*) FROM points") as cursor:
+                    result = await cursor.fetchone()
+                    stats['total_users'] = result[0] if result else 0
+                
+                # Total transactions
+                async with conn.execute("SELECT COUNT(*) FROM transactions") as cursor:
+                    result = await cursor.fetchone()
+                    stats['total_transactions'] = result[0] if result else 0
+                
+                # Total achievements
+                async with conn.execute("SELECT COUNT(*) FROM achievements") as cursor:
+                    result = await cursor.fetchone()
+                    stats['total_achievements'] = result[0] if result else 0
+                
+                # Total points in circulation
+                async with conn.execute("SELECT SUM(balance) FROM points") as cursor:
+                    result = await cursor.fetchone()
+                    stats['total_points'] = result[0] if result and result[0] else 0
+                
+                # Most active user
+                async with conn.execute('''
+                    SELECT user_id, transactions_count 
+                    FROM user_stats 
+                    ORDER BY transactions_count DESC 
+                    LIMIT 1
+                ''') as cursor:
+                    result = await cursor.fetchone()
+                    if result:
+                        stats['most_active_user'] = {'user_id': result[0], 'transactions': result[1]}
+                    else:
+                        stats['most_active_user'] = None
             
             return stats
             
@@ -496,49 +768,47 @@ class PointsDatabase:
     async def get_user_analytics(self, user_id: int) -> Optional[dict]:
         """Get comprehensive analytics for a specific user"""
         try:
-            if not self.conn:
-                await self.initialize()
-            
             analytics = {}
             
             # Current balance
             current_balance = await self.get_points(user_id)
             analytics['current_balance'] = current_balance if current_balance is not None else 0
             
-            # Transaction-based analytics
-            async with self.conn.execute('''
-                SELECT 
-                    COUNT(*) as transaction_count,
-                    SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END) as total_earned,
-                    SUM(CASE WHEN amount < 0 THEN ABS(amount) ELSE 0 END) as total_spent,
-                    MAX(new_balance) as highest_balance,
-                    MIN(created_at) as first_activity,
-                    MAX(created_at) as last_activity
-                FROM transactions 
-                WHERE user_id = ?
-            ''', (user_id,)) as cursor:
-                result = await cursor.fetchone()
-                if result:
-                    analytics['transaction_count'] = result[0] or 0
-                    analytics['total_earned'] = result[1] or 0
-                    analytics['total_spent'] = result[2] or 0
-                    analytics['highest_balance'] = result[3] or analytics['current_balance']
-                    analytics['first_activity'] = result[4] or 'Never'
-                    analytics['last_activity'] = result[5] or 'Never'
-                else:
-                    analytics['transaction_count'] = 0
-                    analytics['total_earned'] = 0
-                    analytics['total_spent'] = 0
-                    analytics['highest_balance'] = analytics['current_balance']
-                    analytics['first_activity'] = 'Never'
-                    analytics['last_activity'] = 'Never'
-            
-            # Achievements count
-            async with self.conn.execute('''
-                SELECT COUNT(*) FROM achievements WHERE user_id = ?
-            ''', (user_id,)) as cursor:
-                result = await cursor.fetchone()
-                analytics['achievements_count'] = result[0] if result else 0
+            async with self._reading() as conn:
+                # Transaction-based analytics
+                async with conn.execute('''
+                    SELECT 
+                        COUNT(*) as transaction_count,
+                        SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END) as total_earned,
+                        SUM(CASE WHEN amount < 0 THEN ABS(amount) ELSE 0 END) as total_spent,
+                        MAX(new_balance) as highest_balance,
+                        MIN(created_at) as first_activity,
+                        MAX(created_at) as last_activity
+                    FROM transactions 
+                    WHERE user_id = ?
+                ''', (user_id,)) as cursor:
+                    result = await cursor.fetchone()
+                    if result:
+                        analytics['transaction_count'] = result[0] or 0
+                        analytics['total_earned'] = result[1] or 0
+                        analytics['total_spent'] = result[2] or 0
+                        analytics['highest_balance'] = result[3] or analytics['current_balance']
+                        analytics['first_activity'] = result[4] or 'Never'
+                        analytics['last_activity'] = result[5] or 'Never'
+                    else:
+                        analytics['transaction_count'] = 0
+                        analytics['total_earned'] = 0
+                        analytics['total_spent'] = 0
+                        analytics['highest_balance'] = analytics['current_balance']
+                        analytics['first_activity'] = 'Never'
+                        analytics['last_activity'] = 'Never'
+                
+                # Achievements count
+                async with conn.execute('''
+                    SELECT COUNT(*) FROM achievements WHERE user_id = ?
+                ''', (user_id,)) as cursor:
+                    result = await cursor.fetchone()
+                    analytics['achievements_count'] = result[0] if result else 0
             
             # User rank
             user_rank = await self.get_user_rank(user_id)
@@ -550,8 +820,157 @@ class PointsDatabase:
             logger.error(f"Error getting user analytics for {user_id}: {e}")
             return None
 
+    async def insert_point_requests(self, requests: list) -> int:
+        """Store (email, order_id, points_amount, verification_code) rows, skipping orders already stored"""
+        async def insert(conn):
+            changes_before = conn.total_changes
+            await conn.executemany('''
+                INSERT OR IGNORE INTO point_requests (email, order_id, points_amount, verification_code)
+                VALUES (?, ?, ?, ?)
+            ''', requests)
+            return conn.total_changes - changes_before
+        
+        return await self._write(insert)
+    
+    async def get_unnotified_point_requests(self, after_id: int, limit: int) -> List[dict]:
+        """Pending requests whose email hasn't been sent, in id order after after_id"""
+        async with self._reading() as conn:
+            async with conn.execute('''
+                SELECT id, email, order_id, points_amount, verification_code
+                FROM point_requests
+                WHERE status = 'pending' AND notified_at IS NULL AND id > ?
+                ORDER BY id
+                LIMIT ?
+            ''', (after_id, limit)) as cursor:
+                rows = await cursor.fetchall()
+        return [
+            {"id": row[0], "email": row[1], "order_id": row[2], "points_amount": row[3], "verification_code": row[4]}
+            for row in rows
+        ]
+    
+    async def mark_point_requests_notified(self, request_ids: list):
+        if not request_ids:
+            return
+        await self._write(lambda conn: conn.executemany(
+            "UPDATE point_requests SET notified_at = CURRENT_TIMESTAMP WHERE id = ?",
+            [(request_id,) for request_id in request_ids]
+        ))
+    
+    async def get_pending_point_requests(self, limit: int = 50) -> List[dict]:
+        try:
+            async with self._reading() as conn:
+                async with conn.execute('''
+                    SELECT email, order_id, points_amount, verification_code, created_at
+                    FROM point_requests
+                    WHERE status = 'pending'
+                    ORDER BY created_at DESC
+                    LIMIT ?
+                ''', (limit,)) as cursor:
+                    rows = await cursor.fetchall()
+            return [
+                {"email": row[0], "order_id": row[1], "points_amount": row[2],
+                 "verification_code": row[3], "created_at": row[4]}
+                for row in rows
+            ]
+        except Exception as e:
+            logger.error(f"Error getting pending point requests: {e}")
+            return []
+    
+    async def claim_point_request(self, verification_code: str, user_id: int) -> Optional[dict]:
+        """Mark a pending request claimed and credit its points in one transaction
+
+        Returns order_id, points_amount and new_balance, or None if the code is unknown or
+        already used.
+        """
+        async def claim(conn):
+            async with conn.execute('''
+                UPDATE point_requests
+                SET status = 'completed', discord_user_id = ?, processed_at = CURRENT_TIMESTAMP
+                WHERE verification_code = ? AND status = 'pending'
+                RETURNING order_id, points_amount
+            ''', (user_id, verification_code)) as cursor:
+                claimed = await cursor.fetchone()
+            if claimed is None:
+                return None
+            order_id, points_amount = claimed
+            _, new_balance = await self._apply_balance(
+                conn, user_id, lambda old: old + points_amount, "add", 0, f"Order reward: {order_id}"
+            )
+            return {"order_id": order_id, "points_amount": points_amount, "new_balance": new_balance}
+        
+        result = await self._write(claim)
+        if result is not None:
+            leaderboard.update(str(user_id), result['new_balance'])
+        return result
+    
+    async def claim_idempotency_key(self, key: str, request_hash: str, ttl_seconds: float) -> Optional[dict]:
+        """Claim an unexpired key for a new request (an expired row is taken over)
+
+        Returns None if this caller claimed it, otherwise the live row's request_hash and
+        response (None while the first request is still running).
+        """
+        async def claim(conn):
+            async with conn.execute('''
+                SELECT request_hash, response FROM idempotency_keys
+                WHERE key = ? AND expires_at > CURRENT_TIMESTAMP
+            ''', (key,)) as cursor:
+                row = await cursor.fetchone()
+            if row:
+                return {"request_hash": row[0], "response": json.loads(row[1]) if row[1] else None}
+            await conn.execute('''
+                INSERT INTO idempotency_keys (key, request_hash, expires_at)
+                VALUES (?, ?, datetime('now', ?))
+                ON CONFLICT(key) DO UPDATE
+                SET request_hash = excluded.request_hash, response = NULL,
+                    created_at = CURRENT_TIMESTAMP, expires_at = excluded.expires_at
+            ''', (key, request_hash, f"{float(ttl_seconds):+} seconds"))
+            return None
+        
+        return await self._write(claim)
+    
+    async def save_idempotent_response(self, key: str, response: dict):
+        await self._write(lambda conn: conn.execute(
+            "UPDATE idempotency_keys SET response = ? WHERE key = ?", (json.dumps(response), key)
+        ))
+    
+    async def release_idempotency_key(self, key: str):
+        await self._write(lambda conn: conn.execute(
+            "DELETE FROM idempotency_keys WHERE key = ? AND response IS NULL", (key,)
+        ))
+    
+    async def delete_expired_idempotency_keys(self) -> int:
+        async def delete(conn):
+            cursor = await conn.execute("DELETE FROM idempotency_keys WHERE expires_at <= CURRENT_TIMESTAMP")
+            return cursor.rowcount
+        
+        return await self._write(delete)
+    
+    def get_stats(self) -> dict:
+        """Connection mode and group commit counters"""
+        return {
+            "tuned": self.tuned,
+            "readers": len(self._reader_conns),
+            "queued_writes": self._write_queue.qsize() if self._write_queue else 0,
+            "commits": self._commits,
+            "writes": self._writes,
+            "writes_per_commit": round(self._writes / self._commits, 2) if self._commits else 0,
+            "write_coalescer": self._coalescer.get_stats() if self._coalescer else {"enabled": False}
+        }
+    
     async def close(self):
-        """Close the database connection"""
+        """Stop the writer after the queued writes commit, then close every connection"""
+        if self._coalescer is not None:
+            await self._coalescer.drain()
+        if self._writer_task:
+            self._write_queue.put_nowait(None)
+            await self._writer_task
+            self._writer_task = None
+            self._write_queue = None
+        for conn in self._reader_conns:
+            await conn.close()
+        self._reader_conns = []
+        self._readers = None
         if self.conn:
             await self.conn.close()
+            self.conn = None
             logger.info("Database connection closed")
@@ -1,102 +1,836 @@
+import asyncio
 import asyncpg
+import json
 import logging
 import os
 from typing import List, Tuple, Optional
+from config import Config
+from leaderboard_index import leaderboard
+from points_store import PointsStore
+from write_coalescer import PointsWrite, WriteCoalescer
 
 logger = logging.getLogger(__name__)
 
-class PostgreSQLPointsDatabase:
-    def __init__(self):
+# Shards per system counter - concurrent writers update different rows, readers sum them
+COUNTER_SHARDS = 16
+
+# system_counters maintained by statement-level triggers, so every write path
+# (including ad-hoc dashboard queries) updates them in its own transaction.
+# Each term selects (counter name, delta) over the changed rows r; deleted and
+# old rows count negatively. Keep recount_counters_statements in step.
+COUNTER_TERMS = {
+    'points': [
+        "SELECT 'users', 1::bigint FROM {rows} r",
+        "SELECT 'total_points', COALESCE(r.balance, 0)::bigint FROM {rows} r",
+        "SELECT 'email_users_without_points', -1::bigint FROM {rows} r "
+        "WHERE EXISTS (SELECT 1 FROM email_submissions e WHERE e.discord_user_id = r.user_id)",
+    ],
+    'transactions': [
+        "SELECT 'transactions', 1::bigint FROM {rows} r",
+    ],
+    'achievements': [
+        "SELECT 'achievements', 1::bigint FROM {rows} r",
+    ],
+    'email_submissions': [
+        "SELECT 'emails', 1::bigint FROM {rows} r",
+        "SELECT 'emails_' || COALESCE(r.status, 'unknown'), 1::bigint FROM {rows} r",
+    ],
+    'admin_messages': [
+        "SELECT 'messages', 1::bigint FROM {rows} r",
+        "SELECT 'messages_' || COALESCE(r.delivery_status, 'unknown'), 1::bigint FROM {rows} r",
+    ],
+}
+
+# Counters of distinct users with at least one email submission matching the
+# condition (the user list counts users, not submissions). A user is counted
+# once however many submissions they have; email_users_without_points also
+# requires that they have no points row (the points terms above move users in
+# and out of it).
+EMAIL_USER_COUNTERS = [
+    ('email_users', "TRUE"),
+    ('email_users_pending', "status = 'pending'"),
+    ('email_users_processed', "status = 'processed'"),
+]
+
+def email_user_deltas(changes: List[Tuple[str, int]]) -> str:
+    """(counter name, delta) for EMAIL_USER_COUNTERS over (transition table, sign) changes
+
+    Each changed user's matching submissions are counted after the statement; the
+    transition rows give the count before it, and the counter moves when a user
+    goes from none to some or back.
+    """
+    changed = " UNION ALL ".join(f"SELECT discord_user_id, status, {sign} FROM {rows}" for rows, sign in changes)
+    changed_counts = ", ".join(
+        f"COALESCE(SUM(delta) FILTER (WHERE {condition}), 0) AS changed_{i}"
+        for i, (_, condition) in enumerate(EMAIL_USER_COUNTERS)
+    )
+    after_counts = ", ".join(
+        f"COUNT(*) FILTER (WHERE {condition}) AS after_{i}" for i, (_, condition) in enumerate(EMAIL_USER_COUNTERS)
+    )
+    moves = [f"(a.after_{i} > 0)::int - (a.after_{i} - c.changed_{i} > 0)::int" for i in range(len(EMAIL_USER_COUNTERS))]
+    deltas = ", ".join(f"('{name}', {move})" for (name, _), move in zip(EMAIL_USER_COUNTERS, moves))
+    return f'''
+            SELECT m.name, m.delta::bigint
+            FROM (
+                SELECT discord_user_id AS user_id, {changed_counts}
+                FROM ({changed}) ch(discord_user_id, status, delta)
+                GROUP BY discord_user_id
+            ) c
+            CROSS JOIN LATERAL (
+                SELECT {after_counts} FROM email_submissions s WHERE s.discord_user_id = c.user_id
+            ) a
+            CROSS JOIN LATERAL (VALUES {deltas},
+                ('email_users_without_points', CASE
+                    WHEN EXISTS (SELECT 1 FROM points p WHERE p.user_id = c.user_id) THEN 0 ELSE {moves[0]} END)
+            ) m(name, delta)'''
+
+# table -> builder of extra deltas that need the whole statement's changes, not one row at a time
+STATEMENT_COUNTER_TERMS = {
+    'email_submissions': email_user_deltas,
+}
+
+# table -> (user id column, operations) whose counter deltas depend on other rows of the same
+# user. Those users are locked (pg_advisory_xact_lock on COUNTER_LOCK_CLASS and hashtext of the
+# id, in id order) before counting, so concurrent transactions count one after the other and
+# each sees the rows the other committed. Points updates never move a user between the
+# email_users* counters, so only inserts and deletes lock.
+COUNTER_USER_LOCKS = {
+    'points': ('user_id', ('INSERT', 'DELETE')),
+    'email_submissions': ('discord_user_id', ('INSERT', 'UPDATE', 'DELETE')),
+}
+
+# First key of the two-key advisory locks taken per user by the counter triggers
+COUNTER_LOCK_CLASS = 724311
+
+def counter_trigger_statements(table: str) -> List[str]:
+    """DDL for the function and INSERT/UPDATE/DELETE triggers that keep a table's counters current"""
+    terms = COUNTER_TERMS[table]
+    added = " UNION ALL ".join(term.format(rows="new_rows") for term in terms)
+    removed = " UNION ALL ".join(
+        f"SELECT name, -delta FROM ({term.format(rows='old_rows')}) t(name, delta)" for term in terms
+    )
+    statement_terms = STATEMENT_COUNTER_TERMS.get(table)
+    inserted, deleted, updated = added, removed, added + " UNION ALL " + removed
+    if statement_terms:
+        inserted += " UNION ALL " + statement_terms([("new_rows", 1)])
+        deleted += " UNION ALL " + statement_terms([("old_rows", -1)])
+        updated += " UNION ALL " + statement_terms([("new_rows", 1), ("old_rows", -1)])
+    user_column, locked_operations = COUNTER_USER_LOCKS.get(table, (None, ()))
+
+    def lock_users(operation: str, *transition_tables: str) -> str:
+        if operation not in locked_operations:
+            return ""
+        users = " UNION ".join(f"SELECT {user_column} FROM {rows}" for rows in transition_tables)
+        return f'''
+            FOR locked_user IN SELECT DISTINCT user_id FROM ({users}) changed(user_id) ORDER BY 1 LOOP
+                PERFORM pg_advisory_xact_lock({COUNTER_LOCK_CLASS}, hashtext(locked_user));
+            END LOOP;'''
+
+    apply = f'''
+            INSERT INTO system_counters (name, shard, value)
+            SELECT name, pg_backend_pid() % {COUNTER_SHARDS}, SUM(delta) FROM ({{deltas}}) d(name, delta)
+            GROUP BY name HAVING SUM(delta) <> 0
+            ORDER BY name
+            ON CONFLICT (name, shard) DO UPDATE SET value = system_counters.value + EXCLUDED.value;'''
+    return [
+        f'''
+        CREATE OR REPLACE FUNCTION count_{table}_changes() RETURNS trigger LANGUAGE plpgsql AS $$
+        DECLARE
+            locked_user TEXT;
+        BEGIN
+            IF TG_OP = 'INSERT' THEN{lock_users('INSERT', 'new_rows')}{apply.format(deltas=inserted)}
+            ELSIF TG_OP = 'DELETE' THEN{lock_users('DELETE', 'old_rows')}{apply.format(deltas=deleted)}
+            ELSE{lock_users('UPDATE', 'new_rows', 'old_rows')}{apply.format(deltas=updated)}
+            END IF;
+            RETURN NULL;
+        END
+        $$
+        ''',
+        f'DROP TRIGGER IF EXISTS {table}_counters_insert ON {table}',
+        f'''
+        CREATE TRIGGER {table}_counters_insert AFTER INSERT ON {table}
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION count_{table}_changes()
+        ''',
+        f'DROP TRIGGER IF EXISTS {table}_counters_update ON {table}',
+        f'''
+        CREATE TRIGGER {table}_counters_update AFTER UPDATE ON {table}
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION count_{table}_changes()
+        ''',
+        f'DROP TRIGGER IF EXISTS {table}_counters_delete ON {table}',
+        f'''
+        CREATE TRIGGER {table}_counters_delete AFTER DELETE ON {table}
+        REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION count_{table}_changes()
+        ''',
+    ]
+
+def recount_counters_statements() -> List[str]:
+    """Recompute every system counter from its table (tables are locked against writes meanwhile)"""
+    return [
+        f"LOCK TABLE {', '.join(COUNTER_TERMS)}, system_counters IN SHARE ROW EXCLUSIVE MODE",
+        'DELETE FROM system_counters',
+        '''
+        INSERT INTO system_counters (name, shard, value)
+        SELECT 'users', 0, COUNT(*) FROM points
+        UNION ALL SELECT 'total_points', 0, COALESCE(SUM(balance), 0) FROM points
+        UNION ALL SELECT 'transactions', 0, COUNT(*) FROM transactions
+        UNION ALL SELECT 'achievements', 0, COUNT(*) FROM achievements
+        UNION ALL SELECT 'emails', 0, COUNT(*) FROM email_submissions
+        UNION ALL SELECT 'emails_' || COALESCE(status, 'unknown'), 0, COUNT(*) FROM email_submissions GROUP BY 1
+        UNION ALL SELECT 'email_users_without_points', 0, COUNT(DISTINCT e.discord_user_id) FROM email_submissions e
+                  WHERE NOT EXISTS (SELECT 1 FROM points p WHERE p.user_id = e.discord_user_id)
+        UNION ALL SELECT 'messages', 0, COUNT(*) FROM admin_messages
+        UNION ALL SELECT 'messages_' || COALESCE(delivery_status, 'unknown'), 0, COUNT(*) FROM admin_messages GROUP BY 1
+        ''' + "".join(
+            f"        UNION ALL SELECT '{name}', 0, COUNT(DISTINCT discord_user_id) FROM email_submissions WHERE {condition}\n"
+            for name, condition in EMAIL_USER_COUNTERS
+        ),
+    ]
+
+# pg_notify channel carrying row-level deltas to the dashboard's /api/events stream
+DASHBOARD_EVENTS_CHANNEL = 'dashboard_events'
+
+# Rows included in one notification; bigger statements only report a count
+DASHBOARD_EVENT_MAX_ROWS = 20
+
+# table -> (event type, columns sent to the dashboard, trigger events)
+DASHBOARD_EVENT_TABLES = {
+    'transactions': ('transaction', 'id, user_id, amount, transaction_type, reason, old_balance, new_balance, created_at',
+                     ['INSERT']),
+    'achievements': ('achievement', 'id, user_id, achievement_type, achievement_name, points_earned, earned_at',
+                     ['INSERT']),
+    'email_submissions': ('email_submission', 'id, discord_user_id, discord_username, status, submitted_at, processed_at',
+                          ['INSERT', 'UPDATE', 'DELETE']),
+    'admin_messages': ('dm', 'id, recipient_user_id, recipient_username, message_type, delivery_status, delivery_error',
+                       ['INSERT', 'UPDATE']),
+}
+
+def event_trigger_statements(table: str) -> List[str]:
+    """DDL for the statement-level triggers that pg_notify the dashboard about a table's changes"""
+    event_type, columns, operations = DASHBOARD_EVENT_TABLES[table]
+    notify = '''
+                SELECT COUNT(*) INTO changed FROM {rows};
+                IF changed = 0 THEN
+                    RETURN NULL;
+                END IF;
+                payload := json_build_object(
+                    'type', '{event_type}', 'op', lower(TG_OP), 'count', changed,
+                    'rows', CASE WHEN changed <= {max_rows} THEN
+                        (SELECT json_agg(r) FROM (SELECT {columns} FROM {rows}) r) END
+                )::text;'''
+    statements = [
+        f'''
+        CREATE OR REPLACE FUNCTION notify_{table}_event() RETURNS trigger LANGUAGE plpgsql AS $$
+        DECLARE
+            changed BIGINT;
+            payload TEXT;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN{notify.format(rows='old_rows', event_type=event_type, columns=columns, max_rows=DASHBOARD_EVENT_MAX_ROWS)}
+            ELSE{notify.format(rows='new_rows', event_type=event_type, columns=columns, max_rows=DASHBOARD_EVENT_MAX_ROWS)}
+            END IF;
+            -- NOTIFY payloads are capped at 8000 bytes; fall back to the count
+            IF octet_length(payload) > 7000 THEN
+                payload := json_build_object('type', '{event_type}', 'op', lower(TG_OP), 'count', changed)::text;
+            END IF;
+            PERFORM pg_notify('{DASHBOARD_EVENTS_CHANNEL}', payload);
+            RETURN NULL;
+        END
+        $$
+        ''',
+    ]
+    for operation in operations:
+        transition = {
+            'INSERT': 'NEW TABLE AS new_rows',
+            'UPDATE': 'OLD TABLE AS old_rows NEW TABLE AS new_rows',
+            'DELETE': 'OLD TABLE AS old_rows',
+        }[operation]
+        statements += [
+            f'DROP TRIGGER IF EXISTS {table}_events_{operation.lower()} ON {table}',
+            f'''
+            CREATE TRIGGER {table}_events_{operation.lower()} AFTER {operation} ON {table}
+            REFERENCING {transition} FOR EACH STATEMENT EXECUTE FUNCTION notify_{table}_event()
+            ''',
+        ]
+    return statements
+
+# /api/users sort options: (key column, direction)
+USER_SORTS = {
+    'points_desc': ('balance', 'DESC'),
+    'points_asc': ('balance', 'ASC'),
+    'username_asc': ('name', 'ASC'),
+    'username_desc': ('name', 'DESC'),
+}
+
+def fallback_name(user_id: str) -> str:
+    """Sort name of a user without a named discord_users row (matches the 'User <id>' label)"""
+    return f"LOWER('User ' || {user_id})"
+
+# A discord_users row with a name for user_id
+NAMED_DIRECTORY_ROW = ("EXISTS (SELECT 1 FROM discord_users du WHERE du.user_id = {0} "
+                       "AND COALESCE(du.display_name, du.username) IS NOT NULL)")
+
+# /api/users status filters, applied to the candidate user u
+USER_STATUS_FILTERS = {
+    'pending': "EXISTS (SELECT 1 FROM email_submissions s WHERE s.discord_user_id = u.user_id AND s.status = 'pending')",
+    'processed': "EXISTS (SELECT 1 FROM email_submissions s WHERE s.discord_user_id = u.user_id AND s.status = 'processed')",
+    'no_email': "NOT EXISTS (SELECT 1 FROM email_submissions s WHERE s.discord_user_id = u.user_id)",
+}
+
+def escape_like(value: str) -> str:
+    """Escape LIKE wildcards in user input"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+# Ordered schema migrations as (version, description, statements). Append new
+# migrations at the end and never edit one that has already been released.
+MIGRATIONS = [
+    (1, "initial schema", [
+        '''
+        CREATE TABLE IF NOT EXISTS points (
+            user_id TEXT PRIMARY KEY,
+            balance INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id SERIAL PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            transaction_type TEXT NOT NULL,
+            admin_id INTEGER,
+            reason TEXT,
+            old_balance INTEGER NOT NULL,
+            new_balance INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS achievements (
+            id SERIAL PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            achievement_type TEXT NOT NULL,
+            achievement_name TEXT NOT NULL,
+            points_earned INTEGER DEFAULT 0,
+            earned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id TEXT PRIMARY KEY,
+            total_points_earned INTEGER DEFAULT 0,
+            total_points_spent INTEGER DEFAULT 0,
+            highest_balance INTEGER DEFAULT 0,
+            transactions_count INTEGER DEFAULT 0,
+            achievements_count INTEGER DEFAULT 0,
+            first_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS email_submissions (
+            id SERIAL PRIMARY KEY,
+            discord_user_id TEXT NOT NULL,
+            discord_username TEXT NOT NULL,
+            email_address TEXT NOT NULL,
+            submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'pending',
+            processed_at TIMESTAMP,
+            admin_notes TEXT
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_points_balance ON points(balance DESC)',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions(user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_achievements_user ON achievements(user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_email_user ON email_submissions(discord_user_id)',
+    ]),
+    (2, "email_submissions.server_roles", [
+        "ALTER TABLE email_submissions ADD COLUMN IF NOT EXISTS server_roles TEXT DEFAULT ''",
+    ]),
+    (3, "admin_messages table", [
+        '''
+        CREATE TABLE IF NOT EXISTS admin_messages (
+            id SERIAL PRIMARY KEY,
+            sender_admin_id TEXT NOT NULL,
+            sender_admin_name TEXT,
+            recipient_user_id TEXT NOT NULL,
+            recipient_username TEXT,
+            message_content TEXT NOT NULL,
+            message_type TEXT DEFAULT 'general',
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            delivery_status TEXT DEFAULT 'pending',
+            delivery_error TEXT
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_admin_messages_sent ON admin_messages(sent_at DESC)',
+        'CREATE INDEX IF NOT EXISTS idx_admin_messages_recipient ON admin_messages(recipient_user_id)',
+    ]),
+    (4, "background jobs", [
+        '''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id SERIAL PRIMARY KEY,
+            job_type TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            payload JSONB NOT NULL DEFAULT '{}',
+            total INTEGER DEFAULT 0,
+            processed INTEGER DEFAULT 0,
+            succeeded INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS job_results (
+            job_id INTEGER NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+            row_index INTEGER NOT NULL,
+            item TEXT,
+            success BOOLEAN NOT NULL,
+            detail JSONB,
+            PRIMARY KEY (job_id, row_index)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)',
+    ]),
+    (5, "admin_messages outbox", [
+        'ALTER TABLE admin_messages ADD COLUMN IF NOT EXISTS attempts INTEGER DEFAULT 0',
+        'ALTER TABLE admin_messages ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP',
+        'ALTER TABLE admin_messages ADD COLUMN IF NOT EXISTS delivered_at TIMESTAMP',
+        'ALTER TABLE admin_messages ADD COLUMN IF NOT EXISTS use_embed BOOLEAN DEFAULT FALSE',
+        # Rows left unfinished by the old inline senders are stale - don't deliver them now
+        '''
+        UPDATE admin_messages
+        SET delivery_status = 'failed', delivery_error = 'Not delivered before outbox migration'
+        WHERE delivery_status IN ('pending', 'sending')
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_admin_messages_outbox ON admin_messages(next_attempt_at, id)
+        WHERE delivery_status IN ('pending', 'retrying')
+        ''',
+    ]),
+    (6, "discord_users directory", [
+        '''
+        CREATE TABLE IF NOT EXISTS discord_users (
+            user_id TEXT PRIMARY KEY,
+            username TEXT,
+            display_name TEXT,
+            avatar_hash TEXT,
+            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_discord_users_refreshed ON discord_users(refreshed_at)',
+        'CREATE INDEX IF NOT EXISTS idx_discord_users_display_name ON discord_users(LOWER(display_name))',
+        # Seed from the names stored with email submissions until the backfill refreshes them
+        '''
+        INSERT INTO discord_users (user_id, display_name, last_seen, refreshed_at)
+        SELECT DISTINCT ON (discord_user_id) discord_user_id, discord_username, submitted_at, '-infinity'::timestamp
+        FROM email_submissions
+        WHERE discord_user_id IS NOT NULL AND discord_username IS NOT NULL
+        ORDER BY discord_user_id, submitted_at DESC
+        ON CONFLICT (user_id) DO NOTHING
+        ''',
+    ]),
+    (7, "system_counters", [
+        '''
+        CREATE TABLE IF NOT EXISTS system_counters (
+            name TEXT NOT NULL,
+            shard SMALLINT NOT NULL DEFAULT 0,
+            value BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (name, shard)
+        )
+        ''',
+        *(statement for table in COUNTER_TERMS for statement in counter_trigger_statements(table)),
+        *recount_counters_statements(),
+    ]),
+    (8, "dashboard event notifications", [
+        *(statement for table in DASHBOARD_EVENT_TABLES for statement in event_trigger_statements(table)),
+    ]),
+    (9, "user list keyset and search indexes", [
+        'CREATE INDEX IF NOT EXISTS idx_points_balance_user ON points(balance, user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_email_status_user ON email_submissions(status, discord_user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_email_user_submitted ON email_submissions(discord_user_id, submitted_at DESC)',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_discord_users_sort_name
+        ON discord_users((LOWER(COALESCE(display_name, username))), user_id)
+        ''',
+        # Substring search uses trigram indexes where pg_trgm can be installed; without it
+        # the search still works, just with sequential scans
+        '''
+        DO $$
+        BEGIN
+            BEGIN
+                CREATE EXTENSION IF NOT EXISTS pg_trgm;
+            EXCEPTION WHEN OTHERS THEN
+                RAISE NOTICE 'pg_trgm unavailable, user search will not be indexed: %', SQLERRM;
+            END;
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+                CREATE INDEX IF NOT EXISTS idx_discord_users_name_trgm
+                    ON discord_users USING gin (LOWER(display_name) gin_trgm_ops, LOWER(username) gin_trgm_ops);
+                CREATE INDEX IF NOT EXISTS idx_email_search_trgm
+                    ON email_submissions USING gin (LOWER(email_address) gin_trgm_ops, LOWER(discord_username) gin_trgm_ops);
+            END IF;
+        END
+        $$
+        ''',
+    ]),
+    (10, "one achievement of each type per user", [
+        # Manual dashboard awards reuse a few generic types; fold the name in so they stay distinct
+        '''
+        UPDATE achievements SET achievement_type = achievement_type || ':' || achievement_name
+        WHERE achievement_type IN ('milestone', 'special', 'participation', 'achievement')
+        ''',
+        # Keep the first of any double award (bonus points already paid are left as they are)
+        '''
+        DELETE FROM achievements a USING achievements b
+        WHERE a.user_id = b.user_id AND a.achievement_type = b.achievement_type AND a.id > b.id
+        ''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_achievements_user_type ON achievements(user_id, achievement_type)',
+        'DROP INDEX IF EXISTS idx_achievements_user',
+    ]),
+    (11, "point_requests", [
+        '''
+        CREATE TABLE IF NOT EXISTS point_requests (
+            id SERIAL PRIMARY KEY,
+            email TEXT NOT NULL,
+            order_id TEXT NOT NULL,
+            points_amount INTEGER NOT NULL,
+            discord_user_id TEXT,
+            status TEXT DEFAULT 'pending',
+            verification_code TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            processed_at TIMESTAMP,
+            notified_at TIMESTAMP,
+            UNIQUE(email, order_id)
+        )
+        ''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_point_requests_code ON point_requests(verification_code)',
+        'CREATE INDEX IF NOT EXISTS idx_point_requests_unnotified ON point_requests(id) WHERE status = \'pending\' AND notified_at IS NULL',
+    ]),
+    (12, "idempotency_keys", [
+        '''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            request_hash TEXT NOT NULL,
+            response JSONB,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys(expires_at)',
+    ]),
+    (13, "admin_messages claim lease", [
+        'ALTER TABLE admin_messages ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_admin_messages_claimed ON admin_messages(claimed_at)
+        WHERE delivery_status = 'sending'
+        ''',
+    ]),
+    (14, "distinct email user counters", [
+        *counter_trigger_statements('points'),
+        *counter_trigger_statements('email_submissions'),
+        *recount_counters_statements(),
+    ]),
+    (15, "jobs claim lease", [
+        'ALTER TABLE jobs ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP',
+        'ALTER TABLE jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP',
+    ]),
+    (16, "user list sort by fallback name", [
+        f"CREATE INDEX IF NOT EXISTS idx_points_fallback_name ON points(({fallback_name('user_id')}), user_id)",
+        f'''
+        CREATE INDEX IF NOT EXISTS idx_email_fallback_name
+        ON email_submissions(({fallback_name('discord_user_id')}), discord_user_id)
+        ''',
+    ]),
+    (17, "serialize email user counters per user", [
+        *counter_trigger_statements('points'),
+        *counter_trigger_statements('email_submissions'),
+        *recount_counters_statements(),
+    ]),
+]
+
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Arbitrary key for pg_advisory_xact_lock while migrating
+MIGRATION_LOCK_ID = 724310
+
+# Balance change, user_stats upsert and ledger row as a single statement.
+# upd writes the balance and returns (old_balance, new_balance); when it writes
+# nothing (a refused debit) the statement returns the unchanged balance twice.
+# Parameters: $1 user_id, $2 amount, $3 transaction_type, $4 admin_id, $5 reason.
+POINTS_WRITE_SQL = '''
+    WITH upd AS (
+        {balance_write}
+    ),
+    stats AS (
+        INSERT INTO user_stats (user_id, total_points_earned, total_points_spent, highest_balance,
+                                transactions_count, first_activity, last_activity)
+        SELECT $1, GREATEST(new_balance - old_balance, 0), GREATEST(old_balance - new_balance, 0),
+               GREATEST(new_balance, 0), 1, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+        FROM upd
+        ON CONFLICT (user_id) DO UPDATE
+        SET total_points_earned = user_stats.total_points_earned + EXCLUDED.total_points_earned,
+            total_points_spent = user_stats.total_points_spent + EXCLUDED.total_points_spent,
+            highest_balance = GREATEST(user_stats.highest_balance, EXCLUDED.highest_balance),
+            transactions_count = user_stats.transactions_count + 1,
+            last_activity = CURRENT_TIMESTAMP
+    ),
+    ledger AS (
+        INSERT INTO transactions (user_id, amount, transaction_type, admin_id, reason, old_balance, new_balance)
+        SELECT $1, new_balance - old_balance, $3::text, $4::integer, $5::text, old_balance, new_balance
+        FROM upd
+    )
+    SELECT old_balance, new_balance FROM upd
+    UNION ALL
+    SELECT balance, balance FROM (
+        SELECT COALESCE((SELECT balance FROM points WHERE user_id = $1), 0) AS balance
+    ) unchanged
+    WHERE NOT EXISTS (SELECT 1 FROM upd)
+'''
+
+POINTS_UPSERT = '''
+        INSERT INTO points (user_id, balance, created_at, updated_at)
+        VALUES ($1, {insert_balance}, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+        ON CONFLICT (user_id) DO UPDATE
+        SET balance = {update_balance}, updated_at = CURRENT_TIMESTAMP
+        RETURNING {old_balance} AS old_balance, balance AS new_balance
+'''
+
+# Plain deltas derive the old balance from the new one
+POINTS_ADD_SQL = POINTS_WRITE_SQL.format(balance_write=POINTS_UPSERT.format(
+    insert_balance='$2::integer',
+    update_balance='points.balance + $2',
+    old_balance='balance - $2'
+))
+
+# Set and clamped writes can't, so the caller locks the row first (_lock_balance) and
+# passes the balance it read as $6. RETURNING can't read it back from the row: by then
+# this statement's own update has replaced it.
+POINTS_CLAMPED_ADD_SQL = POINTS_WRITE_SQL.format(balance_write=POINTS_UPSERT.format(
+    insert_balance='GREATEST($2::integer, 0)',
+    update_balance='GREATEST(points.balance + $2, 0)',
+    old_balance='$6::integer'
+))
+POINTS_SET_SQL = POINTS_WRITE_SQL.format(balance_write=POINTS_UPSERT.format(
+    insert_balance='$2::integer',
+    update_balance='EXCLUDED.balance',
+    old_balance='$6::integer'
+))
+
+# A debit ($2 < 0) that only applies if the balance covers it; otherwise nothing is written
+POINTS_DEDUCT_SQL = POINTS_WRITE_SQL.format(balance_write='''
+        UPDATE points SET balance = balance + $2, updated_at = CURRENT_TIMESTAMP
+        WHERE user_id = $1 AND balance + $2 >= 0
+        RETURNING balance - $2 AS old_balance, balance AS new_balance
+''')
+
+# Everything the achievement rules look at, read in one statement without taking locks.
+# Parameters: $1 user_id, $2 highest join position any rule checks.
+# Shared by the lenient list methods and get_dashboard_snapshot, which lets errors raise
+RECENT_TRANSACTIONS_SQL = '''
+    SELECT id, user_id, amount, transaction_type, admin_id, reason, old_balance, new_balance, created_at
+    FROM transactions ORDER BY created_at DESC LIMIT $1
+'''
+
+RECENT_ACHIEVEMENTS_SQL = '''
+    SELECT id, user_id, achievement_type, achievement_name, points_earned, earned_at
+    FROM achievements
+    ORDER BY earned_at DESC
+    LIMIT $1
+'''
+
+# LIMIT NULL returns every submission
+EMAIL_SUBMISSIONS_SQL = '''
+    SELECT es.id, es.discord_user_id, COALESCE(du.display_name, es.discord_username),
+           es.email_address, es.submitted_at, es.status, es.processed_at,
+           es.admin_notes, es.server_roles
+    FROM email_submissions es
+    LEFT JOIN discord_users du ON du.user_id = es.discord_user_id
+    ORDER BY es.submitted_at DESC
+    LIMIT $1
+'''
+
+ACHIEVEMENT_STATE_SQL = '''
+    WITH p AS (
+        SELECT balance, created_at FROM points WHERE user_id = $1
+    )
+    SELECT COALESCE((SELECT balance FROM p), 0) AS balance,
+           ARRAY(SELECT achievement_type FROM achievements WHERE user_id = $1) AS earned,
+           ARRAY(SELECT DISTINCT status FROM email_submissions WHERE discord_user_id = $1) AS email_statuses,
+           COALESCE((SELECT string_agg(server_roles, ',') FROM email_submissions WHERE discord_user_id = $1), '') AS roles,
+           (SELECT (SELECT COUNT(*) + 1 FROM (
+                        SELECT 1 FROM points o WHERE o.created_at < p.created_at LIMIT $2
+                    ) earlier)
+            FROM p) AS join_position
+'''
+
+# Insert the achievements and credit bonuses only for rows that were actually inserted.
+# A concurrent caller that already awarded a type makes that row a no-op, so the
+# check needs no lock; ledger balances come from the credited row, not the earlier read.
+AWARD_ACHIEVEMENTS_SQL = '''
+    WITH awards AS (
+        SELECT * FROM unnest($2::text[], $3::text[], $4::integer[]) WITH ORDINALITY
+            AS a(achievement_type, achievement_name, points_earned, position)
+    ),
+    earned AS (
+        INSERT INTO achievements (user_id, achievement_type, achievement_name, points_earned)
+        SELECT $1, achievement_type, achievement_name, points_earned FROM awards ORDER BY position
+        ON CONFLICT (user_id, achievement_type) DO NOTHING
+        RETURNING achievement_type
+    ),
+    credited AS (
+        SELECT a.achievement_type, a.achievement_name, a.points_earned, a.position,
+               SUM(a.points_earned) OVER () AS bonus,
+               COALESCE(SUM(a.points_earned) OVER (
+                   ORDER BY a.position ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0) AS earlier
+        FROM awards a JOIN earned e ON e.achievement_type = a.achievement_type
+    ),
+    upd AS (
+        INSERT INTO points (user_id, balance, created_at, updated_at)
+        SELECT $1, SUM(points_earned), CURRENT_TIMESTAMP, CURRENT_TIMESTAMP FROM credited
+        HAVING SUM(points_earned) > 0
+        ON CONFLICT (user_id) DO UPDATE
+        SET balance = points.balance + EXCLUDED.balance, updated_at = CURRENT_TIMESTAMP
+        RETURNING balance AS new_balance
+    ),
+    ledger AS (
+        INSERT INTO transactions (user_id, amount, transaction_type, reason, old_balance, new_balance)
+        SELECT $1, c.points_earned, 'achievement', 'Achievement: ' || c.achievement_name,
+               u.new_balance - c.bonus + c.earlier, u.new_balance - c.bonus + c.earlier + c.points_earned
+        FROM credited c, upd u
+        WHERE c.points_earned > 0
+    ),
+    stats AS (
+        INSERT INTO user_stats (user_id, total_points_earned, total_points_spent, highest_balance,
+                                transactions_count, first_activity, last_activity)
+        SELECT $1, c.bonus, 0, u.new_balance, c.rewarded, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+        FROM upd u, (
+            SELECT SUM(points_earned) AS bonus, COUNT(*) FILTER (WHERE points_earned > 0) AS rewarded FROM credited
+        ) c
+        ON CONFLICT (user_id) DO UPDATE
+        SET total_points_earned = user_stats.total_points_earned + EXCLUDED.total_points_earned,
+            highest_balance = GREATEST(user_stats.highest_balance, EXCLUDED.highest_balance),
+            transactions_count = user_stats.transactions_count + EXCLUDED.transactions_count,
+            last_activity = CURRENT_TIMESTAMP
+    )
+    SELECT (SELECT new_balance FROM upd) AS new_balance,
+           ARRAY(SELECT achievement_type FROM credited ORDER BY position) AS awarded
+'''
+
+# New balance per bulk action, computed from bulk_points_input i joined to points p
+BULK_NEW_BALANCE = {
+    'set': 'i.points',
+    'add': 'COALESCE(p.balance, 0) + i.points',
+    'remove': 'GREATEST(COALESCE(p.balance, 0) - i.points, 0)',
+}
+
+class JobLeaseLost(Exception):
+    """A job's claim was requeued and taken over (or its progress moved on) - the caller must stop"""
+
+class PostgreSQLPointsDatabase(PointsStore):
+    def __init__(self, coalesce_writes: bool = None):
         self.database_url = os.getenv('DATABASE_URL')
         self.pool = None
+        self._init_lock = asyncio.Lock()
+        if coalesce_writes is None:
+            coalesce_writes = Config.POINTS_WRITE_COALESCING
+        self._coalescer = WriteCoalescer(self._apply_points_batch, self._apply_points_write) if coalesce_writes else None
         
     async def initialize(self):
-        """Initialize the PostgreSQL database connection pool and create tables"""
+        """Initialize the PostgreSQL connection pool and apply pending schema migrations"""
+        async with self._init_lock:
+            if self.pool is not None:
+                return
+            await self._create_pool()
+
+    async def _create_pool(self):
+        """Create the connection pool and bring the schema up to date (called once per instance)"""
         try:
-            self.pool = await asyncpg.create_pool(self.database_url, min_size=1, max_size=20)
+            self.pool = await asyncpg.create_pool(self.database_url, **Config.db_pool_settings())
             
             async with self.pool.acquire() as conn:
-                # Create points table
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS points (
-                        user_id TEXT PRIMARY KEY,
-                        balance INTEGER DEFAULT 0,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                
-                # Create transactions table for audit trail
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS transactions (
-                        id SERIAL PRIMARY KEY,
-                        user_id TEXT NOT NULL,
-                        amount INTEGER NOT NULL,
-                        transaction_type TEXT NOT NULL,
-                        admin_id INTEGER,
-                        reason TEXT,
-                        old_balance INTEGER NOT NULL,
-                        new_balance INTEGER NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                
-                # Create achievements table
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS achievements (
-                        id SERIAL PRIMARY KEY,
-                        user_id TEXT NOT NULL,
-                        achievement_type TEXT NOT NULL,
-                        achievement_name TEXT NOT NULL,
-                        points_earned INTEGER DEFAULT 0,
-                        earned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                
-                # Create user_stats table
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS user_stats (
-                        user_id TEXT PRIMARY KEY,
-                        total_points_earned INTEGER DEFAULT 0,
-                        total_points_spent INTEGER DEFAULT 0,
-                        highest_balance INTEGER DEFAULT 0,
-                        transactions_count INTEGER DEFAULT 0,
-                        achievements_count INTEGER DEFAULT 0,
-                        first_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                
-                # Create email_submissions table
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS email_submissions (
-                        id SERIAL PRIMARY KEY,
-                        discord_user_id TEXT NOT NULL,
-                        discord_username TEXT NOT NULL,
-                        email_address TEXT NOT NULL,
-                        submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        status TEXT DEFAULT 'pending',
-                        processed_at TIMESTAMP,
-                        admin_notes TEXT
-                    )
-                ''')
-                
-                # Create indexes for better performance
-                await conn.execute('CREATE INDEX IF NOT EXISTS idx_points_balance ON points(balance DESC)')
-                await conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions(user_id)')
-                await conn.execute('CREATE INDEX IF NOT EXISTS idx_achievements_user ON achievements(user_id)')
-                await conn.execute('CREATE INDEX IF NOT EXISTS idx_email_user ON email_submissions(discord_user_id)')
+                await self._run_migrations(conn)
+            
+            if not leaderboard.loaded:
+                await self.load_leaderboard_index()
                 
             logger.info("PostgreSQL database initialized successfully")
             
         except Exception as e:
             logger.error(f"Error initializing PostgreSQL database: {e}")
+            if self.pool is not None:
+                await self.pool.close()
+                self.pool = None
             raise
     
-    async def close(self):
-        """Close the database connection pool"""
-        if self.pool:
-            await self.pool.close()
+    async def _run_migrations(self, conn):
+        """Apply pending schema migrations - a single version check when the schema is current"""
+        try:
+            current_version = await conn.fetchval('SELECT MAX(version) FROM schema_version') or 0
+        except asyncpg.UndefinedTableError:
+            current_version = 0
+        
+        if current_version >= LATEST_SCHEMA_VERSION:
+            return
+        
+        async with conn.transaction():
+            # Serialize migrations across processes starting at the same time
+            await conn.execute('SELECT pg_advisory_xact_lock($1)', MIGRATION_LOCK_ID)
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+        
+        for version, description, statements in MIGRATIONS:
+            if version <= current_version:
+                continue
+            async with conn.transaction():
+                await conn.execute('SELECT pg_advisory_xact_lock($1)', MIGRATION_LOCK_ID)
+                applied = await conn.fetchval('SELECT 1 FROM schema_version WHERE version = $1', version)
+                if applied:
+                    continue
+                for statement in statements:
+                    await conn.execute(statement)
+                await conn.execute(
+                    'INSERT INTO schema_version (version, description) VALUES ($1, $2)',
+                    version, description
+                )
+            logger.info(f"Applied schema migration {version}: {description}")
+        # Migrations may rewrite achievements (10 drops duplicates), so cached earned sets can't be trusted
+        self._forget_earned()
+    
+    async def load_leaderboard_index(self):
+        """(Re)load the in-process leaderboard index from the points table"""
+        if not leaderboard.begin_reload():
+            return
+        try:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch('SELECT user_id, balance FROM points')
+        except Exception:
+            leaderboard.cancel_reload()
+            raise
+        # Building the index is CPU-bound, keep it off the event loop
+        await asyncio.to_thread(leaderboard.finish_reload, [(row['user_id'], row['balance']) for row in rows])
+    
+    def get_pool_stats(self) -> dict:
+        """Get connection pool size and usage"""
+        if self.pool is None:
+            return {"initialized": False, "min_size": Config.DB_POOL_MIN_SIZE, "max_size": Config.DB_POOL_MAX_SIZE}
+        size = self.pool.get_size()
+        idle = self.pool.get_idle_size()
+        return {
+            "initialized": True,
+            "min_size": self.pool.get_min_size(),
+            "max_size": self.pool.get_max_size(),
+            "size": size,
+            "idle": idle,
+            "in_use": size - idle
+        }
     
     async def get_points(self, user_id) -> int:
         """Get points for a user"""
@@ -110,113 +844,604 @@ class PostgreSQLPointsDatabase:
             logger.error(f"Error getting points for user {user_id}: {e}")
             return 0
     
-    async def update_points(self, user_id, amount: int, admin_id: int = None, reason: str = None) -> bool:
-        """Update points for a user with transaction logging"""
+    def get_write_stats(self) -> dict:
+        """Write coalescer counters, or just enabled=False when writes aren't coalesced"""
+        if self._coalescer is None:
+            return {"enabled": False}
+        return self._coalescer.get_stats()
+
+    async def change_points(self, user_id, amount: int, admin_id: int = None, reason: str = None,
+                            clamp_at_zero: bool = False, transaction_type: str = None,
+                            require_balance: bool = False) -> Optional[Tuple[int, int]]:
+        """Add (or subtract) points in one statement and return (old_balance, new_balance)
+
+        With require_balance, a debit larger than the balance writes nothing and returns
+        (balance, balance).
+        """
         try:
-            user_id_str = str(user_id)
-            async with self.pool.acquire() as conn:
-                async with conn.transaction():
-                    # Get current balance
-                    current_balance = await conn.fetchval('SELECT balance FROM points WHERE user_id = $1', user_id_str)
-                    if current_balance is None:
-                        current_balance = 0
-                        # Insert new user
-                        await conn.execute('''
-                            INSERT INTO points (user_id, balance, created_at, updated_at) 
-                            VALUES ($1, $2, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                        ''', user_id, amount)
-                        
-                        # Insert user stats
-                        await conn.execute('''
-                            INSERT INTO user_stats (user_id, total_points_earned, transactions_count, first_activity, last_activity)
-                            VALUES ($1, $2, 1, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                        ''', user_id, max(0, amount))
-                    else:
-                        new_balance = current_balance + amount
-                        # Update existing user
-                        await conn.execute('''
-                            UPDATE points 
-                            SET balance = $1, updated_at = CURRENT_TIMESTAMP 
-                            WHERE user_id = $2
-                        ''', new_balance, user_id)
-                        
-                        # Update user stats
-                        points_earned = max(0, amount) if amount > 0 else 0
-                        await conn.execute('''
-                            UPDATE user_stats 
-                            SET total_points_earned = total_points_earned + $1,
-                                transactions_count = transactions_count + 1,
-                                last_activity = CURRENT_TIMESTAMP,
-                                highest_balance = GREATEST(highest_balance, $2)
-                            WHERE user_id = $3
-                        ''', points_earned, current_balance + amount, user_id)
-                    
-                    # Log transaction
-                    transaction_type = "add" if amount > 0 else "remove"
-                    await conn.execute('''
-                        INSERT INTO transactions (user_id, amount, transaction_type, admin_id, reason, old_balance, new_balance)
-                        VALUES ($1, $2, $3, $4, $5, $6, $7)
-                    ''', user_id, amount, transaction_type, admin_id, reason, current_balance, current_balance + amount)
-                    
-            return True
+            return await self._write_points(PointsWrite('change', user_id, amount, admin_id, reason,
+                                                        clamp_at_zero, transaction_type, require_balance))
         except Exception as e:
             logger.error(f"Error updating points for user {user_id}: {e}")
-            return False
+            return None
 
-    async def set_points(self, user_id, amount: int, admin_id: int = None, reason: str = None) -> bool:
-        """Set points for a user to a specific amount"""
+    async def assign_points(self, user_id, amount: int, admin_id: int = None,
+                            reason: str = None) -> Optional[Tuple[int, int]]:
+        """Set points in one statement and return (old_balance, new_balance)"""
         try:
-            user_id_str = str(user_id)
-            async with self.pool.acquire() as conn:
-                async with conn.transaction():
-                    # Get current balance
-                    current_balance = await conn.fetchval('SELECT balance FROM points WHERE user_id = $1', user_id_str)
-                    if current_balance is None:
-                        current_balance = 0
-                        # Insert new user with specified points
-                        await conn.execute('''
-                            INSERT INTO points (user_id, balance, created_at, updated_at) 
-                            VALUES ($1, $2, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                        ''', user_id_str, amount)
-                        
-                        # Insert user stats
-                        await conn.execute('''
-                            INSERT INTO user_stats (user_id, total_points_earned, transactions_count, first_activity, last_activity)
-                            VALUES ($1, $2, 1, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                        ''', user_id_str, max(0, amount))
-                        transaction_amount = amount
-                    else:
-                        # Update existing user to specific amount
-                        await conn.execute('''
-                            UPDATE points 
-                            SET balance = $1, updated_at = CURRENT_TIMESTAMP 
-                            WHERE user_id = $2
-                        ''', amount, user_id_str)
-                        
-                        # Update user stats
-                        transaction_amount = amount - current_balance
-                        points_earned = max(0, transaction_amount) if transaction_amount > 0 else 0
-                        await conn.execute('''
-                            UPDATE user_stats 
-                            SET total_points_earned = total_points_earned + $1,
-                                transactions_count = transactions_count + 1,
-                                last_activity = CURRENT_TIMESTAMP,
-                                highest_balance = GREATEST(highest_balance, $2)
-                            WHERE user_id = $3
-                        ''', points_earned, amount, user_id_str)
-                    
-                    # Log transaction  
-                    transaction_type = "set"
-                    await conn.execute('''
-                        INSERT INTO transactions (user_id, amount, transaction_type, admin_id, reason, old_balance, new_balance)
-                        VALUES ($1, $2, $3, $4, $5, $6, $7)
-                    ''', user_id_str, transaction_amount, transaction_type, admin_id, reason or "Points set", current_balance, amount)
-                    
-            return True
+            return await self._write_points(PointsWrite('set', user_id, amount, admin_id, reason))
         except Exception as e:
             logger.error(f"Error setting points for user {user_id}: {e}")
+            return None
+
+    async def _write_points(self, write: PointsWrite) -> Tuple[int, int]:
+        """Apply one balance write, through the coalescer when it is enabled"""
+        if self._coalescer is not None:
+            return await self._coalescer.submit(write)
+        return await self._apply_points_write(write)
+
+    @staticmethod
+    async def _lock_balance(conn, user_id: str) -> int:
+        """Lock a user's points row until the transaction ends (creating it at 0 if missing) and return the balance"""
+        balance = await conn.fetchval('SELECT balance FROM points WHERE user_id = $1 FOR UPDATE', user_id)
+        if balance is None:
+            # Creating the row means a concurrent first write for this user waits on our lock
+            await conn.execute('''
+                INSERT INTO points (user_id, balance, created_at, updated_at)
+                VALUES ($1, 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                ON CONFLICT (user_id) DO NOTHING
+            ''', user_id)
+            balance = await conn.fetchval('SELECT balance FROM points WHERE user_id = $1 FOR UPDATE', user_id)
+        return balance
+
+    @staticmethod
+    def _needs_lock(write: PointsWrite) -> bool:
+        return write.kind == 'set' or (write.clamp_at_zero and not write.deducts)
+
+    async def _run_points_write(self, conn, write: PointsWrite):
+        """The statement for one write; set/clamped writes must run inside a transaction"""
+        args = (write.user_id, write.amount, write.transaction_type, write.admin_id, write.reason)
+        if write.deducts:
+            return await conn.fetchrow(POINTS_DEDUCT_SQL, *args)
+        if self._needs_lock(write):
+            old_balance = await self._lock_balance(conn, write.user_id)
+            sql = POINTS_SET_SQL if write.kind == 'set' else POINTS_CLAMPED_ADD_SQL
+            return await conn.fetchrow(sql, *args, old_balance)
+        return await conn.fetchrow(POINTS_ADD_SQL, *args)
+
+    async def _apply_points_write(self, write: PointsWrite) -> Tuple[int, int]:
+        """One write in its own transaction"""
+        async with self.pool.acquire() as conn:
+            if self._needs_lock(write):
+                async with conn.transaction():
+                    row = await self._run_points_write(conn, write)
+            else:
+                row = await self._run_points_write(conn, write)
+        leaderboard.update(write.user_id, row['new_balance'])
+        return (row['old_balance'], row['new_balance'])
+
+    async def _apply_points_batch(self, writes: List[PointsWrite]) -> List[Tuple[int, int]]:
+        """A coalesced batch of writes in one transaction, in the order given"""
+        results = []
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                for write in writes:
+                    row = await self._run_points_write(conn, write)
+                    results.append((row['old_balance'], row['new_balance']))
+        leaderboard.apply((write.user_id, new_balance) for write, (_, new_balance) in zip(writes, results))
+        return results
+    
+    async def bulk_apply_points(self, action: str, rows, reason: str = None, admin_id: int = None,
+                                conn=None) -> Optional[List[Tuple[str, int, int]]]:
+        """Apply add/remove/set to many users in one transaction, returning (user_id, old, new) per user
+
+        Pass conn to run inside the caller's transaction (as a savepoint); the caller
+        then records the new balances in the leaderboard index once it commits.
+        """
+        if action not in BULK_NEW_BALANCE:
+            raise ValueError(f"Unknown bulk action: {action}")
+        
+        # Collapse duplicate users: deltas add up, the last 'set' wins. 'remove' takes the
+        # magnitude of its points; 'add' keeps the sign, so a negative add subtracts
+        amounts = {}
+        for user_id, points in rows:
+            user_id = str(user_id)
+            if action == 'set':
+                amounts[user_id] = int(points)
+            elif action == 'remove':
+                amounts[user_id] = amounts.get(user_id, 0) + abs(int(points))
+            else:
+                amounts[user_id] = amounts.get(user_id, 0) + int(points)
+        if not amounts:
+            return []
+        
+        try:
+            if conn is not None:
+                result = await self._bulk_apply(conn, action, amounts, reason, admin_id)
+            else:
+                async with self.pool.acquire() as conn:
+                    result = await self._bulk_apply(conn, action, amounts, reason, admin_id)
+                leaderboard.apply((row['user_id'], row['new_balance']) for row in result)
+            
+            logger.info(f"Bulk {action} applied to {len(result)} users")
+            return [(row['user_id'], row['old_balance'], row['new_balance']) for row in result]
+        except Exception as e:
+            logger.error(f"Error applying bulk {action} for {len(amounts)} users: {e}")
+            return None
+    
+    async def _bulk_apply(self, conn, action: str, amounts: dict, reason: str, admin_id: int):
+        """Set-based statements behind bulk_apply_points"""
+        async with conn.transaction():
+            await conn.execute('''
+                CREATE TEMP TABLE bulk_points_input (
+                    user_id TEXT PRIMARY KEY,
+                    points INTEGER NOT NULL
+                ) ON COMMIT DROP
+            ''')
+            await conn.copy_records_to_table(
+                'bulk_points_input', records=list(amounts.items()), columns=['user_id', 'points']
+            )
+            
+            # Lock existing rows in a fixed order so overlapping batches can't deadlock
+            await conn.execute('''
+                SELECT 1 FROM points
+                WHERE user_id IN (SELECT user_id FROM bulk_points_input)
+                ORDER BY user_id
+                FOR UPDATE
+            ''')
+            await conn.execute(f'''
+                CREATE TEMP TABLE bulk_points_result ON COMMIT DROP AS
+                SELECT i.user_id,
+                       COALESCE(p.balance, 0) AS old_balance,
+                       {BULK_NEW_BALANCE[action]} AS new_balance
+                FROM bulk_points_input i
+                LEFT JOIN points p ON p.user_id = i.user_id
+            ''')
+            
+            await conn.execute('''
+                INSERT INTO points (user_id, balance, created_at, updated_at)
+                SELECT user_id, new_balance, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+                FROM bulk_points_result
+                ON CONFLICT (user_id) DO UPDATE
+                SET balance = EXCLUDED.balance, updated_at = CURRENT_TIMESTAMP
+            ''')
+            await conn.execute('''
+                INSERT INTO user_stats (user_id, total_points_earned, total_points_spent, highest_balance,
+                                        transactions_count, first_activity, last_activity)
+                SELECT user_id, GREATEST(new_balance - old_balance, 0), GREATEST(old_balance - new_balance, 0),
+                       GREATEST(new_balance, 0), 1, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+                FROM bulk_points_result
+                ON CONFLICT (user_id) DO UPDATE
+                SET total_points_earned = user_stats.total_points_earned + EXCLUDED.total_points_earned,
+                    total_points_spent = user_stats.total_points_spent + EXCLUDED.total_points_spent,
+                    highest_balance = GREATEST(user_stats.highest_balance, EXCLUDED.highest_balance),
+                    transactions_count = user_stats.transactions_count + 1,
+                    last_activity = CURRENT_TIMESTAMP
+            ''')
+            await conn.execute('''
+                INSERT INTO transactions (user_id, amount, transaction_type, admin_id, reason, old_balance, new_balance)
+                SELECT user_id, new_balance - old_balance, $1::text, $2::integer, $3::text, old_balance, new_balance
+                FROM bulk_points_result
+            ''', action, admin_id, reason)
+            
+            result = await conn.fetch('SELECT user_id, old_balance, new_balance FROM bulk_points_result')
+            # Drop now rather than at commit so a caller's transaction can apply several batches
+            await conn.execute('DROP TABLE bulk_points_input, bulk_points_result')
+            return result
+    
+    async def create_job(self, job_type: str, payload: dict, total: int = 0) -> Optional[int]:
+        """Queue a background job and return its id"""
+        try:
+            async with self.pool.acquire() as conn:
+                return await conn.fetchval('''
+                    INSERT INTO jobs (job_type, payload, total)
+                    VALUES ($1, $2::jsonb, $3)
+                    RETURNING id
+                ''', job_type, json.dumps(payload), total)
+        except Exception as e:
+            logger.error(f"Error creating {job_type} job: {e}")
+            return None
+    
+    async def claim_next_job(self) -> Optional[dict]:
+        """Mark the oldest queued job as running and return it
+
+        The returned claimed_at identifies this claim; progress and the outcome are only
+        recorded while it is still the job's claim.
+        """
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow('''
+                UPDATE jobs
+                SET status = 'running',
+                    started_at = COALESCE(started_at, CURRENT_TIMESTAMP),
+                    claimed_at = CURRENT_TIMESTAMP,
+                    heartbeat_at = CURRENT_TIMESTAMP,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = (
+                    SELECT id FROM jobs WHERE status = 'queued'
+                    ORDER BY id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING *
+            ''')
+            return self._job_from_row(row) if row else None
+    
+    async def requeue_running_jobs(self, lease_seconds: float) -> int:
+        """Put jobs whose worker stopped heartbeating more than lease_seconds ago back in the queue
+
+        They resume from their processed count. Jobs with a live heartbeat may still be
+        running in another process, so they are left alone.
+        """
+        async with self.pool.acquire() as conn:
+            result = await conn.execute('''
+                UPDATE jobs SET status = 'queued', updated_at = CURRENT_TIMESTAMP
+                WHERE status = 'running'
+                  AND (heartbeat_at IS NULL OR heartbeat_at < CURRENT_TIMESTAMP - make_interval(secs => $1))
+            ''', float(lease_seconds))
+            return int(result.split()[-1])
+    
+    async def heartbeat_job(self, job: dict) -> bool:
+        """Extend a running job's lease; False if the claim has been lost"""
+        async with self.pool.acquire() as conn:
+            result = await conn.execute('''
+                UPDATE jobs SET heartbeat_at = CURRENT_TIMESTAMP
+                WHERE id = $1 AND status = 'running' AND claimed_at = $2
+            ''', job['id'], job['claimed_at'])
+            return result != 'UPDATE 0'
+    
+    async def record_job_progress(self, conn, job: dict, offset: int, processed: int, results: list):
+        """Store per-row results and advance the job from offset to processed - call inside the
+        transaction that did the work
+
+        results is a list of (row_index, item, success, detail) tuples. Raises JobLeaseLost,
+        rolling back the caller's transaction, unless the job is still on this claim at offset,
+        so a chunk is never applied twice.
+        """
+        advanced = await conn.execute('''
+            UPDATE jobs
+            SET processed = $2,
+                heartbeat_at = CURRENT_TIMESTAMP,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = $1 AND processed = $3 AND status = 'running' AND claimed_at = $4
+        ''', job['id'], processed, offset, job['claimed_at'])
+        if advanced == 'UPDATE 0':
+            raise JobLeaseLost(f"Job {job['id']} is no longer claimed at row {offset}")
+        if results:
+            await conn.executemany('''
+                INSERT INTO job_results (job_id, row_index, item, success, detail)
+                VALUES ($1, $2, $3, $4, $5::jsonb)
+                ON CONFLICT (job_id, row_index) DO NOTHING
+            ''', [(job['id'], index, item, success, json.dumps(detail) if detail is not None else None)
+                  for index, item, success, detail in results])
+        succeeded = sum(1 for result in results if result[2])
+        await conn.execute('''
+            UPDATE jobs SET succeeded = succeeded + $2, failed = failed + $3 WHERE id = $1
+        ''', job['id'], succeeded, len(results) - succeeded)
+    
+    async def set_job_total(self, job_id: int, total: int):
+        """Update the number of rows a job will process"""
+        async with self.pool.acquire() as conn:
+            await conn.execute('UPDATE jobs SET total = $2 WHERE id = $1', job_id, total)
+    
+    async def finish_job(self, job: dict, status: str, error: str = None):
+        """Mark a job completed or failed, unless its claim has been taken over"""
+        job_id = job['id']
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute('''
+                    UPDATE jobs
+                    SET status = $2, error = $3, updated_at = CURRENT_TIMESTAMP, finished_at = CURRENT_TIMESTAMP
+                    WHERE id = $1 AND claimed_at IS NOT DISTINCT FROM $4
+                ''', job_id, status, error, job.get('claimed_at'))
+        except Exception as e:
+            logger.error(f"Error finishing job {job_id}: {e}")
+    
+    async def get_job(self, job_id: int) -> Optional[dict]:
+        """Get a job's status and counters"""
+        try:
+            async with self.pool.acquire() as conn:
+                row = await conn.fetchrow('SELECT * FROM jobs WHERE id = $1', job_id)
+                return self._job_from_row(row) if row else None
+        except Exception as e:
+            logger.error(f"Error getting job {job_id}: {e}")
+            return None
+    
+    async def get_job_results(self, job_id: int, after: int = -1, limit: int = 500) -> List[dict]:
+        """Get per-row results of a job after the given row index"""
+        try:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch('''
+                    SELECT row_index, item, success, detail FROM job_results
+                    WHERE job_id = $1 AND row_index > $2
+                    ORDER BY row_index
+                    LIMIT $3
+                ''', job_id, after, limit)
+                return [{
+                    "row": row['row_index'],
+                    "item": row['item'],
+                    "success": row['success'],
+                    **(json.loads(row['detail']) if row['detail'] else {})
+                } for row in rows]
+        except Exception as e:
+            logger.error(f"Error getting results for job {job_id}: {e}")
+            return []
+    
+    @staticmethod
+    def _job_from_row(row) -> dict:
+        job = dict(row)
+        job['payload'] = json.loads(job['payload']) if job['payload'] else {}
+        return job
+    
+    async def enqueue_admin_message(self, recipient_user_id, message_content: str, message_type: str = "general",
+                                    sender_admin_id: str = "0", sender_admin_name: str = "Dashboard Admin",
+                                    use_embed: bool = False) -> Optional[int]:
+        """Add a DM to the admin_messages outbox and return its id"""
+        try:
+            async with self.pool.acquire() as conn:
+                return await conn.fetchval('''
+                    INSERT INTO admin_messages (
+                        sender_admin_id, sender_admin_name, recipient_user_id,
+                        message_content, message_type, use_embed
+                    ) VALUES ($1, $2, $3, $4, $5, $6)
+                    RETURNING id
+                ''', str(sender_admin_id), sender_admin_name, str(recipient_user_id),
+                    message_content, message_type, use_embed)
+        except Exception as e:
+            logger.error(f"Error queueing DM for user {recipient_user_id}: {e}")
+            return None
+    
+    async def enqueue_admin_messages(self, conn, messages: list, sender_admin_id: str = "0",
+                                     sender_admin_name: str = "Dashboard Admin", use_embed: bool = False):
+        """Add many DMs to the outbox inside the caller's transaction
+
+        messages is a list of (recipient_user_id, message_content, message_type) tuples.
+        """
+        await conn.executemany('''
+            INSERT INTO admin_messages (
+                sender_admin_id, sender_admin_name, recipient_user_id,
+                message_content, message_type, use_embed
+            ) VALUES ($1, $2, $3, $4, $5, $6)
+        ''', [(str(sender_admin_id), sender_admin_name, str(recipient_user_id), message_content, message_type, use_embed)
+              for recipient_user_id, message_content, message_type in messages])
+    
+    async def claim_admin_messages(self, limit: int) -> List[dict]:
+        """Claim due outbox rows for delivery; concurrent workers skip each other's rows"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                UPDATE admin_messages
+                SET delivery_status = 'sending', attempts = attempts + 1, claimed_at = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT id FROM admin_messages
+                    WHERE delivery_status IN ('pending', 'retrying')
+                      AND next_attempt_at <= CURRENT_TIMESTAMP
+                    ORDER BY next_attempt_at, id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT $1
+                )
+                RETURNING id, recipient_user_id, message_content, message_type, use_embed, attempts, claimed_at
+            ''', limit)
+            return [dict(row) for row in rows]
+    
+    async def release_stuck_admin_messages(self, lease_seconds: float) -> int:
+        """Return rows claimed more than lease_seconds ago (by a process that stopped) to the outbox
+
+        Younger 'sending' rows may still be in the hands of a live worker, so they are left alone.
+        """
+        async with self.pool.acquire() as conn:
+            result = await conn.execute('''
+                UPDATE admin_messages SET delivery_status = 'retrying'
+                WHERE delivery_status = 'sending'
+                  AND (claimed_at IS NULL OR claimed_at < CURRENT_TIMESTAMP - make_interval(secs => $1))
+            ''', float(lease_seconds))
+            return int(result.split()[-1])
+    
+    async def mark_admin_message(self, message: dict, delivery_status: str, delivery_error: str = None,
+                                 retry_in: float = None, recipient_username: str = None) -> bool:
+        """Record a delivery outcome for a claimed message: delivered, failed, or retrying after retry_in seconds
+
+        Only lands while the claim still holds, so a worker whose lease expired can't
+        overwrite the outcome of the attempt that took the message over. False if it didn't.
+        """
+        message_id = message['id']
+        try:
+            async with self.pool.acquire() as conn:
+                result = await conn.execute('''
+                    UPDATE admin_messages
+                    SET delivery_status = $2,
+                        delivery_error = $3,
+                        next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => $4),
+                        delivered_at = CASE WHEN $2 = 'delivered' THEN CURRENT_TIMESTAMP ELSE delivered_at END,
+                        recipient_username = COALESCE(recipient_username, $5)
+                    WHERE id = $1 AND delivery_status = 'sending' AND claimed_at = $6
+                ''', message_id, delivery_status, delivery_error, float(retry_in or 0), recipient_username,
+                    message['claimed_at'])
+                return result != 'UPDATE 0'
+        except Exception as e:
+            logger.error(f"Error updating delivery status of message {message_id}: {e}")
             return False
     
+    async def get_outbox_counts(self) -> dict:
+        """Count outbox rows by delivery status"""
+        try:
+            counters = await self.get_system_counters()
+            return {
+                status: counters[f"messages_{status}"]
+                for status in ('pending', 'retrying', 'sending') if counters.get(f"messages_{status}")
+            }
+        except Exception as e:
+            logger.error(f"Error counting outbox rows: {e}")
+            return {}
+    
+    async def upsert_discord_users(self, users: list):
+        """Record (user_id, username, display_name, avatar_hash) seen on the gateway or fetched"""
+        async with self.pool.acquire() as conn:
+            await conn.execute('''
+                INSERT INTO discord_users (user_id, username, display_name, avatar_hash, last_seen, refreshed_at)
+                SELECT u.user_id, u.username, u.display_name, u.avatar_hash, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+                FROM unnest($1::text[], $2::text[], $3::text[], $4::text[])
+                    AS u(user_id, username, display_name, avatar_hash)
+                ON CONFLICT (user_id) DO UPDATE
+                SET username = EXCLUDED.username,
+                    display_name = EXCLUDED.display_name,
+                    avatar_hash = EXCLUDED.avatar_hash,
+                    last_seen = EXCLUDED.last_seen,
+                    refreshed_at = EXCLUDED.refreshed_at
+            ''', *(list(column) for column in zip(*users)))
+    
+    async def get_discord_names(self, user_ids) -> dict:
+        """Map user ids to their stored display names (ids without a directory row are left out)"""
+        try:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch('''
+                    SELECT user_id, COALESCE(display_name, username) FROM discord_users
+                    WHERE user_id = ANY($1::text[]) AND COALESCE(display_name, username) IS NOT NULL
+                ''', [str(user_id) for user_id in user_ids])
+                return {row[0]: row[1] for row in rows}
+        except Exception as e:
+            logger.error(f"Error reading discord_users: {e}")
+            return {}
+    
+    async def get_stale_discord_user_ids(self, max_age_seconds: float, limit: int) -> List[str]:
+        """Users with points or an email submission whose directory row is missing or older than max_age"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT k.user_id
+                FROM (
+                    SELECT user_id FROM points
+                    UNION
+                    SELECT discord_user_id FROM email_submissions WHERE discord_user_id IS NOT NULL
+                ) k
+                LEFT JOIN discord_users du ON du.user_id = k.user_id
+                WHERE du.user_id IS NULL
+                   OR du.refreshed_at < CURRENT_TIMESTAMP - make_interval(secs => $1)
+                ORDER BY du.refreshed_at NULLS FIRST
+                LIMIT $2
+            ''', float(max_age_seconds), limit)
+            return [row[0] for row in rows]
+    
+    async def mark_discord_users_refreshed(self, user_ids: list):
+        """Push back the next refresh for users Discord couldn't return (deleted accounts etc.)"""
+        async with self.pool.acquire() as conn:
+            await conn.execute('''
+                INSERT INTO discord_users (user_id, refreshed_at)
+                SELECT unnest($1::text[]), CURRENT_TIMESTAMP
+                ON CONFLICT (user_id) DO UPDATE SET refreshed_at = CURRENT_TIMESTAMP
+            ''', [str(user_id) for user_id in user_ids])
+    
+    async def insert_point_requests(self, requests: list) -> int:
+        """Store (email, order_id, points_amount, verification_code) rows, skipping orders already stored"""
+        if not requests:
+            return 0
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval('''
+                WITH inserted AS (
+                    INSERT INTO point_requests (email, order_id, points_amount, verification_code)
+                    SELECT * FROM unnest($1::text[], $2::text[], $3::integer[], $4::text[])
+                    ON CONFLICT DO NOTHING
+                    RETURNING 1
+                )
+                SELECT COUNT(*) FROM inserted
+            ''', *(list(column) for column in zip(*requests)))
+    
+    async def get_unnotified_point_requests(self, after_id: int, limit: int) -> List[dict]:
+        """Pending requests whose email hasn't been sent, in id order after after_id"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT id, email, order_id, points_amount, verification_code
+                FROM point_requests
+                WHERE status = 'pending' AND notified_at IS NULL AND id > $1
+                ORDER BY id
+                LIMIT $2
+            ''', after_id, limit)
+            return [dict(row) for row in rows]
+    
+    async def mark_point_requests_notified(self, request_ids: list):
+        if not request_ids:
+            return
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                "UPDATE point_requests SET notified_at = CURRENT_TIMESTAMP WHERE id = ANY($1::integer[])",
+                list(request_ids)
+            )
+    
+    async def get_pending_point_requests(self, limit: int = 50) -> List[dict]:
+        try:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch('''
+                    SELECT email, order_id, points_amount, verification_code, created_at
+                    FROM point_requests
+                    WHERE status = 'pending'
+                    ORDER BY created_at DESC
+                    LIMIT $1
+                ''', limit)
+                return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Error getting pending point requests: {e}")
+            return []
+    
+    async def claim_point_request(self, verification_code: str, user_id) -> Optional[dict]:
+        """Mark a pending request claimed and credit its points in one transaction
+
+        Returns order_id, points_amount and new_balance, or None if the code is unknown or
+        already used. The conditional UPDATE means concurrent claims of one code credit it once.
+        """
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                claimed = await conn.fetchrow('''
+                    UPDATE point_requests
+                    SET status = 'completed', discord_user_id = $2, processed_at = CURRENT_TIMESTAMP
+                    WHERE verification_code = $1 AND status = 'pending'
+                    RETURNING order_id, points_amount
+                ''', verification_code, str(user_id))
+                if claimed is None:
+                    return None
+                row = await conn.fetchrow(POINTS_ADD_SQL, str(user_id), claimed['points_amount'], "add", 0,
+                                          f"Order reward: {claimed['order_id']}")
+        leaderboard.update(user_id, row['new_balance'])
+        return {**dict(claimed), "new_balance": row['new_balance']}
+    
+    async def claim_idempotency_key(self, key: str, request_hash: str, ttl_seconds: float) -> Optional[dict]:
+        """Claim an unexpired key for a new request (an expired row is taken over)
+
+        Returns None if this caller claimed it, otherwise the live row's request_hash and
+        response (None while the first request is still running).
+        """
+        async with self.pool.acquire() as conn:
+            claimed = await conn.fetchval('''
+                INSERT INTO idempotency_keys (key, request_hash, expires_at)
+                VALUES ($1, $2, CURRENT_TIMESTAMP + make_interval(secs => $3))
+                ON CONFLICT (key) DO UPDATE
+                SET request_hash = EXCLUDED.request_hash, response = NULL,
+                    created_at = CURRENT_TIMESTAMP, expires_at = EXCLUDED.expires_at
+                WHERE idempotency_keys.expires_at <= CURRENT_TIMESTAMP
+                RETURNING TRUE
+            ''', key, request_hash, float(ttl_seconds))
+            if claimed:
+                return None
+            row = await conn.fetchrow(
+                'SELECT request_hash, response FROM idempotency_keys WHERE key = $1', key
+            )
+        if row is None:
+            # Swept between the two statements - report it as running so the client retries
+            return {"request_hash": request_hash, "response": None}
+        return {"request_hash": row['request_hash'],
+                "response": json.loads(row['response']) if row['response'] else None}
+    
+    async def save_idempotent_response(self, key: str, response: dict):
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                'UPDATE idempotency_keys SET response = $2 WHERE key = $1', key, json.dumps(response)
+            )
+    
+    async def release_idempotency_key(self, key: str):
+        async with self.pool.acquire() as conn:
+            await conn.execute('DELETE FROM idempotency_keys WHERE key = $1 AND response IS NULL', key)
+    
+    async def delete_expired_idempotency_keys(self) -> int:
+        async with self.pool.acquire() as conn:
+            result = await conn.execute('DELETE FROM idempotency_keys WHERE expires_at <= CURRENT_TIMESTAMP')
+            return int(result.split()[-1])
+    
     async def get_leaderboard(self, limit: int = 10) -> List[Tuple[int, int]]:
         """Get top users by points"""
         try:
@@ -235,27 +1460,31 @@ class PostgreSQLPointsDatabase:
                     rows = await conn.fetch('''
                         SELECT id, user_id, amount, transaction_type, admin_id, reason, old_balance, new_balance, created_at
                         FROM transactions WHERE user_id = $1 ORDER BY created_at DESC LIMIT $2
-                    ''', user_id, limit)
+                    ''', str(user_id), limit)
                 else:
-                    rows = await conn.fetch('''
-                        SELECT id, user_id, amount, transaction_type, admin_id, reason, old_balance, new_balance, created_at
-                        FROM transactions ORDER BY created_at DESC LIMIT $1
-                    ''', limit)
+                    rows = await conn.fetch(RECENT_TRANSACTIONS_SQL, limit)
                 return [tuple(row) for row in rows]
         except Exception as e:
             logger.error(f"Error getting transactions: {e}")
             return []
     
-    async def add_achievement(self, user_id: int, achievement_type: str, achievement_name: str, points_earned: int = 0) -> bool:
-        """Add an achievement for a user"""
+    async def add_achievement(self, user_id: int, achievement_type: str, achievement_name: str,
+                              points_earned: int = 0) -> Optional[bool]:
+        """Add a manual achievement for a user; False if they already have it, None on error
+
+        Manual awards are stored as "<type>:<name>" so one user can hold several of a type.
+        """
         try:
             async with self.pool.acquire() as conn:
                 async with conn.transaction():
-                    # Add achievement
-                    await conn.execute('''
+                    inserted = await conn.fetchval('''
                         INSERT INTO achievements (user_id, achievement_type, achievement_name, points_earned)
                         VALUES ($1, $2, $3, $4)
-                    ''', user_id, achievement_type, achievement_name, points_earned)
+                        ON CONFLICT (user_id, achievement_type) DO NOTHING
+                        RETURNING id
+                    ''', str(user_id), f"{achievement_type}:{achievement_name}", achievement_name, points_earned)
+                    if inserted is None:
+                        return False
                     
                     # Update user stats
                     await conn.execute('''
@@ -263,12 +1492,63 @@ class PostgreSQLPointsDatabase:
                         SET achievements_count = achievements_count + 1,
                             last_activity = CURRENT_TIMESTAMP
                         WHERE user_id = $1
-                    ''', user_id)
+                    ''', str(user_id))
                     
             return True
         except Exception as e:
             logger.error(f"Error adding achievement for user {user_id}: {e}")
-            return False
+            return None
+    
+    async def get_user_achievements(self, user_id) -> List[dict]:
+        """Get all achievements for a specific user"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT achievement_type, achievement_name, points_earned, earned_at
+                FROM achievements
+                WHERE user_id = $1
+                ORDER BY earned_at DESC
+            ''', str(user_id))
+        return [dict(row) for row in rows]
+    
+    async def get_recent_achievements(self, limit: int = 10) -> List[dict]:
+        """Get recent achievements across all users"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT a.user_id, a.achievement_type, a.achievement_name, a.points_earned, a.earned_at,
+                       COALESCE(du.display_name, du.username) AS username
+                FROM achievements a
+                LEFT JOIN discord_users du ON du.user_id = a.user_id
+                ORDER BY a.earned_at DESC
+                LIMIT $1
+            ''', limit)
+        return [dict(row) for row in rows]
+    
+    async def get_achievement_state(self, user_id, max_join_position: int) -> dict:
+        """Balance, earned types, email statuses, roles and join position in one read"""
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(ACHIEVEMENT_STATE_SQL, str(user_id), max_join_position)
+        return {
+            'balance': row['balance'],
+            'earned': set(row['earned']),
+            'email_statuses': set(row['email_statuses']),
+            'roles': [role.strip() for role in row['roles'].split(',') if role.strip()],
+            'join_position': row['join_position']
+        }
+    
+    async def award_achievements(self, user_id, awards: list) -> Tuple[Optional[int], List[str]]:
+        """Insert (type, name, points_reward) awards, crediting bonuses only for rows actually inserted"""
+        user_id = str(user_id)
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                # Balance row before the achievements index - the same lock order as the backfill
+                await conn.execute("SELECT 1 FROM points WHERE user_id = $1 FOR UPDATE", user_id)
+                result = await conn.fetchrow(
+                    AWARD_ACHIEVEMENTS_SQL, user_id,
+                    [award[0] for award in awards], [award[1] for award in awards], [award[2] for award in awards]
+                )
+        if result['new_balance'] is not None:
+            leaderboard.update(user_id, result['new_balance'])
+        return result['new_balance'], list(result['awarded'])
     
     async def get_user_analytics(self, user_id: int) -> Optional[Tuple]:
         """Get comprehensive analytics for a user"""
@@ -284,21 +1564,155 @@ class PostgreSQLPointsDatabase:
             logger.error(f"Error getting user analytics for {user_id}: {e}")
             return None
     
-    async def get_email_submissions(self):
-        """Get all email submissions"""
+    async def get_email_submissions(self, limit: int = None):
+        """Get email submissions, newest first (all of them unless limit is given)"""
         try:
             async with self.pool.acquire() as conn:
-                rows = await conn.fetch('''
-                    SELECT id, discord_user_id, discord_username, email_address, 
-                           submitted_at, status, processed_at, admin_notes, server_roles
-                    FROM email_submissions 
-                    ORDER BY submitted_at DESC
-                ''')
+                rows = await conn.fetch(EMAIL_SUBMISSIONS_SQL, limit)
                 return [tuple(row) for row in rows]
         except Exception as e:
             logger.error(f"Error getting email submissions: {e}")
             return []
     
+    async def list_users(self, sort: str = 'points_desc', status: str = None, search: str = None,
+                         after: tuple = None, limit: int = 50) -> List[dict]:
+        """One page of the unified user list (points and/or email submission), keyset-paginated
+
+        after is the (sort value, user_id) of the last row of the previous page. Each
+        branch walks an index from the cursor and stops after `limit` rows, so a page
+        costs the same however deep it is and however many users there are.
+        """
+        key, direction = USER_SORTS[sort]
+        comparison = '<' if direction == 'DESC' else '>'
+        args = []
+        
+        def arg(value):
+            args.append(value)
+            return f"${len(args)}"
+        
+        page_size = arg(limit)
+        conditions = []
+        if status:
+            conditions.append(USER_STATUS_FILTERS[status])
+        if after is not None:
+            cast = 'integer' if key == 'balance' else 'text'
+            after_key, after_user = f"{arg(after[0])}::{cast}", f"{arg(str(after[1]))}::text"
+            conditions.append(f"(u.{key}, u.user_id) {comparison} ({after_key}, {after_user})")
+        
+        def keyset(sort_key: str, user_id: str) -> str:
+            # The cursor condition on a branch's own index columns, so its scan starts at the cursor
+            if after is None:
+                return "TRUE"
+            return f"({sort_key}, {user_id}) {comparison} ({after_key}, {after_user})"
+        
+        def zero_balance_keyset(user_id: str) -> str:
+            # keyset() for rows whose balance is always 0, reduced to a condition on the user id
+            if after is None:
+                return "TRUE"
+            if int(after[0]) == 0:
+                return f"{user_id} {comparison} {after_user}"
+            past_cursor = 0 < int(after[0]) if direction == 'DESC' else 0 > int(after[0])
+            return "TRUE" if past_cursor else "FALSE"
+        
+        known_user = ("(p.user_id IS NOT NULL OR EXISTS "
+                      "(SELECT 1 FROM email_submissions s WHERE s.discord_user_id = {0}))")
+        if search:
+            # Drive from the (trigram-indexed) matches rather than walking every user
+            pattern = arg(f"%{escape_like(search.lower())}%")
+            prefix = arg(f"{escape_like(search)}%")
+            sources = [f'''
+                SELECT c.user_id, COALESCE(p.balance, 0) AS balance,
+                       LOWER(COALESCE(du.display_name, du.username, 'User ' || c.user_id)) AS name
+                FROM (
+                    SELECT user_id FROM discord_users
+                    WHERE LOWER(display_name) LIKE {pattern} OR LOWER(username) LIKE {pattern}
+                    UNION
+                    SELECT discord_user_id FROM email_submissions
+                    WHERE LOWER(email_address) LIKE {pattern} OR LOWER(discord_username) LIKE {pattern}
+                    UNION
+                    SELECT user_id FROM points WHERE user_id LIKE {prefix}
+                ) c
+                LEFT JOIN points p ON p.user_id = c.user_id
+                LEFT JOIN discord_users du ON du.user_id = c.user_id
+                WHERE c.user_id IS NOT NULL AND {known_user.format('c.user_id')}
+            ''']
+        elif key == 'balance':
+            # Users with points (idx_points_balance_user), then email-only users at balance 0 in
+            # user id order (idx_email_user), each submitter once
+            sources = [
+                'SELECT user_id, balance, NULL::text AS name FROM points',
+                f'''
+                SELECT DISTINCT e.discord_user_id AS user_id, 0 AS balance, NULL::text AS name
+                FROM email_submissions e
+                WHERE {zero_balance_keyset('e.discord_user_id')}
+                  AND NOT EXISTS (SELECT 1 FROM points p WHERE p.user_id = e.discord_user_id)
+                ORDER BY e.discord_user_id {direction}
+                ''',
+            ]
+        else:
+            # Named directory users (idx_discord_users_sort_name), then users known only by points
+            # or an email submission, under their 'User <id>' label (idx_*_fallback_name)
+            points_name, email_name = fallback_name('p.user_id'), fallback_name('e.discord_user_id')
+            sources = [f'''
+                SELECT du.user_id, COALESCE(p.balance, 0) AS balance,
+                       LOWER(COALESCE(du.display_name, du.username)) AS name
+                FROM discord_users du
+                LEFT JOIN points p ON p.user_id = du.user_id
+                WHERE COALESCE(du.display_name, du.username) IS NOT NULL AND {known_user.format('du.user_id')}
+            ''', f'''
+                SELECT p.user_id, p.balance, {points_name} AS name
+                FROM points p
+                WHERE {keyset(points_name, 'p.user_id')}
+                  AND NOT {NAMED_DIRECTORY_ROW.format('p.user_id')}
+                ORDER BY {points_name} {direction}, p.user_id {direction}
+            ''', f'''
+                SELECT DISTINCT {email_name} AS name, e.discord_user_id AS user_id, 0 AS balance
+                FROM email_submissions e
+                WHERE {keyset(email_name, 'e.discord_user_id')}
+                  AND NOT EXISTS (SELECT 1 FROM points p WHERE p.user_id = e.discord_user_id)
+                  AND NOT {NAMED_DIRECTORY_ROW.format('e.discord_user_id')}
+                ORDER BY {email_name} {direction}, e.discord_user_id {direction}
+            ''']
+        
+        order = f"u.{key} {direction}, u.user_id {direction}"
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        branches = " UNION ALL ".join(
+            f"(SELECT u.user_id, u.balance, u.name FROM ({source}) u {where} ORDER BY {order} LIMIT {page_size})"
+            for source in sources
+        )
+        query = f'''
+            SELECT u.user_id, u.balance, u.name, p.user_id IS NOT NULL AS has_points,
+                   es.email_address, es.status,
+                   COALESCE(du.display_name, es.discord_username) AS username
+            FROM (SELECT * FROM ({branches}) u ORDER BY {order} LIMIT {page_size}) u
+            LEFT JOIN points p ON p.user_id = u.user_id
+            LEFT JOIN discord_users du ON du.user_id = u.user_id
+            LEFT JOIN LATERAL (
+                SELECT email_address, status, discord_username FROM email_submissions
+                WHERE discord_user_id = u.user_id
+                ORDER BY submitted_at DESC LIMIT 1
+            ) es ON TRUE
+            ORDER BY {order}
+        '''
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(query, *args)
+            return [dict(row) for row in rows]
+    
+    async def iterate_query(self, query: str, *args, chunk_size: int = 1000):
+        """Yield the rows of a SELECT in chunks from a server-side cursor
+
+        The connection and its read-only transaction stay open until the generator
+        is exhausted or closed, so only one chunk is held in memory at a time.
+        """
+        async with self.pool.acquire() as conn:
+            async with conn.transaction(readonly=True):
+                cursor = await conn.cursor(query, *args)
+                while True:
+                    rows = await cursor.fetch(chunk_size)
+                    if not rows:
+                        return
+                    yield rows
+    
     async def execute_query(self, query: str, *args):
         """Execute a query and return results (for SELECT) or status (for non-SELECT)"""
         try:
@@ -319,12 +1733,16 @@ class PostgreSQLPointsDatabase:
             else:
                 return None
     
+    async def get_system_counters(self) -> dict:
+        """Read every system counter (summed over its shards) - constant time however large the tables are"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('SELECT name, SUM(value)::bigint FROM system_counters GROUP BY name')
+            return {row[0]: row[1] for row in rows}
+    
     async def get_total_users(self) -> int:
         """Get total number of users"""
         try:
-            async with self.pool.acquire() as conn:
-                result = await conn.fetchval('SELECT COUNT(*) FROM points')
-                return result if result else 0
+            return (await self.get_system_counters()).get('users', 0)
         except Exception as e:
             logger.error(f"Error getting total users: {e}")
             return 0
@@ -332,9 +1750,7 @@ class PostgreSQLPointsDatabase:
     async def get_total_points(self) -> int:
         """Get total points across all users"""
         try:
-            async with self.pool.acquire() as conn:
-                result = await conn.fetchval('SELECT SUM(balance) FROM points')
-                return result if result else 0
+            return (await self.get_system_counters()).get('total_points', 0)
         except Exception as e:
             logger.error(f"Error getting total points: {e}")
             return 0
@@ -342,23 +1758,15 @@ class PostgreSQLPointsDatabase:
     async def get_database_stats(self) -> dict:
         """Get comprehensive database statistics"""
         try:
-            async with self.pool.acquire() as conn:
-                # Get table row counts
-                points_count = await conn.fetchval('SELECT COUNT(*) FROM points')
-                transactions_count = await conn.fetchval('SELECT COUNT(*) FROM transactions')
-                achievements_count = await conn.fetchval('SELECT COUNT(*) FROM achievements')
-                
-                # Get total points
-                total_points = await conn.fetchval('SELECT SUM(balance) FROM points')
-                
-                return {
-                    'tables': {
-                        'points': {'rows': points_count or 0},
-                        'transactions': {'rows': transactions_count or 0},
-                        'achievements': {'rows': achievements_count or 0}
-                    },
-                    'total_points': total_points or 0
-                }
+            counters = await self.get_system_counters()
+            return {
+                'tables': {
+                    'points': {'rows': counters.get('users', 0)},
+                    'transactions': {'rows': counters.get('transactions', 0)},
+                    'achievements': {'rows': counters.get('achievements', 0)}
+                },
+                'total_points': counters.get('total_points', 0)
+            }
         except Exception as e:
             logger.error(f"Error getting database stats: {e}")
             return {
@@ -374,19 +1782,36 @@ class PostgreSQLPointsDatabase:
         """Get recent achievements"""
         try:
             async with self.pool.acquire() as conn:
-                rows = await conn.fetch('''
-                    SELECT user_id, achievement_type, achievement_name, points_earned, earned_at
-                    FROM achievements 
-                    ORDER BY earned_at DESC 
-                    LIMIT $1
-                ''', limit)
+                rows = await conn.fetch(RECENT_ACHIEVEMENTS_SQL, limit)
                 return [tuple(row) for row in rows]
         except Exception as e:
             logger.error(f"Error getting achievements: {e}")
             return []
     
+    async def get_dashboard_snapshot(self, limit: int = 10, email_limit: int = 50) -> dict:
+        """Counters, recent transactions and achievements, and the first page of email submissions
+
+        The reads are independent, so they run concurrently on separate pool connections.
+        Errors raise rather than reading as empty lists, so a failed snapshot is never
+        served (and cached by ETag) as if nothing had happened.
+        """
+        async def fetch(query, *args):
+            async with self.pool.acquire() as conn:
+                return [tuple(row) for row in await conn.fetch(query, *args)]
+
+        counters, transactions, achievements, email_submissions = await asyncio.gather(
+            self.get_system_counters(),
+            fetch(RECENT_TRANSACTIONS_SQL, limit),
+            fetch(RECENT_ACHIEVEMENTS_SQL, limit),
+            fetch(EMAIL_SUBMISSIONS_SQL, email_limit)
+        )
+        return {'counters': counters, 'transactions': transactions, 'achievements': achievements,
+                'email_submissions': email_submissions}
+    
     async def close(self):
         """Close the database connection"""
+        if self._coalescer is not None:
+            await self._coalescer.drain()
         if self.pool:
             await self.pool.close()
             self.pool = None
\ No newline at end of file
@@ -0,0 +1,137 @@
+"""
+Process-wide database runtime for the Flask dashboard.
+
+Flask handles requests on worker threads that have no event loop, so the API
+routes share one background event loop and one PostgreSQLPointsDatabase pool
+instead of building (and tearing down) their own on every request.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+from config import Config
+from database_postgresql import PostgreSQLPointsDatabase
+
+logger = logging.getLogger(__name__)
+
+class DatabaseRuntime:
+    """Background event loop that owns the dashboard's connection pool"""
+
+    def __init__(self):
+        self.db = PostgreSQLPointsDatabase()
+        self.loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._errors = 0
+        self._timeouts = 0
+        self._total_seconds = 0.0
+
+    def start(self):
+        """Start the background event loop if it isn't running yet"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self.loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._run_loop, name="db-runtime", daemon=True)
+            self._thread.start()
+            logger.info("Dashboard database runtime started")
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _with_pool(self, coro):
+        """Make sure the pool exists before running a query coroutine"""
+        if self.db.pool is None:
+            try:
+                await self.db.initialize()
+            except Exception:
+                coro.close()
+                raise
+        return await coro
+
+    def run(self, coro, timeout: float = None):
+        """Run a coroutine on the shared loop and block until it finishes"""
+        self.start()
+        started = time.monotonic()
+        future = asyncio.run_coroutine_threadsafe(self._with_pool(coro), self.loop)
+        try:
+            return future.result(timeout=timeout or Config.DB_REQUEST_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            self._timeouts += 1
+            raise
+        except Exception:
+            self._errors += 1
+            raise
+        finally:
+            self._calls += 1
+            self._total_seconds += time.monotonic() - started
+
+    def iterate(self, agen, timeout: float = None):
+        """Drive an async generator on the shared loop from a Flask thread, one item per step
+
+        Closing the returned generator (e.g. when the client disconnects) closes the
+        async generator too, which releases its connection.
+        """
+        self.run(self.db.initialize())
+        try:
+            while True:
+                future = asyncio.run_coroutine_threadsafe(agen.__anext__(), self.loop)
+                try:
+                    item = future.result(timeout=timeout or Config.DB_REQUEST_TIMEOUT)
+                except StopAsyncIteration:
+                    return
+                except concurrent.futures.TimeoutError:
+                    future.cancel()
+                    self._timeouts += 1
+                    raise
+                yield item
+        finally:
+            try:
+                asyncio.run_coroutine_threadsafe(agen.aclose(), self.loop).result(timeout=10)
+            except Exception as e:
+                logger.error(f"Error closing database stream: {e}")
+
+    def stop(self):
+        """Close the pool and stop the background loop"""
+        with self._lock:
+            if not self._thread or not self._thread.is_alive():
+                return
+            try:
+                future = asyncio.run_coroutine_threadsafe(self.db.close(), self.loop)
+                future.result(timeout=10)
+            except Exception as e:
+                logger.error(f"Error closing dashboard database pool: {e}")
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def get_stats(self) -> dict:
+        """Get pool usage and request counters for the metrics endpoint"""
+        return {
+            "pool": self.db.get_pool_stats(),
+            "write_coalescer": self.db.get_write_stats(),
+            "calls": self._calls,
+            "errors": self._errors,
+            "timeouts": self._timeouts,
+            "avg_ms": round(self._total_seconds * 1000 / self._calls, 2) if self._calls else 0
+        }
+
+# Shared instance used by every Flask route
+runtime = DatabaseRuntime()
+
+def get_db() -> PostgreSQLPointsDatabase:
+    """Get the shared dashboard database"""
+    return runtime.db
+
+def run_db(coro, timeout: float = None):
+    """Run a database coroutine on the shared loop from a Flask thread"""
+    return runtime.run(coro, timeout)
+
+def iterate_db(agen, timeout: float = None):
+    """Iterate a database async generator on the shared loop from a Flask thread"""
+    return runtime.iterate(agen, timeout)
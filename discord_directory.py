@@ -0,0 +1,190 @@
+"""
+Persistent directory of Discord user names (the discord_users table).
+
+Every user the bot sees on the gateway (interactions, messages, member and
+user updates, guild member caches) is recorded in memory and written to
+discord_users in batches. A background backfill refreshes rows that are
+missing or stale with a bounded number of concurrent fetch_user calls, so the
+dashboard, leaderboard and email paths read names with a join instead of
+calling the Discord API.
+"""
+
+import asyncio
+import logging
+import discord
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Gateway events DiscordUserDirectory listens to (method name == event name)
+DIRECTORY_EVENTS = (
+    'on_interaction', 'on_message', 'on_member_join', 'on_member_update',
+    'on_user_update', 'on_guild_available'
+)
+
+def user_record(user) -> tuple:
+    """(user_id, username, display_name, avatar_hash) for a discord.User or Member"""
+    return (
+        str(user.id),
+        user.name,
+        getattr(user, 'global_name', None) or user.name,
+        user.avatar.key if user.avatar else None
+    )
+
+class DiscordUserDirectory:
+    """Gateway-fed cache of user names, flushed to discord_users"""
+
+    def __init__(self, bot, db, on_change=None):
+        self.bot = bot
+        self.db = db
+        self.on_change = on_change  # called with a user id whose name changed or was first seen
+        self._known = {}  # user_id -> last record written
+        self._pending = {}  # user_id -> record waiting for the next flush
+        self._task = None
+        self._written = 0
+        self._fetched = 0
+        self._fetch_errors = 0
+        self._write_errors = 0
+
+    def start(self):
+        """Start the flush and backfill task on the running loop"""
+        if self._task and not self._task.done():
+            return
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Cancel the task and write anything still buffered"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def observe(self, user):
+        """Record a user seen on the gateway; unchanged users cost nothing"""
+        if user is None or getattr(user, 'bot', False):
+            return
+        record = user_record(user)
+        previous = self._known.get(record[0])
+        if previous == record:
+            return
+        self._known[record[0]] = record
+        self._pending[record[0]] = record
+        if (previous is None or previous[2] != record[2]) and self.on_change:
+            self.on_change(record[0])
+
+    # Gateway listeners registered by PointsBot.setup_hook
+    async def on_interaction(self, interaction: discord.Interaction):
+        self.observe(interaction.user)
+
+    async def on_message(self, message: discord.Message):
+        self.observe(message.author)
+
+    async def on_member_join(self, member: discord.Member):
+        self.observe(member)
+
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        self.observe(after)
+        if before.display_name != after.display_name and self.on_change:
+            self.on_change(str(after.id))  # server nickname changed
+
+    async def on_user_update(self, before: discord.User, after: discord.User):
+        self.observe(after)
+
+    async def on_guild_available(self, guild: discord.Guild):
+        for member in guild.members:
+            self.observe(member)
+
+    async def flush(self) -> bool:
+        """Write buffered users in one statement; False if the write failed"""
+        if not self._pending:
+            return True
+        pending, self._pending = self._pending, {}
+        try:
+            await self.db.upsert_discord_users(list(pending.values()))
+            self._written += len(pending)
+            return True
+        except Exception as e:
+            self._write_errors += 1
+            logger.error(f"Error writing {len(pending)} users to discord_users: {e}")
+            # Keep them for the next flush unless newer records arrived meanwhile
+            for user_id, record in pending.items():
+                self._pending.setdefault(user_id, record)
+            return False
+
+    async def backfill(self) -> int:
+        """Fetch users whose directory row is missing or stale, a bounded batch at a time"""
+        semaphore = asyncio.Semaphore(Config.DIRECTORY_BACKFILL_CONCURRENCY)
+        refreshed = 0
+
+        async def fetch(user_id: str):
+            async with semaphore:
+                try:
+                    return await self.bot.fetch_user(int(user_id))
+                except (discord.NotFound, ValueError):
+                    return None
+                except discord.HTTPException as e:
+                    self._fetch_errors += 1
+                    logger.warning(f"Could not fetch user {user_id} for the directory: {e}")
+                    raise
+
+        while True:
+            user_ids = await self.db.get_stale_discord_user_ids(
+                Config.DIRECTORY_STALE_HOURS * 3600, Config.DIRECTORY_BACKFILL_BATCH
+            )
+            if not user_ids:
+                break
+
+            results = await asyncio.gather(*(fetch(user_id) for user_id in user_ids), return_exceptions=True)
+            missing = [user_id for user_id, user in zip(user_ids, results) if user is None]
+            for user in results:
+                if isinstance(user, discord.User):
+                    self.observe(user)
+                    # Write even if unchanged so refreshed_at moves forward
+                    self._pending[str(user.id)] = user_record(user)
+                    self._fetched += 1
+            if not await self.flush():
+                # The rows are still stale, so the next query would return the same ids
+                logger.warning("Stopping the discord_users backfill until the next interval: write failed")
+                break
+            if missing:
+                # Deleted accounts - don't ask again until they are stale
+                await self.db.mark_discord_users_refreshed(missing)
+            refreshed += len(user_ids)
+
+            # Transient errors leave rows stale; stop so they aren't retried in a tight loop
+            if any(isinstance(result, Exception) for result in results) or len(user_ids) < Config.DIRECTORY_BACKFILL_BATCH:
+                break
+        return refreshed
+
+    async def _run(self):
+        await self.bot.wait_until_ready()
+        loop = asyncio.get_running_loop()
+        next_backfill = loop.time()
+        while True:
+            await self.flush()
+            if loop.time() >= next_backfill:
+                try:
+                    refreshed = await self.backfill()
+                    if refreshed:
+                        logger.info(f"Refreshed {refreshed} stale discord_users rows")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Error backfilling discord_users: {e}")
+                next_backfill = loop.time() + Config.DIRECTORY_BACKFILL_INTERVAL
+            await asyncio.sleep(Config.DIRECTORY_FLUSH_SECONDS)
+
+    def get_stats(self) -> dict:
+        """Get directory counters for the metrics endpoint"""
+        return {
+            "known_users": len(self._known),
+            "pending_writes": len(self._pending),
+            "written": self._written,
+            "fetched": self._fetched,
+            "fetch_errors": self._fetch_errors,
+            "write_errors": self._write_errors
+        }
@@ -0,0 +1,226 @@
+"""
+Delivery workers for the admin_messages DM outbox.
+
+Producers only insert a row into admin_messages. DMOutbox runs a pool of
+workers on the bot's event loop that claim due rows (FOR UPDATE SKIP LOCKED),
+pace sends through rate-limit buckets, retry transient failures with
+exponential backoff and record the final delivery_status.
+
+A claim is a lease of DM_CLAIM_LEASE_SECONDS. Rows still 'sending' after it
+expires belong to a process that stopped and are requeued; a worker never
+sends past half its lease (checked again after any wait for the recipient or a
+rate-limit slot), so it can't race the process that requeues it. Outcomes are
+only recorded while the claim still holds.
+"""
+
+import asyncio
+import logging
+import random
+import discord
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Rows each worker claims at a time - small, so a slow recipient doesn't hold many
+CLAIM_BATCH_SIZE = 5
+
+class RateLimitBuckets:
+    """Spaces sends on a global bucket plus one bucket per DM channel"""
+
+    def __init__(self, rate_per_second: float, per_key_interval: float):
+        self.interval = 1.0 / rate_per_second
+        self.per_key_interval = per_key_interval
+        self._next_global = 0.0
+        self._next_by_key = {}
+
+    async def acquire(self, key: str):
+        """Wait for the next free slot on the global bucket and the key's bucket"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        # Reserve slots before sleeping so concurrent workers queue up behind them; a busy
+        # recipient only delays its own sends, not the global bucket
+        global_slot = max(now, self._next_global)
+        slot = max(global_slot, self._next_by_key.get(key, 0.0))
+        self._next_global = global_slot + self.interval
+        self._next_by_key[key] = slot + self.per_key_interval
+        if len(self._next_by_key) > 10000:
+            self._next_by_key = {k: t for k, t in self._next_by_key.items() if t > now}
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds: float):
+        """Hold every bucket after Discord reports a rate limit"""
+        resume_at = asyncio.get_running_loop().time() + seconds
+        self._next_global = max(self._next_global, resume_at)
+
+class DMOutbox:
+    """Pool of delivery workers draining admin_messages"""
+
+    def __init__(self, bot, db):
+        self.bot = bot
+        self.db = db
+        self.loop = None
+        self.buckets = RateLimitBuckets(Config.DM_RATE_PER_SECOND, Config.DM_PER_USER_INTERVAL)
+        self._wake_event = None
+        self._task = None
+        self._workers = 0
+        self._delivered = 0
+        self._failed = 0
+        self._retried = 0
+
+    def start(self):
+        """Start the delivery workers on the running loop"""
+        if self._task and not self._task.done():
+            return
+        self.loop = asyncio.get_running_loop()
+        self._wake_event = asyncio.Event()
+        self._task = self.loop.create_task(self._supervise())
+
+    def wake(self):
+        """Tell the workers new messages were queued - safe to call from any thread"""
+        if self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._wake_event.set)
+
+    async def stop(self):
+        """Cancel the workers; rows they had claimed are requeued once their lease expires"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _supervise(self):
+        await self.bot.wait_until_ready()
+        logger.info(f"DM outbox started with {Config.DM_WORKERS} delivery workers")
+        self._workers = Config.DM_WORKERS
+        try:
+            await asyncio.gather(self._release_expired(), *(self._run() for _ in range(Config.DM_WORKERS)))
+        finally:
+            self._workers = 0
+
+    async def _release_expired(self):
+        """Requeue rows whose claim outlived its lease, now and every half lease"""
+        while True:
+            try:
+                released = await self.db.release_stuck_admin_messages(Config.DM_CLAIM_LEASE_SECONDS)
+                if released:
+                    logger.info(f"Requeued {released} DM(s) left unfinished by a stopped process")
+            except Exception as e:
+                logger.error(f"Error releasing interrupted DMs: {e}")
+            await asyncio.sleep(Config.DM_CLAIM_LEASE_SECONDS / 2)
+
+    async def _run(self):
+        while True:
+            try:
+                messages = await self.db.claim_admin_messages(CLAIM_BATCH_SIZE)
+            except Exception as e:
+                logger.error(f"Error claiming outbox messages: {e}")
+                messages = []
+
+            if not messages:
+                self._wake_event.clear()
+                try:
+                    await asyncio.wait_for(self._wake_event.wait(), timeout=Config.JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            lease_ends = self.loop.time() + Config.DM_CLAIM_LEASE_SECONDS / 2
+            for message in messages:
+                await self._deliver(message, lease_ends)
+
+    def _lease_expiring(self, message: dict, lease_ends: float) -> bool:
+        if self.loop.time() < lease_ends:
+            return False
+        # Leave it 'sending'; once the lease expires it is requeued
+        logger.warning(f"DM {message['id']} claim is about to expire, leaving it for a later attempt")
+        return True
+
+    async def _deliver(self, message: dict, lease_ends: float):
+        message_id = message['id']
+        user_id = message['recipient_user_id']
+        user = None
+        if self._lease_expiring(message, lease_ends):
+            return
+        try:
+            user = self.bot.get_user(int(user_id)) or await self.bot.fetch_user(int(user_id))
+            await self.buckets.acquire(f"dm:{user_id}")
+            if self._lease_expiring(message, lease_ends):
+                return
+            if message['use_embed']:
+                await user.send(embed=build_embed(message['message_type'], message['message_content']))
+            else:
+                await user.send(message['message_content'])
+
+            if not await self.db.mark_admin_message(message, 'delivered', recipient_username=user.display_name):
+                logger.warning(f"DM {message_id} was sent but its claim had already been taken over")
+            self._delivered += 1
+            logger.info(f"✅ DM {message_id} delivered to user {user_id} ({message['message_type']})")
+
+        except discord.Forbidden:
+            await self._fail(message, user, "User has DMs disabled or blocked bot")
+        except discord.NotFound:
+            await self._fail(message, user, "User not found on Discord (account may be deleted)")
+        except ValueError:
+            await self._fail(message, user, f"Invalid Discord user id: {user_id}")
+        except discord.RateLimited as e:
+            self.buckets.pause(e.retry_after)
+            await self._retry(message, user, f"Rate limited for {e.retry_after:.1f}s", e.retry_after)
+        except discord.HTTPException as e:
+            if e.status == 429 or e.status >= 500:
+                await self._retry(message, user, f"HTTP error: {e}")
+            else:
+                await self._fail(message, user, f"HTTP error: {e}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._retry(message, user, str(e))
+
+    async def _retry(self, message: dict, user, error: str, min_delay: float = 0):
+        if message['attempts'] >= Config.DM_MAX_ATTEMPTS:
+            await self._fail(message, user, f"{error} (gave up after {message['attempts']} attempts)")
+            return
+        delay = min(Config.DM_RETRY_BASE_SECONDS * 2 ** (message['attempts'] - 1), Config.DM_RETRY_MAX_SECONDS)
+        delay = max(delay * random.uniform(0.5, 1.5), min_delay)
+        if not await self.db.mark_admin_message(
+            message, 'retrying', error, retry_in=delay,
+            recipient_username=user.display_name if user else None
+        ):
+            return
+        self._retried += 1
+        logger.warning(f"DM {message['id']} to user {message['recipient_user_id']} will be retried in {delay:.0f}s: {error}")
+
+    async def _fail(self, message: dict, user, error: str):
+        if not await self.db.mark_admin_message(
+            message, 'failed', error,
+            recipient_username=user.display_name if user else None
+        ):
+            return
+        self._failed += 1
+        logger.error(f"❌ DM {message['id']} to user {message['recipient_user_id']} failed: {error}")
+
+    def get_stats(self) -> dict:
+        """Get delivery counters for the metrics endpoint"""
+        return {
+            "workers": self._workers,
+            "delivered": self._delivered,
+            "failed": self._failed,
+            "retried": self._retried,
+            "rate_per_second": Config.DM_RATE_PER_SECOND
+        }
+
+def build_embed(message_type: str, message_content: str) -> discord.Embed:
+    """Embed used for automated notifications"""
+    embed = discord.Embed(
+        title=f"📬 {message_type.replace('_', ' ').title()}",
+        description=message_content,
+        color=discord.Color.blue()
+    )
+    embed.add_field(
+        name="From",
+        value="Admin Dashboard (Automated)",
+        inline=True
+    )
+    return embed
@@ -3,9 +3,18 @@
 Enhanced Achievements System for Discord Points Bot
 """
 
+import argparse
 import asyncio
-from database_postgresql import PostgreSQLPointsDatabase
-from datetime import datetime
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Tuple
+from config import Config
+from database_postgresql import PostgreSQLPointsDatabase, escape_like
+from leaderboard_index import leaderboard
+
+logger = logging.getLogger(__name__)
 
 # Define achievement types and their rewards
 ACHIEVEMENT_TYPES = {
@@ -13,188 +22,467 @@ ACHIEVEMENT_TYPES = {
         'name': 'First Points Earned',
         'description': 'Earned your first points!',
         'points_reward': 50,
-        'emoji': '🎉'
+        'emoji': '🎉',
+        'rule': {'min_balance': 1}
     },
     'milestone_100': {
         'name': '100 Points Milestone',
         'description': 'Reached 100 total points!',
         'points_reward': 25,
-        'emoji': '💯'
+        'emoji': '💯',
+        'rule': {'min_balance': 100}
     },
     'milestone_500': {
         'name': '500 Points Milestone', 
         'description': 'Reached 500 total points!',
         'points_reward': 75,
-        'emoji': '🌟'
+        'emoji': '🌟',
+        'rule': {'min_balance': 500}
     },
     'milestone_1000': {
         'name': '1000 Points Milestone',
         'description': 'Reached 1000 total points!',
         'points_reward': 150,
-        'emoji': '💎'
+        'emoji': '💎',
+        'rule': {'min_balance': 1000}
     },
     'high_roller': {
         'name': 'High Roller',
         'description': 'Accumulated over 2000 points!',
         'points_reward': 300,
-        'emoji': '🎰'
+        'emoji': '🎰',
+        'rule': {'min_balance': 2000}
     },
     'email_verified': {
         'name': 'Email Verified',
         'description': 'Successfully submitted and verified email!',
         'points_reward': 100,
-        'emoji': '📧'
+        'emoji': '📧',
+        'rule': {'email_status': 'processed'}
     },
     'early_adopter': {
         'name': 'Early Adopter',
         'description': 'One of the first 10 users to join!',
         'points_reward': 200,
-        'emoji': '🚀'
+        'emoji': '🚀',
+        'rule': {'join_position': 10}
     },
     'community_member': {
         'name': 'Community Member',
         'description': 'Active member with VIP role!',
         'points_reward': 150,
-        'emoji': '👑'
+        'emoji': '👑',
+        'rule': {'role': 'VIP'}
     }
 }
 
-async def check_and_award_achievements(db, user_id: str, current_balance: int = None):
-    """Check if user has earned any new achievements and award them"""
-    
-    if current_balance is None:
-        current_balance = await db.get_points(user_id)
-    
-    # Get user's existing achievements
-    async with db.pool.acquire() as conn:
-        existing_achievements = await conn.fetch(
-            "SELECT achievement_type FROM achievements WHERE user_id = $1",
-            user_id
-        )
-        existing_types = {row['achievement_type'] for row in existing_achievements}
-    
-    new_achievements = []
-    
-    # Check milestone achievements
-    if current_balance >= 100 and 'milestone_100' not in existing_types:
-        new_achievements.append('milestone_100')
-    
-    if current_balance >= 500 and 'milestone_500' not in existing_types:
-        new_achievements.append('milestone_500')
-    
-    if current_balance >= 1000 and 'milestone_1000' not in existing_types:
-        new_achievements.append('milestone_1000')
-    
-    if current_balance >= 2000 and 'high_roller' not in existing_types:
-        new_achievements.append('high_roller')
-    
-    # Check if user has any points for first_points achievement
-    if current_balance > 0 and 'first_points' not in existing_types:
-        new_achievements.append('first_points')
-    
-    # Check email verification achievement
-    if 'email_verified' not in existing_types:
-        async with db.pool.acquire() as conn:
-            email_result = await conn.fetchrow(
-                "SELECT status FROM email_submissions WHERE discord_user_id = $1 AND status = 'processed'",
-                user_id
-            )
-            if email_result:
-                new_achievements.append('email_verified')
-    
-    # Award new achievements
-    for achievement_type in new_achievements:
-        await award_achievement(db, user_id, achievement_type)
-    
-    return new_achievements
+class AchievementRule:
+    """Predicate declared by an achievement type's 'rule'; every condition given must hold
 
-async def award_achievement(db, user_id: str, achievement_type: str):
-    """Award a specific achievement to a user"""
-    
-    if achievement_type not in ACHIEVEMENT_TYPES:
-        return False
-    
-    achievement_data = ACHIEVEMENT_TYPES[achievement_type]
+    min_balance: balance at least this much
+    email_status: an email submission with this status
+    role: a server role whose name contains this text (from email_submissions.server_roles)
+    join_position: one of the first N users in the points table
+    """
+
+    def __init__(self, achievement_type: str, data: dict):
+        self.achievement_type = achievement_type
+        self.name = data['name']
+        self.points_reward = data['points_reward']
+        self.min_balance = data['rule'].get('min_balance')
+        self.email_status = data['rule'].get('email_status')
+        self.role = data['rule'].get('role')
+        self.join_position = data['rule'].get('join_position')
+        # Only these can start matching because of a points write
+        self.balance_only = set(data['rule']) == {'min_balance'}
+
+    def matches(self, state: dict, balance: int) -> bool:
+        if self.min_balance is not None and balance < self.min_balance:
+            return False
+        if self.email_status is not None and self.email_status not in state['email_statuses']:
+            return False
+        if self.role is not None and not any(self.role.lower() in role.lower() for role in state['roles']):
+            return False
+        if self.join_position is not None and not (state['join_position'] and state['join_position'] <= self.join_position):
+            return False
+        return True
+
+ACHIEVEMENT_RULES = [AchievementRule(achievement_type, data) for achievement_type, data in ACHIEVEMENT_TYPES.items()]
+
+def evaluate_rules(state: dict, earned: set) -> List[Tuple[AchievementRule, int]]:
+    """(rule, balance before its bonus) for every rule the user newly qualifies for
+
+    Bonuses are added as rules fire, so a bonus that lifts the balance past another
+    milestone awards that one too.
+    """
+    balance = state['balance']
+    earned = set(earned)
+    awarded = []
+    while True:
+        qualifying = [rule for rule in ACHIEVEMENT_RULES
+                      if rule.achievement_type not in earned and rule.matches(state, balance)]
+        if not qualifying:
+            return awarded
+        for rule in qualifying:
+            earned.add(rule.achievement_type)
+            awarded.append((rule, balance))
+            balance += rule.points_reward
+
+def out_of_reach(state: dict) -> set:
+    """Types whose join position the user is already past, which no points write can change"""
+    return {rule.achievement_type for rule in ACHIEVEMENT_RULES
+            if rule.join_position is not None
+            and not (state['join_position'] and state['join_position'] <= rule.join_position)}
+
+class EarnedAchievementCache:
+    """Per-user bitmask of earned ACHIEVEMENT_RULES, so most checks after a points write need no query
+
+    Bit i is set when the user holds ACHIEVEMENT_RULES[i], or can't reach it through a
+    later points write (see out_of_reach). While an entry is fresh (up to
+    Config.ACHIEVEMENT_PROFILE_TTL seconds after the database check that stored it),
+    balance-only rules are settled from the balance just written. Email and role status
+    change without a points write, in any process, so an entry missing one of those rules
+    is never settled. Expiry also bounds how long an achievement removed by another
+    process can be taken as held. Each PointsStore owns
+    one cache (PointsStore.earned_cache), at most max_users entries, least recently used
+    evicted first; the store forgets entries when it deletes or rewrites achievements.
+    """
+
+    def __init__(self, rules: List[AchievementRule], max_users: int = None):
+        self.rules = rules
+        self.max_users = max_users or Config.ACHIEVEMENT_CACHE_MAX_USERS
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user_id -> (earned mask, time.monotonic() of the database check)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def mask(self, achievement_types) -> int:
+        bits = 0
+        for position, rule in enumerate(self.rules):
+            if rule.achievement_type in achievement_types:
+                bits |= 1 << position
+        return bits
+
+    def settled(self, user_id: str, balance: int) -> bool:
+        """True when nothing can newly qualify at this balance, so the check can be skipped"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+            settled = entry is not None and self._settled(entry, balance)
+            if settled:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return settled
+
+    def _settled(self, entry, balance: int) -> bool:
+        held, checked_at = entry
+        if time.monotonic() - checked_at >= Config.ACHIEVEMENT_PROFILE_TTL:
+            return False
+        for position, rule in enumerate(self.rules):
+            if held & (1 << position):
+                continue
+            if not rule.balance_only or balance >= rule.min_balance:
+                return False
+        return True
+
+    def store(self, user_id: str, achievement_types):
+        """Record what the user holds (or can't reach) after a database check"""
+        with self._lock:
+            self._entries[user_id] = (self.mask(achievement_types), time.monotonic())
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def forget(self, user_id: str):
+        """Drop one user's entry, so their next check reads the database"""
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        """Hit rate and skipped queries for the metrics endpoint"""
+        with self._lock:
+            checks = self.hits + self.misses
+            return {
+                "users": len(self._entries),
+                "max_users": self.max_users,
+                "evictions": self.evictions,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits * 100 / checks, 1) if checks else 0,
+                "queries_saved": self.hits
+            }
+
+async def check_and_award_achievements(db, user_id: str, balance: int = None) -> List[str]:
+    """Check if user has earned any new achievements and award them atomically
+
+    Pass the balance just written to let the store's earned_cache skip the check entirely
+    when the user can't qualify for anything new. Safe to call concurrently for the same
+    user: each achievement (and its bonus) is only credited by the caller whose insert succeeded.
+    """
+    user_id = str(user_id)
+    earned_cache = db.earned_cache
+    if balance is not None and earned_cache.settled(user_id, balance):
+        return []
+    max_join_position = max((rule.join_position or 0 for rule in ACHIEVEMENT_RULES), default=0)
     
-    async with db.pool.acquire() as conn:
-        # Insert achievement record
-        await conn.execute('''
-            INSERT INTO achievements (user_id, achievement_type, achievement_name, points_earned)
-            VALUES ($1, $2, $3, $4)
-        ''', user_id, achievement_type, achievement_data['name'], achievement_data['points_reward'])
+    try:
+        state = await db.get_achievement_state(user_id, max_join_position)
+        awarded = evaluate_rules(state, state['earned'])
+        if not awarded:
+            earned_cache.store(user_id, state['earned'] | out_of_reach(state))
+            return []
         
-        # Award bonus points
-        if achievement_data['points_reward'] > 0:
-            current_balance = await db.get_points(user_id)
-            new_balance = current_balance + achievement_data['points_reward']
-            
-            # Update points
-            await conn.execute('''
-                INSERT INTO points (user_id, balance) VALUES ($1, $2)
-                ON CONFLICT (user_id) DO UPDATE SET 
-                    balance = $2, updated_at = CURRENT_TIMESTAMP
-            ''', user_id, new_balance)
-            
-            # Log transaction
-            await conn.execute('''
-                INSERT INTO transactions (user_id, amount, transaction_type, reason, old_balance, new_balance)
-                VALUES ($1, $2, 'achievement', $3, $4, $5)
-            ''', user_id, achievement_data['points_reward'], 
-            f"Achievement: {achievement_data['name']}", current_balance, new_balance)
+        _, credited = await db.award_achievements(
+            user_id, [(rule.achievement_type, rule.name, rule.points_reward) for rule, _ in awarded]
+        )
+    except Exception as e:
+        logger.error(f"Error checking achievements for user {user_id}: {e}")
+        return []
     
-    return True
+    # Types that conflicted were awarded by a concurrent caller, so they're held either way
+    earned_cache.store(user_id, state['earned'] | {rule.achievement_type for rule, _ in awarded} | out_of_reach(state))
+    return credited
 
 async def get_user_achievements(db, user_id: str):
     """Get all achievements for a specific user"""
-    
-    async with db.pool.acquire() as conn:
-        achievements = await conn.fetch('''
-            SELECT achievement_type, achievement_name, points_earned, earned_at
-            FROM achievements 
-            WHERE user_id = $1 
-            ORDER BY earned_at DESC
-        ''', user_id)
-    
-    return [dict(row) for row in achievements]
+    return await db.get_user_achievements(user_id)
 
 async def get_recent_achievements(db, limit: int = 10):
     """Get recent achievements across all users"""
+    return await db.get_recent_achievements(limit)
+
+# One rule over a chunk: $1 type, $2 min_balance, $3 email_status, $4 role pattern,
+# $5 join_position, $6 pass, $7 rule order
+BACKFILL_RULE_SQL = '''
+    INSERT INTO backfill_awards (user_id, achievement_type, pass, rule_order)
+    SELECT u.user_id, $1, $6, $7
+    FROM backfill_users u
+    WHERE ($2::integer IS NULL OR u.balance >= $2)
+      AND ($3::text IS NULL OR EXISTS (
+              SELECT 1 FROM email_submissions es WHERE es.discord_user_id = u.user_id AND es.status = $3))
+      AND ($4::text IS NULL OR EXISTS (
+              SELECT 1 FROM email_submissions es WHERE es.discord_user_id = u.user_id AND es.server_roles ILIKE $4))
+      AND ($5::integer IS NULL OR (
+              SELECT COUNT(*) FROM (SELECT 1 FROM points o WHERE o.created_at < u.created_at LIMIT $5) earlier) < $5)
+      AND NOT EXISTS (SELECT 1 FROM achievements a WHERE a.user_id = u.user_id AND a.achievement_type = $1)
+      AND NOT EXISTS (SELECT 1 FROM backfill_awards b WHERE b.user_id = u.user_id AND b.achievement_type = $1)
+'''
+
+# Computed awards with their name, bonus, the user's starting balance and the order they fired in
+BACKFILL_AWARDS_SQL = '''
+    SELECT b.user_id, b.achievement_type, r.achievement_name, r.points_earned,
+           u.start_balance, b.pass, b.rule_order
+    FROM backfill_awards b
+    JOIN backfill_users u ON u.user_id = b.user_id
+    JOIN unnest($1::text[], $2::text[], $3::integer[]) AS r(achievement_type, achievement_name, points_earned)
+      ON r.achievement_type = b.achievement_type
+'''
+
+class _DryRunRollback(Exception):
+    """Raised inside a dry-run chunk's transaction to discard it"""
+
+async def backfill_achievements(db, dry_run: bool = False, chunk_size: int = 1000) -> dict:
+    """Award every missing achievement to existing users with set-based statements
+
+    Users are taken from the points table chunk_size at a time, each chunk in its own
+    transaction so locks are only held briefly. Every rule is one INSERT ... SELECT
+    per pass; passes repeat while bonuses push balances past further milestones.
+    Awards and points count only achievements actually inserted. With dry_run each
+    chunk is written the same way, counted, then rolled back.
+    PostgreSQL only (db must be a PostgreSQLPointsDatabase).
+    """
+    summary = {"users_checked": 0, "awards": {}, "points": 0, "dry_run": dry_run}
+    after = ''
     
-    async with db.pool.acquire() as conn:
-        achievements = await conn.fetch('''
-            SELECT user_id, achievement_type, achievement_name, points_earned, earned_at
-            FROM achievements 
-            ORDER BY earned_at DESC 
-            LIMIT $1
-        ''', limit)
+    while True:
+        balances = []
+        async with db.pool.acquire() as conn:
+            try:
+                async with conn.transaction():
+                    users, last, counts, balances = await _backfill_chunk(conn, after, chunk_size)
+                    if dry_run and users:
+                        raise _DryRunRollback()
+            except _DryRunRollback:
+                pass
+        if not users:
+            break
+        
+        if balances and not dry_run:
+            leaderboard.apply((row['user_id'], row['balance']) for row in balances)
+        summary["users_checked"] += users
+        for row in counts:
+            summary["awards"][row['achievement_type']] = summary["awards"].get(row['achievement_type'], 0) + row['awarded']
+            summary["points"] += row['points']
+        logger.info(f"Achievement backfill checked {summary['users_checked']} users, "
+                    f"{sum(summary['awards'].values())} awards so far")
+        after = last
     
-    return [dict(row) for row in achievements]
+    return summary
+
+async def _backfill_chunk(conn, after: str, chunk_size: int):
+    """Compute and write awards for the next chunk of users
 
-async def initialize_achievements_for_existing_users():
+    Returns (users in chunk, last user_id, awards and points per type, new balances).
+    """
+    rule_types = [rule.achievement_type for rule in ACHIEVEMENT_RULES]
+    rule_rewards = [rule.points_reward for rule in ACHIEVEMENT_RULES]
+    
+    await conn.execute('''
+        CREATE TEMP TABLE backfill_users (
+            user_id TEXT PRIMARY KEY,
+            balance INTEGER NOT NULL,
+            start_balance INTEGER NOT NULL,
+            created_at TIMESTAMP
+        ) ON COMMIT DROP
+    ''')
+    await conn.execute('''
+        CREATE TEMP TABLE backfill_awards (
+            user_id TEXT NOT NULL,
+            achievement_type TEXT NOT NULL,
+            pass INTEGER NOT NULL,
+            rule_order INTEGER NOT NULL
+        ) ON COMMIT DROP
+    ''')
+    # Lock the chunk's balances until this transaction ends
+    chunk = await conn.fetchrow('''
+        WITH locked AS (
+            INSERT INTO backfill_users (user_id, balance, start_balance, created_at)
+            SELECT user_id, COALESCE(balance, 0), COALESCE(balance, 0), created_at
+            FROM points WHERE user_id > $1
+            ORDER BY user_id LIMIT $2
+            FOR UPDATE
+            RETURNING user_id
+        )
+        SELECT COUNT(*) AS users, MAX(user_id) AS last FROM locked
+    ''', after, chunk_size)
+    if not chunk['users']:
+        return 0, None, [], []
+    
+    for award_pass in range(len(ACHIEVEMENT_RULES)):
+        inserted = 0
+        for rule_order, rule in enumerate(ACHIEVEMENT_RULES):
+            status = await conn.execute(
+                BACKFILL_RULE_SQL, rule.achievement_type, rule.min_balance, rule.email_status,
+                f"%{escape_like(rule.role)}%" if rule.role else None, rule.join_position,
+                award_pass, rule_order
+            )
+            inserted += int(status.split()[-1])
+        if not inserted:
+            break
+        # Bonuses from this pass count toward the next one
+        await conn.execute('''
+            UPDATE backfill_users u SET balance = u.balance + s.bonus
+            FROM (
+                SELECT b.user_id, SUM(r.points_earned) AS bonus
+                FROM backfill_awards b
+                JOIN unnest($2::text[], $3::integer[]) AS r(achievement_type, points_earned)
+                  ON r.achievement_type = b.achievement_type
+                WHERE b.pass = $1
+                GROUP BY b.user_id
+            ) s
+            WHERE u.user_id = s.user_id
+        ''', award_pass, rule_types, rule_rewards)
+    
+    counts, balances = await _write_backfill(conn)
+    return chunk['users'], chunk['last'], counts, balances
+
+async def _write_backfill(conn):
+    """Write a chunk's computed awards in bulk; returns (awards and points per type, new balances)"""
+    await conn.execute('''
+        CREATE TEMP TABLE backfill_rows (
+            user_id TEXT NOT NULL,
+            achievement_type TEXT NOT NULL,
+            achievement_name TEXT NOT NULL,
+            points_earned INTEGER NOT NULL,
+            old_balance INTEGER NOT NULL
+        ) ON COMMIT DROP
+    ''')
+    # Only awards that were actually inserted are kept: one awarded concurrently since the chunk was
+    # evaluated conflicts, and neither its bonus nor its share of the running balance is counted again
+    await conn.execute(f'''
+        WITH candidates AS ({BACKFILL_AWARDS_SQL}),
+        inserted AS (
+            INSERT INTO achievements (user_id, achievement_type, achievement_name, points_earned)
+            SELECT user_id, achievement_type, achievement_name, points_earned FROM candidates
+            ON CONFLICT (user_id, achievement_type) DO NOTHING
+            RETURNING user_id, achievement_type
+        )
+        INSERT INTO backfill_rows (user_id, achievement_type, achievement_name, points_earned, old_balance)
+        SELECT c.user_id, c.achievement_type, c.achievement_name, c.points_earned,
+               c.start_balance + COALESCE(SUM(c.points_earned) OVER (
+                   PARTITION BY c.user_id ORDER BY c.pass, c.rule_order
+                   ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0)
+        FROM candidates c
+        JOIN inserted i ON i.user_id = c.user_id AND i.achievement_type = c.achievement_type
+    ''',
+        [rule.achievement_type for rule in ACHIEVEMENT_RULES],
+        [rule.name for rule in ACHIEVEMENT_RULES],
+        [rule.points_reward for rule in ACHIEVEMENT_RULES]
+    )
+    counts = await conn.fetch('''
+        SELECT achievement_type, COUNT(*) AS awarded, SUM(points_earned) AS points
+        FROM backfill_rows GROUP BY achievement_type
+    ''')
+    await conn.execute('''
+        INSERT INTO transactions (user_id, amount, transaction_type, reason, old_balance, new_balance)
+        SELECT user_id, points_earned, 'achievement', 'Achievement: ' || achievement_name,
+               old_balance, old_balance + points_earned
+        FROM backfill_rows WHERE points_earned > 0
+    ''')
+    await conn.execute('''
+        INSERT INTO user_stats (user_id, total_points_earned, total_points_spent, highest_balance,
+                                transactions_count, first_activity, last_activity)
+        SELECT user_id, SUM(points_earned), 0, MAX(old_balance + points_earned), COUNT(*),
+               CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+        FROM backfill_rows WHERE points_earned > 0
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET total_points_earned = user_stats.total_points_earned + EXCLUDED.total_points_earned,
+            highest_balance = GREATEST(user_stats.highest_balance, EXCLUDED.highest_balance),
+            transactions_count = user_stats.transactions_count + EXCLUDED.transactions_count,
+            last_activity = CURRENT_TIMESTAMP
+    ''')
+    balances = await conn.fetch('''
+        UPDATE points p SET balance = p.balance + s.bonus, updated_at = CURRENT_TIMESTAMP
+        FROM (
+            SELECT user_id, SUM(points_earned) AS bonus FROM backfill_rows
+            GROUP BY user_id HAVING SUM(points_earned) > 0
+        ) s
+        WHERE p.user_id = s.user_id
+        RETURNING p.user_id, p.balance
+    ''')
+    return counts, balances
+
+async def initialize_achievements_for_existing_users(dry_run: bool = False, chunk_size: int = 1000):
     """Initialize achievements for all existing users based on their current stats"""
     
     db = PostgreSQLPointsDatabase()
     await db.initialize()
     
     try:
-        # Get all users with points
-        async with db.pool.acquire() as conn:
-            users = await conn.fetch("SELECT user_id, balance FROM points")
-        
-        print(f"Checking achievements for {len(users)} users...")
-        
-        for user in users:
-            user_id = user['user_id']
-            balance = user['balance']
-            
-            new_achievements = await check_and_award_achievements(db, user_id, balance)
-            if new_achievements:
-                print(f"User {user_id}: Awarded {len(new_achievements)} achievements")
+        summary = await backfill_achievements(db, dry_run=dry_run, chunk_size=chunk_size)
         
-        print("Achievement initialization complete!")
+        verb = "Would award" if dry_run else "Awarded"
+        print(f"Checked {summary['users_checked']} users")
+        for achievement_type, awarded in sorted(summary['awards'].items()):
+            print(f"  {verb} {ACHIEVEMENT_TYPES[achievement_type]['name']}: {awarded} users")
+        print(f"{verb} {sum(summary['awards'].values())} achievements worth {summary['points']:,} bonus points")
         
     finally:
         await db.close()
 
 if __name__ == "__main__":
-    asyncio.run(initialize_achievements_for_existing_users())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Award missing achievements to existing users")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be awarded without writing")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="users per transaction")
+    args = parser.parse_args()
+    asyncio.run(initialize_achievements_for_existing_users(args.dry_run, args.chunk_size))
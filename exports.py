@@ -0,0 +1,136 @@
+"""
+Streaming CSV / NDJSON exports for the dashboard.
+
+Each export is a SELECT read through a server-side cursor (see
+PostgreSQLPointsDatabase.iterate_query) and written out chunk by chunk, so
+memory stays flat however large the table is and the header row goes out
+before the first query returns.
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional
+
+# Rows fetched from the cursor per chunk
+EXPORT_CHUNK_SIZE = 1000
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+class ExportSpec:
+    """One exportable table: its query, output columns and filterable columns"""
+
+    def __init__(self, query: str, columns: List[str], date_column: str, status_column: Optional[str],
+                 order_by: str, statuses: Optional[Iterable[str]] = None):
+        self.query = query
+        self.columns = columns
+        self.date_column = date_column
+        self.status_column = status_column
+        self.order_by = order_by
+        self.statuses = set(statuses) if statuses else None
+
+EXPORTS = {
+    'users': ExportSpec(
+        '''
+        SELECT * FROM (
+            SELECT COALESCE(p.user_id, es.discord_user_id) AS user_id,
+                   COALESCE(du.display_name, es.discord_username) AS username,
+                   COALESCE(p.balance, 0) AS points,
+                   es.email_address AS email,
+                   COALESCE(es.status, 'no_email') AS email_status,
+                   COALESCE(p.created_at, es.submitted_at) AS created_at
+            FROM points p
+            FULL OUTER JOIN (
+                SELECT DISTINCT ON (discord_user_id) discord_user_id, discord_username, email_address, status, submitted_at
+                FROM email_submissions
+                ORDER BY discord_user_id, submitted_at DESC
+            ) es ON es.discord_user_id = p.user_id
+            LEFT JOIN discord_users du ON du.user_id = COALESCE(p.user_id, es.discord_user_id)
+        ) e
+        ''',
+        ['user_id', 'username', 'points', 'email', 'email_status', 'created_at'],
+        date_column='created_at', status_column='email_status', order_by='points DESC, user_id',
+        statuses=('pending', 'processed', 'no_email')
+    ),
+    'transactions': ExportSpec(
+        '''
+        SELECT id, user_id, amount, transaction_type, admin_id, reason, old_balance, new_balance, created_at
+        FROM transactions e
+        ''',
+        ['id', 'user_id', 'amount', 'transaction_type', 'admin_id', 'reason', 'old_balance', 'new_balance', 'created_at'],
+        date_column='created_at', status_column='transaction_type', order_by='id'
+    ),
+    'email_submissions': ExportSpec(
+        '''
+        SELECT id, discord_user_id, discord_username, email_address, submitted_at, status,
+               processed_at, admin_notes, server_roles
+        FROM email_submissions e
+        ''',
+        ['id', 'discord_user_id', 'discord_username', 'email_address', 'submitted_at', 'status',
+         'processed_at', 'admin_notes', 'server_roles'],
+        date_column='submitted_at', status_column='status', order_by='submitted_at DESC, id DESC'
+    ),
+    'messages': ExportSpec(
+        '''
+        SELECT id, sent_at, sender_admin_name, sender_admin_id, recipient_username, recipient_user_id,
+               message_type, message_content, delivery_status, delivery_error, attempts, delivered_at
+        FROM admin_messages e
+        ''',
+        ['id', 'sent_at', 'sender_admin_name', 'sender_admin_id', 'recipient_username', 'recipient_user_id',
+         'message_type', 'message_content', 'delivery_status', 'delivery_error', 'attempts', 'delivered_at'],
+        date_column='sent_at', status_column='delivery_status', order_by='sent_at DESC, id DESC'
+    ),
+}
+
+def parse_date(value: Optional[str]) -> Optional[datetime]:
+    """Parse a since/until filter (ISO date or datetime); raises ValueError when malformed"""
+    return datetime.fromisoformat(value) if value else None
+
+def build_export_query(name: str, since: datetime = None, until: datetime = None, status: str = None):
+    """(query, args) for an export with optional date range and status filters"""
+    spec = EXPORTS[name]
+    conditions, args = [], []
+    if since:
+        args.append(since)
+        conditions.append(f"e.{spec.date_column} >= ${len(args)}")
+    if until:
+        args.append(until)
+        conditions.append(f"e.{spec.date_column} < ${len(args)}")
+    if status:
+        if spec.statuses is not None and status not in spec.statuses:
+            raise ValueError(f"Unknown status: {status}")
+        args.append(status)
+        conditions.append(f"e.{spec.status_column} = ${len(args)}")
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"{spec.query}{where} ORDER BY {spec.order_by}", args
+
+def _csv_value(column: str, value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if column.endswith('user_id') or column == 'admin_id':
+        # Leading ' keeps Excel from turning Discord ids into floats
+        return "'" + str(value)
+    return value
+
+def render_export(name: str, export_format: str, chunks: Iterable[list]) -> Iterator[str]:
+    """Turn chunks of records into CSV or NDJSON text, one string per chunk"""
+    columns = EXPORTS[name].columns
+    if export_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        yield buffer.getvalue()
+        for rows in chunks:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows([_csv_value(column, row[column]) for column in columns] for row in rows)
+            yield buffer.getvalue()
+    else:
+        for rows in chunks:
+            yield "".join(json.dumps({column: row[column] for column in columns}, default=str) + "\n" for row in rows)
@@ -0,0 +1,79 @@
+"""
+Idempotency-Key handling for point-mutating requests.
+
+The first request with a key claims it in the idempotency_keys table together
+with a hash of its payload. Once it succeeds, its response is stored under the
+key, and a later request with the same key and payload gets that response back
+without running again. Failed requests release the key, so a retry runs for
+real. Keys are scoped per endpoint and expire after IDEMPOTENCY_TTL_HOURS. Reads
+ignore expired rows, and the bot's sweeper deletes them.
+
+If a request dies between applying points and storing its response, its key
+stays claimed until it expires. Retries get "still in progress" until then
+instead of a second credit.
+"""
+
+import hashlib
+import json
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+class IdempotencyError(Exception):
+    """A key that can't be used for this request; status is the HTTP status to answer with"""
+
+    def __init__(self, message: str, status: int = 409):
+        super().__init__(message)
+        self.status = status
+
+def request_hash(scope: str, payload) -> str:
+    """Stable hash of an endpoint and its payload"""
+    body = json.dumps([scope, payload], sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+async def begin_idempotent(store, scope: str, key: str, payload) -> Optional[Dict]:
+    """Claim key for this request; returns None to go ahead, or the stored response to replay"""
+    if len(key) > MAX_KEY_LENGTH:
+        raise IdempotencyError(f"{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters", 400)
+    digest = request_hash(scope, payload)
+    existing = await store.claim_idempotency_key(f"{scope}:{key}", digest, Config.IDEMPOTENCY_TTL_HOURS * 3600)
+    if existing is None:
+        return None
+    if existing['request_hash'] != digest:
+        raise IdempotencyError(f"{IDEMPOTENCY_HEADER} was already used for a different request", 422)
+    if existing['response'] is None:
+        raise IdempotencyError(f"A request with this {IDEMPOTENCY_HEADER} is still in progress")
+    return existing['response']
+
+async def finish_idempotent(store, scope: str, key: str, response: Optional[Dict]):
+    """Store a successful response for replay, or release the key so a retry runs again"""
+    try:
+        if response and response.get('success'):
+            await store.save_idempotent_response(f"{scope}:{key}", response)
+        else:
+            await store.release_idempotency_key(f"{scope}:{key}")
+    except Exception as e:
+        logger.error(f"Error finishing idempotent {scope} request: {e}")
+
+async def run_idempotent(store, scope: str, key: Optional[str], payload,
+                         operation: Callable[[], Awaitable[Dict]]) -> Dict:
+    """Run operation() once per key; repeats with the same key and payload get the first result"""
+    if not key:
+        return await operation()
+    try:
+        stored = await begin_idempotent(store, scope, key, payload)
+    except IdempotencyError as e:
+        return {"success": False, "error": str(e)}
+    if stored is not None:
+        return stored
+    result = None
+    try:
+        result = await operation()
+    finally:
+        await finish_idempotent(store, scope, key, result)
+    return result
@@ -0,0 +1,287 @@
+"""
+Persistent background jobs for long-running dashboard operations.
+
+Flask routes queue a row in the jobs table and return its id straight away.
+JobWorker runs on the bot's event loop, works through each job in chunks and
+commits every chunk together with its per-row results and the job's processed
+count, so a restarted worker resumes exactly where it stopped.
+
+A claimed job is a lease kept alive by heartbeats. Only jobs whose heartbeat is
+older than JOB_LEASE_SECONDS are requeued, and a chunk only commits if the job
+is still on the same claim at the chunk's offset, so a job still running in
+another process (say, during a restart overlap) is never applied twice.
+"""
+
+import asyncio
+import logging
+import time
+from config import Config
+from database_postgresql import JobLeaseLost
+from leaderboard_index import leaderboard
+
+logger = logging.getLogger(__name__)
+
+# job_type -> async handler(worker, job)
+JOB_HANDLERS = {}
+
+def job_handler(job_type: str):
+    """Register a coroutine as the handler for a job type"""
+    def register(func):
+        JOB_HANDLERS[job_type] = func
+        return func
+    return register
+
+class JobWorker:
+    """Runs queued jobs one at a time on the bot's event loop"""
+
+    def __init__(self, db, outbox=None):
+        self.db = db
+        self.outbox = outbox  # DMOutbox woken when a chunk queues notifications
+        self.loop = None
+        self.current_job_id = None
+        self._wake_event = None
+        self._task = None
+        self._completed = 0
+        self._failed = 0
+        self._rows = 0
+
+    def start(self):
+        """Start the worker task on the running loop"""
+        if self._task and not self._task.done():
+            return
+        self.loop = asyncio.get_running_loop()
+        self._wake_event = asyncio.Event()
+        self._task = self.loop.create_task(self._run())
+        logger.info("Background job worker started")
+
+    def wake(self):
+        """Tell the worker a job was queued - safe to call from any thread"""
+        if self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._wake_event.set)
+
+    async def stop(self):
+        """Cancel the worker; an interrupted job is requeued once its lease expires"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _requeue_expired(self):
+        try:
+            resumed = await self.db.requeue_running_jobs(Config.JOB_LEASE_SECONDS)
+            if resumed:
+                logger.info(f"Resuming {resumed} interrupted background job(s)")
+        except Exception as e:
+            logger.error(f"Error requeueing interrupted jobs: {e}")
+
+    async def _run(self):
+        next_requeue = self.loop.time()
+        while True:
+            if self.loop.time() >= next_requeue:
+                await self._requeue_expired()
+                next_requeue = self.loop.time() + Config.JOB_LEASE_SECONDS / 2
+
+            try:
+                job = await self.db.claim_next_job()
+            except Exception as e:
+                logger.error(f"Error claiming background job: {e}")
+                job = None
+
+            if job is None:
+                self._wake_event.clear()
+                try:
+                    await asyncio.wait_for(self._wake_event.wait(), timeout=Config.JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._execute(job)
+
+    async def _execute(self, job: dict):
+        handler = JOB_HANDLERS.get(job['job_type'])
+        if handler is None:
+            await self.db.finish_job(job, 'failed', f"Unknown job type: {job['job_type']}")
+            self._failed += 1
+            return
+
+        self.current_job_id = job['id']
+        heartbeat = self.loop.create_task(self._heartbeat(job))
+        logger.info(f"Running job {job['id']} ({job['job_type']}) from row {job['processed']}")
+        try:
+            await handler(self, job)
+            await self.db.finish_job(job, 'completed')
+            self._completed += 1
+            logger.info(f"Job {job['id']} ({job['job_type']}) completed")
+        except asyncio.CancelledError:
+            # Leave the job 'running' so it is requeued and resumed once its lease expires
+            raise
+        except JobLeaseLost as e:
+            # Another worker owns the job now; its outcome is theirs to record
+            logger.warning(f"Stopped job {job['id']} ({job['job_type']}): {e}")
+        except Exception as e:
+            logger.error(f"Job {job['id']} ({job['job_type']}) failed: {e}")
+            await self.db.finish_job(job, 'failed', str(e))
+            self._failed += 1
+        finally:
+            heartbeat.cancel()
+            self.current_job_id = None
+
+    async def _heartbeat(self, job: dict):
+        """Keep the job's lease alive while a chunk runs"""
+        while True:
+            await asyncio.sleep(Config.JOB_LEASE_SECONDS / 3)
+            try:
+                if not await self.db.heartbeat_job(job):
+                    logger.warning(f"Job {job['id']} lost its claim; its current chunk will roll back")
+                    return
+            except Exception as e:
+                logger.error(f"Error extending the lease of job {job['id']}: {e}")
+
+    def get_stats(self) -> dict:
+        """Get worker counters for the metrics endpoint"""
+        return {
+            "running": bool(self._task and not self._task.done()),
+            "current_job_id": self.current_job_id,
+            "completed": self._completed,
+            "failed": self._failed,
+            "rows_processed": self._rows
+        }
+
+def job_progress(job: dict) -> dict:
+    """Format a job row for the progress API, including throughput and ETA"""
+    started_at = job.get('started_at')
+    finished_at = job.get('finished_at') or job.get('updated_at')
+    elapsed = (finished_at - started_at).total_seconds() if started_at and finished_at else 0
+    processed = job.get('processed') or 0
+    total = job.get('total') or 0
+    rows_per_second = processed / elapsed if elapsed > 0 else 0
+    remaining = max(total - processed, 0)
+
+    return {
+        "id": job['id'],
+        "type": job['job_type'],
+        "status": job['status'],
+        "total": total,
+        "processed": processed,
+        "succeeded": job.get('succeeded') or 0,
+        "failed": job.get('failed') or 0,
+        "percent": round(processed * 100 / total, 1) if total else (100.0 if job['status'] == 'completed' else 0.0),
+        "rows_per_second": round(rows_per_second, 1),
+        "eta_seconds": round(remaining / rows_per_second) if rows_per_second and job['status'] == 'running' else None,
+        "error": job.get('error'),
+        "created_at": job['created_at'].isoformat() if job.get('created_at') else None,
+        "started_at": started_at.isoformat() if started_at else None,
+        "finished_at": job['finished_at'].isoformat() if job.get('finished_at') else None
+    }
+
+@job_handler("bulk_points")
+async def run_bulk_points(worker: JobWorker, job: dict):
+    """Apply a bulk add/remove/set in chunks and queue a DM with each user's new balance"""
+    payload = job['payload']
+    action = payload['action']
+    reason = payload.get('reason')
+    rows = payload['rows']
+
+    for offset in range(job['processed'], len(rows), Config.JOB_CHUNK_SIZE):
+        chunk = rows[offset:offset + Config.JOB_CHUNK_SIZE]
+        started = time.monotonic()
+
+        async with worker.db.pool.acquire() as conn:
+            async with conn.transaction():
+                balances = await worker.db.bulk_apply_points(action, chunk, reason=reason, conn=conn)
+                if balances is None:
+                    raise RuntimeError(f"Bulk {action} failed at row {offset}")
+
+                by_user = {user_id: (old_balance, new_balance) for user_id, old_balance, new_balance in balances}
+                results = []
+                for index, (user_id, points) in enumerate(chunk, start=offset):
+                    old_balance, new_balance = by_user[str(user_id)]
+                    results.append((index, str(user_id), True, {
+                        "points": points,
+                        "old_balance": old_balance,
+                        "new_balance": new_balance
+                    }))
+                await worker.db.record_job_progress(conn, job, offset, offset + len(chunk), results)
+                
+                # Notifications commit with the balances, so a resumed job never drops or repeats them
+                await worker.db.enqueue_admin_messages(conn, [
+                    (user_id, bulk_points_message(action, old_balance, new_balance, reason), BULK_MESSAGE_TYPES[action])
+                    for user_id, old_balance, new_balance in balances
+                ])
+
+        leaderboard.apply((user_id, new_balance) for user_id, old_balance, new_balance in balances)
+        worker._rows += len(chunk)
+        logger.info(f"Job {job['id']}: applied rows {offset}-{offset + len(chunk) - 1} in {time.monotonic() - started:.2f}s")
+        if worker.outbox:
+            worker.outbox.wake()
+
+BULK_MESSAGE_TYPES = {'set': "points_set", 'add': "points_added", 'remove': "points_removed"}
+
+def bulk_points_message(action: str, old_balance: int, new_balance: int, reason: str = None) -> str:
+    """DM text for a bulk points change"""
+    change = new_balance - old_balance
+    if action == 'set':
+        return f"🔄 **Points Set**\n\nYour points have been set to **{new_balance:,} points**.\n\n📝 **Reason:** {reason or 'Admin adjustment'}"
+    if action == 'add':
+        return f"➕ **Points Added**\n\nYou received **+{change:,} points**!\n\n💰 **New Total:** {new_balance:,} points\n📝 **Reason:** {reason or 'Admin bonus'}"
+    return f"➖ **Points Removed**\n\n**{-change:,} points** have been deducted.\n\n💰 **New Total:** {new_balance:,} points\n📝 **Reason:** {reason or 'Admin adjustment'}"
+
+@job_handler("bulk_email_action")
+async def run_bulk_email_action(worker: JobWorker, job: dict):
+    """Mark email submissions processed or delete them, in chunks"""
+    payload = job['payload']
+    action = payload['action']
+    submission_ids = payload['submission_ids']
+
+    if action == 'process':
+        query = '''
+            UPDATE email_submissions
+            SET status = 'processed', processed_at = CURRENT_TIMESTAMP
+            WHERE id = ANY($1::int[])
+            RETURNING id
+        '''
+    else:
+        query = 'DELETE FROM email_submissions WHERE id = ANY($1::int[]) RETURNING id'
+
+    for offset in range(job['processed'], len(submission_ids), Config.JOB_CHUNK_SIZE):
+        chunk = [int(submission_id) for submission_id in submission_ids[offset:offset + Config.JOB_CHUNK_SIZE]]
+        async with worker.db.pool.acquire() as conn:
+            async with conn.transaction():
+                done = {row['id'] for row in await conn.fetch(query, chunk)}
+                results = [
+                    (index, str(submission_id), submission_id in done,
+                     None if submission_id in done else {"error": "Submission not found"})
+                    for index, submission_id in enumerate(chunk, start=offset)
+                ]
+                await worker.db.record_job_progress(conn, job, offset, offset + len(chunk), results)
+        worker._rows += len(chunk)
+
+@job_handler("clear_processed_emails")
+async def run_clear_processed_emails(worker: JobWorker, job: dict):
+    """Delete processed email submissions in chunks until none are left"""
+    processed = job['processed']
+    while True:
+        async with worker.db.pool.acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch('''
+                    DELETE FROM email_submissions
+                    WHERE id IN (
+                        SELECT id FROM email_submissions WHERE status = 'processed'
+                        ORDER BY id
+                        LIMIT $1
+                    )
+                    RETURNING id
+                ''', Config.JOB_CHUNK_SIZE)
+                if not rows:
+                    break
+                results = [(index, str(row['id']), True, None) for index, row in enumerate(rows, start=processed)]
+                await worker.db.record_job_progress(conn, job, processed, processed + len(rows), results)
+                processed += len(rows)
+        worker._rows += len(rows)
+
+    # Rows may have been processed by admins after the job was queued
+    if processed != job['total']:
+        await worker.db.set_job_total(job['id'], processed)
@@ -0,0 +1,129 @@
+"""
+Rendered leaderboard pages for /pointsboard.
+
+Page bodies (the ranking lines with resolved usernames) are cached per guild,
+page size and page number. The leaderboard index reports the first position
+each write moved, and only pages at or below that position are dropped, so a
+repeat /pointsboard costs no database queries and no Discord API calls. The
+totals header is read from the index, which is already in memory.
+"""
+
+import logging
+import threading
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from leaderboard_index import leaderboard
+
+logger = logging.getLogger(__name__)
+
+MEDALS = {1: "🥇", 2: "🥈", 3: "🥉"}
+
+class LeaderboardPageCache:
+    """Cache of rendered leaderboard pages with write-driven invalidation"""
+
+    def __init__(self, index):
+        self.index = index
+        self._lock = threading.Lock()
+        self._pages = {}  # (guild_id, page_size, page) -> rendered ranking lines
+        self._names = {}  # (guild_id, user_id) -> display name
+        self._unresolved = set()  # user ids rendered with the "User <id>" fallback
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        index.add_listener(self.invalidate_from)
+
+    def invalidate_from(self, position: int):
+        """Drop pages that show leaderboard position `position` (0-based) or anything after it"""
+        with self._lock:
+            self._generation += 1
+            stale = [key for key in self._pages if (key[2] + 1) * key[1] > position]
+            for key in stale:
+                del self._pages[key]
+            self.invalidations += len(stale)
+
+    def forget_name(self, user_id):
+        """Drop a cached username so the next render resolves it again"""
+        user_id = str(user_id)
+        with self._lock:
+            stale = [key for key in self._names if key[1] == user_id]
+            if not stale and user_id not in self._unresolved:
+                return
+            for key in stale:
+                del self._names[key]
+            self._unresolved.discard(user_id)
+            self._pages.clear()
+            self._generation += 1
+
+    def page_count(self, page_size: int) -> int:
+        return max(1, -(-self.index.count_positive() // page_size))
+
+    async def get_page(self, guild_id: Optional[int], page_size: int, page: int,
+                       resolve_names: Callable[[List[str]], Awaitable[Dict[str, str]]]) -> Tuple[Optional[str], int]:
+        """Return (embed description, page count); description is None when nobody has points"""
+        page_count = self.page_count(page_size)
+        page = min(max(page, 0), page_count - 1)
+        key = (guild_id, page_size, page)
+
+        with self._lock:
+            body = self._pages.get(key)
+            generation = self._generation
+        if body is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            body = await self._render(guild_id, page_size, page, resolve_names)
+            if body is None:
+                return None, page_count
+            with self._lock:
+                # Don't store a page that a write invalidated while names were resolving
+                if generation == self._generation:
+                    self._pages[key] = body
+
+        total_users, total_points = self.index.totals()
+        description = f"📊 **Database Overview:**\n"
+        description += f"👥 Total Users: {total_users:,}\n"
+        description += f"💰 Total Points: {total_points:,}\n\n"
+        return description + body, page_count
+
+    async def _render(self, guild_id: Optional[int], page_size: int, page: int, resolve_names) -> Optional[str]:
+        start = page * page_size
+        entries = self.index.top(page_size, offset=start)
+        if not entries:
+            return None
+
+        # Resolve every name the page needs in one call
+        with self._lock:
+            names = {user_id: self._names.get((guild_id, user_id)) for user_id, _ in entries}
+        missing = [user_id for user_id, name in names.items() if name is None]
+        if missing:
+            resolved = await resolve_names(missing)
+            with self._lock:
+                for user_id in missing:
+                    if resolved.get(user_id):
+                        names[user_id] = self._names[(guild_id, user_id)] = resolved[user_id]
+                    else:
+                        self._unresolved.add(user_id)
+
+        if page == 0:
+            body = f"🏆 **Top {len(entries)} Rankings:**\n"
+        else:
+            body = f"🏆 **Rankings {start + 1:,}-{start + len(entries):,}:**\n"
+
+        for position, (user_id, balance) in enumerate(entries, start + 1):
+            username = names[user_id] or f"User {user_id}"
+            body += f"{MEDALS.get(position, f'{position}.')} **{username}** - {balance:,} points\n"
+        return body
+
+    def get_stats(self) -> dict:
+        """Hit/miss counters for the metrics endpoint"""
+        with self._lock:
+            return {
+                "pages": len(self._pages),
+                "names": len(self._names),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidated_pages": self.invalidations
+            }
+
+# Shared instance fed by the process-wide leaderboard index
+page_cache = LeaderboardPageCache(leaderboard)
@@ -0,0 +1,294 @@
+"""
+In-process order-statistic index of point balances.
+
+Keeps every (balance, user_id) pair in an indexable skip list so rank, top-N,
+"users around me" and percentile lookups are O(log n) instead of a COUNT(*)
+over the points table. The index is loaded once when the first database pool
+starts, updated by every points write path after it commits, and periodically
+resynced to pick up changes made outside this process (import scripts etc.).
+
+The bot loop and the dashboard loop both write to it, so all access goes
+through one lock.
+"""
+
+import logging
+import random
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class _Node:
+    __slots__ = ('value', 'next', 'width')
+
+    def __init__(self, value, levels: int):
+        self.value = value
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+class IndexableSkiplist:
+    """Sorted list with O(log n) insert, remove, index lookup and bisect
+
+    Each link stores how many level-0 steps it spans, which is what makes
+    positional lookups logarithmic.
+    """
+
+    MAX_LEVELS = 32
+
+    def __init__(self):
+        self.size = 0
+        self.levels = 1  # levels in use; searches skip the empty ones above
+        self.head = _Node(None, self.MAX_LEVELS)
+
+    def __len__(self):
+        return self.size
+
+    def _random_levels(self) -> int:
+        levels = 1
+        while levels < self.MAX_LEVELS and random.random() < 0.5:
+            levels += 1
+        return levels
+
+    def insert(self, value):
+        levels = self._random_levels()
+        if levels > self.levels:
+            for level in range(self.levels, levels):
+                self.head.width[level] = self.size + 1
+            self.levels = levels
+
+        chain = [None] * self.levels
+        steps_at_level = [0] * self.levels
+        node = self.head
+        for level in reversed(range(self.levels)):
+            while node.next[level] is not None and node.next[level].value < value:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        new_node = _Node(value, levels)
+        steps = 0
+        for level in range(levels):
+            prev = chain[level]
+            new_node.next[level] = prev.next[level]
+            prev.next[level] = new_node
+            new_node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, self.levels):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, value):
+        chain = [None] * self.levels
+        node = self.head
+        for level in reversed(range(self.levels)):
+            while node.next[level] is not None and node.next[level].value < value:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target is None or target.value != value:
+            raise KeyError(value)
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), self.levels):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def bisect_left(self, value) -> int:
+        """Number of items smaller than value"""
+        position = 0
+        node = self.head
+        for level in reversed(range(self.levels)):
+            while node.next[level] is not None and node.next[level].value < value:
+                position += node.width[level]
+                node = node.next[level]
+        return position
+
+    def _node_at(self, index: int):
+        node = self.head
+        remaining = index + 1
+        for level in reversed(range(self.levels)):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def __getitem__(self, index: int):
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        return self._node_at(index).value
+
+    def slice(self, start: int, stop: int) -> list:
+        """Items in positions [start, stop) - one O(log n) seek then a linear walk"""
+        start = max(start, 0)
+        stop = min(stop, self.size)
+        if start >= stop:
+            return []
+        node = self._node_at(start)
+        items = []
+        while node is not None and len(items) < stop - start:
+            items.append(node.value)
+            node = node.next[0]
+        return items
+
+class LeaderboardIndex:
+    """Thread-safe balance ranking shared by the bot and dashboard"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = IndexableSkiplist()  # (-balance, user_id): highest balance first
+        self._balances = {}
+        self._total_points = 0
+        self._pending = None  # updates recorded while a reload is reading the table
+        self._listeners = []
+        self.loaded = False
+        self.version = 0
+
+    def add_listener(self, callback):
+        """Call callback(position) after a change, with the first leaderboard position it moved"""
+        self._listeners.append(callback)
+
+    def _notify(self, position: Optional[int]):
+        if position is None:
+            return
+        for callback in self._listeners:
+            try:
+                callback(position)
+            except Exception as e:
+                logger.error(f"Error in leaderboard index listener: {e}")
+
+    def begin_reload(self) -> bool:
+        """Start recording updates before the points table is read; False if a reload is running"""
+        with self._lock:
+            if self._pending is not None:
+                return False
+            self._pending = {}
+            return True
+
+    def cancel_reload(self):
+        with self._lock:
+            self._pending = None
+
+    def finish_reload(self, rows: Iterable[Tuple[str, int]]):
+        """Replace the index with a fresh snapshot plus any updates made while it was read"""
+        # Build outside the lock so readers and writers aren't held up by a large reload
+        entries = IndexableSkiplist()
+        balances = {}
+        for user_id, balance in rows:
+            balances[str(user_id)] = balance or 0
+        for user_id, balance in balances.items():
+            entries.insert((-balance, user_id))
+
+        with self._lock:
+            pending = self._pending or {}
+            self._pending = None
+            unchanged = self.loaded and balances == self._balances
+            if not unchanged:
+                self._entries = entries
+                self._balances = balances
+                self._total_points = sum(balances.values())
+                self.version += 1
+            changed_from = self._apply_locked(pending.items())
+            self.loaded = True
+        self._notify(changed_from if unchanged else 0)
+        logger.info(f"Leaderboard index loaded with {len(balances)} users")
+
+    def update(self, user_id, balance: int):
+        """Record a committed balance"""
+        self.apply([(user_id, balance)])
+
+    def apply(self, balances: Iterable[Tuple[str, int]]):
+        """Record several committed balances"""
+        with self._lock:
+            if self._pending is not None:
+                balances = list(balances)
+                for user_id, balance in balances:
+                    self._pending[str(user_id)] = balance
+            changed_from = self._apply_locked(balances)
+        self._notify(changed_from)
+
+    def _apply_locked(self, balances) -> Optional[int]:
+        """Apply balances and return the first position that moved (None if nothing changed)"""
+        changed_from = None
+        for user_id, balance in balances:
+            user_id = str(user_id)
+            old_balance = self._balances.get(user_id)
+            if old_balance == balance:
+                continue
+            position = self._entries.size
+            if old_balance is not None:
+                position = self._entries.bisect_left((-old_balance, user_id))
+                self._entries.remove((-old_balance, user_id))
+                self._total_points -= old_balance
+            self._entries.insert((-balance, user_id))
+            position = min(position, self._entries.bisect_left((-balance, user_id)))
+            changed_from = position if changed_from is None else min(changed_from, position)
+            self._balances[user_id] = balance
+            self._total_points += balance
+            self.version += 1
+        return changed_from
+
+    def get_balance(self, user_id) -> Optional[int]:
+        with self._lock:
+            return self._balances.get(str(user_id))
+
+    def rank(self, user_id) -> Optional[int]:
+        """1 + number of users with a strictly higher balance (ties share a rank)"""
+        with self._lock:
+            balance = self._balances.get(str(user_id))
+            if balance is None:
+                return None
+            return self._entries.bisect_left((-balance, '')) + 1
+
+    def percentile(self, user_id) -> Optional[float]:
+        """Share of users with a lower balance, 0-100"""
+        with self._lock:
+            balance = self._balances.get(str(user_id))
+            if balance is None or not self._entries.size:
+                return None
+            at_or_above = self._entries.bisect_left((-balance + 1, ''))
+            return round((self._entries.size - at_or_above) * 100 / self._entries.size, 1)
+
+    def top(self, limit: int, offset: int = 0, positive_only: bool = True) -> List[Tuple[str, int]]:
+        """(user_id, balance) in leaderboard order"""
+        with self._lock:
+            entries = self._entries.slice(offset, offset + limit)
+        return [(user_id, -negative) for negative, user_id in entries if not positive_only or -negative > 0]
+
+    def around(self, user_id, radius: int = 2) -> List[Tuple[int, str, int]]:
+        """(position, user_id, balance) for the users just above and below a user"""
+        with self._lock:
+            balance = self._balances.get(str(user_id))
+            if balance is None:
+                return []
+            position = self._entries.bisect_left((-balance, str(user_id)))
+            start = max(position - radius, 0)
+            entries = self._entries.slice(start, position + radius + 1)
+        return [(start + i + 1, entry_user_id, -negative) for i, (negative, entry_user_id) in enumerate(entries)]
+
+    def count_positive(self) -> int:
+        """Users with a balance above zero (the leaderboard's population)"""
+        with self._lock:
+            return self._entries.bisect_left((0, ''))
+
+    def totals(self) -> Tuple[int, int]:
+        """(total users, total points)"""
+        with self._lock:
+            return self._entries.size, self._total_points
+
+    def get_stats(self) -> dict:
+        """Index size for the metrics endpoint"""
+        with self._lock:
+            return {
+                "loaded": self.loaded,
+                "users": self._entries.size,
+                "total_points": self._total_points,
+                "version": self.version,
+                "reloading": self._pending is not None
+            }
+
+# Shared instance updated by every PostgreSQLPointsDatabase in the process
+leaderboard = LeaderboardIndex()
@@ -0,0 +1,167 @@
+"""
+Batched SendGrid delivery of "points available" emails.
+
+Recipients are grouped into SendGrid personalizations (up to 1000 per request)
+with per-recipient substitutions, so the message body is rendered once per
+batch instead of once per order. All requests go through one pooled aiohttp
+session with a bounded number of batches in flight, which keeps the event loop
+free. SENDGRID_API_HOST points the mailer at a local fake endpoint for testing.
+"""
+
+import asyncio
+import logging
+import math
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional
+import aiohttp
+from sendgrid.helpers.mail import Mail, Email, Content, Personalization, Substitution, To
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# SendGrid's limit on personalizations per mail/send request
+MAX_PERSONALIZATIONS = 1000
+
+# Attempts per batch for rate limits (429) and server errors (5xx)
+MAX_ATTEMPTS = 3
+
+SUBJECT = "Discord Points Available - Order -order_id-"
+
+HTML_TEMPLATE = """
+<div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
+    <h2 style="color: #5865F2;">Discord Points Available!</h2>
+
+    <p>Hello!</p>
+
+    <p>Your order <strong>-order_id-</strong> qualifies for <strong>-points- Discord points</strong> in our -server_name-!</p>
+
+    <div style="background: #f0f0f0; padding: 20px; border-radius: 8px; margin: 20px 0;">
+        <h3>How to claim your points:</h3>
+        <ol>
+            <li>Join our Discord server if you haven't already</li>
+            <li>Use this command in any channel:</li>
+            <code style="background: #2f3136; color: #ffffff; padding: 10px; display: block; border-radius: 4px; margin: 10px 0;">
+                /claim -code-
+            </code>
+            <li>Your -points- points will be added automatically!</li>
+        </ol>
+    </div>
+
+    <p><strong>Verification Code:</strong> <code>-code-</code></p>
+
+    <p style="color: #666; font-size: 14px;">
+        This code is unique to your order and can only be used once.
+        If you have any questions, please contact our support team.
+    </p>
+
+    <hr style="margin: 30px 0;">
+    <p style="color: #888; font-size: 12px;">
+        This email was sent because your order qualifies for Discord points.
+        If you believe this was sent in error, please ignore this message.
+    </p>
+</div>
+"""
+
+TEXT_TEMPLATE = """
+Discord Points Available!
+
+Your order -order_id- qualifies for -points- Discord points in our -server_name-!
+
+To claim your points:
+1. Join our Discord server
+2. Use the command: /claim -code-
+3. Your -points- points will be added automatically!
+
+Verification Code: -code-
+
+This code is unique to your order and can only be used once.
+"""
+
+def build_batch(notifications: List[Dict], server_name: str, from_email: str) -> dict:
+    """mail/send request body with one personalization per notification"""
+    message = Mail(from_email=Email(from_email), subject=SUBJECT)
+    for notification in notifications:
+        personalization = Personalization()
+        personalization.add_to(To(notification['email']))
+        for key, value in (('-order_id-', notification['order_id']), ('-points-', notification['points_amount']),
+                           ('-code-', notification['verification_code']), ('-server_name-', server_name)):
+            personalization.add_substitution(Substitution(key, str(value)))
+        message.add_personalization(personalization)
+    message.content = [Content("text/plain", TEXT_TEMPLATE), Content("text/html", HTML_TEMPLATE)]
+    return message.get()
+
+def retry_after_seconds(value: Optional[str], default: float) -> float:
+    """Seconds to wait from a Retry-After header (delay-seconds or HTTP-date), default if missing or unreadable"""
+    if not value:
+        return default
+    try:
+        seconds = float(value)
+    except ValueError:
+        pass
+    else:
+        return max(seconds, 0) if math.isfinite(seconds) else default
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0)
+
+class PointNotificationMailer:
+    """Pooled, concurrency-limited SendGrid client; use as an async context manager"""
+
+    def __init__(self, api_key: str, host: str = None, batch_size: int = None, concurrency: int = None,
+                 from_email: str = None):
+        self.api_key = api_key
+        self.url = (host or Config.SENDGRID_API_HOST).rstrip('/') + '/v3/mail/send'
+        self.batch_size = min(batch_size or Config.SENDGRID_BATCH_SIZE, MAX_PERSONALIZATIONS)
+        self.concurrency = concurrency or Config.SENDGRID_CONCURRENCY
+        self.from_email = from_email or Config.SENDGRID_FROM_EMAIL
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._session = None
+        self.sent = 0
+        self.failed = 0
+        self.requests = 0
+
+    async def __aenter__(self):
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            timeout=aiohttp.ClientTimeout(total=60)
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._session.close()
+        self._session = None
+
+    async def send_batch(self, notifications: List[Dict], server_name: str) -> bool:
+        """Send one batch (at most batch_size recipients) in a single request"""
+        body = build_batch(notifications, server_name, self.from_email)
+        async with self._semaphore:
+            for attempt in range(1, MAX_ATTEMPTS + 1):
+                try:
+                    self.requests += 1
+                    async with self._session.post(self.url, json=body) as response:
+                        if response.status == 202:
+                            self.sent += len(notifications)
+                            return True
+                        error = f"HTTP {response.status}: {(await response.text())[:200]}"
+                        retry = response.status == 429 or response.status >= 500
+                        delay = retry_after_seconds(response.headers.get('Retry-After'), 2 ** attempt)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error, retry, delay = str(e) or type(e).__name__, True, 2 ** attempt
+                if not retry or attempt == MAX_ATTEMPTS:
+                    break
+                logger.warning(f"SendGrid batch of {len(notifications)} failed ({error}), retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+        logger.error(f"SendGrid batch of {len(notifications)} failed: {error}")
+        self.failed += len(notifications)
+        return False
+
+    async def send_all(self, notifications: List[Dict], server_name: str) -> List[bool]:
+        """Split notifications into batches and send them concurrently; one result per batch"""
+        batches = [notifications[i:i + self.batch_size] for i in range(0, len(notifications), self.batch_size)]
+        return await asyncio.gather(*(self.send_batch(batch, server_name) for batch in batches))
@@ -1,82 +1,170 @@
 import csv
+import itertools
 import os
 import logging
-from typing import Dict, List, Optional
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail, Email, To, Content
-from database import PointsDatabase
+import secrets
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+from points_store import PointsStore, create_points_store
+from notification_mailer import PointNotificationMailer
+from idempotency import run_idempotent
 
 logger = logging.getLogger(__name__)
 
+# Orders written to point_requests per statement while importing a file
+ORDER_CHUNK_SIZE = 1000
+
+# Rejected rows listed in the import result (all of them are logged and counted)
+MAX_REPORTED_REJECTS = 100
+
+# Header substrings for each column, checked in this order; the first header that matches wins
+ORDER_COLUMNS = (
+    ('email', ('email', 'mail')),
+    ('order_id', ('order', 'id')),
+    ('amount', ('amount', 'total', 'price', 'cost')),
+)
+
+class OrderFileError(Exception):
+    """The order file can't be imported at all (e.g. no email column)"""
+
+def resolve_order_columns(header: List[str]) -> Dict[str, Optional[int]]:
+    """Map email/order_id/amount to column positions from the header row"""
+    columns = {name: None for name, _ in ORDER_COLUMNS}
+    for position, key in enumerate(header):
+        key_lower = key.lower().strip()
+        for name, terms in ORDER_COLUMNS:
+            if any(term in key_lower for term in terms):
+                if columns[name] is None:
+                    columns[name] = position
+                break
+    return columns
+
+def parse_amount(value: str) -> Optional[float]:
+    try:
+        return float(value.replace('$', '').replace(',', '').strip())
+    except ValueError:
+        return None
+
+def iter_orders(csvfile, points_per_order: int, reject: Callable[[int, str], None]) -> Iterator[dict]:
+    """Yield one order per valid row; rows without a usable email go to reject(row_num, reason)"""
+    sample = csvfile.read(1024)
+    csvfile.seek(0)
+    delimiter = ';' if ';' in sample and sample.count(';') > sample.count(',') else ','
+    
+    reader = csv.reader(csvfile, delimiter=delimiter)
+    header = next(reader, None)
+    if not header:
+        raise OrderFileError("Order file is empty")
+    columns = resolve_order_columns(header)
+    if columns['email'] is None:
+        raise OrderFileError(f"No email column found in header: {', '.join(header)}")
+    
+    def field(row, name):
+        position = columns[name]
+        return row[position].strip() if position is not None and position < len(row) else ''
+    
+    for row_num, row in enumerate(reader, start=2):
+        if not any(row):
+            continue
+        email = field(row, 'email')
+        if '@' not in email:
+            reject(row_num, "No valid email found")
+            continue
+        order_amount = parse_amount(field(row, 'amount')) if columns['amount'] is not None else None
+        yield {
+            'email': email,
+            'order_id': field(row, 'order_id') or f"Order-{row_num}",
+            'order_amount': order_amount or 0,
+            # 1 amount = 1 point, falling back to the flat rate
+            'points': int(order_amount) if order_amount and order_amount > 0 else points_per_order,
+            'row': row_num
+        }
+
+def new_point_requests(orders: List[dict]) -> List[tuple]:
+    """(email, order_id, points_amount, verification_code) rows with fresh codes"""
+    return [(order['email'], order['order_id'], order['points'], secrets.token_urlsafe(8)) for order in orders]
+
+def chunked(items: Iterable, size: int) -> Iterator[list]:
+    """Group an iterable into lists of at most size items"""
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
 class OrderProcessor:
-    def __init__(self):
+    """Order import, notification and claim flow on a long-lived points store
+
+    Pass the bot's database (bot.db) so claims land in the store /mypoints reads;
+    otherwise Config.POINTS_BACKEND picks one. The store is opened on first use and
+    stays open until close().
+    """
+
+    def __init__(self, db: PointsStore = None):
         self.sendgrid_key = os.environ.get('SENDGRID_API_KEY')
         if not self.sendgrid_key:
             logger.warning("SENDGRID_API_KEY not found. Email functionality will be disabled.")
         
-        self.db = PointsDatabase()
+        self.db = db or create_points_store()
+    
+    async def close(self):
+        await self.db.close()
+        
+    async def process_order_file(self, file_path: str, points_per_order: int = 100,
+                                 chunk_size: int = ORDER_CHUNK_SIZE,
+                                 on_progress: Callable[[dict], None] = None) -> Dict[str, any]:
+        """Stream a CSV order file into point_requests, chunk_size orders per write
+
+        Only one chunk of orders is held at a time. on_progress, if given, is called after
+        every chunk with running counts and that chunk's rejected rows. Re-importing the
+        same file is safe: (email, order_id) pairs already stored are skipped.
+        """
+        if not os.path.exists(file_path):
+            return {"success": False, "error": f"File not found: {file_path}"}
+        
+        progress = {"orders_found": 0, "stored": 0, "duplicates": 0, "rejected": 0, "chunks": 0}
+        rejects = []  # the first MAX_REPORTED_REJECTS, for the result
+        
+        def reject(row_num: int, reason: str):
+            logger.warning(f"Row {row_num}: {reason}")
+            progress["rejected"] += 1
+            chunk_rejects.append({"row": row_num, "reason": reason})
+            if len(rejects) < MAX_REPORTED_REJECTS:
+                rejects.append({"row": row_num, "reason": reason})
         
-    async def process_order_file(self, file_path: str, points_per_order: int = 100) -> Dict[str, any]:
-        """Process a CSV order file and prepare point distribution"""
         try:
-            if not os.path.exists(file_path):
-                return {"success": False, "error": f"File not found: {file_path}"}
-            
-            orders = []
-            with open(file_path, 'r', newline='', encoding='utf-8') as csvfile:
-                # Try to detect the CSV format
-                sample = csvfile.read(1024)
-                csvfile.seek(0)
-                
-                # Common delimiters
-                delimiter = ','
-                if ';' in sample and sample.count(';') > sample.count(','):
-                    delimiter = ';'
-                
-                reader = csv.DictReader(csvfile, delimiter=delimiter)
-                
-                for row_num, row in enumerate(reader, start=2):
-                    # Look for email and amount columns (case insensitive)
-                    email = None
-                    order_id = None
-                    order_amount = None
+            await self.db.initialize()
+            with open(file_path, 'r', newline='', encoding='utf-8-sig') as csvfile:
+                chunk_rejects = []
+                for chunk in chunked(iter_orders(csvfile, points_per_order, reject), chunk_size):
+                    progress["orders_found"] += len(chunk)
                     
-                    for key, value in row.items():
-                        key_lower = key.lower().strip()
-                        if 'email' in key_lower or 'mail' in key_lower:
-                            email = value.strip()
-                        elif 'order' in key_lower or 'id' in key_lower:
-                            order_id = value.strip()
-                        elif any(term in key_lower for term in ['amount', 'total', 'price', 'cost']):
-                            try:
-                                order_amount = float(str(value).replace('$', '').replace(',', '').strip())
-                            except:
-                                order_amount = None
+                    stored = await self.db.insert_point_requests(new_point_requests(chunk))
+                    progress["stored"] += stored
+                    progress["duplicates"] += len(chunk) - stored
+                    progress["chunks"] += 1
                     
-                    if email and '@' in email:
-                        # Calculate points: 1 amount = 1 point
-                        calculated_points = int(order_amount) if order_amount and order_amount > 0 else points_per_order
-                        
-                        orders.append({
-                            'email': email,
-                            'order_id': order_id or f"Order-{row_num}",
-                            'order_amount': order_amount or 0,
-                            'points': calculated_points,
-                            'row': row_num
-                        })
-                    else:
-                        logger.warning(f"Row {row_num}: No valid email found")
+                    if on_progress:
+                        on_progress({**progress, "rejects": chunk_rejects})
+                    chunk_rejects = []
+                
+                if chunk_rejects and on_progress:
+                    # Rejects after the last full chunk
+                    on_progress({**progress, "rejects": chunk_rejects})
             
             return {
                 "success": True,
-                "orders_found": len(orders),
-                "orders": orders,
-                "message": f"Found {len(orders)} valid orders with email addresses"
+                **progress,
+                "rejects": rejects,
+                "message": f"Stored {progress['stored']} of {progress['orders_found']} valid orders "
+                           f"({progress['duplicates']} already imported, {progress['rejected']} rows rejected)"
             }
             
+        except OrderFileError as e:
+            return {"success": False, "error": str(e)}
         except Exception as e:
             logger.error(f"Error processing order file: {e}")
-            return {"success": False, "error": str(e)}
+            return {"success": False, "error": str(e), **progress}
     
     async def create_point_requests(self, orders: List[Dict], server_name: str = "Discord Server") -> Dict[str, any]:
         """Create point request records and send notification emails"""
@@ -84,230 +172,101 @@ class OrderProcessor:
             if not self.sendgrid_key:
                 return {"success": False, "error": "SendGrid API key not configured"}
             
-            # Initialize database
             await self.db.initialize()
-            
-            # Create point_requests table if it doesn't exist
-            await self.db.conn.execute('''
-                CREATE TABLE IF NOT EXISTS point_requests (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    email TEXT NOT NULL,
-                    order_id TEXT NOT NULL,
-                    points_amount INTEGER NOT NULL,
-                    discord_user_id INTEGER,
-                    status TEXT DEFAULT 'pending',
-                    verification_code TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    processed_at TIMESTAMP,
-                    UNIQUE(email, order_id)
-                )
-            ''')
-            
-            successful_emails = 0
-            failed_emails = 0
-            
-            for order in orders:
-                try:
-                    # Generate verification code
-                    import secrets
-                    verification_code = secrets.token_urlsafe(8)
-                    
-                    # Insert request into database
-                    await self.db.conn.execute('''
-                        INSERT OR REPLACE INTO point_requests 
-                        (email, order_id, points_amount, verification_code)
-                        VALUES (?, ?, ?, ?)
-                    ''', (order['email'], order['order_id'], order['points'], verification_code))
+            for chunk in chunked(orders, ORDER_CHUNK_SIZE):
+                await self.db.insert_point_requests(new_point_requests(chunk))
+        except Exception as e:
+            logger.error(f"Error creating point requests: {e}")
+            return {"success": False, "error": str(e)}
+        
+        return await self.send_pending_notifications(server_name)
+    
+    async def send_pending_notifications(self, server_name: str = "Discord Server") -> Dict[str, any]:
+        """Email every pending point request that hasn't been notified yet
+
+        Requests are read concurrency * batch_size at a time and sent as concurrent
+        SendGrid batches; only requests in batches SendGrid accepted are marked notified,
+        so a rerun retries the rest.
+        """
+        if not self.sendgrid_key:
+            return {"success": False, "error": "SendGrid API key not configured"}
+        
+        try:
+            await self.db.initialize()
+            async with PointNotificationMailer(self.sendgrid_key) as mailer:
+                after_id = 0
+                while True:
+                    notifications = await self.db.get_unnotified_point_requests(
+                        after_id, mailer.batch_size * mailer.concurrency
+                    )
+                    if not notifications:
+                        break
+                    after_id = notifications[-1]['id']
                     
-                    # Send email notification
-                    if await self.send_point_notification(
-                        order['email'], 
-                        order['order_id'], 
-                        order['points'], 
-                        verification_code,
-                        server_name
-                    ):
-                        successful_emails += 1
-                    else:
-                        failed_emails += 1
-                        
-                except Exception as e:
-                    logger.error(f"Error processing order {order['order_id']}: {e}")
-                    failed_emails += 1
-            
-            await self.db.conn.commit()
-            await self.db.close()
+                    results = await mailer.send_all(notifications, server_name)
+                    await self.db.mark_point_requests_notified([
+                        notification['id']
+                        for ok, start in zip(results, range(0, len(notifications), mailer.batch_size)) if ok
+                        for notification in notifications[start:start + mailer.batch_size]
+                    ])
+                    logger.info(f"Order notifications: {mailer.sent} sent, {mailer.failed} failed so far")
             
             return {
                 "success": True,
-                "emails_sent": successful_emails,
-                "emails_failed": failed_emails,
-                "message": f"Sent {successful_emails} notifications, {failed_emails} failed"
+                "emails_sent": mailer.sent,
+                "emails_failed": mailer.failed,
+                "requests": mailer.requests,
+                "message": f"Sent {mailer.sent} notifications, {mailer.failed} failed"
             }
             
         except Exception as e:
-            logger.error(f"Error creating point requests: {e}")
+            logger.error(f"Error sending point request notifications: {e}")
             return {"success": False, "error": str(e)}
     
     async def send_point_notification(self, email: str, order_id: str, points: int, verification_code: str, server_name: str) -> bool:
         """Send email notification about available points"""
         try:
-            sg = SendGridAPIClient(self.sendgrid_key)
-            
-            # Email content
-            subject = f"Discord Points Available - Order {order_id}"
-            
-            html_content = f"""
-            <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
-                <h2 style="color: #5865F2;">Discord Points Available!</h2>
-                
-                <p>Hello!</p>
-                
-                <p>Your order <strong>{order_id}</strong> qualifies for <strong>{points} Discord points</strong> in our {server_name}!</p>
-                
-                {f'<p style="color: #666;">Order Amount: <strong>${order_amount:.2f}</strong></p>' if hasattr(locals(), 'order_amount') and order_amount else ''}
-                
-                <div style="background: #f0f0f0; padding: 20px; border-radius: 8px; margin: 20px 0;">
-                    <h3>How to claim your points:</h3>
-                    <ol>
-                        <li>Join our Discord server if you haven't already</li>
-                        <li>Use this command in any channel:</li>
-                        <code style="background: #2f3136; color: #ffffff; padding: 10px; display: block; border-radius: 4px; margin: 10px 0;">
-                            !claim {verification_code}
-                        </code>
-                        <li>Your {points} points will be added automatically!</li>
-                    </ol>
-                </div>
-                
-                <p><strong>Verification Code:</strong> <code>{verification_code}</code></p>
-                
-                <p style="color: #666; font-size: 14px;">
-                    This code is unique to your order and can only be used once.
-                    If you have any questions, please contact our support team.
-                </p>
-                
-                <hr style="margin: 30px 0;">
-                <p style="color: #888; font-size: 12px;">
-                    This email was sent because your order qualifies for Discord points.
-                    If you believe this was sent in error, please ignore this message.
-                </p>
-            </div>
-            """
-            
-            text_content = f"""
-            Discord Points Available!
-            
-            Your order {order_id} qualifies for {points} Discord points in our {server_name}!
-            
-            To claim your points:
-            1. Join our Discord server
-            2. Use the command: !claim {verification_code}
-            3. Your {points} points will be added automatically!
-            
-            Verification Code: {verification_code}
-            
-            This code is unique to your order and can only be used once.
-            """
-            
-            message = Mail(
-                from_email=Email("noreply@yourdomain.com"),  # Replace with your verified sender
-                to_emails=To(email),
-                subject=subject
-            )
-            
-            message.content = [
-                Content("text/plain", text_content),
-                Content("text/html", html_content)
-            ]
-            
-            response = sg.send(message)
-            logger.info(f"Email sent to {email} for order {order_id}, status: {response.status_code}")
-            return response.status_code == 202
-            
+            async with PointNotificationMailer(self.sendgrid_key) as mailer:
+                return await mailer.send_batch([{
+                    "email": email, "order_id": order_id, "points_amount": points, "verification_code": verification_code
+                }], server_name)
         except Exception as e:
             logger.error(f"Error sending email to {email}: {e}")
             return False
     
-    async def process_claim(self, verification_code: str, discord_user_id: int) -> Dict[str, any]:
-        """Process a point claim using verification code"""
-        try:
-            await self.db.initialize()
-            
-            # Find pending request
-            async with self.db.conn.execute('''
-                SELECT email, order_id, points_amount, status 
-                FROM point_requests 
-                WHERE verification_code = ? AND status = 'pending'
-            ''', (verification_code,)) as cursor:
-                request = await cursor.fetchone()
-            
-            if not request:
+    async def process_claim(self, verification_code: str, discord_user_id: int,
+                            idempotency_key: str = None) -> Dict[str, any]:
+        """Process a point claim using verification code
+
+        With an idempotency_key, a repeat of the same claim gets the first successful
+        result back instead of "already used".
+        """
+        verification_code = verification_code.strip()
+        
+        async def claim_points():
+            claim = await self.db.claim_point_request(verification_code, discord_user_id)
+            if claim is None:
                 return {"success": False, "error": "Invalid or already used verification code"}
             
-            email, order_id, points_amount, status = request
-            
-            # Update request status and assign user
-            await self.db.conn.execute('''
-                UPDATE point_requests 
-                SET status = 'completed', discord_user_id = ?, processed_at = CURRENT_TIMESTAMP
-                WHERE verification_code = ?
-            ''', (discord_user_id, verification_code))
-            
-            # Add points to user
-            success = await self.db.update_points(
-                discord_user_id, 
-                points_amount, 
-                0,  # System admin ID
-                f"Order reward: {order_id}"
-            )
-            
-            if success:
-                await self.db.conn.commit()
-                new_balance = await self.db.get_points(discord_user_id)
-                
-                return {
-                    "success": True,
-                    "points_added": points_amount,
-                    "new_balance": new_balance,
-                    "order_id": order_id,
-                    "message": f"Successfully claimed {points_amount} points for order {order_id}!"
-                }
-            else:
-                return {"success": False, "error": "Failed to add points to account"}
+            return {
+                "success": True,
+                "points_added": claim['points_amount'],
+                "new_balance": claim['new_balance'],
+                "order_id": claim['order_id'],
+                "message": f"Successfully claimed {claim['points_amount']} points for order {claim['order_id']}!"
+            }
+        
+        try:
+            await self.db.initialize()
+            return await run_idempotent(self.db, "process_claim", idempotency_key,
+                                        {"verification_code": verification_code, "user_id": str(discord_user_id)},
+                                        claim_points)
             
         except Exception as e:
             logger.error(f"Error processing claim {verification_code}: {e}")
             return {"success": False, "error": str(e)}
-        finally:
-            await self.db.close()
     
     async def get_pending_requests(self, limit: int = 50) -> List[Dict]:
         """Get list of pending point requests"""
-        try:
-            await self.db.initialize()
-            
-            async with self.db.conn.execute('''
-                SELECT email, order_id, points_amount, verification_code, created_at
-                FROM point_requests 
-                WHERE status = 'pending'
-                ORDER BY created_at DESC
-                LIMIT ?
-            ''', (limit,)) as cursor:
-                requests = await cursor.fetchall()
-            
-            return [
-                {
-                    "email": req[0],
-                    "order_id": req[1],
-                    "points_amount": req[2],
-                    "verification_code": req[3],
-                    "created_at": req[4]
-                }
-                for req in requests
-            ]
-            
-        except Exception as e:
-            logger.error(f"Error getting pending requests: {e}")
-            return []
-        finally:
-            await self.db.close()
\ No newline at end of file
+        await self.db.initialize()
+        return await self.db.get_pending_point_requests(limit)
@@ -0,0 +1,197 @@
+"""
+Backend-neutral interface to the points store.
+
+PointsStore is the contract shared by PostgreSQLPointsDatabase and the SQLite
+PointsDatabase: balances, the leaderboard, the transaction ledger,
+achievements and order point requests. Both implementations apply the same
+rules (every balance write logs a ledger row and updates user_stats in one
+transaction, user ids are returned as strings, timestamps as datetimes, and
+the in-process leaderboard index is updated after each commit), so code
+written against PointsStore behaves the same on either backend.
+Config.POINTS_BACKEND picks the backend for create_points_store.
+"""
+
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Set, Tuple
+from config import Config
+
+POINTS_BACKENDS = ('postgresql', 'sqlite')
+
+class PointsStore(ABC):
+    """Points, ledger, achievements and point requests for one backend"""
+
+    _earned_cache = None
+    _earned_cache_lock = threading.Lock()
+
+    @property
+    def earned_cache(self):
+        """This store's EarnedAchievementCache (see enhanced_achievements), created on first use"""
+        if self._earned_cache is None:
+            from enhanced_achievements import ACHIEVEMENT_RULES, EarnedAchievementCache
+            with self._earned_cache_lock:
+                if self._earned_cache is None:
+                    self._earned_cache = EarnedAchievementCache(ACHIEVEMENT_RULES)
+        return self._earned_cache
+
+    def _forget_earned(self, user_id=None):
+        """Drop cached earned achievements for one user (or everyone) after deleting or rewriting them"""
+        if self._earned_cache is None:
+            return
+        if user_id is None:
+            self._earned_cache.clear()
+        else:
+            self._earned_cache.forget(user_id)
+
+    @abstractmethod
+    async def initialize(self):
+        """Open the connection (or pool) and apply pending migrations; a no-op once open"""
+
+    @abstractmethod
+    async def close(self):
+        """Close the connection (or pool)"""
+
+    @abstractmethod
+    async def load_leaderboard_index(self):
+        """(Re)load the in-process leaderboard index from the points table"""
+
+    # Balances
+
+    @abstractmethod
+    async def get_points(self, user_id) -> int:
+        """Current balance, 0 for unknown users"""
+
+    @abstractmethod
+    async def change_points(self, user_id, amount: int, admin_id: int = None, reason: str = None,
+                            clamp_at_zero: bool = False, transaction_type: str = None,
+                            require_balance: bool = False) -> Optional[Tuple[int, int]]:
+        """Add (or subtract) points and return (old_balance, new_balance); None on error
+
+        With require_balance, a debit larger than the balance writes nothing and returns
+        (balance, balance).
+        """
+
+    @abstractmethod
+    async def assign_points(self, user_id, amount: int, admin_id: int = None,
+                            reason: str = None) -> Optional[Tuple[int, int]]:
+        """Set a balance and return (old_balance, new_balance); None on error"""
+
+    async def update_points(self, user_id, amount: int, admin_id: int = None, reason: str = None) -> bool:
+        """Update points for a user with transaction logging"""
+        return await self.change_points(user_id, amount, admin_id, reason) is not None
+
+    async def set_points(self, user_id, amount: int, admin_id: int = None, reason: str = None) -> bool:
+        """Set points for a user to a specific amount"""
+        return await self.assign_points(user_id, amount, admin_id, reason) is not None
+
+    # Leaderboard and totals
+
+    @abstractmethod
+    async def get_leaderboard(self, limit: int = 10) -> List[Tuple[str, int]]:
+        """(user_id, balance) of the top users with a positive balance"""
+
+    @abstractmethod
+    async def get_total_users(self) -> int:
+        """Number of users with a points row"""
+
+    @abstractmethod
+    async def get_total_points(self) -> int:
+        """Sum of all balances"""
+
+    # Ledger
+
+    @abstractmethod
+    async def get_transactions(self, user_id=None, limit: int = 10) -> List[Tuple]:
+        """(id, user_id, amount, transaction_type, admin_id, reason, old_balance, new_balance,
+        created_at), newest first, for one user or everyone"""
+
+    # Achievements
+
+    @abstractmethod
+    async def add_achievement(self, user_id, achievement_type: str, achievement_name: str,
+                              points_earned: int = 0) -> Optional[bool]:
+        """Add a manual achievement; False if the user already has it, None on error"""
+
+    @abstractmethod
+    async def get_achievements(self, limit: int = 10) -> List[Tuple]:
+        """(id, user_id, achievement_type, achievement_name, points_earned, earned_at), newest first"""
+
+    @abstractmethod
+    async def get_user_achievements(self, user_id) -> List[Dict]:
+        """achievement_type, achievement_name, points_earned, earned_at for one user, newest first"""
+
+    @abstractmethod
+    async def get_recent_achievements(self, limit: int = 10) -> List[Dict]:
+        """Recent achievements across all users, with the username where it is known"""
+
+    @abstractmethod
+    async def get_achievement_state(self, user_id, max_join_position: int) -> Dict:
+        """Everything the achievement rules look at: balance, earned (set of types),
+        email_statuses, roles and join_position (None past max_join_position)"""
+
+    @abstractmethod
+    async def award_achievements(self, user_id, awards: List[Tuple[str, str, int]]) -> Tuple[Optional[int], List[str]]:
+        """Insert (type, name, points_reward) awards and credit their bonuses in one transaction
+
+        Types the user already holds are skipped without crediting anything. Returns
+        (new balance, or None if nothing was credited, awarded types in order).
+        """
+
+    # Order point requests
+
+    @abstractmethod
+    async def insert_point_requests(self, requests: list) -> int:
+        """Store (email, order_id, points_amount, verification_code) rows, skipping orders already stored"""
+
+    @abstractmethod
+    async def get_unnotified_point_requests(self, after_id: int, limit: int) -> List[Dict]:
+        """Pending requests whose email hasn't been sent, in id order after after_id"""
+
+    @abstractmethod
+    async def mark_point_requests_notified(self, request_ids: list):
+        """Record that the emails for these requests went out"""
+
+    @abstractmethod
+    async def get_pending_point_requests(self, limit: int = 50) -> List[Dict]:
+        """Unclaimed requests, newest first"""
+
+    @abstractmethod
+    async def claim_point_request(self, verification_code: str, user_id) -> Optional[Dict]:
+        """Mark a pending request claimed and credit its points in one transaction
+
+        Returns order_id, points_amount and new_balance, or None if the code is unknown or
+        already used.
+        """
+
+    # Idempotency keys
+
+    @abstractmethod
+    async def claim_idempotency_key(self, key: str, request_hash: str, ttl_seconds: float) -> Optional[Dict]:
+        """Claim an unexpired key for a new request
+
+        Returns None if this caller claimed it, otherwise the live row's request_hash and
+        response (None while the first request is still running).
+        """
+
+    @abstractmethod
+    async def save_idempotent_response(self, key: str, response: Dict):
+        """Store the response replayed for repeats of a claimed key"""
+
+    @abstractmethod
+    async def release_idempotency_key(self, key: str):
+        """Drop a claim that has no response, so the key can be used again"""
+
+    @abstractmethod
+    async def delete_expired_idempotency_keys(self) -> int:
+        """Remove expired keys and return how many went"""
+
+def create_points_store(backend: str = None) -> PointsStore:
+    """A new, uninitialized store for `backend` (default Config.POINTS_BACKEND)"""
+    backend = (backend or Config.POINTS_BACKEND).lower()
+    if backend == 'postgresql':
+        from database_postgresql import PostgreSQLPointsDatabase
+        return PostgreSQLPointsDatabase()
+    if backend == 'sqlite':
+        from database import PointsDatabase
+        return PointsDatabase(Config.DATABASE_PATH)
+    raise ValueError(f"Unknown points backend: {backend} (expected one of {', '.join(POINTS_BACKENDS)})")
@@ -0,0 +1,54 @@
+"""
+Shared fixtures. Tests run against SQLite always and against PostgreSQL when
+TEST_DATABASE_URL points at a disposable database; they only touch user ids
+starting with TEST_USER_PREFIX.
+"""
+
+import contextlib
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+TEST_USER_PREFIX = "999900000"
+
+async def delete_test_users(store):
+    """Remove rows left by earlier runs (PostgreSQL databases outlive a test)"""
+    if getattr(store, 'pool', None) is None:
+        return
+    async with store.pool.acquire() as conn:
+        for table in ("transactions", "user_stats", "achievements", "points"):
+            await conn.execute(f"DELETE FROM {table} WHERE user_id LIKE $1", TEST_USER_PREFIX + "%")
+        await conn.execute("DELETE FROM point_requests WHERE order_id LIKE 'TEST-ORDER-%'")
+        await conn.execute("DELETE FROM admin_messages WHERE recipient_user_id LIKE $1", TEST_USER_PREFIX + "%")
+        await conn.execute("DELETE FROM email_submissions WHERE discord_user_id LIKE $1", TEST_USER_PREFIX + "%")
+        await conn.execute("DELETE FROM jobs WHERE job_type LIKE 'test_%'")
+        await conn.execute("DELETE FROM discord_users WHERE user_id LIKE $1", TEST_USER_PREFIX + "%")
+        await conn.execute("DELETE FROM idempotency_keys WHERE key LIKE $1", "%:" + TEST_USER_PREFIX + "%")
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def open_store(request, tmp_path):
+    """open_store(**kwargs) is an async context manager yielding a fresh, initialized store"""
+    if request.param == "postgresql" and not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL not set")
+
+    @contextlib.asynccontextmanager
+    async def open_store(**kwargs):
+        if request.param == "sqlite":
+            from database import PointsDatabase
+            store = PointsDatabase(str(tmp_path / "points.db"), tuned=False, **kwargs)
+        else:
+            from database_postgresql import PostgreSQLPointsDatabase
+            store = PostgreSQLPointsDatabase(**kwargs)
+            store.database_url = TEST_DATABASE_URL
+        await store.initialize()
+        try:
+            await delete_test_users(store)
+            yield store
+        finally:
+            await delete_test_users(store)
+            await store.close()
+
+    return open_store
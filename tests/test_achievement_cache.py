@@ -0,0 +1,91 @@
+"""The earned-achievement cache skips settled checks, and is per store, bounded and invalidated"""
+
+import asyncio
+from config import Config
+from conftest import TEST_USER_PREFIX
+from enhanced_achievements import ACHIEVEMENT_RULES, EarnedAchievementCache, check_and_award_achievements
+
+USER = TEST_USER_PREFIX + "1"
+# Every rule a points write can't bring within reach
+PROFILE = {rule.achievement_type for rule in ACHIEVEMENT_RULES if not rule.balance_only}
+
+def test_settled_check_is_skipped(open_store):
+    async def run():
+        async with open_store() as store:
+            await store.assign_points(USER, 50)
+            assert "first_points" in await check_and_award_achievements(store, USER, 50)
+            balance = await store.get_points(USER)
+            store.earned_cache.store(USER, PROFILE | {"first_points", "milestone_100"})
+
+            assert await check_and_award_achievements(store, USER, balance) == []
+            assert store.earned_cache.get_stats()["hits"] == 1
+
+            _, balance = await store.change_points(USER, 2000)
+            assert "high_roller" in await check_and_award_achievements(store, USER, balance)
+    asyncio.run(run())
+
+def test_unearned_email_or_role_is_rechecked(open_store):
+    async def run():
+        async with open_store() as store:
+            await store.assign_points(USER, 50)
+            await check_and_award_achievements(store, USER, 50)
+            balance = await store.get_points(USER)
+
+            # Nothing here has verified an email or holds the role, which can change at any time
+            await check_and_award_achievements(store, USER, balance)
+            assert store.earned_cache.get_stats()["hits"] == 0
+            store.earned_cache.store(USER, PROFILE - {"email_verified"})
+            assert not store.earned_cache.settled(USER, 0)
+    asyncio.run(run())
+
+def test_expired_entry_is_rechecked(open_store, monkeypatch):
+    async def run():
+        async with open_store() as store:
+            store.earned_cache.store(USER, PROFILE)
+            assert store.earned_cache.settled(USER, 0)
+            monkeypatch.setattr(Config, "ACHIEVEMENT_PROFILE_TTL", 0)
+            assert not store.earned_cache.settled(USER, 0)
+    asyncio.run(run())
+
+def test_caches_are_per_store(open_store):
+    async def run():
+        async with open_store() as first, open_store() as second:
+            first.earned_cache.store(USER, PROFILE)
+            assert first.earned_cache is not second.earned_cache
+            assert not second.earned_cache.settled(USER, 0)
+    asyncio.run(run())
+
+def test_deleting_a_user_forgets_them(tmp_path):
+    from database import PointsDatabase
+
+    async def run():
+        store = PointsDatabase(str(tmp_path / "points.db"), tuned=False)
+        await store.initialize()
+        try:
+            store.earned_cache.store(USER, PROFILE)
+            assert await store.delete_user(int(USER))
+            assert not store.earned_cache.settled(USER, 0)
+        finally:
+            await store.close()
+    asyncio.run(run())
+
+def test_forget_and_clear():
+    cache = EarnedAchievementCache(ACHIEVEMENT_RULES)
+    cache.store("1", PROFILE)
+    cache.store("2", PROFILE)
+    cache.forget(1)
+    assert not cache.settled("1", 0)
+    assert cache.settled("2", 0)
+    cache.clear()
+    assert not cache.settled("2", 0)
+
+def test_least_recently_used_user_is_evicted():
+    cache = EarnedAchievementCache(ACHIEVEMENT_RULES, max_users=2)
+    cache.store("1", PROFILE)
+    cache.store("2", PROFILE)
+    assert cache.settled("1", 0)
+    cache.store("3", PROFILE)
+    assert cache.settled("1", 0)
+    assert not cache.settled("2", 0)
+    assert cache.get_stats()["users"] == 2
+    assert cache.get_stats()["evictions"] == 1
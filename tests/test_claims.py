@@ -0,0 +1,23 @@
+"""Retrying a claim with the same idempotency key replays its first result"""
+
+import asyncio
+from conftest import TEST_USER_PREFIX
+from order_processor import OrderProcessor
+
+USER = TEST_USER_PREFIX + "1"
+OTHER_USER = TEST_USER_PREFIX + "2"
+
+def test_retried_claim_replays_result(open_store):
+    async def run():
+        async with open_store() as store:
+            await store.insert_point_requests([("claim-test@example.com", "TEST-ORDER-1", 40, "TESTCODE1")])
+            processor = OrderProcessor(store)
+            first = await processor.process_claim("TESTCODE1", int(USER), idempotency_key=f"{USER}:TESTCODE1")
+            retry = await processor.process_claim(" TESTCODE1 ", int(USER), idempotency_key=f"{USER}:TESTCODE1")
+            other = await processor.process_claim("TESTCODE1", int(OTHER_USER), idempotency_key=f"{OTHER_USER}:TESTCODE1")
+
+            assert first["success"] and first["points_added"] == 40
+            assert retry == first
+            assert not other["success"]
+            assert await store.get_points(USER) == 40
+    asyncio.run(run())
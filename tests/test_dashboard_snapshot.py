@@ -0,0 +1,39 @@
+"""The dashboard snapshot carries the first page of email submissions and fails loudly"""
+
+import asyncio
+import pytest
+from conftest import TEST_USER_PREFIX
+
+USER = TEST_USER_PREFIX + "1"
+
+class UnreachablePool:
+    def acquire(self):
+        raise ConnectionError("database unreachable")
+
+def test_snapshot_includes_email_submissions(open_store):
+    async def run():
+        async with open_store() as store:
+            if getattr(store, 'pool', None) is None:
+                pytest.skip("the dashboard snapshot is PostgreSQL only")
+            async with store.pool.acquire() as conn:
+                await conn.execute('''
+                    INSERT INTO email_submissions (discord_user_id, discord_username, email_address, status)
+                    VALUES ($1, 'snapshot test', 'snapshot@example.com', 'pending')
+                ''', USER)
+            snapshot = await store.get_dashboard_snapshot()
+            assert snapshot['email_submissions'][0][1] == USER
+    asyncio.run(run())
+
+def test_snapshot_raises_instead_of_reading_empty(open_store):
+    async def run():
+        async with open_store() as store:
+            if getattr(store, 'pool', None) is None:
+                pytest.skip("the dashboard snapshot is PostgreSQL only")
+            pool, store.pool = store.pool, UnreachablePool()
+            try:
+                assert await store.get_transactions(limit=10) == []
+                with pytest.raises(ConnectionError):
+                    await store.get_dashboard_snapshot()
+            finally:
+                store.pool = pool
+    asyncio.run(run())
@@ -0,0 +1,37 @@
+"""A backfill whose write fails stops instead of refetching the same users"""
+
+import asyncio
+from unittest import mock
+import discord
+from config import Config
+from discord_directory import DiscordUserDirectory
+
+class FailingDirectoryStore:
+    def __init__(self):
+        self.stale_queries = 0
+
+    async def get_stale_discord_user_ids(self, stale_seconds, limit):
+        self.stale_queries += 1
+        return [str(user_id) for user_id in range(1, limit + 1)]
+
+    async def upsert_discord_users(self, records):
+        raise ConnectionError("database unavailable")
+
+    async def mark_discord_users_refreshed(self, user_ids):
+        pass
+
+class FakeBot:
+    async def fetch_user(self, user_id):
+        user = mock.Mock(spec=discord.User)
+        user.id, user.name, user.global_name, user.avatar, user.bot = user_id, f"user{user_id}", None, None, False
+        return user
+
+def test_backfill_stops_when_flush_fails(monkeypatch):
+    monkeypatch.setattr(Config, "DIRECTORY_BACKFILL_BATCH", 3)
+    store = FailingDirectoryStore()
+    directory = DiscordUserDirectory(FakeBot(), store)
+
+    assert asyncio.run(directory.backfill()) == 0
+    assert store.stale_queries == 1
+    assert directory.get_stats()["write_errors"] == 1
+    assert directory.get_stats()["pending_writes"] == 3
@@ -0,0 +1,54 @@
+"""DM claims are leases: only expired ones are requeued, and only the current claim records an outcome"""
+
+import asyncio
+import pytest
+from conftest import TEST_USER_PREFIX
+
+USER = TEST_USER_PREFIX + "1"
+
+async def delivery_status(store, message_id):
+    async with store.pool.acquire() as conn:
+        return await conn.fetchval("SELECT delivery_status FROM admin_messages WHERE id = $1", message_id)
+
+def test_live_claims_are_not_released(open_store):
+    async def run():
+        async with open_store() as store:
+            if getattr(store, 'pool', None) is None:
+                pytest.skip("the DM outbox is PostgreSQL only")
+            message_id = await store.enqueue_admin_message(USER, "lease test")
+            claimed = await store.claim_admin_messages(100)
+            assert message_id in [message['id'] for message in claimed]
+
+            await store.release_stuck_admin_messages(600)
+            assert await delivery_status(store, message_id) == 'sending'
+
+            async with store.pool.acquire() as conn:
+                await conn.execute(
+                    "UPDATE admin_messages SET claimed_at = CURRENT_TIMESTAMP - INTERVAL '11 minutes' WHERE id = $1",
+                    message_id
+                )
+            assert await store.release_stuck_admin_messages(600) >= 1
+            assert await delivery_status(store, message_id) == 'retrying'
+    asyncio.run(run())
+
+def test_outcome_of_a_lost_claim_is_dropped(open_store):
+    async def run():
+        async with open_store() as store:
+            if getattr(store, 'pool', None) is None:
+                pytest.skip("the DM outbox is PostgreSQL only")
+            message_id = await store.enqueue_admin_message(USER, "fence test")
+            stale = next(message for message in await store.claim_admin_messages(100) if message['id'] == message_id)
+
+            # The lease expires, the row is requeued and another worker claims it
+            async with store.pool.acquire() as conn:
+                await conn.execute(
+                    "UPDATE admin_messages SET delivery_status = 'pending', next_attempt_at = CURRENT_TIMESTAMP "
+                    "WHERE id = $1", message_id
+                )
+            current = next(message for message in await store.claim_admin_messages(100) if message['id'] == message_id)
+
+            assert not await store.mark_admin_message(stale, 'failed', "too late")
+            assert await delivery_status(store, message_id) == 'sending'
+            assert await store.mark_admin_message(current, 'delivered')
+            assert await delivery_status(store, message_id) == 'delivered'
+    asyncio.run(run())
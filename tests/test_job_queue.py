@@ -0,0 +1,67 @@
+"""Jobs are only requeued once their lease expires, and a chunk commits only on its own claim"""
+
+import asyncio
+import pytest
+from database_postgresql import JobLeaseLost
+from job_queue import JOB_HANDLERS, JobWorker
+
+class FakeJobStore:
+    def __init__(self):
+        self.finished = []
+
+    async def heartbeat_job(self, job):
+        return True
+
+    async def finish_job(self, job, status, error=None):
+        self.finished.append((job['id'], status))
+
+def test_lost_lease_does_not_finish_the_job(monkeypatch):
+    async def taken_over(worker, job):
+        raise JobLeaseLost("claimed elsewhere")
+
+    async def run():
+        monkeypatch.setitem(JOB_HANDLERS, "test_taken_over", taken_over)
+        store = FakeJobStore()
+        worker = JobWorker(store)
+        worker.loop = asyncio.get_running_loop()
+        await worker._execute({'id': 1, 'job_type': "test_taken_over", 'processed': 0, 'claimed_at': None})
+        assert store.finished == []
+        assert worker.get_stats()["failed"] == 0
+    asyncio.run(run())
+
+def test_jobs_are_requeued_only_after_their_lease(open_store):
+    async def run():
+        async with open_store() as store:
+            if getattr(store, 'pool', None) is None:
+                pytest.skip("background jobs are PostgreSQL only")
+            job_id = await store.create_job("test_lease", {}, total=2)
+            job = await store.claim_next_job()
+            assert job['id'] == job_id
+
+            await store.requeue_running_jobs(600)
+            assert (await store.get_job(job_id))['status'] == 'running'
+
+            async with store.pool.acquire() as conn:
+                with pytest.raises(JobLeaseLost):
+                    async with conn.transaction():
+                        await store.record_job_progress(conn, job, 1, 2, [(1, "b", True, None)])
+                async with conn.transaction():
+                    await store.record_job_progress(conn, job, 0, 1, [(0, "a", True, None)])
+            assert (await store.get_job(job_id))['processed'] == 1
+
+            async with store.pool.acquire() as conn:
+                await conn.execute(
+                    "UPDATE jobs SET heartbeat_at = CURRENT_TIMESTAMP - INTERVAL '11 minutes' WHERE id = $1", job_id
+                )
+            assert await store.requeue_running_jobs(600) >= 1
+            reclaimed = await store.claim_next_job()
+            assert reclaimed['id'] == job_id
+
+            # The first claim can no longer record progress or an outcome
+            async with store.pool.acquire() as conn:
+                with pytest.raises(JobLeaseLost):
+                    async with conn.transaction():
+                        await store.record_job_progress(conn, job, 1, 2, [(1, "b", True, None)])
+            await store.finish_job(job, 'failed', "stale worker")
+            assert (await store.get_job(job_id))['status'] == 'running'
+    asyncio.run(run())
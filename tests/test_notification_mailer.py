@@ -0,0 +1,18 @@
+"""Retry-After is read in both of its forms"""
+
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from notification_mailer import retry_after_seconds
+
+def test_delay_seconds():
+    assert retry_after_seconds("7", 2) == 7
+    assert retry_after_seconds("-3", 2) == 0
+
+def test_http_date():
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 25 <= retry_after_seconds(format_datetime(retry_at, usegmt=True), 2) <= 30
+    assert retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT", 2) == 0
+
+def test_missing_or_unreadable_uses_default():
+    for value in (None, "", "soon", "inf", "nan"):
+        assert retry_after_seconds(value, 4) == 4
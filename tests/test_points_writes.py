@@ -0,0 +1,76 @@
+"""Balance writes report the balance they replaced, in the result and in the ledger"""
+
+import asyncio
+import pytest
+from conftest import TEST_USER_PREFIX
+
+USER = TEST_USER_PREFIX + "1"
+OTHER_USER = TEST_USER_PREFIX + "2"
+
+async def last_ledger_row(store, user_id):
+    # (id, user_id, amount, transaction_type, admin_id, reason, old_balance, new_balance, created_at)
+    rows = await store.get_transactions(user_id, limit=100)
+    return max(rows, key=lambda row: row[0]) if rows else None
+
+@pytest.mark.parametrize("coalesce", [False, True])
+def test_set_records_replaced_balance(open_store, coalesce):
+    async def run():
+        async with open_store(coalesce_writes=coalesce) as store:
+            assert await store.assign_points(USER, 300) == (0, 300)
+            assert await store.assign_points(USER, 5) == (300, 5)
+            row = await last_ledger_row(store, USER)
+            assert (row[2], row[3], row[6], row[7]) == (-295, "set", 300, 5)
+    asyncio.run(run())
+
+def test_clamped_debit_records_replaced_balance(open_store):
+    async def run():
+        async with open_store() as store:
+            await store.assign_points(USER, 10)
+            assert await store.change_points(USER, -50, clamp_at_zero=True) == (10, 0)
+            row = await last_ledger_row(store, USER)
+            assert (row[2], row[6], row[7]) == (-10, 10, 0)
+    asyncio.run(run())
+
+@pytest.mark.parametrize("coalesce", [False, True])
+def test_required_balance_refuses_overdraft(open_store, coalesce):
+    async def run():
+        async with open_store(coalesce_writes=coalesce) as store:
+            await store.assign_points(USER, 10)
+            assert await store.change_points(USER, -50, require_balance=True) == (10, 10)
+            assert len(await store.get_transactions(USER, limit=100)) == 1
+            assert await store.change_points(USER, -4, require_balance=True) == (10, 6)
+            assert await store.change_points(OTHER_USER, -1, require_balance=True) == (0, 0)
+            assert await store.get_points(OTHER_USER) == 0
+    asyncio.run(run())
+
+def test_concurrent_required_debits_never_overdraw(open_store):
+    async def run():
+        async with open_store() as store:
+            await store.assign_points(USER, 10)
+            results = await asyncio.gather(*(store.change_points(USER, -4, require_balance=True) for _ in range(5)))
+            assert sum(1 for old, new in results if new != old) == 2
+            assert await store.get_points(USER) == 2
+    asyncio.run(run())
+
+def test_writes_skip_a_queue_that_has_fallen_behind():
+    from write_coalescer import PointsWrite, WriteCoalescer
+
+    async def run():
+        release = asyncio.Event()
+
+        async def apply_batch(writes):
+            await release.wait()
+            return [(0, write.amount) for write in writes]
+
+        async def apply_one(write):
+            return (0, -write.amount)
+
+        coalescer = WriteCoalescer(apply_batch, apply_one, window_ms=1, max_ops=1, max_wait_ms=20)
+        stuck = [asyncio.create_task(coalescer.submit(PointsWrite('change', USER, amount))) for amount in (1, 2)]
+        await asyncio.sleep(0.05)
+        # The first write's batch is stuck and the second has waited past max_wait_ms
+        assert await coalescer.submit(PointsWrite('change', USER, 3)) == (0, -3)
+        assert coalescer.get_stats()["direct_writes"] == 1
+        release.set()
+        assert await asyncio.gather(*stuck) == [(0, 1), (0, 2)]
+    asyncio.run(run())
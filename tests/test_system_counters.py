@@ -0,0 +1,68 @@
+"""The email_users* counters count distinct users, not submissions"""
+
+import asyncio
+import pytest
+from conftest import TEST_USER_PREFIX
+
+USER = TEST_USER_PREFIX + "1"
+
+COUNTERS = ('email_users', 'email_users_pending', 'email_users_processed', 'email_users_without_points')
+
+async def email_user_counters(store):
+    counters = await store.get_system_counters()
+    return tuple(counters.get(name, 0) for name in COUNTERS)
+
+def changes(before, after):
+    return tuple(a - b for a, b in zip(after, before))
+
+def test_email_user_counters_are_distinct(open_store):
+    async def run():
+        async with open_store() as store:
+            if getattr(store, 'pool', None) is None:
+                pytest.skip("system_counters are PostgreSQL only")
+            before = await email_user_counters(store)
+            async with store.pool.acquire() as conn:
+                await conn.executemany('''
+                    INSERT INTO email_submissions (discord_user_id, discord_username, email_address, status)
+                    VALUES ($1, 'counter test', $2, $3)
+                ''', [(USER, "a@example.com", "pending"), (USER, "b@example.com", "pending"),
+                      (USER, "c@example.com", "processed")])
+            assert changes(before, await email_user_counters(store)) == (1, 1, 1, 1)
+
+            await store.assign_points(USER, 10)
+            assert changes(before, await email_user_counters(store)) == (1, 1, 1, 0)
+
+            async with store.pool.acquire() as conn:
+                await conn.execute("UPDATE email_submissions SET status = 'processed' WHERE discord_user_id = $1", USER)
+            assert changes(before, await email_user_counters(store)) == (1, 0, 1, 0)
+
+            async with store.pool.acquire() as conn:
+                await conn.execute("DELETE FROM points WHERE user_id = $1", USER)
+                await conn.execute("DELETE FROM email_submissions WHERE discord_user_id = $1", USER)
+            assert changes(before, await email_user_counters(store)) == (0, 0, 0, 0)
+    asyncio.run(run())
+
+def test_concurrent_first_submissions_count_once(open_store):
+    async def run():
+        async with open_store() as store:
+            if getattr(store, 'pool', None) is None:
+                pytest.skip("system_counters are PostgreSQL only")
+            before = await email_user_counters(store)
+            insert = '''
+                INSERT INTO email_submissions (discord_user_id, discord_username, email_address, status)
+                VALUES ($1, 'counter test', $2, 'pending')
+            '''
+            async with store.pool.acquire() as first, store.pool.acquire() as second:
+                first_tx, second_tx = first.transaction(), second.transaction()
+                await first_tx.start()
+                await second_tx.start()
+                await first.execute(insert, USER, "a@example.com")
+                # Waits in the trigger for the first transaction's per-user lock
+                second_insert = asyncio.ensure_future(second.execute(insert, USER, "b@example.com"))
+                await asyncio.sleep(0.2)
+                assert not second_insert.done()
+                await first_tx.commit()
+                await second_insert
+                await second_tx.commit()
+            assert changes(before, await email_user_counters(store)) == (1, 1, 0, 1)
+    asyncio.run(run())
@@ -0,0 +1,41 @@
+"""Every known user appears exactly once in the user list, whatever the sort"""
+
+import asyncio
+import pytest
+from conftest import TEST_USER_PREFIX
+from database_postgresql import USER_SORTS
+
+POINTS_ONLY = TEST_USER_PREFIX + "1"
+EMAIL_ONLY = TEST_USER_PREFIX + "2"
+NAMED = TEST_USER_PREFIX + "3"
+
+async def walk(store, sort, status=None):
+    """user ids of every page, following the cursor"""
+    seen, after = [], None
+    while True:
+        rows = await store.list_users(sort, status, None, after, 2)
+        if not rows:
+            return seen
+        seen.extend(row['user_id'] for row in rows)
+        key = USER_SORTS[sort][0]
+        after = (rows[-1][key], rows[-1]['user_id'])
+
+@pytest.mark.parametrize("sort", list(USER_SORTS))
+def test_every_user_listed_once(open_store, sort):
+    async def run():
+        async with open_store() as store:
+            if getattr(store, 'pool', None) is None:
+                pytest.skip("the user list is PostgreSQL only")
+            await store.assign_points(POINTS_ONLY, 5)
+            await store.assign_points(NAMED, 7)
+            await store.upsert_discord_users([(NAMED, "named", "Named User", None)])
+            async with store.pool.acquire() as conn:
+                await conn.executemany('''
+                    INSERT INTO email_submissions (discord_user_id, discord_username, email_address, status)
+                    VALUES ($1, 'list test', $2, 'pending')
+                ''', [(EMAIL_ONLY, "a@example.com"), (EMAIL_ONLY, "b@example.com")])
+
+            listed = [user_id for user_id in await walk(store, sort) if user_id.startswith(TEST_USER_PREFIX)]
+            assert sorted(listed) == [POINTS_ONLY, EMAIL_ONLY, NAMED]
+            assert (await walk(store, sort, 'pending')).count(EMAIL_ONLY) == 1
+    asyncio.run(run())
@@ -0,0 +1,164 @@
+"""
+Opt-in coalescing of points writes (Config.POINTS_WRITE_COALESCING).
+
+change_points / assign_points calls are gathered until POINTS_COALESCE_WINDOW_MS
+has passed since the first one, or POINTS_COALESCE_MAX_OPS are waiting. The
+whole batch is then applied in one transaction, so a burst pays for one commit
+(and one fsync) instead of one per call. Each caller still gets back its own
+(old_balance, new_balance), and the window is the most latency a write gains
+on an idle store. One batch is applied at a time: writes arriving meanwhile
+form the next batch, which starts as soon as the current one commits, so
+batches grow with load instead of the commit rate capping throughput.
+If batches still fall behind, so that the oldest queued write has waited
+POINTS_COALESCE_MAX_WAIT_MS, new writes skip the queue and are applied in their
+own transaction until it catches up. This caps how far the queue (and the wait
+for it) can grow under sustained load.
+
+A batch is applied in user id order, keeping arrival order for each user, so
+concurrent batches from other stores (the bot and dashboard each have one) lock
+rows in the same order and can't deadlock.
+If the batch transaction fails, its writes are retried one transaction each,
+so only the write at fault fails.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class PointsWrite:
+    """One change_points ("change") or assign_points ("set") call"""
+
+    __slots__ = ('kind', 'user_id', 'amount', 'admin_id', 'reason', 'clamp_at_zero', 'transaction_type',
+                 'require_balance')
+
+    def __init__(self, kind: str, user_id, amount: int, admin_id: int = None, reason: str = None,
+                 clamp_at_zero: bool = False, transaction_type: str = None, require_balance: bool = False):
+        self.kind = kind
+        self.user_id = str(user_id)
+        self.amount = amount
+        self.admin_id = admin_id
+        self.clamp_at_zero = clamp_at_zero
+        self.require_balance = require_balance
+        if kind == 'set':
+            self.reason = reason or "Points set"
+            self.transaction_type = "set"
+        else:
+            self.reason = reason
+            self.transaction_type = transaction_type or ("add" if amount > 0 else "remove")
+
+    @property
+    def deducts(self) -> bool:
+        """A debit that is refused, rather than applied, when the balance doesn't cover it"""
+        return self.kind == 'change' and self.require_balance and self.amount < 0
+
+    def new_balance(self, old_balance: int) -> Optional[int]:
+        """Balance after this write, or None for a refused debit"""
+        if self.kind == 'set':
+            return self.amount
+        balance = old_balance + self.amount
+        if self.deducts and balance < 0:
+            return None
+        return max(balance, 0) if self.clamp_at_zero else balance
+
+class WriteCoalescer:
+    """Batches PointsWrites for one store; use from a single event loop"""
+
+    def __init__(self, apply_batch: Callable[[List[PointsWrite]], Awaitable[List[Tuple[int, int]]]],
+                 apply_one: Callable[[PointsWrite], Awaitable[Tuple[int, int]]],
+                 window_ms: float = None, max_ops: int = None, max_wait_ms: float = None):
+        self.apply_batch = apply_batch  # all writes in one transaction, (old, new) per write
+        self.apply_one = apply_one  # fallback for a batch that failed
+        self.window = (Config.POINTS_COALESCE_WINDOW_MS if window_ms is None else window_ms) / 1000
+        self.max_ops = max_ops or Config.POINTS_COALESCE_MAX_OPS
+        self.max_wait = (max_wait_ms or Config.POINTS_COALESCE_MAX_WAIT_MS) / 1000
+        self._pending = []  # (write, future, loop.time() it was queued) waiting for the next batch
+        self._timer = None
+        self._task = None  # applies batches until nothing is pending
+        self._batches = 0
+        self._writes = 0
+        self._fallbacks = 0
+        self._direct = 0
+
+    async def submit(self, write: PointsWrite) -> Tuple[int, int]:
+        """Queue a write and wait for its (old_balance, new_balance) once its batch commits"""
+        loop = asyncio.get_running_loop()
+        if self._pending and loop.time() - self._pending[0][2] >= self.max_wait:
+            # Batches are behind; queueing would only add to the backlog
+            self._direct += 1
+            return await self.apply_one(write)
+        future = loop.create_future()
+        self._pending.append((write, future, loop.time()))
+        # While a batch is being applied, new writes just wait for the next one
+        if self._task is None:
+            if len(self._pending) >= self.max_ops:
+                self._start()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self._start)
+        return await future
+
+    def _start(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._task is None and self._pending:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        try:
+            # Writes that queued up during a batch have waited long enough; apply them straight away
+            while self._pending:
+                batch, self._pending = self._pending[:self.max_ops], self._pending[self.max_ops:]
+                await self._apply(batch)
+        finally:
+            self._task = None
+
+    async def _apply(self, batch: list):
+        # sorted() is stable, so writes for the same user keep their arrival order
+        batch = sorted(batch, key=lambda item: item[0].user_id)
+        try:
+            results = await self.apply_batch([write for write, _, _ in batch])
+            outcomes = [(future, result, None) for (_, future, _), result in zip(batch, results)]
+            self._batches += 1
+            self._writes += len(batch)
+        except Exception as e:
+            logger.warning(f"Coalesced batch of {len(batch)} points writes failed ({e}), applying them one by one")
+            self._fallbacks += 1
+            outcomes = []
+            for write, future, _ in batch:
+                try:
+                    outcomes.append((future, await self.apply_one(write), None))
+                except Exception as error:
+                    outcomes.append((future, None, error))
+
+        for future, result, error in outcomes:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def drain(self):
+        """Apply anything still queued, without waiting out the window"""
+        self._start()
+        if self._task is not None:
+            await self._task
+
+    def get_stats(self) -> dict:
+        """Batch counters for the metrics endpoint"""
+        return {
+            "enabled": True,
+            "window_ms": self.window * 1000,
+            "max_ops": self.max_ops,
+            "max_wait_ms": self.max_wait * 1000,
+            "queued": len(self._pending),
+            "applying": self._task is not None,
+            "batches": self._batches,
+            "writes": self._writes,
+            "writes_per_batch": round(self._writes / self._batches, 2) if self._batches else 0,
+            "fallbacks": self._fallbacks,
+            "direct_writes": self._direct
+        }